@@ -0,0 +1,119 @@
+import argparse
+import os
+import re
+import sys
+
+# Shared with Agent 5: the local graph store and the canonical queries
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../functions/agent5_writer')))
+
+from canonical_sql import CANONICAL_GQL, CANONICAL_SQL
+
+INDEX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spanner-indexes.sql')
+
+def index_statements(path=INDEX_FILE):
+    """{index_name: CREATE INDEX statement} from the index file, in file order."""
+    with open(path, 'r') as f:
+        text = re.sub(r"--[^\n]*", "", f.read())
+    statements = [s.strip() for s in text.split(';') if s.strip()]
+    return {re.search(r"CREATE INDEX (\w+)", s).group(1): s for s in statements}
+
+# --- Spanner ---
+
+def spanner_indexes(database):
+    with database.snapshot() as snapshot:
+        rows = snapshot.execute_sql(
+            "SELECT INDEX_NAME FROM INFORMATION_SCHEMA.INDEXES WHERE TABLE_SCHEMA = '' AND INDEX_TYPE = 'INDEX'")
+        return {row[0] for row in rows}
+
+def spanner_plan(database, sql):
+    """Scans in the query plan, e.g. 'IndexScan CodeStructureByName' or 'TableScan SourceCodeLines (full)'."""
+    from google.cloud.spanner_v1 import ExecuteSqlRequest
+    with database.snapshot() as snapshot:
+        results = snapshot.execute_sql(sql, query_mode=ExecuteSqlRequest.QueryMode.PLAN)
+        list(results)
+        scans = []
+        for node in results.stats.query_plan.plan_nodes:
+            if node.display_name != 'Scan':
+                continue
+            metadata = dict(node.metadata)
+            full = " (full)" if metadata.get('Full scan') == 'true' else ""
+            scans.append(f"{metadata.get('scan_type', 'Scan')} {metadata.get('scan_target', '?')}{full}")
+        return scans
+
+# --- SQLite ---
+
+def sqlite_plan(store, sql):
+    """Table accesses in EXPLAIN QUERY PLAN, e.g. 'SEARCH sub USING INDEX CodeStructureByName (name=?)'."""
+    rows = store.execute_sql("EXPLAIN QUERY PLAN " + sql)[1]
+    return [row[3] for row in rows if row[3].startswith(('SCAN', 'SEARCH'))]
+
+def full_scans(scans):
+    return sum(1 for s in scans if '(full)' in s or s.startswith('SCAN'))
+
+def compare_plans(before, after):
+    print("\n=== QUERY PLANS (before -> after) ===")
+    for name in before:
+        print(f"\n{name}: full scans {full_scans(before[name])} -> {full_scans(after[name])}")
+        for scan in before[name]:
+            print(f"  - {scan}")
+        for scan in after[name]:
+            print(f"  + {scan}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply spanner-indexes.sql and compare canonical query plans')
+    parser.add_argument('--project_id', help='GCP Project ID')
+    parser.add_argument('--instance_id', help='Spanner Instance ID')
+    parser.add_argument('--database_id', help='Spanner Database ID')
+    parser.add_argument('--sqlite', help='Apply the SQLite equivalents to a local graph store at this path instead')
+    parser.add_argument('--dry_run', action='store_true', help='Print the plans and the DDL to run, change nothing')
+    parser.add_argument('--drop', action='store_true', help='Drop the indexes instead (rollback)')
+    args = parser.parse_args()
+
+    statements = index_statements()
+
+    if args.sqlite:
+        from graph_store import SQLiteGraphStore, SQLITE_QUERY_INDEXES
+        store = SQLiteGraphStore(args.sqlite, query_indexes=False)
+        if args.drop:
+            for name in statements:
+                store.execute_sql(f"DROP INDEX IF EXISTS {name}")
+            print(f"Dropped {len(statements)} indexes")
+            return
+        before = {name: sqlite_plan(store, sql) for name, sql in CANONICAL_SQL.items()}
+        if args.dry_run:
+            print(SQLITE_QUERY_INDEXES)
+            compare_plans(before, before)
+            return
+        store.conn.executescript(SQLITE_QUERY_INDEXES)
+        store.execute_sql("ANALYZE")
+        compare_plans(before, {name: sqlite_plan(store, sql) for name, sql in CANONICAL_SQL.items()})
+        return
+
+    if not (args.project_id and args.instance_id and args.database_id):
+        parser.error('--project_id, --instance_id and --database_id are required for Spanner')
+    from google.cloud import spanner
+    spanner_client = spanner.Client(project=args.project_id)
+    instance = spanner_client.instance(args.instance_id)
+    database = instance.database(args.database_id)
+
+    existing = spanner_indexes(database)
+    if args.drop:
+        ddl = [f"DROP INDEX {name}" for name in statements if name in existing]
+    else:
+        ddl = [sql for name, sql in statements.items() if name not in existing]
+    print(f"{len(ddl)} DDL statements ({len(existing & set(statements))} of {len(statements)} indexes exist)")
+    for sql in ddl:
+        print(f"\n{sql};")
+
+    before = {name: spanner_plan(database, sql) for name, sql in CANONICAL_GQL.items()}
+    if args.dry_run or not ddl:
+        compare_plans(before, before)
+        return
+
+    # Index backfills run as a long-running schema operation
+    print("\nApplying DDL (backfilling indexes, this can take a while)...")
+    database.update_ddl(ddl).result()
+    compare_plans(before, {name: spanner_plan(database, sql) for name, sql in CANONICAL_GQL.items()})
+
+if __name__ == '__main__':
+    main()
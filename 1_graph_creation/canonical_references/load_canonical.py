@@ -1,7 +1,12 @@
 import argparse
 import json
 import os
-from google.cloud import spanner
+import sys
+
+# Shared with Agent 5: mutation-group bulk writes and the local graph store
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../functions/agent5_writer')))
+
+from spanner_types import COMMIT_TIMESTAMP
 
 def load_json(filepath):
     with open(filepath, 'r') as f:
@@ -21,7 +26,7 @@ def insert_data(database, table_name, records):
         values = []
         for record in records:
             row = [record.get(col) for col in columns[:-1]]
-            row.append(spanner.COMMIT_TIMESTAMP)
+            row.append(COMMIT_TIMESTAMP)
             values.append(row)
 
         transaction.insert_or_update(
@@ -35,15 +40,28 @@ def insert_data(database, table_name, records):
 
 def main():
     parser = argparse.ArgumentParser(description='Load Canonical JSONs into Spanner')
-    parser.add_argument('--project_id', required=True, help='GCP Project ID')
-    parser.add_argument('--instance_id', required=True, help='Spanner Instance ID')
-    parser.add_argument('--database_id', required=True, help='Spanner Database ID')
+    parser.add_argument('--project_id', help='GCP Project ID')
+    parser.add_argument('--instance_id', help='Spanner Instance ID')
+    parser.add_argument('--database_id', help='Spanner Database ID')
+    parser.add_argument('--sqlite', help='Load into a local SQLite graph store at this path instead of Spanner')
+    parser.add_argument('--bulk', action='store_true',
+                        help='Load with concurrent batch_write mutation groups instead of one transaction per table')
     args = parser.parse_args()
-
-    # Initialize Spanner Client
-    spanner_client = spanner.Client(project=args.project_id)
-    instance = spanner_client.instance(args.instance_id)
-    database = instance.database(args.database_id)
+    if args.bulk and args.sqlite:
+        parser.error('--bulk uses Spanner batch_write; the SQLite store loads one transaction per table')
+
+    if args.sqlite:
+        # Same tables and write calls, embedded (see agent5_writer/graph_store.py)
+        from graph_store import SQLiteGraphStore
+        database = SQLiteGraphStore(args.sqlite)
+    else:
+        if not (args.project_id and args.instance_id and args.database_id):
+            parser.error('--project_id, --instance_id and --database_id are required for Spanner')
+        # Initialize Spanner Client
+        from google.cloud import spanner
+        spanner_client = spanner.Client(project=args.project_id)
+        instance = spanner_client.instance(args.instance_id)
+        database = instance.database(args.database_id)
 
     base_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -58,8 +76,8 @@ def main():
         'program_name': program_meta['program_name'],
         'file_name': program_meta['file_name'],
         'total_lines': program_meta['total_lines'],
-        'last_analyzed': spanner.COMMIT_TIMESTAMP, # Placeholder, will be overridden by allow_commit_timestamp logic or handled separately
-        'updated_at': spanner.COMMIT_TIMESTAMP
+        'last_analyzed': COMMIT_TIMESTAMP, # Placeholder, will be overridden by allow_commit_timestamp logic or handled separately
+        'updated_at': COMMIT_TIMESTAMP
     }
     # Handling timestamps differently for Programs as it has specific timestamp fields
     def insert_program(transaction):
@@ -69,14 +87,15 @@ def main():
             program_record['program_name'],
             program_record['file_name'],
             program_record['total_lines'],
-            spanner.COMMIT_TIMESTAMP,
-            spanner.COMMIT_TIMESTAMP,
-            spanner.COMMIT_TIMESTAMP
+            COMMIT_TIMESTAMP,
+            COMMIT_TIMESTAMP,
+            COMMIT_TIMESTAMP
         ]]
         transaction.insert_or_update(table='Programs', columns=columns, values=values)
         print("Inserted/Updated Program record")
     
-    database.run_in_transaction(insert_program)
+    if not args.bulk:
+        database.run_in_transaction(insert_program)
 
 
     # 3. Load CodeStructure (Must load first to calculate structure_id for lines)
@@ -105,7 +124,8 @@ def main():
         for line_num in range(item['start_line'], item['end_line'] + 1):
             line_to_structure_map[line_num] = item['section_id']
 
-    insert_data(database, 'CodeStructure', structure_records)
+    if not args.bulk:
+        insert_data(database, 'CodeStructure', structure_records)
 
     # 2. Load SourceCodeLines
     print("Loading SourceCodeLines...")
@@ -114,7 +134,8 @@ def main():
     for line in source_lines:
         line['structure_id'] = line_to_structure_map.get(line['line_number'])
         
-    insert_data(database, 'SourceCodeLines', source_lines)
+    if not args.bulk:
+        insert_data(database, 'SourceCodeLines', source_lines)
 
     # 4. Load DataEntities
     print("Loading DataEntities...")
@@ -136,7 +157,8 @@ def main():
             'description': None
         }
         entity_records.append(record)
-    insert_data(database, 'DataEntities', entity_records)
+    if not args.bulk:
+        insert_data(database, 'DataEntities', entity_records)
 
     # 5. Load LineReferences & ControlFlow
     print("Loading References and Flow...")
@@ -156,7 +178,8 @@ def main():
             'usage_type': item['usage_type']
         }
         line_ref_records.append(record)
-    insert_data(database, 'LineReferences', line_ref_records)
+    if not args.bulk:
+        insert_data(database, 'LineReferences', line_ref_records)
 
     # ControlFlow
     # JSON: flow_id, source_line_id, target_structure_id, type
@@ -170,7 +193,43 @@ def main():
             'type': item['type']
         }
         control_flow_records.append(record)
-    insert_data(database, 'ControlFlow', control_flow_records)
+    if not args.bulk:
+        insert_data(database, 'ControlFlow', control_flow_records)
+
+    # 6. CallClosure (derived: transitive PERFORM/GO TO reachability per structure)
+    from call_closure import closure_rows, call_edges
+    print("Loading Call Closure...")
+    closure_records = closure_rows(program_meta['program_id'],
+                                   call_edges({'SourceCodeLines': source_lines, 'ControlFlow': control_flow_records}),
+                                   structure_records)
+    if not args.bulk:
+        insert_data(database, 'CallClosure', closure_records)
+
+    # 7. StructureEntityUsage (derived: references rolled up per structure, entity and usage)
+    from usage_rollup import usage_rows, usage_edges
+    print("Loading Structure Entity Usage...")
+    usage_records = usage_rows(program_meta['program_id'],
+                               usage_edges({'SourceCodeLines': source_lines, 'LineReferences': line_ref_records}))
+    if not args.bulk:
+        insert_data(database, 'StructureEntityUsage', usage_records)
+
+    if args.bulk:
+        from mutation_writer import bulk_write
+        print("Bulk loading with mutation groups...")
+        tables = {
+            'Programs': [program_record],
+            'CodeStructure': structure_records,
+            'SourceCodeLines': source_lines,
+            'DataEntities': entity_records,
+            'LineReferences': line_ref_records,
+            'ControlFlow': control_flow_records,
+            'CallClosure': closure_records,
+            'StructureEntityUsage': usage_records,
+        }
+        stats = bulk_write(database, {program_meta['program_id']: tables})
+        if stats['failed_groups']:
+            print(f"Canonical Data Load Incomplete: {stats['failed_groups']} mutation groups failed")
+            sys.exit(1)
 
     print("Canonical Data Load Complete!")
 
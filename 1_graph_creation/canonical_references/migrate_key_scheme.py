@@ -0,0 +1,100 @@
+import argparse
+import os
+import re
+import sys
+from google.cloud import spanner
+
+# Shared with Agent 5: program reads, key schemes and the bounded writers
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../functions/agent5_writer')))
+
+from delta_writer import read_current
+from key_schemes import apply_key_scheme
+from mutation_writer import write_tables, bulk_write
+
+SCHEMA_FILES = {
+    'plain': 'spanner-schema.sql',
+    'sharded': 'spanner-schema-sharded.sql',
+    'interleaved': 'spanner-schema-interleaved.sql',
+}
+
+TABLES = ['Programs', 'CodeStructure', 'SourceCodeLines', 'DataEntities', 'LineReferences', 'ControlFlow',
+          'CallClosure', 'StructureEntityUsage']
+
+def ddl_statements(path):
+    """Statements of a schema file, comments removed."""
+    with open(path, 'r') as f:
+        text = re.sub(r"--[^\n]*", "", f.read())
+    return [s.strip() for s in text.split(';') if s.strip()]
+
+def program_ids(database):
+    with database.snapshot() as snapshot:
+        return [row[0] for row in snapshot.execute_sql("SELECT program_id FROM Programs ORDER BY program_id")]
+
+def row_counts(database):
+    counts = {}
+    with database.snapshot(multi_use=True) as snapshot:
+        for table in TABLES:
+            counts[table] = list(snapshot.execute_sql(f"SELECT COUNT(*) FROM {table}"))[0][0]
+    return counts
+
+def program_tables(source, program_id):
+    """One program's rows from the source database, ready to write."""
+    # The plain-scheme reads join through string ids, which every scheme keeps
+    current = read_current(source, program_id, 'plain')
+    tables = {table: list(rows.values()) for table, rows in current.items()}
+    for program in tables['Programs']:
+        # Not part of the compared columns; artifact_hash is left for the next delta write
+        program['last_analyzed'] = spanner.COMMIT_TIMESTAMP
+        program['updated_at'] = spanner.COMMIT_TIMESTAMP
+    return tables
+
+def main():
+    parser = argparse.ArgumentParser(description='Copy the graph into a database with a different key scheme')
+    parser.add_argument('--project_id', required=True, help='GCP Project ID')
+    parser.add_argument('--instance_id', required=True, help='Spanner Instance ID')
+    parser.add_argument('--source_database', required=True, help='Database to read (any key scheme)')
+    parser.add_argument('--target_database', required=True, help='Database to write')
+    parser.add_argument('--scheme', choices=sorted(SCHEMA_FILES), default='sharded', help='Target key scheme')
+    parser.add_argument('--create_schema', action='store_true',
+                        help="Apply the scheme's schema file to the (empty) target database first")
+    parser.add_argument('--programs', help='Comma-separated program ids (default: all)')
+    parser.add_argument('--bulk', action='store_true', help='Write with batch_write mutation groups')
+    args = parser.parse_args()
+
+    spanner_client = spanner.Client(project=args.project_id)
+    instance = spanner_client.instance(args.instance_id)
+    source = instance.database(args.source_database)
+    target = instance.database(args.target_database)
+
+    if args.create_schema:
+        schema_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), SCHEMA_FILES[args.scheme])
+        print(f"Applying {SCHEMA_FILES[args.scheme]} to {args.target_database}...")
+        target.update_ddl(ddl_statements(schema_path)).result()
+
+    programs = args.programs.split(',') if args.programs else program_ids(source)
+    print(f"Migrating {len(programs)} programs to the '{args.scheme}' key scheme...")
+
+    failed = 0
+    for program_id in programs:
+        tables = apply_key_scheme(program_tables(source, program_id), args.scheme, program_id)
+        print(f"\n{program_id}: " + ", ".join(f"{t} {len(r)}" for t, r in tables.items()))
+        if args.bulk:
+            failed += bulk_write(target, {program_id: tables})['failed_groups']
+        else:
+            write_tables(target, tables)
+
+    # Row counts only match when every program was migrated
+    if not args.programs:
+        source_counts, target_counts = row_counts(source), row_counts(target)
+        print("\n=== ROW COUNTS (source -> target) ===")
+        for table in TABLES:
+            mark = "" if source_counts[table] == target_counts[table] else "  MISMATCH"
+            print(f"{table:16} {source_counts[table]:8} -> {target_counts[table]:8}{mark}")
+
+    if failed:
+        print(f"\nMigration Incomplete: {failed} mutation groups failed")
+        sys.exit(1)
+    print("\nMigration Complete!")
+
+if __name__ == '__main__':
+    main()
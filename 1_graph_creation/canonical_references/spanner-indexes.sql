@@ -0,0 +1,41 @@
+-- Secondary indexes for the canonical queries (canonical_queries.txt, verify_canonical.py,
+-- test_scripts/run_*_query.py). Apply with apply_indexes.py, which also compares query plans.
+-- Only columns, never STRING(MAX) content, are stored. All referenced columns exist in every schema
+-- variant (spanner-schema.sql, -sharded, -interleaved).
+-- Each index adds one mutation per written row; Agent 5 counts them when QUERY_INDEXES=true.
+
+-- Structure lookups by name: MATCH (main:Structure {name: 'MAIN-PARA'}), per program and corpus-wide
+CREATE INDEX CodeStructureByProgramName ON CodeStructure (program_id, name)
+  STORING (type, parent_structure_id, start_line_number, end_line_number);
+
+CREATE INDEX CodeStructureByName ON CodeStructure (name)
+  STORING (program_id, type, start_line_number, end_line_number);
+
+-- Lines in source order: per program (source_code) and per structure (CONTAINS_LINE, ordered traces)
+CREATE INDEX SourceCodeLinesByProgramLine ON SourceCodeLines (program_id, line_number)
+  STORING (structure_id, type);
+
+CREATE INDEX SourceCodeLinesByStructureLine ON SourceCodeLines (structure_id, line_number)
+  STORING (type);
+
+-- Entities by type: MATCH (file:Entity {type: 'FILE'})
+CREATE INDEX DataEntitiesByType ON DataEntities (type, name)
+  STORING (program_id, definition_line_id);
+
+-- REFERENCES in both directions, filtered on usage_type
+CREATE INDEX LineReferencesByTargetUsage ON LineReferences (target_entity_id, usage_type)
+  STORING (source_line_id);
+
+CREATE INDEX LineReferencesBySourceUsage ON LineReferences (source_line_id, usage_type)
+  STORING (target_entity_id);
+
+-- CALLS in both directions (who calls this paragraph / what this line calls)
+CREATE INDEX ControlFlowByTarget ON ControlFlow (target_structure_id)
+  STORING (source_line_id, type);
+
+CREATE INDEX ControlFlowBySource ON ControlFlow (source_line_id)
+  STORING (target_structure_id, type);
+
+-- Inventory per entity from the rollup (reads one row per usage type, see asset_inventory_rollup)
+CREATE INDEX StructureEntityUsageByEntityUsage ON StructureEntityUsage (entity_id, usage_type)
+  STORING (reference_count);
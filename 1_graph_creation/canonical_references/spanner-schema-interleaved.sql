@@ -0,0 +1,177 @@
+-- Spanner Schema for COBOL Modernization Knowledge Graph (Line-Centric Model), interleaved under Programs
+-- Same tables as spanner-schema.sql, but every per-program table is interleaved in Programs and keyed by
+-- (program_id, <string id>) (agent5_writer/key_schemes.py, KEY_SCHEME=interleaved).
+-- A program's structures, lines, entities and edges are stored next to its Programs row, so a per-program
+-- traversal or write stays within one split. LineReferences and ControlFlow gain a program_id column.
+-- Foreign keys reference the composite primary keys; all references are within one program.
+-- Deleting a Programs row deletes the whole program (ON DELETE CASCADE).
+-- Migrate an existing database with migrate_key_scheme.py --scheme interleaved.
+
+-- 1. Programs table (Metadata)
+CREATE TABLE Programs (
+  program_id STRING(256) NOT NULL,
+  program_name STRING(100) NOT NULL,
+  file_name STRING(200) NOT NULL,
+  total_lines INT64,
+  last_analyzed TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  updated_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  artifact_hash STRING(64), -- SHA-256 of the artifacts last written (Agent 5 delta mode)
+) PRIMARY KEY (program_id);
+
+-- 2. Code Structure (The Hierarchy)
+-- Divisions, Sections, Paragraphs.
+CREATE TABLE CodeStructure (
+  program_id STRING(256) NOT NULL,
+  structure_id STRING(256) NOT NULL,
+  parent_structure_id STRING(256), -- Recursive relationship (e.g. Section -> Division)
+  name STRING(200) NOT NULL,
+  type STRING(50) NOT NULL, -- 'DIVISION', 'SECTION', 'PARAGRAPH'
+  start_line_number INT64 NOT NULL,
+  end_line_number INT64 NOT NULL,
+  created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  FOREIGN KEY (program_id, parent_structure_id) REFERENCES CodeStructure (program_id, structure_id),
+) PRIMARY KEY (program_id, structure_id),
+  INTERLEAVE IN PARENT Programs ON DELETE CASCADE;
+
+-- 3. Source Code Lines (The Atomic Unit)
+-- Every single line of code is a record.
+CREATE TABLE SourceCodeLines (
+  program_id STRING(256) NOT NULL,
+  line_id STRING(256) NOT NULL, -- Format: {program_id}_{line_number}
+  structure_id STRING(256), -- The smallest containing structure (e.g. Paragraph)
+  line_number INT64 NOT NULL,
+  content STRING(MAX) NOT NULL, -- Raw text
+  type STRING(50) NOT NULL, -- 'CODE', 'COMMENT', 'BLANK', 'DIRECTIVE'
+  created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  FOREIGN KEY (program_id, structure_id) REFERENCES CodeStructure (program_id, structure_id),
+) PRIMARY KEY (program_id, line_id),
+  INTERLEAVE IN PARENT Programs ON DELETE CASCADE;
+
+-- 4. Data Entities (Variables, Files)
+CREATE TABLE DataEntities (
+  program_id STRING(256) NOT NULL,
+  entity_id STRING(256) NOT NULL,
+  name STRING(200) NOT NULL,
+  type STRING(50) NOT NULL, -- 'VARIABLE', 'FILE', 'COPYBOOK'
+  definition_line_id STRING(256), -- Where it is defined
+  description STRING(MAX),
+  created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  FOREIGN KEY (program_id, definition_line_id) REFERENCES SourceCodeLines (program_id, line_id),
+) PRIMARY KEY (program_id, entity_id),
+  INTERLEAVE IN PARENT Programs ON DELETE CASCADE;
+
+-- 5. Line References (The Usage Edges)
+-- Links lines to the entities they use.
+CREATE TABLE LineReferences (
+  program_id STRING(256) NOT NULL, -- Program of the source line
+  reference_id STRING(256) NOT NULL,
+  source_line_id STRING(256) NOT NULL,
+  target_entity_id STRING(256) NOT NULL,
+  usage_type STRING(50) NOT NULL, -- 'READS', 'WRITES', 'DECLARATION'
+  created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  FOREIGN KEY (program_id, source_line_id) REFERENCES SourceCodeLines (program_id, line_id),
+  FOREIGN KEY (program_id, target_entity_id) REFERENCES DataEntities (program_id, entity_id),
+) PRIMARY KEY (program_id, reference_id),
+  INTERLEAVE IN PARENT Programs ON DELETE CASCADE;
+
+-- 6. Control Flow (The Execution Edges)
+-- Links lines (PERFORM/GO TO) to target Structures (Paragraphs).
+CREATE TABLE ControlFlow (
+  program_id STRING(256) NOT NULL, -- Program of the source line
+  flow_id STRING(256) NOT NULL,
+  source_line_id STRING(256) NOT NULL,
+  target_structure_id STRING(256) NOT NULL,
+  type STRING(50) NOT NULL, -- 'PERFORM', 'GO_TO', 'CALL'
+  created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  FOREIGN KEY (program_id, source_line_id) REFERENCES SourceCodeLines (program_id, line_id),
+  FOREIGN KEY (program_id, target_structure_id) REFERENCES CodeStructure (program_id, structure_id),
+) PRIMARY KEY (program_id, flow_id),
+  INTERLEAVE IN PARENT Programs ON DELETE CASCADE;
+
+-- 7. Call Closure (Derived: transitive PERFORM/GO TO reachability)
+-- One row per (structure, structure it reaches), written by Agent 5 from ControlFlow.
+CREATE TABLE CallClosure (
+  program_id STRING(256) NOT NULL,
+  closure_id STRING(512) NOT NULL, -- Format: {source_structure_id}->{target_structure_id}
+  source_structure_id STRING(256) NOT NULL,
+  target_structure_id STRING(256) NOT NULL,
+  depth INT64 NOT NULL, -- Fewest CALLS hops from source to target
+  first_call_line_id STRING(256) NOT NULL, -- Line in the source structure making the first hop
+  first_call_line_number INT64 NOT NULL,
+  created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  FOREIGN KEY (program_id, source_structure_id) REFERENCES CodeStructure (program_id, structure_id),
+  FOREIGN KEY (program_id, target_structure_id) REFERENCES CodeStructure (program_id, structure_id),
+  FOREIGN KEY (program_id, first_call_line_id) REFERENCES SourceCodeLines (program_id, line_id),
+) PRIMARY KEY (program_id, closure_id),
+  INTERLEAVE IN PARENT Programs ON DELETE CASCADE;
+
+-- 8. Structure Entity Usage (Derived: REFERENCES rolled up per structure)
+-- One row per (structure, entity, usage_type), written by Agent 5 from LineReferences.
+CREATE TABLE StructureEntityUsage (
+  program_id STRING(256) NOT NULL,
+  usage_id STRING(1024) NOT NULL, -- Format: {structure_id}|{entity_id}|{usage_type}
+  structure_id STRING(256) NOT NULL, -- SOURCE KEY of USES; lines outside any structure are not rolled up
+  entity_id STRING(256) NOT NULL,
+  usage_type STRING(50) NOT NULL,
+  reference_count INT64 NOT NULL, -- REFERENCES edges rolled up
+  first_line_number INT64 NOT NULL,
+  last_line_number INT64 NOT NULL,
+  created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  FOREIGN KEY (program_id, structure_id) REFERENCES CodeStructure (program_id, structure_id),
+  FOREIGN KEY (program_id, entity_id) REFERENCES DataEntities (program_id, entity_id),
+) PRIMARY KEY (program_id, usage_id),
+  INTERLEAVE IN PARENT Programs ON DELETE CASCADE;
+
+-- Spanner Graph Definition
+-- Node keys are the table primary keys; edges reference them with program_id included.
+CREATE OR REPLACE PROPERTY GRAPH CobolLineGraph
+  NODE TABLES (
+    Programs KEY (program_id) LABEL Program PROPERTIES (program_name, file_name),
+    SourceCodeLines KEY (program_id, line_id) LABEL Line PROPERTIES (content, line_number, type),
+    CodeStructure KEY (program_id, structure_id) LABEL Structure PROPERTIES (name, type, start_line_number, end_line_number),
+    DataEntities KEY (program_id, entity_id) LABEL Entity PROPERTIES (name, type, description)
+  )
+  EDGE TABLES (
+    -- Hierarchy: Program contains Lines
+    SourceCodeLines AS ContainsLine
+      SOURCE KEY (program_id) REFERENCES Programs (program_id)
+      DESTINATION KEY (program_id, line_id) REFERENCES SourceCodeLines (program_id, line_id)
+      LABEL HAS_LINE,
+
+    -- Hierarchy: Structure Parent/Child
+    CodeStructure AS ParentStructure
+      SOURCE KEY (program_id, parent_structure_id) REFERENCES CodeStructure (program_id, structure_id)
+      DESTINATION KEY (program_id, structure_id) REFERENCES CodeStructure (program_id, structure_id)
+      LABEL CONTAINS_CHILD,
+
+    -- Hierarchy: Structure contains Lines
+    SourceCodeLines AS StructureContainsLine
+      SOURCE KEY (program_id, structure_id) REFERENCES CodeStructure (program_id, structure_id)
+      DESTINATION KEY (program_id, line_id) REFERENCES SourceCodeLines (program_id, line_id)
+      LABEL CONTAINS_LINE,
+
+    -- Usage: Line uses Entity
+    LineReferences
+      SOURCE KEY (program_id, source_line_id) REFERENCES SourceCodeLines (program_id, line_id)
+      DESTINATION KEY (program_id, target_entity_id) REFERENCES DataEntities (program_id, entity_id)
+      LABEL REFERENCES,
+
+    -- Flow: Line calls Structure
+    ControlFlow
+      SOURCE KEY (program_id, source_line_id) REFERENCES SourceCodeLines (program_id, line_id)
+      DESTINATION KEY (program_id, target_structure_id) REFERENCES CodeStructure (program_id, structure_id)
+      LABEL CALLS,
+
+    -- Flow: Structure reaches Structure over one or more CALLS (CallClosure)
+    CallClosure
+      SOURCE KEY (program_id, source_structure_id) REFERENCES CodeStructure (program_id, structure_id)
+      DESTINATION KEY (program_id, target_structure_id) REFERENCES CodeStructure (program_id, structure_id)
+      LABEL REACHES,
+
+    -- Usage: Structure uses Entity (StructureEntityUsage, REFERENCES rolled up)
+    StructureEntityUsage
+      SOURCE KEY (program_id, structure_id) REFERENCES CodeStructure (program_id, structure_id)
+      DESTINATION KEY (program_id, entity_id) REFERENCES DataEntities (program_id, entity_id)
+      LABEL USES
+  );
@@ -0,0 +1,180 @@
+-- Spanner Schema for COBOL Modernization Knowledge Graph (Line-Centric Model), hash-sharded keys
+-- Same tables as spanner-schema.sql, but SourceCodeLines, LineReferences and ControlFlow are keyed by
+-- (shard_id, <string id>) with shard_id = hash(string id) mod 64 (agent5_writer/key_schemes.py, KEY_SCHEME=sharded).
+-- Monotonic ids like {program_id}_{line_number} no longer land on one split during a bulk load.
+-- The string ids stay as columns with unique indexes, so foreign keys and the property graph are unchanged.
+-- Migrate an existing database with migrate_key_scheme.py.
+
+-- 1. Programs table (Metadata)
+CREATE TABLE Programs (
+  program_id STRING(256) NOT NULL,
+  program_name STRING(100) NOT NULL,
+  file_name STRING(200) NOT NULL,
+  total_lines INT64,
+  last_analyzed TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  updated_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  artifact_hash STRING(64), -- SHA-256 of the artifacts last written (Agent 5 delta mode)
+) PRIMARY KEY (program_id);
+
+-- 2. Code Structure (The Hierarchy)
+-- Divisions, Sections, Paragraphs.
+CREATE TABLE CodeStructure (
+  structure_id STRING(256) NOT NULL,
+  program_id STRING(256) NOT NULL,
+  parent_structure_id STRING(256), -- Recursive relationship (e.g. Section -> Division)
+  name STRING(200) NOT NULL,
+  type STRING(50) NOT NULL, -- 'DIVISION', 'SECTION', 'PARAGRAPH'
+  start_line_number INT64 NOT NULL,
+  end_line_number INT64 NOT NULL,
+  created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  FOREIGN KEY (program_id) REFERENCES Programs (program_id),
+  FOREIGN KEY (parent_structure_id) REFERENCES CodeStructure (structure_id),
+) PRIMARY KEY (structure_id);
+
+-- 3. Source Code Lines (The Atomic Unit)
+-- Every single line of code is a record.
+CREATE TABLE SourceCodeLines (
+  shard_id INT64 NOT NULL, -- hash(line_id) mod SHARD_COUNT, computed by the writer
+  line_id STRING(256) NOT NULL, -- Format: {program_id}_{line_number}
+  program_id STRING(256) NOT NULL,
+  structure_id STRING(256), -- The smallest containing structure (e.g. Paragraph)
+  line_number INT64 NOT NULL,
+  content STRING(MAX) NOT NULL, -- Raw text
+  type STRING(50) NOT NULL, -- 'CODE', 'COMMENT', 'BLANK', 'DIRECTIVE'
+  created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  FOREIGN KEY (program_id) REFERENCES Programs (program_id),
+  FOREIGN KEY (structure_id) REFERENCES CodeStructure (structure_id),
+) PRIMARY KEY (shard_id, line_id);
+
+-- Referenced by FKs and point lookups. Only the short id is written here, not the row.
+CREATE UNIQUE INDEX SourceCodeLinesByLineId ON SourceCodeLines (line_id);
+
+-- 4. Data Entities (Variables, Files)
+CREATE TABLE DataEntities (
+  entity_id STRING(256) NOT NULL,
+  program_id STRING(256) NOT NULL,
+  name STRING(200) NOT NULL,
+  type STRING(50) NOT NULL, -- 'VARIABLE', 'FILE', 'COPYBOOK'
+  definition_line_id STRING(256), -- Where it is defined
+  description STRING(MAX),
+  created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  FOREIGN KEY (program_id) REFERENCES Programs (program_id),
+  FOREIGN KEY (definition_line_id) REFERENCES SourceCodeLines (line_id),
+) PRIMARY KEY (entity_id);
+
+-- 5. Line References (The Usage Edges)
+-- Links lines to the entities they use.
+CREATE TABLE LineReferences (
+  shard_id INT64 NOT NULL, -- hash(reference_id) mod SHARD_COUNT
+  reference_id STRING(256) NOT NULL,
+  source_line_id STRING(256) NOT NULL,
+  target_entity_id STRING(256) NOT NULL,
+  usage_type STRING(50) NOT NULL, -- 'READS', 'WRITES', 'DECLARATION'
+  created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  FOREIGN KEY (source_line_id) REFERENCES SourceCodeLines (line_id),
+  FOREIGN KEY (target_entity_id) REFERENCES DataEntities (entity_id),
+) PRIMARY KEY (shard_id, reference_id);
+
+CREATE UNIQUE INDEX LineReferencesByReferenceId ON LineReferences (reference_id);
+
+-- 6. Control Flow (The Execution Edges)
+-- Links lines (PERFORM/GO TO) to target Structures (Paragraphs).
+CREATE TABLE ControlFlow (
+  shard_id INT64 NOT NULL, -- hash(flow_id) mod SHARD_COUNT
+  flow_id STRING(256) NOT NULL,
+  source_line_id STRING(256) NOT NULL,
+  target_structure_id STRING(256) NOT NULL,
+  type STRING(50) NOT NULL, -- 'PERFORM', 'GO_TO', 'CALL'
+  created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  FOREIGN KEY (source_line_id) REFERENCES SourceCodeLines (line_id),
+  FOREIGN KEY (target_structure_id) REFERENCES CodeStructure (structure_id),
+) PRIMARY KEY (shard_id, flow_id);
+
+CREATE UNIQUE INDEX ControlFlowByFlowId ON ControlFlow (flow_id);
+
+-- 7. Call Closure (Derived: transitive PERFORM/GO TO reachability)
+-- One row per (structure, structure it reaches), written by Agent 5 from ControlFlow.
+CREATE TABLE CallClosure (
+  closure_id STRING(512) NOT NULL, -- Format: {source_structure_id}->{target_structure_id}
+  program_id STRING(256) NOT NULL,
+  source_structure_id STRING(256) NOT NULL,
+  target_structure_id STRING(256) NOT NULL,
+  depth INT64 NOT NULL, -- Fewest CALLS hops from source to target
+  first_call_line_id STRING(256) NOT NULL, -- Line in the source structure making the first hop
+  first_call_line_number INT64 NOT NULL,
+  created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  FOREIGN KEY (program_id) REFERENCES Programs (program_id),
+  FOREIGN KEY (source_structure_id) REFERENCES CodeStructure (structure_id),
+  FOREIGN KEY (target_structure_id) REFERENCES CodeStructure (structure_id),
+  FOREIGN KEY (first_call_line_id) REFERENCES SourceCodeLines (line_id),
+) PRIMARY KEY (closure_id);
+
+-- 8. Structure Entity Usage (Derived: REFERENCES rolled up per structure)
+-- One row per (structure, entity, usage_type), written by Agent 5 from LineReferences.
+CREATE TABLE StructureEntityUsage (
+  usage_id STRING(1024) NOT NULL, -- Format: {structure_id}|{entity_id}|{usage_type}
+  program_id STRING(256) NOT NULL,
+  structure_id STRING(256) NOT NULL, -- SOURCE KEY of USES; lines outside any structure are not rolled up
+  entity_id STRING(256) NOT NULL,
+  usage_type STRING(50) NOT NULL,
+  reference_count INT64 NOT NULL, -- REFERENCES edges rolled up
+  first_line_number INT64 NOT NULL,
+  last_line_number INT64 NOT NULL,
+  created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  FOREIGN KEY (program_id) REFERENCES Programs (program_id),
+  FOREIGN KEY (structure_id) REFERENCES CodeStructure (structure_id),
+  FOREIGN KEY (entity_id) REFERENCES DataEntities (entity_id),
+) PRIMARY KEY (usage_id);
+
+-- Spanner Graph Definition
+CREATE OR REPLACE PROPERTY GRAPH CobolLineGraph
+  NODE TABLES (
+    Programs KEY (program_id, program_name) LABEL Program PROPERTIES (program_name, file_name),
+    SourceCodeLines KEY (line_id, line_number) LABEL Line PROPERTIES (content, line_number, type),
+    CodeStructure KEY (structure_id, name) LABEL Structure PROPERTIES (name, type, start_line_number, end_line_number),
+    DataEntities KEY (entity_id, name) LABEL Entity PROPERTIES (name, type, description)
+  )
+  EDGE TABLES (
+    -- Hierarchy: Structure contains Lines
+    SourceCodeLines AS ContainsLine
+      SOURCE KEY (program_id) REFERENCES Programs (program_id) -- Simplification, could traverse Structure
+      DESTINATION KEY (line_id) REFERENCES SourceCodeLines (line_id)
+      LABEL HAS_LINE,
+    
+    -- Hierarchy: Structure Parent/Child
+    CodeStructure AS ParentStructure
+      SOURCE KEY (parent_structure_id) REFERENCES CodeStructure (structure_id)
+      DESTINATION KEY (structure_id) REFERENCES CodeStructure (structure_id)
+      LABEL CONTAINS_CHILD,
+
+    -- Hierarchy: Structure contains Lines (NEW)
+    SourceCodeLines AS StructureContainsLine
+      SOURCE KEY (structure_id) REFERENCES CodeStructure (structure_id)
+      DESTINATION KEY (line_id) REFERENCES SourceCodeLines (line_id)
+      LABEL CONTAINS_LINE,
+
+    -- Usage: Line uses Entity
+    LineReferences
+      SOURCE KEY (source_line_id) REFERENCES SourceCodeLines (line_id)
+      DESTINATION KEY (target_entity_id) REFERENCES DataEntities (entity_id)
+      LABEL REFERENCES,
+
+    -- Flow: Line calls Structure
+    ControlFlow
+      SOURCE KEY (source_line_id) REFERENCES SourceCodeLines (line_id)
+      DESTINATION KEY (target_structure_id) REFERENCES CodeStructure (structure_id)
+      LABEL CALLS,
+
+    -- Flow: Structure reaches Structure over one or more CALLS (CallClosure)
+    CallClosure
+      SOURCE KEY (source_structure_id) REFERENCES CodeStructure (structure_id)
+      DESTINATION KEY (target_structure_id) REFERENCES CodeStructure (structure_id)
+      LABEL REACHES,
+
+    -- Usage: Structure uses Entity (StructureEntityUsage, REFERENCES rolled up)
+    StructureEntityUsage
+      SOURCE KEY (structure_id) REFERENCES CodeStructure (structure_id)
+      DESTINATION KEY (entity_id) REFERENCES DataEntities (entity_id)
+      LABEL USES
+  );
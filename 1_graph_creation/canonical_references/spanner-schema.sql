@@ -10,7 +10,9 @@ CREATE TABLE Programs (
   last_analyzed TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
   created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
   updated_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  artifact_hash STRING(64), -- SHA-256 of the artifacts last written (Agent 5 delta mode)
 ) PRIMARY KEY (program_id);
+-- Existing databases: ALTER TABLE Programs ADD COLUMN artifact_hash STRING(64);
 
 -- 2. Code Structure (The Hierarchy)
 -- Divisions, Sections, Paragraphs.
@@ -78,6 +80,42 @@ CREATE TABLE ControlFlow (
   FOREIGN KEY (target_structure_id) REFERENCES CodeStructure (structure_id),
 ) PRIMARY KEY (flow_id);
 
+-- 7. Call Closure (Derived: transitive PERFORM/GO TO reachability)
+-- One row per (structure, structure it reaches), written by Agent 5 from ControlFlow.
+-- Existing databases: create this table before deploying Agent 5 with CallClosure support.
+CREATE TABLE CallClosure (
+  closure_id STRING(512) NOT NULL, -- Format: {source_structure_id}->{target_structure_id}
+  program_id STRING(256) NOT NULL,
+  source_structure_id STRING(256) NOT NULL,
+  target_structure_id STRING(256) NOT NULL,
+  depth INT64 NOT NULL, -- Fewest CALLS hops from source to target
+  first_call_line_id STRING(256) NOT NULL, -- Line in the source structure making the first hop
+  first_call_line_number INT64 NOT NULL,
+  created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  FOREIGN KEY (program_id) REFERENCES Programs (program_id),
+  FOREIGN KEY (source_structure_id) REFERENCES CodeStructure (structure_id),
+  FOREIGN KEY (target_structure_id) REFERENCES CodeStructure (structure_id),
+  FOREIGN KEY (first_call_line_id) REFERENCES SourceCodeLines (line_id),
+) PRIMARY KEY (closure_id);
+
+-- 8. Structure Entity Usage (Derived: REFERENCES rolled up per structure)
+-- One row per (structure, entity, usage_type), written by Agent 5 from LineReferences.
+-- Existing databases: create this table before deploying Agent 5 with StructureEntityUsage support.
+CREATE TABLE StructureEntityUsage (
+  usage_id STRING(1024) NOT NULL, -- Format: {structure_id}|{entity_id}|{usage_type}
+  program_id STRING(256) NOT NULL,
+  structure_id STRING(256) NOT NULL, -- SOURCE KEY of USES; lines outside any structure are not rolled up
+  entity_id STRING(256) NOT NULL,
+  usage_type STRING(50) NOT NULL,
+  reference_count INT64 NOT NULL, -- REFERENCES edges rolled up
+  first_line_number INT64 NOT NULL,
+  last_line_number INT64 NOT NULL,
+  created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp=true),
+  FOREIGN KEY (program_id) REFERENCES Programs (program_id),
+  FOREIGN KEY (structure_id) REFERENCES CodeStructure (structure_id),
+  FOREIGN KEY (entity_id) REFERENCES DataEntities (entity_id),
+) PRIMARY KEY (usage_id);
+
 -- Spanner Graph Definition
 CREATE OR REPLACE PROPERTY GRAPH CobolLineGraph
   NODE TABLES (
@@ -115,5 +153,17 @@ CREATE OR REPLACE PROPERTY GRAPH CobolLineGraph
     ControlFlow
       SOURCE KEY (source_line_id) REFERENCES SourceCodeLines (line_id)
       DESTINATION KEY (target_structure_id) REFERENCES CodeStructure (structure_id)
-      LABEL CALLS
+      LABEL CALLS,
+
+    -- Flow: Structure reaches Structure over one or more CALLS (CallClosure)
+    CallClosure
+      SOURCE KEY (source_structure_id) REFERENCES CodeStructure (structure_id)
+      DESTINATION KEY (target_structure_id) REFERENCES CodeStructure (structure_id)
+      LABEL REACHES,
+
+    -- Usage: Structure uses Entity (StructureEntityUsage, REFERENCES rolled up)
+    StructureEntityUsage
+      SOURCE KEY (structure_id) REFERENCES CodeStructure (structure_id)
+      DESTINATION KEY (entity_id) REFERENCES DataEntities (entity_id)
+      LABEL USES
   );
@@ -1,5 +1,9 @@
 import argparse
-from google.cloud import spanner
+import os
+import sys
+
+# Shared with Agent 5: the local graph store and the SQL forms of the canonical queries
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../functions/agent5_writer')))
 
 def run_query(database, query, query_type="Traceability"):
     print(f"\n--- Running {query_type} Query ---")
@@ -15,11 +19,22 @@ def run_query(database, query, query_type="Traceability"):
 
 def main():
     parser = argparse.ArgumentParser(description='Verify Canonical Data in Spanner')
-    parser.add_argument('--project_id', required=True, help='GCP Project ID')
-    parser.add_argument('--instance_id', required=True, help='Spanner Instance ID')
-    parser.add_argument('--database_id', required=True, help='Spanner Database ID')
+    parser.add_argument('--project_id', help='GCP Project ID')
+    parser.add_argument('--instance_id', help='Spanner Instance ID')
+    parser.add_argument('--database_id', help='Spanner Database ID')
+    parser.add_argument('--sqlite', help='Verify a local SQLite graph store at this path instead of Spanner')
     args = parser.parse_args()
 
+    if args.sqlite:
+        from graph_store import SQLiteGraphStore
+        from canonical_sql import CANONICAL_SQL
+        database = SQLiteGraphStore(args.sqlite)
+        run_query(database, CANONICAL_SQL['policy_map'], "Life of a Transaction (Policy Map, SQL)")
+        return
+
+    if not (args.project_id and args.instance_id and args.database_id):
+        parser.error('--project_id, --instance_id and --database_id are required for Spanner')
+    from google.cloud import spanner
     spanner_client = spanner.Client(project=args.project_id)
     instance = spanner_client.instance(args.instance_id)
     database = instance.database(args.database_id)
@@ -0,0 +1,156 @@
+"""
+Cross-program copybook entity registry.
+
+Entities defined by a copybook (COPY CVACT01Y, ...) are the same in every program
+that includes it. The registry stores them once, keyed by copybook name and
+content hash, so later programs reuse them instead of re-extracting. Only
+copybooks whose source can be read from COPYBOOK_DIR take part: without the
+content, an edited copybook could not be told from the one registered.
+
+Storage is a local directory or a gs://bucket/prefix, one JSON file per entry.
+"""
+import os
+import re
+import json
+import hashlib
+
+# Local directory or gs://bucket/prefix. Empty disables the registry.
+COPYBOOK_REGISTRY_PATH = os.environ.get("COPYBOOK_REGISTRY_PATH", "")
+# Directory with copybook sources. The registry key is the copybook's content hash;
+# COPY statements whose copybook is not found here bypass the registry.
+COPYBOOK_DIR = os.environ.get("COPYBOOK_DIR", "")
+
+COPY_RE = re.compile(r"^\s*COPY\s+['\"]?([A-Z0-9$#@-]+)['\"]?(.*?)\.?\s*$", re.IGNORECASE)
+COPYBOOK_EXTENSIONS = ('', '.cpy', '.CPY', '.cbl', '.CBL')
+
+# Fields stored per registry entity (program-specific fields are re-derived on reuse)
+TEMPLATE_FIELDS = ('entity_name', 'entity_type', 'description')
+
+def find_copy_statements(source_lines):
+    """
+    Finds COPY statements in a program.
+    Returns [{copybook, line_id, line_number, content_hash}], one per statement
+    whose copybook source can be read.
+    """
+    statements = []
+    for line in source_lines:
+        if line.get('type') in ('COMMENT', 'BLANK'):
+            continue
+        content = line.get('content', '')
+        # Fixed format: columns 1-6 sequence area, column 7 indicator
+        if len(content) > 6 and content[6] in '*/':
+            continue
+        m = COPY_RE.match(content[7:] if len(content) > 7 else content)
+        if not m:
+            continue
+        copybook = m.group(1).upper()
+        content_hash = copybook_hash(copybook, m.group(2))
+        if content_hash is None:
+            continue
+        statements.append({
+            'copybook': copybook,
+            'line_id': line.get('line_id'),
+            'line_number': line.get('line_number'),
+            'content_hash': content_hash
+        })
+    return statements
+
+def copybook_hash(copybook, copy_suffix=''):
+    """
+    Content hash of a copybook (plus any REPLACING clause, which changes the fields),
+    or None when its source can't be read.
+    """
+    source = _read_copybook_source(copybook)
+    if source is None:
+        return None
+    h = hashlib.sha256()
+    h.update(source)
+    h.update(" ".join(copy_suffix.upper().split()).encode())
+    return h.hexdigest()
+
+def _read_copybook_source(copybook):
+    if not COPYBOOK_DIR:
+        return None
+    for ext in COPYBOOK_EXTENSIONS:
+        path = os.path.join(COPYBOOK_DIR, copybook + ext)
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                return f.read()
+    return None
+
+def materialize(program_id, statement, templates):
+    """Derives per-program entity records from registry templates for one COPY statement."""
+    entities = []
+    for t in templates:
+        is_copybook = t.get('entity_type') == 'COPYBOOK'
+        entities.append({
+            'entity_name': t['entity_name'],
+            'entity_type': t['entity_type'],
+            # The COPYBOOK entity is defined by the COPY line; its fields live outside the program
+            'definition_line_id': statement['line_id'] if is_copybook else None,
+            'description': t.get('description', ''),
+            'program_id': program_id,
+            'found_in_structure': 'COPYBOOK REGISTRY',
+            'source_copybook': statement['copybook']
+        })
+    return entities
+
+class CopybookRegistry:
+    def __init__(self, path=COPYBOOK_REGISTRY_PATH):
+        self.path = path
+        self._bucket = None
+        self._prefix = ''
+        if path.startswith('gs://'):
+            from google.cloud import storage
+            bucket_name, _, self._prefix = path[len('gs://'):].partition('/')
+            self._bucket = storage.Client().bucket(bucket_name)
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _key(self, copybook, content_hash):
+        return f"{copybook}_{content_hash[:16]}.json"
+
+    def get(self, copybook, content_hash):
+        """Returns the stored entity templates, or None on a miss."""
+        if not self.enabled:
+            return None
+        key = self._key(copybook, content_hash)
+        try:
+            if self._bucket is not None:
+                blob = self._bucket.blob(f"{self._prefix.rstrip('/')}/{key}".lstrip('/'))
+                if not blob.exists():
+                    return None
+                data = json.loads(blob.download_as_text())
+            else:
+                file_path = os.path.join(self.path, key)
+                if not os.path.exists(file_path):
+                    return None
+                with open(file_path, 'r') as f:
+                    data = json.load(f)
+            return data.get('entities')
+        except Exception as e:
+            print(f"Copybook registry read failed for {key}: {e}")
+            return None
+
+    def put(self, copybook, content_hash, entities, program_id=None):
+        if not self.enabled or not entities:
+            return
+        key = self._key(copybook, content_hash)
+        data = json.dumps({
+            'copybook': copybook,
+            'content_hash': content_hash,
+            'registered_from': program_id,
+            'entities': [{f: e.get(f) for f in TEMPLATE_FIELDS} for e in entities]
+        }, indent=2)
+        try:
+            if self._bucket is not None:
+                blob = self._bucket.blob(f"{self._prefix.rstrip('/')}/{key}".lstrip('/'))
+                blob.upload_from_string(data, content_type='application/json')
+            else:
+                os.makedirs(self.path, exist_ok=True)
+                with open(os.path.join(self.path, key), 'w') as f:
+                    f.write(data)
+        except Exception as e:
+            print(f"Copybook registry write failed for {key}: {e}")
@@ -7,6 +7,12 @@ REGION="us-central1"
 # CD to the directory of this script so --source=. works
 cd "$(dirname "$0")"
 
+# Modules shared with the other orchestrator (event stream, scheduling, worker dispatch)
+# are uploaded with this function's source, then removed again
+SHARED_MODULES=$(cd ../shared && ls *.py)
+cp ../shared/*.py .
+trap 'rm -f $SHARED_MODULES' EXIT
+
 echo "--- Deploying Agent 3 Worker ---"
 gcloud functions deploy agent3-entity-worker \
     --gen2 \
@@ -37,7 +43,7 @@ gcloud functions deploy agent3-entity-orchestrator \
     --timeout=3600s \
     --memory=4Gi \
     --cpu=2 \
-    --set-env-vars=GOOGLE_CLOUD_PROJECT=$PROJECT_ID,WORKER_URL=$WORKER_URL
+    --set-env-vars=GOOGLE_CLOUD_PROJECT=$PROJECT_ID,WORKER_URL=$WORKER_URL,WORKER_MODE=http
 
 # Get Orchestrator URL
 ORCHESTRATOR_URL=$(gcloud functions describe agent3-entity-orchestrator --gen2 --region=$REGION --format='value(serviceConfig.uri)')
@@ -0,0 +1,93 @@
+"""
+Deterministic validation of extracted entities.
+
+Each entity the model reports for a structure is checked before it is grouped:
+  - membership:  the name occurs (whole identifier, case-insensitive) in the
+                 lines of the structure it was reported for, unless it comes
+                 from a COPY member (source_copybook)
+  - line range:  a definition_line_id is a line of this program and the name
+                 occurs on it; bare line numbers are normalized to
+                 {program_id}_{n}
+  - consistency: a FILE is named by a SELECT/FD/SD, a COPYBOOK by a COPY statement
+Invalid entities come back with a reason, so the worker can re-ask about just
+those and report whatever is still invalid instead of dropping it silently.
+"""
+import re
+
+WORD_RE = re.compile(r"""'[^']*'?|"[^"]*"?|[A-Za-z0-9][A-Za-z0-9-]*""")
+LINE_NUMBER_RE = re.compile(r'(\d+)$')
+FILE_WORDS = ('SELECT', 'FD', 'SD')
+
+def line_words(content):
+    """Upper-cased words of a fixed-format line's source area (literals and comments excluded)."""
+    if len(content) > 6 and content[6] in '*/':
+        return []
+    return [w.upper() for w in WORD_RE.findall(content[7:72]) if w[0] not in '\'"']
+
+def structure_words(lines):
+    words = set()
+    for line in lines:
+        words.update(line_words(line.get('content', '')))
+    return words
+
+class EntityValidator:
+    """Validates extracted entities against the program's source lines."""
+
+    def __init__(self, program_id, source_lines):
+        self.program_id = program_id
+        self.words_by_id = {}
+        self.file_names = set()
+        self.copy_names = set()
+        self.declared_on = {} # NAME -> line ids where a level/SELECT/FD entry declares it
+        for line in source_lines:
+            line_id = line.get('line_id') or f"{program_id}_{line.get('line_number')}"
+            words = line_words(line.get('content', ''))
+            self.words_by_id[line_id] = set(words)
+            for i, w in enumerate(words[:-1]):
+                if w in FILE_WORDS:
+                    self.file_names.add(words[i + 1])
+                elif w == 'COPY':
+                    self.copy_names.add(words[i + 1])
+            if len(words) > 1 and (words[0].isdigit() or words[0] in FILE_WORDS):
+                self.declared_on.setdefault(words[1], []).append(line_id)
+
+    def normalize_line_id(self, value):
+        """'CBTRN01C_29', '29' or 'Line 29' -> 'CBTRN01C_29'; None stays None."""
+        if value is None or value in self.words_by_id:
+            return value
+        m = LINE_NUMBER_RE.search(str(value).strip())
+        return f"{self.program_id}_{m.group(1)}" if m else value
+
+    def check(self, entity, words):
+        """Returns (entity, None) if valid, else (entity, reason). words: the structure's words."""
+        name = (entity.get('entity_name') or '').strip()
+        norm = name.upper()
+        entity = dict(entity, entity_name=name, definition_line_id=self.normalize_line_id(entity.get('definition_line_id')))
+        from_copybook = bool(entity.get('source_copybook'))
+
+        if not name:
+            return entity, "empty entity_name"
+        if not from_copybook and norm not in words:
+            return entity, f"'{name}' does not occur in the structure"
+        line_id = entity['definition_line_id']
+        if line_id is not None:
+            if line_id not in self.words_by_id:
+                return entity, f"definition line {line_id} is not a line of {self.program_id}"
+            if not from_copybook and norm not in self.words_by_id[line_id]:
+                return entity, f"'{name}' does not occur on definition line {line_id}"
+        if entity.get('entity_type') == 'FILE' and self.file_names and norm not in self.file_names:
+            return entity, f"FILE '{name}' has no SELECT/FD"
+        if entity.get('entity_type') == 'COPYBOOK' and norm not in self.copy_names:
+            return entity, f"COPYBOOK '{name}' has no COPY statement"
+        return entity, None
+
+    def validate(self, entities, words):
+        """Splits entities into (valid, invalid); invalid items carry a 'reason'."""
+        valid, invalid = [], []
+        for e in entities:
+            e, reason = self.check(e, words)
+            if reason:
+                invalid.append(dict(e, reason=reason))
+            else:
+                valid.append(e)
+        return valid, invalid
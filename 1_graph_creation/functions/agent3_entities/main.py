@@ -3,17 +3,41 @@ from flask import Request, Response, jsonify
 import os
 import json
 import time
+import sys
 import asyncio
 import aiohttp
 import datetime
 from google import genai
 from google.genai import types
 
+# Modules shared with the other orchestrator live in ../shared (deploy.sh copies them in)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+
+from scheduling import (estimate_tokens, pack_structures, BATCH_TOKEN_BUDGET,
+                        CostModel, lpt_order, simulated_makespan)
+from copybook_registry import CopybookRegistry, find_copy_statements, materialize
+from event_stream import (wants_ndjson, progress, partial_result, error, summary,
+                          render_ndjson, render_text, NDJSON_MIMETYPE)
+import worker_dispatch
+from worker_dispatch import stream_async, WORKER_MODE, WORKER_POOL_SIZE
+from entity_validator import EntityValidator, structure_words
+
 # --- Configuration ---
 PROJECT_ID = os.environ.get("GOOGLE_CLOUD_PROJECT", "wz-cobol-graph")
 LOCATION = os.environ.get("GOOGLE_CLOUD_REGION", "global")
 MODEL_NAME = "gemini-3-pro-preview"
 
+# Max concurrent 'resolve' calls for genuinely ambiguous entity groups.
+RESOLVE_CONCURRENCY = int(os.environ.get("RESOLVE_CONCURRENCY", "10"))
+# How the orchestrator reaches the worker: WORKER_MODE / WORKER_POOL_SIZE, see worker_dispatch.py
+
+# Descriptions are clipped to this length in resolve payloads.
+RESOLVE_DESCRIPTION_CHARS = 300
+
+# 'reask' re-asks the model about extracted entities failing validation, 'drop' drops (and reports)
+# them, 'off' accepts model output as-is
+ENTITY_VALIDATION = os.environ.get("ENTITY_VALIDATION", "reask")
+
 # Initialize Gemini Client (Shared)
 try:
     client = genai.Client(vertexai=True, project=PROJECT_ID, location=LOCATION)
@@ -33,6 +57,66 @@ def generate_with_retries(model, contents, config, max_retries=3):
             time.sleep(delay)
             delay *= 2
 
+def premerge_group(program_id, group):
+    """
+    Rule-based merge for candidates sharing a name.
+    Candidates are the same logical entity if they agree on entity_type and
+    have at most one distinct definition_line_id (the same variable seen in
+    several paragraphs, or only one structure saw the definition).
+    Returns the merged entity, or None if the group needs LLM resolution.
+    """
+    entity_types = {c.get('entity_type') for c in group}
+    if len(entity_types) != 1:
+        return None
+    definitions = {c.get('definition_line_id') for c in group if c.get('definition_line_id')}
+    if len(definitions) > 1:
+        return None
+
+    # Prefer the defining candidate as the base record
+    base = next((c for c in group if c.get('definition_line_id')), group[0])
+    description = base.get('description') or max(
+        (c.get('description') or '' for c in group), key=len
+    )
+    entity_name = base['entity_name'].strip()
+    merged = {
+        'entity_name': entity_name,
+        'entity_type': base.get('entity_type'),
+        'definition_line_id': base.get('definition_line_id'),
+        'description': description,
+        'program_id': program_id,
+        'entity_id': f"{program_id}_{entity_name}"
+    }
+    source_copybook = next((c['source_copybook'] for c in group if c.get('source_copybook')), None)
+    if source_copybook:
+        merged['source_copybook'] = source_copybook
+    return merged
+
+def compact_candidates(group):
+    """
+    Shrinks a conflict group for the resolve prompt.
+    Collapses candidates with the same (type, definition) into one entry and
+    drops fields the resolver does not need.
+    """
+    compacted = {}
+    for c in group:
+        key = (c.get('entity_type'), c.get('definition_line_id'))
+        if key not in compacted:
+            compacted[key] = {
+                'entity_name': c.get('entity_name'),
+                'entity_type': c.get('entity_type'),
+                'definition_line_id': c.get('definition_line_id'),
+                'description': (c.get('description') or '')[:RESOLVE_DESCRIPTION_CHARS],
+                'source_copybook': c.get('source_copybook'),
+                'found_in_structures': []
+            }
+        entry = compacted[key]
+        if not entry['description'] and c.get('description'):
+            entry['description'] = c['description'][:RESOLVE_DESCRIPTION_CHARS]
+        found_in = c.get('found_in_structure')
+        if found_in and found_in not in entry['found_in_structures']:
+            entry['found_in_structures'].append(found_in)
+    return list(compacted.values())
+
 # --- WORKER FUNCTION ---
 
 @functions_framework.http
@@ -52,22 +136,47 @@ def entity_worker(request: Request):
 
     try:
         req_json = request.get_json(silent=True) or {}
-        mode = req_json.get('mode', 'extract')
-        program_id = req_json.get('program_id', 'UNKNOWN')
-
-        if mode == 'extract':
-            return handle_extract(req_json, program_id)
-        elif mode == 'resolve':
-            return handle_resolve(req_json, program_id)
-        else:
-            return jsonify({'error': f"Unknown mode: {mode}"}), 400
+        body, status = dispatch_mode(req_json)
+        return jsonify(body), status
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def dispatch_mode(req_json):
+    """Routes a worker payload to its handler. Returns (body, status)."""
+    mode = req_json.get('mode', 'extract')
+    program_id = req_json.get('program_id', 'UNKNOWN')
+
+    if mode == 'extract':
+        return handle_extract(req_json, program_id)
+    elif mode == 'resolve':
+        return handle_resolve(req_json, program_id)
+    else:
+        return {'error': f"Unknown mode: {mode}"}, 400
+
+def run_worker(payload):
+    """
+    In-process worker entry point (thread/process pool executors).
+    Same contract as the HTTP worker: returns the body, or {'error': ...}.
+    """
+    try:
+        body, status = dispatch_mode(payload)
+        if status != 200 and 'error' not in body:
+            body = {'error': f"Status {status}"}
+        return body
+    except Exception as e:
+        return {'error': str(e)}
+
 def handle_extract(req_json, program_id):
+    """
+    Extracts entities for one or more structures in a single Gemini call.
+    Small structures are packed into one request by the orchestrator, so the
+    program context is paid once per batch. Results are keyed by structure
+    (section_id, or name if absent) in 'results_by_structure'.
+    """
     structures = req_json.get('structures', [])
     source_lines = req_json.get('source_lines', [])
+    known_copybooks = req_json.get('known_copybooks', [])
     
     # Build line map for context
     line_map = {line['line_number']: line for line in source_lines} if source_lines else {}
@@ -80,87 +189,210 @@ def handle_extract(req_json, program_id):
             if l_obj.get('content', '').strip():
                 full_program_context += f"Line {ln} [{l_obj.get('line_id', 'NA')}]: {l_obj.get('content', '')}\n"
 
-    found_entities = []
-
+    # Reconstruct content for each structure in the batch
+    blocks = []
+    names_by_key = {}
+    words_by_key = {} # identifiers per structure, for validation
     for struct in structures:
         name = struct.get('name', '')
         sType = struct.get('type', '')
+        key = struct.get('section_id') or name
         
-        # Reconstruct content
         structured_content = ""
         start_line = struct.get('start_line')
         end_line = struct.get('end_line')
         if start_line and end_line and line_map:
-            for ln in range(start_line, end_line + 1):
-                if ln in line_map:
-                    l_obj = line_map[ln]
-                    structured_content += f"Line {ln} [ID: {l_obj.get('line_id', 'NA')}]: {l_obj.get('content', '')}\n"
+            struct_lines = [line_map[ln] for ln in range(start_line, end_line + 1) if ln in line_map]
+            for l_obj in struct_lines:
+                structured_content += f"Line {l_obj['line_number']} [ID: {l_obj.get('line_id', 'NA')}]: {l_obj.get('content', '')}\n"
         else:
             structured_content = struct.get('content', '')
+            struct_lines = [{'content': c} for c in structured_content.split('\n')]
 
         if not structured_content.strip():
             continue
 
-        # Gemini Call
-        prompt = f"""
-        You are analyzing COBOL structure: {name} ({sType}).
-        Program: {program_id}.
-        
-        === FULL PROGRAM CONTEXT ===
-        {full_program_context[:30000]} ... (truncated if too long)
-        
-        === CURRENT STRUCTURE ===
-        {structured_content}
-        
-        Task: Extract ALL Data Entities defined OR referenced in this code block.
-        Include: FILE, VARIABLE, COPYBOOK.
-        Set definition_line_id if defined here.
-        """
-        
-        config = types.GenerateContentConfig(
-            temperature=1.0,
-            response_mime_type="application/json",
-            response_schema={
-                "type": "OBJECT",
-                "properties": {
-                    "found_entities": {
-                        "type": "ARRAY",
-                        "items": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "entity_name": {"type": "STRING"},
-                                "entity_type": {"type": "STRING", "enum": ["FILE", "VARIABLE", "COPYBOOK"]},
-                                "definition_line_id": {"type": "STRING", "nullable": True},
-                                "description": {"type": "STRING"}
-                            },
-                            "required": ["entity_name", "entity_type"]
-                        }
+        names_by_key[key] = name
+        words_by_key[key] = structure_words(struct_lines)
+        blocks.append(f"--- STRUCTURE [{key}]: {name} ({sType}) ---\n{structured_content}")
+
+    results_by_structure = {key: [] for key in names_by_key}
+    if not blocks:
+        return {"entities": [], "results_by_structure": results_by_structure}, 200
+
+    structures_str = "\n".join(blocks)
+    known_copybooks_str = ""
+    if known_copybooks:
+        known_copybooks_str = f"Fields defined inside these copybooks are already catalogued, do NOT extract them (still extract the COPYBOOK entities themselves): {', '.join(known_copybooks)}"
+
+    # Gemini Call (one per batch)
+    prompt = f"""
+    You are analyzing {len(blocks)} COBOL structure(s).
+    Program: {program_id}.
+    
+    === FULL PROGRAM CONTEXT ===
+    {full_program_context[:30000]} ... (truncated if too long)
+    
+    === CURRENT STRUCTURES ===
+    {structures_str}
+    
+    Task: For EACH structure above, extract ALL Data Entities defined OR referenced in that code block.
+    Include: FILE, VARIABLE, COPYBOOK.
+    Set definition_line_id if defined here.
+    Set structure_key to the bracketed key of the structure the entity was found in.
+    If an entity is defined inside a COPY member rather than in this program's own text, set source_copybook to that copybook's name.
+    {known_copybooks_str}
+    """
+    
+    config = types.GenerateContentConfig(
+        temperature=1.0,
+        response_mime_type="application/json",
+        response_schema={
+            "type": "OBJECT",
+            "properties": {
+                "found_entities": {
+                    "type": "ARRAY",
+                    "items": {
+                        "type": "OBJECT",
+                        "properties": {
+                            "structure_key": {"type": "STRING", "enum": list(names_by_key.keys())},
+                            "entity_name": {"type": "STRING"},
+                            "entity_type": {"type": "STRING", "enum": ["FILE", "VARIABLE", "COPYBOOK"]},
+                            "definition_line_id": {"type": "STRING", "nullable": True},
+                            "source_copybook": {"type": "STRING", "nullable": True},
+                            "description": {"type": "STRING"}
+                        },
+                        "required": ["structure_key", "entity_name", "entity_type"]
                     }
                 }
             }
-        )
+        }
+    )
 
-        try:
-            resp = generate_with_retries(MODEL_NAME, [prompt], config)
-            entities = json.loads(resp.text).get('found_entities', [])
-            for e in entities:
-                e['program_id'] = program_id
-                e['found_in_structure'] = name
-            found_entities.extend(entities)
-        except Exception as e:
-            print(f"Error extracting structure {name}: {e}")
-            # Return what we have so far or error info? 
-            # We'll just skip this structure in the worker output
-            pass
+    found_entities = []
+    dropped = []
+    try:
+        resp = generate_with_retries(MODEL_NAME, [prompt], config)
+        entities = json.loads(resp.text).get('found_entities', [])
+        validator = EntityValidator(program_id, source_lines) if ENTITY_VALIDATION != 'off' else None
+        accepted = []
+        invalid = []
+        for e in entities:
+            key = e.pop('structure_key', None)
+            if key not in results_by_structure:
+                # Single-structure batches can only mean one thing; otherwise the
+                # structure whose text has the name is
+                norm = (e.get('entity_name') or '').strip().upper()
+                candidates = [k for k, words in words_by_key.items() if norm in words]
+                if len(results_by_structure) == 1:
+                    key = next(iter(results_by_structure))
+                elif candidates:
+                    key = candidates[0]
+                else:
+                    dropped.append(dict(e, reason=f"unknown structure_key {key}"))
+                    continue
+            if validator is None:
+                accepted.append((key, e))
+                continue
+            e, reason = validator.check(e, words_by_key[key])
+            if reason:
+                invalid.append((key, dict(e, reason=reason)))
+            else:
+                accepted.append((key, e))
+
+        if invalid and ENTITY_VALIDATION == 'reask':
+            fixed, invalid = reask_entities(program_id, invalid, validator, words_by_key, names_by_key)
+            accepted.extend(fixed)
+        dropped.extend(dict(e, found_in_structure=names_by_key[key]) for key, e in invalid)
+
+        for key, e in accepted:
+            e['program_id'] = program_id
+            e['found_in_structure'] = names_by_key[key]
+            results_by_structure[key].append(e)
+            found_entities.append(e)
+    except Exception as e:
+        print(f"Error extracting structures {list(names_by_key.values())}: {e}")
+        # We'll just skip this batch in the worker output
+        pass
+
+    return {"entities": found_entities, "results_by_structure": results_by_structure, "dropped_entities": dropped}, 200
+
+def reask_entities(program_id, invalid, validator, words_by_key, names_by_key):
+    """
+    Targeted re-ask: only the (structure key, entity) pairs that failed validation,
+    each with its problem and where the name is declared. Returns (fixed, still_invalid).
+    """
+    items = []
+    for i, (key, e) in enumerate(invalid):
+        declared = ', '.join(validator.declared_on.get(e['entity_name'].upper(), [])) or 'none'
+        items.append(f"    {i}: {names_by_key[key]} | {e['entity_name']} {e.get('entity_type')} {e.get('definition_line_id')} | {e['reason']} | {declared}")
+
+    prompt = f"""
+    These entities extracted from COBOL program {program_id} failed validation.
+    For each item give the corrected entity (name exactly as written in the code, type, definition line id),
+    or set drop=true if it is not a data entity used in that structure.
+
+    ITEMS (#: structure | entity_name entity_type definition_line_id | problem | declared on):
+{chr(10).join(items)}
+    """
+    config = types.GenerateContentConfig(
+        temperature=0.5,
+        response_mime_type="application/json",
+        response_schema={
+            "type": "OBJECT",
+            "properties": {
+                "corrections": {
+                    "type": "ARRAY",
+                    "items": {
+                        "type": "OBJECT",
+                        "properties": {
+                            "item": {"type": "INTEGER"},
+                            "entity_name": {"type": "STRING", "nullable": True},
+                            "entity_type": {"type": "STRING", "enum": ["FILE", "VARIABLE", "COPYBOOK"], "nullable": True},
+                            "definition_line_id": {"type": "STRING", "nullable": True},
+                            "drop": {"type": "BOOLEAN"}
+                        },
+                        "required": ["item", "drop"]
+                    }
+                }
+            }
+        }
+    )
 
-    return jsonify({"entities": found_entities})
+    pending = dict(enumerate(invalid))
+    fixed = []
+    try:
+        resp = generate_with_retries(MODEL_NAME, [prompt], config)
+        corrections = json.loads(resp.text or '{}').get('corrections', [])
+    except Exception as e:
+        print(f"Re-ask failed for {len(invalid)} entities: {e}")
+        corrections = []
+    for c in corrections:
+        i = c.get('item')
+        if i not in pending:
+            continue
+        key, e = pending[i]
+        if c.get('drop'):
+            pending[i] = (key, dict(e, reason=f"dropped on re-ask ({e['reason']})"))
+            continue
+        corrected = {k: v for k, v in e.items() if k != 'reason'}
+        corrected['entity_name'] = c.get('entity_name') or e['entity_name']
+        corrected['entity_type'] = c.get('entity_type') or e.get('entity_type')
+        corrected['definition_line_id'] = c['definition_line_id'] if 'definition_line_id' in c else e.get('definition_line_id')
+        corrected, reason = validator.check(corrected, words_by_key[key])
+        if reason:
+            pending[i] = (key, dict(corrected, reason=reason))
+        else:
+            del pending[i]
+            fixed.append((key, corrected))
+    return fixed, list(pending.values())
 
 def handle_resolve(req_json, program_id):
     entity_name = req_json.get('entity_name')
     candidates = req_json.get('candidates', [])
     
     if not candidates:
-        return jsonify({"error": "No candidates provided"}), 400
+        return {"error": "No candidates provided"}, 400
         
     prompt = f"""
     Conflict Resolution.
@@ -168,7 +400,7 @@ def handle_resolve(req_json, program_id):
     Program: {program_id}
     
     I have found multiple definitions/usages for this entity from different parts of the code:
-    {json.dumps(candidates, indent=2)}
+    {json.dumps(candidates, separators=(",", ":"))}
     
     Task: Analyze these candidates. 
     1. If they refer to the SAME logical entity (just seen in different places), MERGE them into a single record.
@@ -193,6 +425,7 @@ def handle_resolve(req_json, program_id):
                             "entity_name": {"type": "STRING"},
                             "entity_type": {"type": "STRING", "enum": ["FILE", "VARIABLE", "COPYBOOK"]},
                             "definition_line_id": {"type": "STRING", "nullable": True},
+                            "source_copybook": {"type": "STRING", "nullable": True},
                             "description": {"type": "STRING"}
                         },
                         "required": ["entity_name", "entity_type"]
@@ -208,9 +441,9 @@ def handle_resolve(req_json, program_id):
         for rec in resolved:
             rec['program_id'] = program_id
             rec['entity_id'] = f"{program_id}_{rec['entity_name']}"
-        return jsonify({"entities": resolved})
+        return {"entities": resolved}, 200
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return {"error": str(e)}, 500
 
 
 # --- ORCHESTRATOR FUNCTION ---
@@ -221,17 +454,19 @@ def entity_orchestrator(request: Request):
     Orchestrator Function.
     1. Receives full structure list.
     2. Scatters extraction tasks to Worker.
-    3. Gathers results.
-    4. Identifies conflicts.
-    5. Scatters resolution tasks to Worker.
+    3. Gathers results as they complete, grouping by name.
+    4. Pre-merges unambiguous groups, identifies real conflicts.
+    5. Scatters resolution tasks to Worker (bounded).
     6. Returns final list.
-    Streams logs back to caller.
+    Streams logs back to caller as each worker completes.
+    With {"format": "ndjson"} or Accept: application/x-ndjson, streams typed events
+    instead (see event_stream.py), one partial_result per finalized entity name.
     """
     if request.method == 'OPTIONS':
         headers = {
             'Access-Control-Allow-Origin': '*',
             'Access-Control-Allow-Methods': 'POST',
-            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Allow-Headers': 'Content-Type, Accept',
         }
         return ('', 204, headers)
 
@@ -240,166 +475,298 @@ def entity_orchestrator(request: Request):
     source_lines = req_json.get('source_lines', [])
     program_id = req_json.get('program_id', 'UNKNOWN')
     
-    # URL of the Worker Function (Self or separate deployment)
-    # In a real deployment, this should be an env var.
-    # For local test or simulation, we might need to mock or loopback.
+    # URL of the Worker Function (Self or separate deployment), only used in 'http' mode
     worker_url = os.environ.get('WORKER_URL', 'http://localhost:8080') # Default/Placeholder
     
-    # chunk_size = 5 # Removed per user request: 1 call per structure
     
-    def stream_process():
-        yield f"--- Orchestrator Started for {program_id} ---\n"
-        yield f"Input: {len(structures)} structures, {len(source_lines)} source lines.\n"
-        yield f"Worker URL: {worker_url}\n"
-        
-        # --- PHASE 1: SCATTER (Extract) ---
-        # chunks = [structures[i:i + chunk_size] for i in range(0, len(structures), chunk_size)]
-        yield f"Phase 1: Extracting from {len(structures)} structures (Parallel 1:1)...\n"
-        
-        all_entities = []
-        
-        async def process_structures():
-            # Limit concurrency to avoid overwhelming local OS or target
-            sem = asyncio.Semaphore(50) 
-            
-            async def bound_call(session, url, payload, tag):
-                async with sem:
-                    return await call_worker(session, url, payload, tag)
-
-            async with aiohttp.ClientSession() as session:
-                tasks = []
-                for i, struct in enumerate(structures):
-                    payload = {
-                        "mode": "extract",
-                        "program_id": program_id,
-                        "structures": [struct], # Single structure list
-                        "source_lines": source_lines 
-                    }
-                    struct_name = struct.get('name', f'Struct_{i}')
-                    task = asyncio.create_task(bound_call(session, worker_url, payload, f"Struct {struct_name}"))
-                    tasks.append(task)
-                
-                return await asyncio.gather(*tasks)
-
-        # Run Async Loop in Sync Generator
-        # We need a helper to run the async function and yield results as they come?
-        # Ideally, we'd use an async generator, but Flask/Functions Framework expects sync generator for simple streaming 
-        # or we run the loop and collect. 
-        # For "streaming logs", we can gather results but print progress?
-        # True streaming from async tasks in a sync generator is tricky.
-        # We will run the loop, but maybe use a callback or shared queue if we want real-time updates?
-        # For simplicity in this MVP: Run all chunks, then report.
-        
-        try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            results = loop.run_until_complete(process_structures())
-            loop.close()
-            
-            for res in results:
-                if 'error' in res:
-                    yield f"  [Error] {res['error']}\n"
+    # Upper-cased text per structure, used to tell when a name's candidate set is complete
+    line_map = {l['line_number']: l for l in source_lines}
+    struct_texts = [structure_text(s, line_map).upper() for s in structures]
+
+    # Pack small structures into shared worker calls under the token budget
+    struct_tokens = [estimate_tokens(text) for text in struct_texts]
+    batches = pack_structures(struct_tokens)
+
+    # Longest-predicted-first: the most expensive calls start before the concurrency limit fills
+    extract_concurrency = 50
+    cost_model = CostModel('agent3_extract')
+    batch_costs = []
+    for batch in batches:
+        lines = sum(struct_texts[i].count("\n") + 1 for i in batch)
+        tokens = sum(struct_tokens[i] for i in batch)
+        batch_costs.append((lines, tokens, cost_model.predict(lines, tokens)))
+    structure_order_makespan = simulated_makespan([c[2] for c in batch_costs], extract_concurrency)
+    order = lpt_order([c[2] for c in batch_costs])
+    batches = [batches[j] for j in order]
+    batch_costs = [batch_costs[j] for j in order]
+
+    # Copybook registry: reuse entities for copybooks another program already described
+    registry = CopybookRegistry()
+    copy_statements = find_copy_statements(source_lines) if registry.enabled else []
+    registry_entities = []
+    registry_hits = set()
+    for stmt in copy_statements:
+        templates = registry.get(stmt['copybook'], stmt['content_hash'])
+        if templates:
+            registry_hits.add(stmt['copybook'])
+            registry_entities.extend(materialize(program_id, stmt, templates))
+
+    final_entities = {} # Normalized name -> resolved entity records
+    stats = {'raw': 0, 'singles': 0, 'premerged': 0, 'conflicts': 0, 'late': 0, 'dropped': 0}
+
+    async def run_pipeline():
+        """
+        Extracts, groups and resolves in one event loop, yielding events as it goes.
+        A name is finalized (pre-merged or sent to resolve) as soon as every structure
+        whose text mentions it has returned, so resolution overlaps extraction.
+        """
+        grouped = {}        # name -> raw candidates
+        waiting_on = {}     # structure index -> names still waiting on it
+        pending_count = {}  # name -> running structures that mention it
+        completed = set()
+        late = {}           # name -> candidates arriving after the name was finalized
+        finalized = {}      # name -> raw candidates it was finalized from
+        resolve_tasks = []
+        newly_final = []    # names whose entities became final since the last flush
+        extract_sem = asyncio.Semaphore(extract_concurrency) # Limit concurrency to avoid overwhelming local OS or target
+        resolve_sem = asyncio.Semaphore(RESOLVE_CONCURRENCY)
+
+        async with aiohttp.ClientSession() as session:
+            async def extract(batch, batch_cost):
+                payload = {
+                    "mode": "extract",
+                    "program_id": program_id,
+                    "structures": [structures[i] for i in batch],
+                    "source_lines": source_lines,
+                    "known_copybooks": sorted(registry_hits)
+                }
+                names = ", ".join(structures[i].get('name', f'Struct_{i}') for i in batch)
+                async with extract_sem:
+                    res, seconds = await dispatch_worker_timed(session, worker_url, payload, f"Structs [{names}]")
+                    if 'error' not in res:
+                        lines, tokens, predicted = batch_cost
+                        cost_model.record(lines, tokens, predicted, seconds)
+                    return batch, res
+
+            async def resolve(name, group):
+                payload = {
+                    "mode": "resolve",
+                    "program_id": program_id,
+                    "entity_name": name,
+                    "candidates": compact_candidates(group)
+                }
+                async with resolve_sem:
+                    return name, await dispatch_worker(session, worker_url, payload, f"Resolve {name}")
+
+            def finalize(name, group):
+                finalized[name] = group
+                merged = premerge_group(program_id, group)
+                if merged:
+                    final_entities[name] = [merged]
+                    newly_final.append(name)
+                    if len(group) > 1:
+                        stats['premerged'] += 1
+                    else:
+                        stats['singles'] += 1
                 else:
-                    ents = res.get('entities', [])
-                    all_entities.extend(ents)
-                    yield f"  [Success] Got {len(ents)} entities.\n"
-                    
-        except Exception as e:
-            yield f"Fatal Error in Phase 1: {e}\n"
-            return
+                    final_entities[name] = []
+                    stats['conflicts'] += 1
+                    resolve_tasks.append(asyncio.create_task(resolve(name, group)))
+
+            def collect(ents, ready):
+                """Adds candidates to their name group; names with no pending structures become ready."""
+                for e in ents:
+                    norm = e['entity_name'].upper().strip()
+                    if norm in final_entities:
+                        late.setdefault(norm, []).append(e)
+                        continue
+                    if norm not in grouped:
+                        grouped[norm] = []
+                        mentioned_in = [j for j, text in enumerate(struct_texts)
+                                        if j not in completed and norm in text]
+                        pending_count[norm] = len(mentioned_in)
+                        for j in mentioned_in:
+                            waiting_on.setdefault(j, set()).add(norm)
+                        if not mentioned_in:
+                            ready.append(norm)
+                    grouped[norm].append(e)
+
+            def flush_final():
+                """Emits each finalized name's entities as a partial result (a later one for the same name supersedes it)."""
+                for norm in newly_final:
+                    yield partial_result("entities", norm, final_entities[norm])
+                newly_final.clear()
+
+            # Registry entities join the groups like any other candidate
+            ready = []
+            collect(registry_entities, ready)
+            for norm in ready:
+                finalize(norm, grouped.pop(norm))
+            for ev in flush_final():
+                yield ev
+
+            # Tasks queue on the semaphore in creation order, i.e. longest first
+            extract_tasks = [asyncio.create_task(extract(batch, cost)) for batch, cost in zip(batches, batch_costs)]
+            for next_done in asyncio.as_completed(extract_tasks):
+                batch, res = await next_done
+                completed.update(batch)
+                ready = []
 
-        yield f"Phase 1 Complete. Total Raw Entities: {len(all_entities)}\n"
-        
-        # --- PHASE 2: GROUP ---
-        grouped = {}
-        for e in all_entities:
-            norm = e['entity_name'].upper().strip()
-            if norm not in grouped: grouped[norm] = []
-            grouped[norm].append(e)
-            
-        unique_count = len([k for k, v in grouped.items() if len(v) == 1])
-        conflict_count = len([k for k, v in grouped.items() if len(v) > 1])
-        
-        yield f"Phase 2: Grouping. {len(grouped)} unique entity names.\n"
-        yield f"  Single definitions: {unique_count}\n"
-        yield f"  Conflicts to resolve: {conflict_count}\n"
-        
-        # --- PHASE 3: RECONCILE ---
-        final_list = []
-        
-        # Add singles directly
-        for name, group in grouped.items():
-            if len(group) == 1:
-                final_list.append(group[0])
-        
-        # Resolve conflicts
-        if conflict_count > 0:
-            yield "Phase 3: Resolving conflicts (Parallel)...\n"
-            conflicts = [(name, group) for name, group in grouped.items() if len(group) > 1]
-            
-            async def resolve_conflicts():
-                async with aiohttp.ClientSession() as session:
-                    tasks = []
-                    for name, group in conflicts:
-                        payload = {
-                            "mode": "resolve",
-                            "program_id": program_id,
-                            "entity_name": name,
-                            "candidates": group
-                        }
-                        task = asyncio.create_task(call_worker(session, worker_url, payload, f"Resolve {name}"))
-                        tasks.append(task)
-                    return await asyncio.gather(*tasks)
-
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            resolution_results = loop.run_until_complete(resolve_conflicts())
-            loop.close()
-            
-            for res in resolution_results:
                 if 'error' in res:
-                    yield f"  [Error] Resolution failed: {res['error']}\n"
+                    yield error(res['error'], structures=[structures[i].get('name', f'Struct_{i}') for i in batch])
+                    per_structure = []
+                elif 'results_by_structure' in res:
+                    by_key = res['results_by_structure']
+                    per_structure = [(i, by_key.get(structure_key(structures[i]), [])) for i in batch]
                 else:
+                    # Older workers return a flat list for the whole batch
+                    per_structure = [(batch[0], res.get('entities', []))]
+
+                for i, ents in per_structure:
+                    struct_name = structures[i].get('name', f'Struct_{i}')
+                    stats['raw'] += len(ents)
+                    yield progress(f"  [Success] {struct_name}: Got {len(ents)} entities.")
+                    collect(ents, ready)
+
+                # Entities failing validation (after the worker's re-ask) are reported, not discarded silently
+                dropped = res.get('dropped_entities', [])
+                if dropped:
+                    stats['dropped'] += len(dropped)
+                    shown = '; '.join(f"{d.get('entity_name')} ({d.get('reason')})" for d in dropped[:10])
+                    yield progress(f"    [Dropped] {shown}" + (" ..." if len(dropped) > 10 else ""))
+
+                for i in batch:
+                    for norm in waiting_on.pop(i, ()):
+                        pending_count[norm] -= 1
+                        if pending_count[norm] == 0:
+                            ready.append(norm)
+                for norm in ready:
+                    finalize(norm, grouped.pop(norm))
+                for ev in flush_final():
+                    yield ev
+
+            yield progress(f"Phase 1 Complete. Total Raw Entities: {stats['raw']}")
+            yield progress(f"  Single definitions: {stats['singles']}")
+            yield progress(f"  Pre-merged (rule-based): {stats['premerged']}")
+            yield progress(f"  Conflicts sent to resolve: {stats['conflicts']}")
+            if stats['dropped']:
+                yield progress(f"  Dropped after validation: {stats['dropped']}")
+
+            async def drain_resolves():
+                for next_done in asyncio.as_completed(list(resolve_tasks)):
+                    name, res = await next_done
+                    if 'error' in res:
+                        yield error(f"Resolution failed: {res['error']}", entity_name=name)
+                        continue
                     # Support multiple entities returned from resolution (split)
                     ents = res.get('entities', [])
                     if not ents and 'entity' in res: # Fallback for backward compat if needed
-                         ents = [res['entity']]
-                    
-                    final_list.extend(ents)
-                    # yield f"  [Resolved] {ents[0].get('entity_name')} (+{len(ents)-1} siblings)\n"
-            
-            yield f"Phase 3 Complete. Resolved {len(resolution_results)} conflicts.\n"
+                        ents = [res['entity']]
+                    final_entities[name].extend(ents)
+                    yield partial_result("entities", name, final_entities[name])
+                resolve_tasks.clear()
 
-        # --- PHASE 4: FINALIZE ---
-        yield "Phase 4: Finalizing Artifact...\n"
+            if resolve_tasks:
+                yield progress(f"Phase 3: Waiting on {len(resolve_tasks)} conflict resolutions (limit {RESOLVE_CONCURRENCY})...")
+                async for ev in drain_resolves():
+                    yield ev
+
+            # Candidates reported outside the structures that mention the name
+            # arrive after finalization; fold them into the result and re-check.
+            if late:
+                stats['late'] = len(late)
+                yield progress(f"Phase 3b: Re-checking {len(late)} names with late candidates...")
+                for norm, extra in late.items():
+                    # Withdraw the earlier result; the re-check emits the new one.
+                    # The name is finalized again from its raw candidates, not the merged records.
+                    yield partial_result("entities", norm, [])
+                    final_entities.pop(norm)
+                    finalize(norm, finalized[norm] + extra)
+                for ev in flush_final():
+                    yield ev
+                async for ev in drain_resolves():
+                    yield ev
+
+            yield progress("Phase 3 Complete.")
+
+    def stream_events():
+        yield progress(f"--- Orchestrator Started for {program_id} ---")
+        yield progress(f"Input: {len(structures)} structures, {len(source_lines)} source lines.")
+        yield progress(f"Worker Mode: {WORKER_MODE}" + (f" ({worker_url})" if WORKER_MODE == 'http' else f" (pool {WORKER_POOL_SIZE})"))
         
-        final_artifact = {
-            "program_id": program_id,
-            "entities": final_list,
-            "metadata": {
+        # --- PHASES 1-3: EXTRACT, GROUP, RESOLVE (streamed as workers complete) ---
+        if registry_hits:
+            yield progress(f"Copybook Registry: reusing {len(registry_entities)} entities from {len(registry_hits)} copybooks.")
+        yield progress(f"Phase 1: Extracting from {len(structures)} structures in {len(batches)} worker calls (budget {BATCH_TOKEN_BUDGET} tokens, streaming)...")
+        if batches:
+            yield progress(f"Scheduling: longest first, predicted makespan ~{simulated_makespan([c[2] for c in batch_costs], extract_concurrency):.0f}s "
+                           f"(structure order ~{structure_order_makespan:.0f}s, "
+                           f"{'calibrated' if cost_model.calibrated else 'default'} cost model).")
+        try:
+            for ev in stream_async(run_pipeline):
+                yield ev
+        except Exception as e:
+            yield error(str(e), fatal=True)
+            return
+
+        calls, predicted_total, actual_total, mean_error = cost_model.error_summary()
+        if calls:
+            yield progress(f"Cost model: {calls} extract calls, predicted {predicted_total:.0f}s vs actual {actual_total:.0f}s (mean error {mean_error:.1f}s).")
+            cost_model.save()
+
+        final_list = [e for ents in final_entities.values() for e in ents]
+
+        # Register copybooks seen for the first time so later programs can reuse them
+        if copy_statements:
+            registered = set()
+            for stmt in copy_statements:
+                cb = stmt['copybook']
+                if cb in registry_hits or cb in registered:
+                    continue
+                cb_entities = [e for e in final_list
+                               if (e.get('source_copybook') or '').upper() == cb
+                               or (e.get('entity_type') == 'COPYBOOK' and e['entity_name'].upper() == cb)]
+                if cb_entities:
+                    registry.put(cb, stmt['content_hash'], cb_entities, program_id)
+                    registered.add(cb)
+            yield progress(f"Copybook Registry: {len(registry_hits)} reused, {len(registered)} registered.")
+
+        # --- PHASE 4: FINALIZE ---
+        # Entities already went out as partial results; the summary carries the rest of the artifact
+        yield progress("Phase 4: Finalizing Artifact...")
+        yield progress("--- Orchestration Complete ---")
+        yield summary(
+            program_id=program_id,
+            metadata={
                 "total_entities": len(final_list),
                 "generated_at": datetime.datetime.now().isoformat()
-            }
-        }
-        
-        yield "--- Orchestration Complete ---\n"
-        yield "JSON_START\n"
-        yield json.dumps(final_artifact)
-        yield "\nJSON_END\n"
+            },
+            counts=dict(stats)
+        )
 
-    return Response(stream_process(), mimetype='text/plain')
+    if wants_ndjson(request, req_json):
+        return Response(render_ndjson(stream_events()), mimetype=NDJSON_MIMETYPE)
+    return Response(render_text(stream_events(), ["program_id", "entities", "metadata"]), mimetype='text/plain')
 
-async def call_worker(session, url, payload, context_tag):
-    try:
-        # In local testing or if URLs are not set up, this might fail.
-        # Need error handling.
-        async with session.post(url, json=payload) as resp:
-            if resp.status != 200:
-                txt = await resp.text()
-                return {'error': f"{context_tag}: Status {resp.status} - {txt}"}
-            return await resp.json()
-    except Exception as e:
-        return {'error': f"{context_tag}: {str(e)}"}
+def structure_key(struct):
+    """Key a structure's results are returned under by the extract worker."""
+    return struct.get('section_id') or struct.get('name', '')
+
+def structure_text(struct, line_map):
+    """Raw source text of a structure, from its line range or its 'content' field."""
+    start_line = struct.get('start_line')
+    end_line = struct.get('end_line')
+    if start_line and end_line and line_map:
+        return "\n".join(line_map[ln].get('content', '') for ln in range(start_line, end_line + 1) if ln in line_map)
+    return struct.get('content', '')
+
+async def dispatch_worker(session, url, payload, tag):
+    """Calls this function's worker over HTTP or in-process (see worker_dispatch.py)."""
+    return await worker_dispatch.dispatch_worker(session, url, run_worker, payload, tag)
+
+async def dispatch_worker_timed(session, url, payload, tag):
+    """dispatch_worker, also returning how long the worker ran (see worker_dispatch.py)."""
+    return await worker_dispatch.dispatch_worker_timed(session, url, run_worker, payload, tag)
 
 # --- Local/Main execution for testing ---
 if __name__ == "__main__":
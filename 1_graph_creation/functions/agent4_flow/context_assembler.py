@@ -0,0 +1,127 @@
+"""
+Relevance-trimmed prompt context for the flow worker.
+
+Instead of the whole program, known-entity list and paragraph list, a worker
+prompt gets:
+  - the DATA DIVISION declarations of identifiers that appear in the target lines
+  - the target structure itself (always, never trimmed)
+  - the names of paragraphs the target can reach
+under a hard token budget on the declarations.
+"""
+import os
+import re
+import sys
+
+# scheduling is shared with Agent 3 and lives in ../shared (deploy.sh copies it in)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+
+from control_flow_extractor import tokenize, extract_control_flow
+from scheduling import estimate_tokens
+
+# 'trimmed' uses the assembler, 'full' sends the whole program as before
+CONTEXT_MODE = os.environ.get("CONTEXT_MODE", "trimmed")
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "4000"))
+
+LEVEL_RE = re.compile(r'^(0?[1-9]|[1-4][0-9]|66|77|88)$')
+IDENT_RE = re.compile(r'^[A-Z0-9][A-Z0-9-]*$')
+
+def identifiers_in(lines):
+    """Upper-cased identifiers (non-literal, non-numeric words) used in the given lines."""
+    return {tok for tok, _, is_literal in tokenize(lines)
+            if not is_literal and IDENT_RE.match(tok) and not tok.isdigit()}
+
+def get_declarations(index):
+    """
+    NAME -> sorted line indexes of its declaration in the ENVIRONMENT/DATA DIVISIONs
+    (SELECT, FD/SD, level-numbered items), plus any 88-level conditions right under it.
+    Cached on the program index.
+    """
+    cached = getattr(index, '_declarations', None)
+    if cached is not None:
+        return cached
+
+    declarations = {}
+    pos_by_line = {l.get('line_number'): i for i, l in enumerate(index.lines)}
+    tokens = tokenize(index.lines)
+    current = None # last non-88 item, 88-level conditions attach to it
+
+    for i, (tok, ln, is_literal) in enumerate(tokens):
+        if is_literal:
+            continue
+        if tok == 'PROCEDURE' and i + 1 < len(tokens) and tokens[i + 1][0] == 'DIVISION':
+            break
+        prev = tokens[i - 1][0] if i > 0 else '.'
+        if i + 1 >= len(tokens) or tokens[i + 1][2]:
+            continue
+        name = tokens[i + 1][0]
+        if not IDENT_RE.match(name) or name.isdigit():
+            continue
+
+        if tok in ('SELECT', 'FD', 'SD'):
+            pass
+        elif LEVEL_RE.match(tok) and prev == '.':
+            # Level numbers start an entry (the previous entry ended with a period)
+            pass
+        else:
+            continue
+
+        pos = pos_by_line[ln]
+        if tok == '88' and current:
+            declarations.setdefault(current, []).append(pos)
+        elif tok != '88':
+            current = name
+        declarations.setdefault(name, []).append(pos)
+
+    for name in declarations:
+        declarations[name] = sorted(set(declarations[name]))
+    index._declarations = declarations
+    return declarations
+
+def assemble_context(index, target_lines, known_entities, known_paragraphs, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Returns (declarations_text, entities, paragraphs, stats).
+    entities / paragraphs are the subsets of the known lists relevant to the target.
+    stats reports full vs trimmed context tokens.
+    """
+    idents = identifiers_in(target_lines)
+    declarations = get_declarations(index)
+    target_positions = {l.get('line_number') for l in target_lines}
+
+    # Declarations in order of first use in the target, until the budget runs out
+    ordered = []
+    for tok, _, is_literal in tokenize(target_lines):
+        if not is_literal and tok in declarations and tok not in ordered:
+            ordered.append(tok)
+
+    selected = set()
+    used_tokens = 0
+    dropped = 0
+    for name in ordered:
+        positions = [p for p in declarations[name] if p not in selected
+                     and index.lines[p].get('line_number') not in target_positions]
+        cost = sum(estimate_tokens(index.text[index.offsets[p]:index.offsets[p + 1]]) for p in positions)
+        if used_tokens + cost > token_budget:
+            dropped += 1
+            continue
+        selected.update(positions)
+        used_tokens += cost
+
+    declarations_text = "".join(index.text[index.offsets[p]:index.offsets[p + 1]] for p in sorted(selected))
+
+    entities = [e for e in known_entities if e.upper() in idents]
+    reachable = []
+    for f in extract_control_flow(target_lines, known_paragraphs):
+        if f['type'] != 'CALL' and f['target_structure_name'] not in reachable:
+            reachable.append(f['target_structure_name'])
+
+    full_tokens = (estimate_tokens(index.text) + estimate_tokens(str(known_entities))
+                   + estimate_tokens(str(known_paragraphs)))
+    trimmed_tokens = (used_tokens + estimate_tokens(str(entities)) + estimate_tokens(str(reachable)))
+    stats = {
+        'full_context_tokens': full_tokens,
+        'trimmed_context_tokens': trimmed_tokens,
+        'tokens_saved': max(full_tokens - trimmed_tokens, 0),
+        'declarations': len(selected),
+        'declarations_dropped_for_budget': dropped
+    }
+    return declarations_text, entities, reachable, stats
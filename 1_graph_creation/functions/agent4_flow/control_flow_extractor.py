@@ -0,0 +1,90 @@
+"""
+Deterministic control-flow extractor for COBOL.
+
+PERFORM / GO TO / CALL targets are lexically unambiguous once the paragraph and
+section names are known, so they are found with a tokenizer instead of the LLM.
+Handles:
+  - PERFORM para [THRU|THROUGH para2] [n TIMES | UNTIL ... | VARYING ...]
+  - inline PERFORM [VARYING|UNTIL|WITH TEST|n TIMES] ... END-PERFORM (no edge)
+  - GO [TO] para, GO [TO] para1 para2 ... DEPENDING ON identifier
+  - CALL 'literal' / CALL identifier
+"""
+import re
+
+TOKEN_RE = re.compile(r"""'[^']*'?|"[^"]*"?|[A-Za-z0-9][A-Za-z0-9-]*|\S""")
+
+def source_area(content):
+    """Columns 8-72 of a fixed-format line, or '' for comment/debug lines."""
+    if len(content) > 6 and content[6] in '*/':
+        return ''
+    return content[7:72]
+
+def tokenize(lines):
+    """
+    Tokenizes code lines into (TOKEN, line_number, is_literal) tuples.
+    Literals keep their quotes stripped; words are upper-cased.
+    """
+    tokens = []
+    for line in lines:
+        if line.get('type') in ('COMMENT', 'BLANK'):
+            continue
+        ln = line.get('line_number')
+        for tok in TOKEN_RE.findall(source_area(line.get('content', ''))):
+            if tok[0] in '\'"':
+                tokens.append((tok.strip('\'"'), ln, True))
+            else:
+                tokens.append((tok.upper(), ln, False))
+    return tokens
+
+def extract_control_flow(lines, known_names):
+    """
+    Returns control_flow items in the worker's output shape:
+    [{line_number, target_structure_name, type}], in source order.
+    known_names: paragraph/section names valid as PERFORM/GO TO targets.
+    """
+    names = {n.upper(): n for n in known_names}
+    tokens = tokenize(lines)
+    flows = []
+    seen = set()
+
+    def emit(line_number, target, flow_type):
+        key = (line_number, target, flow_type)
+        if key not in seen:
+            seen.add(key)
+            flows.append({"line_number": line_number, "target_structure_name": target, "type": flow_type})
+
+    def word(i):
+        if i < len(tokens) and not tokens[i][2]:
+            return tokens[i][0]
+        return None
+
+    for i, (tok, ln, is_literal) in enumerate(tokens):
+        if is_literal:
+            continue
+
+        if tok == 'PERFORM':
+            # Out-of-line PERFORM names a procedure; anything else is inline
+            target = word(i + 1)
+            if target not in names:
+                continue
+            emit(ln, names[target], 'PERFORM')
+            if word(i + 2) in ('THRU', 'THROUGH') and word(i + 3) in names:
+                emit(ln, names[word(i + 3)], 'PERFORM')
+
+        elif tok == 'GO':
+            j = i + 1
+            if word(j) == 'TO':
+                j += 1
+            # One target, or a list of targets for GO TO ... DEPENDING ON
+            while word(j) in names:
+                emit(ln, names[word(j)], 'GO_TO')
+                j += 1
+
+        elif tok == 'CALL':
+            if i + 1 >= len(tokens):
+                continue
+            target, _, target_is_literal = tokens[i + 1]
+            if target_is_literal or re.match(r'^[A-Z0-9][A-Z0-9-]*$', target):
+                emit(ln, names.get(target.upper(), target), 'CALL')
+
+    return flows
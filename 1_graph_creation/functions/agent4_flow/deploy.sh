@@ -7,6 +7,12 @@ REGION="us-central1"
 # CD to the directory of this script so --source=. works
 cd "$(dirname "$0")"
 
+# Modules shared with the other orchestrator (event stream, scheduling, worker dispatch)
+# are uploaded with this function's source, then removed again
+SHARED_MODULES=$(cd ../shared && ls *.py)
+cp ../shared/*.py .
+trap 'rm -f $SHARED_MODULES' EXIT
+
 echo "--- Deploying Agent 4 Worker ---"
 gcloud functions deploy agent4-flow-worker \
     --gen2 \
@@ -37,10 +43,27 @@ gcloud functions deploy agent4-flow-orchestrator \
     --timeout=3600s \
     --memory=4Gi \
     --cpu=2 \
-    --set-env-vars=GOOGLE_CLOUD_PROJECT=$PROJECT_ID,WORKER_URL=$WORKER_URL
+    --set-env-vars=GOOGLE_CLOUD_PROJECT=$PROJECT_ID,WORKER_URL=$WORKER_URL,WORKER_MODE=http
 
 # Get Orchestrator URL
 ORCHESTRATOR_URL=$(gcloud functions describe agent4-flow-orchestrator --gen2 --region=$REGION --format='value(serviceConfig.uri)')
 echo "Orchestrator URL: $ORCHESTRATOR_URL"
 
+echo "--- Deploying Fused Orchestrator (Agent 3 + 4 in one pass) ---"
+gcloud functions deploy agent4-fused-orchestrator \
+    --gen2 \
+    --region=$REGION \
+    --runtime=python311 \
+    --source=. \
+    --entry-point=fused_orchestrator \
+    --trigger-http \
+    --allow-unauthenticated \
+    --timeout=3600s \
+    --memory=4Gi \
+    --cpu=2 \
+    --set-env-vars=GOOGLE_CLOUD_PROJECT=$PROJECT_ID,WORKER_URL=$WORKER_URL,WORKER_MODE=http
+
+FUSED_URL=$(gcloud functions describe agent4-fused-orchestrator --gen2 --region=$REGION --format='value(serviceConfig.uri)')
+echo "Fused Orchestrator URL: $FUSED_URL"
+
 echo "--- Deployment Complete ---"
@@ -0,0 +1,105 @@
+"""
+Aho-Corasick multi-pattern matcher over known entity names.
+
+Built once per entity set and cached. Scanning a structure's lines yields the
+candidate (line_number, entity_name) pairs, honouring COBOL identifier
+boundaries (letters, digits and hyphens are part of a name, so WS-A does not
+match inside WS-A-B). Comment lines and string literals are skipped.
+"""
+import re
+import hashlib
+import threading
+from collections import deque, OrderedDict
+
+from control_flow_extractor import source_area
+
+IDENT_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_")
+LITERAL_RE = re.compile(r"""'[^']*'?|"[^"]*"?""")
+MATCHER_CACHE_SIZE = 8
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+class EntityMatcher:
+    def __init__(self, names):
+        # Upper-cased pattern -> original name (first spelling wins)
+        self.names = {}
+        for n in names:
+            if n and n.strip():
+                self.names.setdefault(n.strip().upper(), n.strip())
+
+        # Trie: goto transitions, failure links, output patterns per state
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for pattern in self.names:
+            state = 0
+            for ch in pattern:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                state = nxt
+            self.out[state].append(pattern)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def find(self, text):
+        """Returns [(start, name)] for whole-identifier matches in text (case-insensitive)."""
+        text = text.upper()
+        matches = []
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            for pattern in self.out[state]:
+                start = i - len(pattern) + 1
+                before = text[start - 1] if start > 0 else ' '
+                after = text[i + 1] if i + 1 < len(text) else ' '
+                if before not in IDENT_CHARS and after not in IDENT_CHARS:
+                    matches.append((start, self.names[pattern]))
+        matches.sort()
+        return matches
+
+    def scan(self, lines):
+        """Candidate references: [(line_number, entity_name)], unique per line, in source order."""
+        candidates = []
+        for line in lines:
+            if line.get('type') in ('COMMENT', 'BLANK'):
+                continue
+            code = LITERAL_RE.sub(lambda m: ' ' * len(m.group(0)), source_area(line.get('content', '')))
+            seen = set()
+            for _, name in self.find(code):
+                if name not in seen:
+                    seen.add(name)
+                    candidates.append((line.get('line_number'), name))
+        return candidates
+
+def get_matcher(names):
+    """Returns the cached matcher for this entity-name set, building it on a miss."""
+    key = hashlib.sha1("\n".join(sorted(set(names))).encode()).hexdigest()
+    with _cache_lock:
+        matcher = _cache.get(key)
+        if matcher is not None:
+            _cache.move_to_end(key)
+            return matcher
+
+    matcher = EntityMatcher(names)
+    with _cache_lock:
+        _cache[key] = matcher
+        while len(_cache) > MATCHER_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return matcher
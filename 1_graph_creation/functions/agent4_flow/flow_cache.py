@@ -0,0 +1,106 @@
+"""
+Incremental flow analysis cache.
+
+Per-structure worker results are stored under a hash of everything the analysis
+depends on: the structure's lines (contents at relative offsets, so inserting
+lines above a paragraph does not invalidate it), the entity and paragraph names
+it references, and the prompt version. Results are stored with relative line
+offsets and rebased onto the structure's current first line on load.
+
+Storage is a local directory or a gs://bucket/prefix, one JSON file per entry.
+"""
+import os
+import json
+import hashlib
+import concurrent.futures
+
+from context_assembler import identifiers_in
+
+# Local directory or gs://bucket/prefix. Empty disables the cache.
+FLOW_CACHE_PATH = os.environ.get("FLOW_CACHE_PATH", "")
+FLOW_CACHE_IO_THREADS = 16
+
+RESULT_KINDS = ('control_flow', 'line_references')
+
+def structure_cache_key(lines, entity_names, paragraph_names, prompt_version):
+    """
+    Content key of one structure's analysis. Only the entity / paragraph names that
+    appear in the structure count, so unrelated edits elsewhere keep it valid.
+    """
+    first = lines[0].get('line_number') if lines else 0
+    idents = identifiers_in(lines)
+    h = hashlib.sha256()
+    h.update(f"{prompt_version}\n".encode())
+    for line in lines:
+        h.update(f"{line.get('line_number') - first}|{line.get('type', '')}|{line.get('content', '')}\n".encode())
+    h.update(("E:" + ",".join(sorted({n.upper() for n in entity_names} & idents)) + "\n").encode())
+    h.update(("P:" + ",".join(sorted({n.upper() for n in paragraph_names} & idents)) + "\n").encode())
+    return h.hexdigest()
+
+def to_relative(result, first_line):
+    return {kind: [{**item, 'line_number': item.get('line_number') - first_line}
+                   for item in result.get(kind, []) if isinstance(item.get('line_number'), int)]
+            for kind in RESULT_KINDS}
+
+def rebase(cached, first_line):
+    return {kind: [{**item, 'line_number': item['line_number'] + first_line}
+                   for item in cached.get(kind, [])]
+            for kind in RESULT_KINDS}
+
+class FlowCache:
+    def __init__(self, path=FLOW_CACHE_PATH):
+        self.path = path
+        self._bucket = None
+        self._prefix = ''
+        if path.startswith('gs://'):
+            from google.cloud import storage
+            bucket_name, _, self._prefix = path[len('gs://'):].partition('/')
+            self._bucket = storage.Client().bucket(bucket_name)
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _blob(self, key):
+        return self._bucket.blob(f"{self._prefix.rstrip('/')}/{key}.json".lstrip('/'))
+
+    def get(self, key):
+        """Returns the stored relative result, or None on a miss."""
+        if not self.enabled:
+            return None
+        try:
+            if self._bucket is not None:
+                blob = self._blob(key)
+                if not blob.exists():
+                    return None
+                return json.loads(blob.download_as_text())
+            file_path = os.path.join(self.path, f"{key}.json")
+            if not os.path.exists(file_path):
+                return None
+            with open(file_path, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Flow cache read failed for {key}: {e}")
+            return None
+
+    def get_many(self, keys):
+        """key -> stored result for every hit (lookups run in parallel for gs://)."""
+        if not self.enabled or not keys:
+            return {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=FLOW_CACHE_IO_THREADS) as pool:
+            found = dict(zip(keys, pool.map(self.get, keys)))
+        return {k: v for k, v in found.items() if v is not None}
+
+    def put(self, key, relative_result):
+        if not self.enabled:
+            return
+        data = json.dumps(relative_result)
+        try:
+            if self._bucket is not None:
+                self._blob(key).upload_from_string(data, content_type='application/json')
+            else:
+                os.makedirs(self.path, exist_ok=True)
+                with open(os.path.join(self.path, f"{key}.json"), 'w') as f:
+                    f.write(data)
+        except Exception as e:
+            print(f"Flow cache write failed for {key}: {e}")
@@ -0,0 +1,108 @@
+"""
+Deterministic post-pass for the fused extraction mode.
+
+The fused worker returns raw entity candidates and name-based references per
+structure. This pass turns them into 03_entities.json records without another
+LLM call:
+  - candidates are grouped by upper-cased name; type by majority, longest description
+  - definition lines come from the program's own declarations (SELECT/FD/SD and
+    level-numbered items), falling back to the lines the model reported
+  - a name declared on several lines becomes one entity per declaration
+    ({program_id}_{name}_L{line}), like Agent 3's resolver splits
+  - referenced names the model did not list but the program declares are added
+References resolve to the entity declared on that line, else to the first
+declaration of the name (unqualified duplicates need OF/IN qualification in COBOL).
+"""
+from collections import Counter
+
+from context_assembler import get_declarations, identifiers_in
+from control_flow_extractor import tokenize
+
+TYPE_PRIORITY = ('FILE', 'COPYBOOK', 'VARIABLE')
+
+def declaration_lines(index):
+    """
+    NAME -> line numbers where the name itself is declared (88-level children excluded).
+    A file's SELECT and FD/SD describe one entity, so only its first file declaration counts.
+    """
+    lines = {}
+    for name, positions in get_declarations(index).items():
+        file_declared = False
+        for p in positions:
+            line = index.lines[p]
+            if name not in identifiers_in([line]):
+                continue
+            if declared_type(line) == 'FILE':
+                if file_declared:
+                    continue
+                file_declared = True
+            lines.setdefault(name, []).append(line.get('line_number'))
+    return lines
+
+def declared_type(line):
+    """FILE for SELECT/FD/SD declarations, VARIABLE otherwise."""
+    tokens = [tok for tok, _, is_literal in tokenize([line]) if not is_literal]
+    return 'FILE' if tokens and tokens[0] in ('SELECT', 'FD', 'SD') else 'VARIABLE'
+
+def majority_type(group):
+    """Most frequent entity_type; ties go to FILE, then COPYBOOK, then VARIABLE."""
+    counts = Counter(c.get('entity_type') or 'VARIABLE' for c in group)
+    rank = lambda t: TYPE_PRIORITY.index(t) if t in TYPE_PRIORITY else len(TYPE_PRIORITY)
+    return min(counts, key=lambda t: (-counts[t], rank(t)))
+
+def assemble_entities(program_id, candidates, referenced_names, index):
+    """
+    Returns (entities, lookup). entities are 03-shaped records; lookup maps
+    NAME -> [(definition_line_number, entity_id)] in declaration order.
+    """
+    declared = declaration_lines(index)
+    line_map = {l.get('line_number'): l for l in index.lines}
+    groups = {}
+    for c in candidates:
+        name = (c.get('entity_name') or '').strip()
+        if name:
+            groups.setdefault(name.upper(), []).append(c)
+
+    # Referenced but never listed: the program's declaration is enough to add it
+    for name in referenced_names:
+        norm = (name or '').strip().upper()
+        if norm and norm not in groups and norm in declared:
+            groups[norm] = [{'entity_name': norm,
+                             'entity_type': declared_type(line_map[declared[norm][0]]),
+                             'description': ''}]
+
+    entities = []
+    lookup = {}
+    for norm, group in groups.items():
+        entity_type = majority_type(group)
+        description = max((c.get('description') or '' for c in group), key=len)
+        entity_name = norm # COBOL names are case-insensitive
+
+        definitions = sorted(set(declared.get(norm, [])))
+        if not definitions:
+            definitions = sorted({c['definition_line_number'] for c in group
+                                  if isinstance(c.get('definition_line_number'), int)})
+
+        for line_number in definitions or [None]:
+            suffix = f"_L{line_number}" if len(definitions) > 1 else ""
+            entity_id = f"{program_id}_{entity_name}{suffix}"
+            entities.append({
+                'entity_name': entity_name,
+                'entity_type': entity_type,
+                'definition_line_id': f"{program_id}_{line_number}" if line_number is not None else None,
+                'description': description,
+                'program_id': program_id,
+                'entity_id': entity_id
+            })
+            lookup.setdefault(norm, []).append((line_number, entity_id))
+    return entities, lookup
+
+def resolve_reference(lookup, name, line_number):
+    """Entity id for a reference to `name` on `line_number`, or None if the name is unknown."""
+    options = lookup.get((name or '').strip().upper())
+    if not options:
+        return None
+    for definition_line, entity_id in options:
+        if definition_line == line_number:
+            return entity_id
+    return options[0][1]
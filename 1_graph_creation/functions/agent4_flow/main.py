@@ -3,16 +3,79 @@ from flask import Request, Response, jsonify
 import os
 import json
 import time
+import sys
 import asyncio
 import aiohttp
 import datetime
+import itertools
 from google import genai
 from google.genai import types
 
+# Modules shared with the other orchestrator live in ../shared (deploy.sh copies them in)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+
+from scheduling import (estimate_tokens, pack_structures, BATCH_TOKEN_BUDGET,
+                        CostModel, lpt_order, simulated_makespan)
+from control_flow_extractor import extract_control_flow
+from program_index import get_program_index, program_fingerprint
+from context_assembler import assemble_context, get_declarations, identifiers_in, CONTEXT_MODE
+from entity_matcher import get_matcher
+from flow_cache import FlowCache, structure_cache_key, to_relative, rebase
+from event_stream import (wants_ndjson, progress, partial_result, error, summary,
+                          render_ndjson, render_text, NDJSON_MIMETYPE)
+import worker_dispatch
+from worker_dispatch import stream_async, WORKER_MODE, WORKER_POOL_SIZE
+from fused_postpass import assemble_entities, resolve_reference
+from reference_validator import ReferenceValidator, validate_control_flow, get_procedure_start
+from routing import (get_policy, policy_key, complexity_features, combined_features, route, escalate,
+                     routing_summary)
+
 # --- Configuration ---
 PROJECT_ID = os.environ.get("GOOGLE_CLOUD_PROJECT", "wz-cobol-graph")
 LOCATION = os.environ.get("GOOGLE_CLOUD_REGION", "global")
 MODEL_NAME = "gemini-3-pro-preview"
+# Bump when the worker prompt or post-processing changes, so cached flow results are not reused
+PROMPT_VERSION = "2"
+
+# How the orchestrator reaches the worker: WORKER_MODE / WORKER_POOL_SIZE, see worker_dispatch.py
+# Concurrent worker calls per orchestrator run
+WORKER_CONCURRENCY = 20
+
+# 'deterministic' extracts PERFORM/GO TO/CALL with the tokenizer; 'llm' asks Gemini as before
+CONTROL_FLOW_EXTRACTOR = os.environ.get("CONTROL_FLOW_EXTRACTOR", "deterministic")
+
+# 'prescan' finds candidate (line, entity) pairs with the matcher and the LLM only classifies them;
+# 'llm' lets the model find references itself as before
+REFERENCE_CANDIDATES = os.environ.get("REFERENCE_CANDIDATES", "prescan")
+USAGE_TYPES = ["READS", "WRITES", "UPDATES", "VALIDATES", "OPENS", "CLOSES", "DECLARATION"]
+
+# Model tier / thinking level per call come from the routing policy (see routing.py, ROUTING_POLICY).
+# A call is re-asked one tier up when more than this share of its pre-scan candidates is left unclassified.
+ROUTING_ESCALATE_UNCLASSIFIED = float(os.environ.get("ROUTING_ESCALATE_UNCLASSIFIED", "0.2"))
+# Likewise when more than this share of its references fails validation (what remains is re-asked on the final tier)
+ROUTING_ESCALATE_INVALID = float(os.environ.get("ROUTING_ESCALATE_INVALID", "0.2"))
+
+# 'reask' re-asks the model about references failing validation, 'drop' drops (and reports) them,
+# 'off' accepts model output as-is
+REFERENCE_VALIDATION = os.environ.get("REFERENCE_VALIDATION", "reask")
+
+# Usage-type definitions shared by the reference and fused prompts
+USAGE_TYPE_RULES = """           - Usage Types:
+             - 'READS': Entity value is used/read (source in MOVE, displayed, used in COMPUTE, READ file INTO record).
+             - 'WRITES': Entity is written to an output file (WRITE record).
+             - 'UPDATES': Entity is modified/receives data (target in MOVE, result of COMPUTE, REWRITE record).
+             - 'VALIDATES': Entity is checked in a condition (IF A = 'Y', EVALUATE).
+             - 'OPENS': File is opened (OPEN INPUT/OUTPUT/EXTEND file).
+             - 'CLOSES': File is closed (CLOSE file).
+             - 'DECLARATION': Definition (FD, 01, 05 level, SELECT).
+           
+           CRITICAL FILE I/O RULES:
+             - OPEN INPUT/OUTPUT/EXTEND file-name → usage_type = 'OPENS' (NOT 'READS')
+             - CLOSE file-name → usage_type = 'CLOSES' (NOT 'READS' or 'UPDATES')
+             - READ file-name INTO variable → file usage_type = 'READS', variable = 'UPDATES'
+             - WRITE record-name → record usage_type = 'WRITES'
+             - REWRITE record-name → record usage_type = 'UPDATES'
+"""
 
 # Initialize Gemini Client (Shared)
 try:
@@ -33,6 +96,19 @@ def generate_with_retries(model, contents, config, max_retries=3):
             time.sleep(delay)
             delay *= 2
 
+def routed_config(response_schema, tier):
+    """JSON generation config at the routing tier's thinking level."""
+    return types.GenerateContentConfig(
+        temperature=1.0,
+        top_p=0.95,
+        max_output_tokens=8192,
+        response_mime_type="application/json",
+        response_schema=response_schema,
+        thinking_config=types.ThinkingConfig(
+            thinking_level=tier['thinking_level'],
+        ),
+    )
+
 # --- WORKER FUNCTION ---
 
 @functions_framework.http
@@ -40,6 +116,8 @@ def flow_worker(request: Request):
     """
     Worker Function.
     Analyzes a specific Structure within the context of the full program.
+    Accepts a batch via 'target_structure_ids'; results are then also
+    returned keyed by structure id under 'results'.
     """
     if request.method == 'OPTIONS':
         headers = {
@@ -49,167 +127,570 @@ def flow_worker(request: Request):
         }
         return ('', 204, headers)
 
+    req_json = request.get_json(silent=True) or {}
+    body, status = dispatch_mode(req_json)
+    return jsonify(body), status
+
+def dispatch_mode(req_json):
+    """Routes a worker request: 'fused' extracts entities and references together."""
+    if req_json.get('mode') == 'fused':
+        return analyze_fused(req_json)
+    return analyze_structures(req_json)
+
+def target_code_text(index, target_structure_ids):
+    """Rendered target lines, one block per structure when batched."""
+    if len(target_structure_ids) > 1:
+        return "".join(f"--- STRUCTURE {sid} ---\n" + index.structure_text(sid) for sid in target_structure_ids)
+    return index.structure_text(target_structure_ids[0])
+
+def invalid_share_failure(line_references, validator):
+    """Escalation reason when too many references fail validation, else None."""
+    if REFERENCE_VALIDATION == 'off' or not line_references:
+        return None
+    invalid = len(validator.validate(line_references)[1])
+    if invalid > ROUTING_ESCALATE_INVALID * len(line_references):
+        return f"{invalid}/{len(line_references)} references invalid"
+    return None
+
+def validate_references(program_id, line_references, validator, tier, debug_msgs):
+    """
+    Checks model references deterministically. With REFERENCE_VALIDATION='reask' the
+    invalid ones (only) go back to the model in one compact prompt; what is still
+    invalid afterwards is returned as dropped, each with its reason.
+    Returns (valid, dropped).
+    """
+    if REFERENCE_VALIDATION == 'off':
+        return line_references, []
+    valid, invalid = validator.validate(line_references)
+    if not invalid:
+        return valid, []
+    if REFERENCE_VALIDATION != 'reask':
+        debug_msgs.append(f"[VALIDATE] {len(valid)} valid, {len(invalid)} dropped")
+        return valid, invalid
+
+    items = []
+    for i, ref in enumerate(invalid):
+        ln = ref.get('line_number')
+        line = validator.lines.get(ln)
+        code = line.get('content', '')[7:72].strip() if line else '(not a line of the target)'
+        on_line = ', '.join(validator.names_on_line(ln)) or 'none'
+        items.append(f"        {i}: {ln} | {code} | {ref.get('target_entity_name')} {ref.get('usage_type')} | {ref['reason']} | {on_line}")
+
+    prompt = f"""
+        These data references from COBOL program {program_id} failed validation.
+        For each item give the corrected reference, or set drop=true if the entity is not used on that line.
+
+        ITEMS (#: line_number | code | entity usage_type | problem | known entities on the line):
+{chr(10).join(items)}
+
+{USAGE_TYPE_RULES}
+        OUTPUT JSON:
+        {{
+          "corrections": [
+            {{ "item": <int>, "line_number": <int>, "target_entity_name": "<name>", "usage_type": "<type>", "drop": <bool> }}
+          ]
+        }}
+        """
+    response_schema = {
+        "type": "OBJECT",
+        "properties": {
+            "corrections": {
+                "type": "ARRAY",
+                "items": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "item": {"type": "INTEGER"},
+                        "line_number": {"type": "INTEGER", "nullable": True},
+                        "target_entity_name": {"type": "STRING", "nullable": True},
+                        "usage_type": {"type": "STRING", "enum": USAGE_TYPES, "nullable": True},
+                        "drop": {"type": "BOOLEAN"}
+                    },
+                    "required": ["item", "drop"]
+                }
+            }
+        }
+    }
+
+    corrected = []
+    dropped = {i: ref for i, ref in enumerate(invalid)}
+    try:
+        response = generate_with_retries(tier['model'], [prompt], routed_config(response_schema, tier))
+        corrections = json.loads(response.text or '{}').get('corrections', [])
+    except Exception as e:
+        debug_msgs.append(f"[REASK] failed: {e}")
+        corrections = []
+    for c in corrections:
+        i = c.get('item')
+        if i not in dropped:
+            continue
+        ref = dropped[i]
+        if c.get('drop'):
+            dropped[i] = dict(ref, reason=f"dropped on re-ask ({ref['reason']})")
+            continue
+        del dropped[i]
+        corrected.append({
+            "line_number": c.get('line_number') or ref.get('line_number'),
+            "target_entity_name": c.get('target_entity_name') or ref.get('target_entity_name'),
+            "usage_type": c.get('usage_type') or ref.get('usage_type')
+        })
+
+    # Corrections are held to the same checks; duplicates of accepted references fall away
+    fixed, still_invalid = validator.validate(corrected)
+    accepted, _ = validator.validate(valid + fixed)
+    dropped = list(dropped.values()) + still_invalid
+    debug_msgs.append(f"[REASK] {len(invalid)} invalid: {len(fixed)} corrected, {len(dropped)} dropped")
+    return accepted, dropped
+
+def flow_structure_features(index, structure_id, entity_names):
+    """Routing features of one structure; candidates are known-entity occurrences."""
+    lines = index.structure_lines(structure_id)
+    return complexity_features(lines, len(get_matcher(entity_names).scan(lines)))
+
+def fused_structure_features(index, structure_id):
+    """Routing features of one structure; candidates are declared identifiers it uses."""
+    lines = index.structure_lines(structure_id)
+    return complexity_features(lines, len(identifiers_in(lines) & set(get_declarations(index))))
+
+def analyze_structures(req_json):
+    """
+    Worker body, shared by the HTTP entry point and the in-process executors.
+    Returns (body, status).
+    """
     try:
-        req_json = request.get_json(silent=True) or {}
         program_id = req_json.get('program_id', 'UNKNOWN')
         target_structure_id = req_json.get('target_structure_id')
+        target_structure_ids = req_json.get('target_structure_ids') or ([target_structure_id] if target_structure_id else [])
         all_source_lines = req_json.get('source_lines', [])
         known_entities = req_json.get('entities', []) # List of names
         known_paragraphs = req_json.get('paragraphs', []) # List of names
 
-        if not target_structure_id:
-            return jsonify({'error': 'Missing target_structure_id'}), 400
-
-        # 1. Identify the lines for the target structure
-        # (The orchestrator sends full source, but we need to know what to focus on)
-        # We could pass start/end line, or filter here.
-        # Let's assume the Orchestrator passed the structure metadata or we derive it.
-        # Actually, it's better if the Orchestrator passes the *range* or the *lines* of the structure
-        # in addition to the full context?
-        # User said "just send all of 01 enriched".
-        # So we need to know *which* lines are the target structure.
-        # We can filter `all_source_lines` where `structure_id` == `target_structure_id`.
-        
-        target_lines = [
-            line for line in all_source_lines 
-            if line.get('structure_id') == target_structure_id
-        ]
+        if not target_structure_ids:
+            return {'error': 'Missing target_structure_id'}, 400
+
+        # 1. Identify the lines for the target structure(s)
+        # The program index (structure_id -> line ranges + rendered text) is built once
+        # per program version and cached, so this is a lookup rather than a scan.
+        index = get_program_index(program_id, all_source_lines, req_json.get('program_fingerprint'))
+        target_lines = []
+        for sid in target_structure_ids:
+            target_lines.extend(index.structure_lines(sid))
+        results = {sid: {'control_flow': [], 'line_references': []} for sid in target_structure_ids}
         
         if not target_lines:
             # Maybe it's a structure with no lines? (e.g. wrapper division)
-            return jsonify({'control_flow': [], 'line_references': []})
+            return {'control_flow': [], 'line_references': [], 'results': results}, 200
+
+        # Candidate references: every whole-identifier occurrence of a known entity in the target
+        prescan = REFERENCE_CANDIDATES == 'prescan'
+        candidates = get_matcher(known_entities).scan(target_lines) if prescan else []
 
         # 2. Prepare Context
-        # Full code representation
-        full_code_str = ""
-        for line in all_source_lines:
-            ln = line.get('line_number')
-            content = line.get('content', '')
-            full_code_str += f"{ln} | {content}\n"
-
-        # Target Code representation
-        target_code_str = ""
-        for line in target_lines:
-            ln = line.get('line_number')
-            content = line.get('content', '')
-            target_code_str += f"{ln} | {content}\n"
-
-        # 3. Prompt
+        # Trimmed: only declarations of identifiers the target uses, plus the entities
+        # and paragraphs it can touch. Full: the whole program (pre-rendered in the index).
+        context_stats = None
+        if CONTEXT_MODE == 'trimmed':
+            declarations_str, known_entities, known_paragraphs, context_stats = assemble_context(
+                index, target_lines, known_entities, known_paragraphs)
+            context_block = f"""=== RELEVANT DATA DECLARATIONS (For Reference) ===
+        {declarations_str}"""
+        else:
+            context_block = f"""=== FULL PROGRAM CONTEXT (For Reference) ===
+        {index.text}"""
+
+        # Target Code representation (one block per structure when batched)
+        target_code_str = target_code_text(index, target_structure_ids)
+
+        # 3. Control Flow
+        # PERFORM / GO TO / CALL targets are lexical, so by default they are extracted
+        # deterministically and the LLM only handles data references.
+        deterministic_flow = CONTROL_FLOW_EXTRACTOR == 'deterministic'
+        control_flow = extract_control_flow(target_lines, known_paragraphs) if deterministic_flow else []
+
+        if prescan:
+            # Numbered candidates; the model answers with candidate numbers and usage types only
+            entities_block = "CANDIDATE REFERENCES (#: line_number entity_name):\n" + "\n".join(
+                f"        {i}: {ln} {name}" for i, (ln, name) in enumerate(candidates))
+            refs_task = """Classify **Line References**: give the usage_type of each CANDIDATE REFERENCE.
+           - Answer only with candidate numbers from the list; omit a candidate only if the name is not used there."""
+            output_refs_block = """"classifications": [
+            { "candidate": <int>, "usage_type": "<type>" }
+          ]"""
+        else:
+            entities_block = f"""KNOWN ENTITIES (Variables/Files):
+        {json.dumps(known_entities)}"""
+            refs_task = "Identify **Line References**: Usages of KNOWN ENTITIES."
+            output_refs_block = """"line_references": [
+            { "line_number": <int>, "target_entity_name": "<name>", "usage_type": "<type>" }
+          ]"""
+
+        if deterministic_flow:
+            paragraphs_block = ""
+            task_block = f"""1. {refs_task}"""
+            output_flow_block = ""
+        else:
+            paragraphs_block = f"""KNOWN PARAGRAPHS (Flow Targets):
+        {json.dumps(known_paragraphs)}
+        """
+            task_block = f"""1. Identify **Control Flow**: `PERFORM`, `GO TO`, `CALL` statements.
+           - Target must be in KNOWN PARAGRAPHS (for internal flow).
+           - Type: 'PERFORM', 'GO_TO', 'CALL'.
+        2. {refs_task}"""
+            output_flow_block = """"control_flow": [
+            { "line_number": <int>, "target_structure_name": "<name>", "type": "<type>" }
+          ],"""
+
+        # 4. Prompt
         prompt = f"""
-        You are analyzing the Control Flow and Data References for a specific COBOL structure.
+        You are analyzing the {'Data References' if deterministic_flow else 'Control Flow and Data References'} for specific COBOL structure(s).
         
         Program: {program_id}
-        Target Structure ID: {target_structure_id}
-        
-        KNOWN ENTITIES (Variables/Files):
-        {json.dumps(known_entities)}
+        Target Structure ID(s): {', '.join(target_structure_ids)}
         
-        KNOWN PARAGRAPHS (Flow Targets):
-        {json.dumps(known_paragraphs)}
+        {entities_block}
         
-        === FULL PROGRAM CONTEXT (For Reference) ===
-        {full_code_str}
+        {paragraphs_block}
+        {context_block}
         
         === TARGET STRUCTURE CODE (Analyze THESE lines) ===
         {target_code_str}
         
         TASK:
-        1. Identify **Control Flow**: `PERFORM`, `GO TO`, `CALL` statements.
-           - Target must be in KNOWN PARAGRAPHS (for internal flow).
-           - Type: 'PERFORM', 'GO_TO', 'CALL'.
-        2. Identify **Line References**: Usages of KNOWN ENTITIES.
-           - Usage Types:
-             - 'READS': Entity value is used/read (source in MOVE, displayed, used in COMPUTE, READ file INTO record).
-             - 'WRITES': Entity is written to an output file (WRITE record).
-             - 'UPDATES': Entity is modified/receives data (target in MOVE, result of COMPUTE, REWRITE record).
-             - 'VALIDATES': Entity is checked in a condition (IF A = 'Y', EVALUATE).
-             - 'OPENS': File is opened (OPEN INPUT/OUTPUT/EXTEND file).
-             - 'CLOSES': File is closed (CLOSE file).
-             - 'DECLARATION': Definition (FD, 01, 05 level, SELECT).
-           
-           CRITICAL FILE I/O RULES:
-             - OPEN INPUT/OUTPUT/EXTEND file-name → usage_type = 'OPENS' (NOT 'READS')
-             - CLOSE file-name → usage_type = 'CLOSES' (NOT 'READS' or 'UPDATES')
-             - READ file-name INTO variable → file usage_type = 'READS', variable = 'UPDATES'
-             - WRITE record-name → record usage_type = 'WRITES'
-             - REWRITE record-name → record usage_type = 'UPDATES'
-        
+        {task_block}
+{USAGE_TYPE_RULES}        
         OUTPUT JSON:
         {{
-          "control_flow": [
-            {{ "line_number": <int>, "target_structure_name": "<name>", "type": "<type>" }}
-          ],
-          "line_references": [
-            {{ "line_number": <int>, "target_entity_name": "<name>", "usage_type": "<type>" }}
-          ]
+          {output_flow_block}
+          {output_refs_block}
         }}
         """
         
-        config = types.GenerateContentConfig(
-            temperature=1.0,
-            top_p=0.95,
-            max_output_tokens=8192,
-            response_mime_type="application/json",
-            response_schema={
-                "type": "OBJECT",
-                "properties": {
-                    "control_flow": {
-                        "type": "ARRAY",
-                        "items": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "line_number": {"type": "INTEGER"},
-                                "target_structure_name": {"type": "STRING"},
-                                "type": {"type": "STRING", "enum": ["PERFORM", "GO_TO", "CALL"]}
-                            },
-                            "required": ["line_number", "target_structure_name", "type"]
-                        }
-                    },
-                    "line_references": {
-                        "type": "ARRAY",
-                        "items": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "line_number": {"type": "INTEGER"},
-                                "target_entity_name": {"type": "STRING"},
-                                "usage_type": {"type": "STRING", "enum": ["READS", "WRITES", "UPDATES", "VALIDATES", "OPENS", "CLOSES", "DECLARATION"]}
-                            },
-                            "required": ["line_number", "target_entity_name", "usage_type"]
-                        }
+        response_schema = {
+            "type": "OBJECT",
+            "properties": {
+                **({} if deterministic_flow else {"control_flow": {
+                    "type": "ARRAY",
+                    "items": {
+                        "type": "OBJECT",
+                        "properties": {
+                            "line_number": {"type": "INTEGER"},
+                            "target_structure_name": {"type": "STRING"},
+                            "type": {"type": "STRING", "enum": ["PERFORM", "GO_TO", "CALL"]}
+                        },
+                        "required": ["line_number", "target_structure_name", "type"]
                     }
-                }
-            },
-            thinking_config=types.ThinkingConfig(
-                thinking_level="HIGH",
-            ),
-        )
+                }}),
+                **({"classifications": {
+                    "type": "ARRAY",
+                    "items": {
+                        "type": "OBJECT",
+                        "properties": {
+                            "candidate": {"type": "INTEGER"},
+                            "usage_type": {"type": "STRING", "enum": USAGE_TYPES}
+                        },
+                        "required": ["candidate", "usage_type"]
+                    }
+                }} if prescan else {"line_references": {
+                    "type": "ARRAY",
+                    "items": {
+                        "type": "OBJECT",
+                        "properties": {
+                            "line_number": {"type": "INTEGER"},
+                            "target_entity_name": {"type": "STRING"},
+                            "usage_type": {"type": "STRING", "enum": USAGE_TYPES}
+                        },
+                        "required": ["line_number", "target_entity_name", "usage_type"]
+                    }
+                }})
+            }
+        }
 
         # Collect debug messages to return to orchestrator
         debug_msgs = []
+        if context_stats:
+            debug_msgs.append(f"[CTX] {context_stats['full_context_tokens']} -> {context_stats['trimmed_context_tokens']} tokens")
         
-        response = generate_with_retries(MODEL_NAME, [prompt], config)
+        if prescan:
+            debug_msgs.append(f"[SCAN] {len(candidates)} candidate references")
+
+        def interpret(raw_text):
+            """Parses one response. Returns (result, unclassified, failure reason or None)."""
+            failure = None
+            # Handle empty response
+            if not raw_text or raw_text.strip() == "":
+                debug_msgs.append(f"[WARN] Empty response. Lines: {[l.get('content', '')[:40] for l in target_lines[:3]]}")
+                raw_text = '{}'
+                failure = "empty response"
+            try:
+                result = json.loads(raw_text)
+            except json.JSONDecodeError as je:
+                debug_msgs.append(f"[ERROR] JSON parse failed: {str(je)[:100]}. Raw: {raw_text[:200]}")
+                result = {'line_references': []}
+                failure = "unparseable response"
+
+            unclassified = []
+            if prescan:
+                # Map candidate numbers back to references; anything the model skipped is reported
+                line_references = []
+                classified = set()
+                for c in result.pop('classifications', []):
+                    i = c.get('candidate')
+                    if isinstance(i, int) and 0 <= i < len(candidates) and i not in classified:
+                        classified.add(i)
+                        ln, name = candidates[i]
+                        line_references.append({"line_number": ln, "target_entity_name": name, "usage_type": c.get('usage_type')})
+                unclassified = [{"line_number": ln, "target_entity_name": name}
+                                for i, (ln, name) in enumerate(candidates) if i not in classified]
+                result['line_references'] = line_references
+                if candidates and len(unclassified) > ROUTING_ESCALATE_UNCLASSIFIED * len(candidates):
+                    failure = failure or f"{len(unclassified)}/{len(candidates)} candidates unclassified"
+            return result, unclassified, failure
+
+        # Route by complexity: small structures go to a cheaper tier, failed output is re-asked one tier up
+        policy = get_policy(MODEL_NAME)
+        features = combined_features([flow_structure_features(index, sid, req_json.get('entities', []))
+                                      for sid in target_structure_ids])
+        tier_index = route(features, policy)
+        escalations = 0
+        validator = ReferenceValidator(target_lines, req_json.get('entities', []), USAGE_TYPES, get_procedure_start(index))
+        output_failure = None
+
+        if deterministic_flow and not (candidates if prescan else known_entities):
+            # Control flow is already known and no entity appears in the target: nothing to ask
+            debug_msgs.append(f"[SKIP] {', '.join(target_structure_ids)}: no known entities in target lines")
+            result, unclassified, _ = interpret('{"line_references": []}')
+        else:
+            while True:
+                tier = policy[tier_index]
+                response = generate_with_retries(tier['model'], [prompt], routed_config(response_schema, tier))
+                
+                # Log the raw response for debugging
+                raw_text = response.text if response and hasattr(response, 'text') else None
+                debug_msgs.append(f"[OK] {', '.join(target_structure_ids)}: {len(target_lines)} lines, tier={tier['name']}, resp_len={len(raw_text) if raw_text else 0}")
+                result, unclassified, output_failure = interpret(raw_text)
+                failure = output_failure or invalid_share_failure(result.get('line_references'), validator)
+
+                next_index = escalate(policy, tier_index) if failure else None
+                if next_index is None:
+                    break
+                debug_msgs.append(f"[ESCALATE] {tier['name']} -> {policy[next_index]['name']}: {failure}")
+                tier_index = next_index
+                escalations += 1
+            result['routing'] = {"tier": policy[tier_index]['name'], "escalations": escalations, "features": features}
+
+        if deterministic_flow:
+            result['control_flow'] = control_flow
+        result.setdefault('control_flow', [])
+        result.setdefault('line_references', [])
+
+        # 5. Validate; only the invalid items go back to the model
+        if not deterministic_flow and REFERENCE_VALIDATION != 'off':
+            result['control_flow'], dropped_flows = validate_control_flow(
+                result['control_flow'], target_lines, req_json.get('paragraphs', []))
+            result['dropped_control_flow'] = dropped_flows
+        if result['line_references']:
+            result['line_references'], result['dropped_references'] = validate_references(
+                program_id, result['line_references'], validator, policy[tier_index], debug_msgs)
         
-        # Log the raw response for debugging
-        raw_text = response.text if response and hasattr(response, 'text') else None
-        debug_msgs.append(f"[OK] {target_structure_id}: {len(target_lines)} lines, resp_len={len(raw_text) if raw_text else 0}")
+        # Only output that parsed (on the last tier tried) and went through validation may be cached;
+        # references still invalid after the re-ask are dropped, which keeps the structure out of the cache too
+        if output_failure:
+            debug_msgs.append(f"[FAILED] {', '.join(target_structure_ids)}: {output_failure}")
+        result['cacheable'] = output_failure is None and REFERENCE_VALIDATION != 'off'
+
+        # Key results by structure via the line each item sits on
+        line_to_structure = {line.get('line_number'): line.get('structure_id') for line in target_lines}
+        if prescan:
+            for sid in results:
+                results[sid]['unclassified_candidates'] = []
+            result['unclassified_candidates'] = unclassified
+        for sid in results:
+            results[sid]['dropped_references'] = []
+            results[sid]['dropped_control_flow'] = []
+        for kind in ('control_flow', 'line_references', 'unclassified_candidates', 'dropped_references', 'dropped_control_flow'):
+            for item in result.get(kind, []):
+                sid = line_to_structure.get(item.get('line_number'))
+                if sid is None and (len(target_structure_ids) == 1 or kind.startswith('dropped_')):
+                    # Dropped items may sit outside the target; report them with the first structure
+                    sid = target_structure_ids[0]
+                if sid in results:
+                    results[sid][kind].append(item)
+        result['results'] = results
         
-        # Handle empty response
-        if not raw_text or raw_text.strip() == "":
-            debug_msgs.append(f"[WARN] Empty response. Lines: {[l.get('content', '')[:40] for l in target_lines[:3]]}")
-            return jsonify({'control_flow': [], 'line_references': [], '_debug': debug_msgs})
+        # Add debug info to result
+        result['_debug'] = debug_msgs
+        if context_stats:
+            result['context_stats'] = context_stats
+        return result, 200
+
+    except Exception as e:
+        return {'error': str(e), '_debug': [f"[EXCEPTION] {req_json.get('target_structure_ids') or req_json.get('target_structure_id')}: {e}"]}, 500
+
+
+def analyze_fused(req_json):
+    """
+    Fused worker body: entities, control flow and line references for the target
+    structure(s) in one call, instead of one Agent 3 and one Agent 4 call each.
+    Control flow is deterministic; entity ids are assigned by the orchestrator's
+    post-pass. Returns (body, status).
+    """
+    try:
+        program_id = req_json.get('program_id', 'UNKNOWN')
+        target_structure_ids = req_json.get('target_structure_ids') or []
+        all_source_lines = req_json.get('source_lines', [])
+        known_paragraphs = req_json.get('paragraphs', [])
+
+        if not target_structure_ids:
+            return {'error': 'Missing target_structure_ids'}, 400
+
+        index = get_program_index(program_id, all_source_lines, req_json.get('program_fingerprint'))
+        target_lines = []
+        for sid in target_structure_ids:
+            target_lines.extend(index.structure_lines(sid))
+        results = {sid: {'control_flow': [], 'line_references': []} for sid in target_structure_ids}
+        if not target_lines:
+            return {'entities': [], 'control_flow': [], 'line_references': [], 'results': results}, 200
+
+        # Entities are not known yet, so the context is the declarations of every identifier the target uses
+        context_stats = None
+        if CONTEXT_MODE == 'trimmed':
+            declarations_str, _, _, context_stats = assemble_context(index, target_lines, [], known_paragraphs)
+            context_block = f"""=== RELEVANT DATA DECLARATIONS (For Reference) ===
+        {declarations_str}"""
+        else:
+            context_block = f"""=== FULL PROGRAM CONTEXT (For Reference) ===
+        {index.text}"""
+
+        prompt = f"""
+        You are analyzing the Data Entities and Data References for specific COBOL structure(s).
         
-        try:
-            result = json.loads(raw_text)
-        except json.JSONDecodeError as je:
-            debug_msgs.append(f"[ERROR] JSON parse failed: {str(je)[:100]}. Raw: {raw_text[:200]}")
-            return jsonify({'control_flow': [], 'line_references': [], '_debug': debug_msgs})
+        Program: {program_id}
+        Target Structure ID(s): {', '.join(target_structure_ids)}
         
-        # Add debug info to result
+        {context_block}
+        
+        === TARGET STRUCTURE CODE (Analyze THESE lines) ===
+        {target_code_text(index, target_structure_ids)}
+        
+        TASK:
+        1. Extract **Data Entities** defined OR referenced in the target lines: FILE, VARIABLE, COPYBOOK.
+           - Set definition_line_number to the line that declares the entity if it is shown above, else null.
+           - Give a short description of what the entity holds or is used for.
+        2. Identify **Line References**: Usages of those entities in the target lines.
+{USAGE_TYPE_RULES}
+        OUTPUT JSON:
+        {{
+          "entities": [
+            {{ "entity_name": "<name>", "entity_type": "<type>", "definition_line_number": <int or null>, "description": "<text>" }}
+          ],
+          "line_references": [
+            {{ "line_number": <int>, "target_entity_name": "<name>", "usage_type": "<type>" }}
+          ]
+        }}
+        """
+
+        response_schema = {
+            "type": "OBJECT",
+            "properties": {
+                "entities": {
+                    "type": "ARRAY",
+                    "items": {
+                        "type": "OBJECT",
+                        "properties": {
+                            "entity_name": {"type": "STRING"},
+                            "entity_type": {"type": "STRING", "enum": ["FILE", "VARIABLE", "COPYBOOK"]},
+                            "definition_line_number": {"type": "INTEGER", "nullable": True},
+                            "description": {"type": "STRING"}
+                        },
+                        "required": ["entity_name", "entity_type"]
+                    }
+                },
+                "line_references": {
+                    "type": "ARRAY",
+                    "items": {
+                        "type": "OBJECT",
+                        "properties": {
+                            "line_number": {"type": "INTEGER"},
+                            "target_entity_name": {"type": "STRING"},
+                            "usage_type": {"type": "STRING", "enum": USAGE_TYPES}
+                        },
+                        "required": ["line_number", "target_entity_name", "usage_type"]
+                    }
+                }
+            }
+        }
+
+        debug_msgs = []
+        policy = get_policy(MODEL_NAME)
+        features = combined_features([fused_structure_features(index, sid) for sid in target_structure_ids])
+        tier_index = route(features, policy)
+        escalations = 0
+        declared, procedure_start = get_declarations(index), get_procedure_start(index)
+        while True:
+            tier = policy[tier_index]
+            response = generate_with_retries(tier['model'], [prompt], routed_config(response_schema, tier))
+            raw_text = response.text if response and hasattr(response, 'text') else None
+            debug_msgs.append(f"[OK] {', '.join(target_structure_ids)}: {len(target_lines)} lines, tier={tier['name']}, resp_len={len(raw_text) if raw_text else 0}")
+            failure = None
+            try:
+                result = json.loads(raw_text or '')
+            except json.JSONDecodeError as je:
+                debug_msgs.append(f"[ERROR] JSON parse failed: {str(je)[:100]}. Raw: {(raw_text or '')[:200]}")
+                result = {}
+                failure = "unparseable response"
+            # References may name any declared identifier or an entity the model listed
+            names = set(declared) | {e.get('entity_name') or '' for e in result.get('entities') or []}
+            validator = ReferenceValidator(target_lines, names, USAGE_TYPES, procedure_start)
+            failure = failure or invalid_share_failure(result.get('line_references'), validator)
+
+            next_index = escalate(policy, tier_index) if failure else None
+            if next_index is None:
+                break
+            debug_msgs.append(f"[ESCALATE] {tier['name']} -> {policy[next_index]['name']}: {failure}")
+            tier_index = next_index
+            escalations += 1
+        result['routing'] = {"tier": policy[tier_index]['name'], "escalations": escalations, "features": features}
+
+        result.setdefault('entities', [])
+        result.setdefault('line_references', [])
+        result['control_flow'] = extract_control_flow(target_lines, known_paragraphs)
+
+        if result['line_references']:
+            result['line_references'], result['dropped_references'] = validate_references(
+                program_id, result['line_references'], validator, policy[tier_index], debug_msgs)
+
+        # Key flow and references by structure via the line each item sits on
+        line_to_structure = {line.get('line_number'): line.get('structure_id') for line in target_lines}
+        for sid in results:
+            results[sid]['dropped_references'] = []
+        for kind in ('control_flow', 'line_references', 'dropped_references'):
+            for item in result.get(kind, []):
+                sid = line_to_structure.get(item.get('line_number'))
+                if sid is None and kind == 'dropped_references':
+                    sid = target_structure_ids[0]
+                if sid in results:
+                    results[sid][kind].append(item)
+        result['results'] = results
         result['_debug'] = debug_msgs
-        return jsonify(result)
+        if context_stats:
+            result['context_stats'] = context_stats
+        return result, 200
+
+    except Exception as e:
+        return {'error': str(e), '_debug': [f"[EXCEPTION] fused {req_json.get('target_structure_ids')}: {e}"]}, 500
+
 
+def run_worker(payload):
+    """
+    In-process worker entry point (thread/process pool executors).
+    Same contract as the HTTP worker: returns the body, or {'error': ...}.
+    """
+    try:
+        body, status = dispatch_mode(payload)
+        if status != 200 and 'error' not in body:
+            body = {'error': f"Status {status}"}
+        return body
     except Exception as e:
-        return jsonify({'error': str(e), '_debug': [f"[EXCEPTION] {target_structure_id}: {e}"]}), 500
+        return {'error': str(e)}
 
 
 # --- ORCHESTRATOR FUNCTION ---
@@ -222,12 +703,15 @@ def flow_orchestrator(request: Request):
     2. Dispatches workers for each Structure.
     3. Maps Names to IDs (Paragraph Name -> Structure ID, Entity Name -> Entity ID).
     4. Returns aggregated Control Flow & References.
+    Streams per-structure progress as each worker completes.
+    With {"format": "ndjson"} or Accept: application/x-ndjson, streams typed events
+    instead (see event_stream.py), one partial_result per structure.
     """
     if request.method == 'OPTIONS':
         headers = {
             'Access-Control-Allow-Origin': '*',
             'Access-Control-Allow-Methods': 'POST',
-            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Allow-Headers': 'Content-Type, Accept',
         }
         return ('', 204, headers)
 
@@ -240,11 +724,13 @@ def flow_orchestrator(request: Request):
     entities = req_json.get('entities', []) # 03_entities.json list
     program_id = req_json.get('program_id', 'UNKNOWN')
     
+    # Only used in 'http' worker mode
     worker_url = os.environ.get('WORKER_URL', 'http://localhost:8080')
 
     # Prep Context Lists
     entity_names = [e['entity_name'] for e in entities]
-    paragraph_names = [s['name'] for s in structures if s['type'] == 'PARAGRAPH']
+    # Sections are valid PERFORM / GO TO targets too
+    paragraph_names = [s['name'] for s in structures if s['type'] in ('PARAGRAPH', 'SECTION')]
     
     # Mapping Lookups (for final ID resolution)
     # Entity Name -> Entity ID
@@ -254,9 +740,19 @@ def flow_orchestrator(request: Request):
     # Logic: If multiple structures have same name, this is tricky. Assuming unique names or first match.
     structure_lookup = {s['name']: s['section_id'] for s in structures}
 
-    def stream_process():
-        yield f"--- Flow Orchestrator Started for {program_id} ---\n"
-        yield f"Structures: {len(structures)}, Entities: {len(entity_names)}\n"
+    # Index the program once; workers reuse it by fingerprint (shared directly in-process)
+    fingerprint = program_fingerprint(source_lines)
+    index = get_program_index(program_id, source_lines, fingerprint)
+
+    # Per-structure result cache (FLOW_CACHE_PATH); everything that shapes a result is in the key
+    flow_cache = FlowCache()
+    prompt_version = (f"{PROMPT_VERSION}|{MODEL_NAME}|{CONTROL_FLOW_EXTRACTOR}|{REFERENCE_CANDIDATES}|{CONTEXT_MODE}"
+                      f"|{policy_key(get_policy(MODEL_NAME))}")
+
+    def stream_events():
+        yield progress(f"--- Flow Orchestrator Started for {program_id} ---")
+        yield progress(f"Structures: {len(structures)}, Entities: {len(entity_names)}")
+        yield progress(f"Worker Mode: {WORKER_MODE}" + (f" ({worker_url})" if WORKER_MODE == 'http' else f" (pool {WORKER_POOL_SIZE})"))
         
         # Filter structures to process? 
         # User wanted "all sections". We iterate all structures in 02.
@@ -268,109 +764,432 @@ def flow_orchestrator(request: Request):
         # 01_enriched assigns `structure_id` to the *most specific* structure.
         # So we should iterate only structures that actually have lines assigned to them in `source_lines`.
         
-        active_structure_ids = set(l.get('structure_id') for l in source_lines if l.get('structure_id'))
+        active_structure_ids = set(index.structure_ids())
         target_structures = [s for s in structures if s['section_id'] in active_structure_ids]
         
-        yield f"Targeting {len(target_structures)} structures (those containing lines).\n"
+        yield progress(f"Targeting {len(target_structures)} structures (those containing lines).")
         
-        all_control_flow = []
-        all_line_references = []
+        flow_ids = set()
+
+        # Incremental runs: structures whose content key is unchanged reuse their stored result
+        first_lines = {s['section_id']: index.structure_lines(s['section_id'])[0].get('line_number')
+                       for s in target_structures}
+        cache_keys = {}
+        cached_results = {}
+        if flow_cache.enabled:
+            for s in target_structures:
+                sid = s['section_id']
+                cache_keys[sid] = structure_cache_key(index.structure_lines(sid), entity_names, paragraph_names, prompt_version)
+            hits = flow_cache.get_many(list(set(cache_keys.values())))
+            cached_results = {sid: rebase(hits[key], first_lines[sid]) for sid, key in cache_keys.items() if key in hits}
+            yield progress(f"Flow cache: {len(cached_results)} unchanged, {len(target_structures) - len(cached_results)} to analyze.")
+        pending_structures = [s for s in target_structures if s['section_id'] not in cached_results]
         
-        async def process_structures():
-            sem = asyncio.Semaphore(20) # Concurrency limit
-            
-            async def bound_call(session, payload, tag):
-                async with sem:
-                    return await call_worker(session, worker_url, payload, tag)
-
-            async with aiohttp.ClientSession() as session:
-                tasks = []
-                for struct in target_structures:
-                    payload = {
-                        "program_id": program_id,
-                        "target_structure_id": struct['section_id'],
-                        "source_lines": source_lines, # SENDING ALL
-                        "entities": entity_names,
-                        "paragraphs": paragraph_names
-                    }
-                    task = asyncio.create_task(bound_call(session, payload, f"Struct {struct['name']}"))
-                    tasks.append(task)
-                return await asyncio.gather(*tasks)
+        # Pack small structures into shared worker calls (per routing tier), longest-predicted first
+        policy = get_policy(MODEL_NAME)
+        tiers = [route(flow_structure_features(index, s['section_id'], entity_names), policy) for s in pending_structures]
+        cost_model = CostModel('agent4_flow')
+        batches, batch_costs, packed_predictions = plan_batches(index, pending_structures, cost_model, tiers)
+        yield progress(f"Dispatching {len(batches)} worker calls (budget {BATCH_TOKEN_BUDGET} tokens).")
+        if batches:
+            yield progress(schedule_summary(batch_costs, packed_predictions, cost_model))
+
+        def make_payload(batch):
+            payload = {
+                "program_id": program_id,
+                "target_structure_ids": [s['section_id'] for s in batch],
+                "source_lines": source_lines, # SENDING ALL
+                "program_fingerprint": fingerprint,
+                "entities": entity_names,
+                "paragraphs": paragraph_names
+            }
+            if len(batch) == 1:
+                payload["target_structure_id"] = batch[0]['section_id']
+            return payload
+
+        process_structures = dispatch_batches(worker_url, batches, batch_costs, make_payload, cost_model)
 
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            results = loop.run_until_complete(process_structures())
-            loop.close()
-            
             flow_counter = 0
             ref_counter = 0
+            tokens_saved = 0
+            unclassified_counter = 0
+            dropped_counter = 0
+            external_calls = []
+            routings = []
             
-            for res in results:
+            # Cached structures first, then results stream back through the bridge as each worker finishes
+            cached = (([s], {'results': {s['section_id']: cached_results[s['section_id']]}, 'cached': True})
+                      for s in target_structures if s['section_id'] in cached_results)
+            for batch, res in itertools.chain(cached, stream_async(process_structures)):
                 if 'error' in res:
-                    yield f"  [Error] {res['error']}\n"
+                    yield error(res['error'], structures=[s['name'] for s in batch])
+                    continue
+
+                tokens_saved += (res.get('context_stats') or {}).get('tokens_saved', 0)
+                if res.get('routing'):
+                    routings.append(res['routing'])
+                if 'results' in res:
+                    per_structure = [(s, res['results'].get(s['section_id'], {})) for s in batch]
                 else:
-                    # Post-process and aggregate
-                    flows = res.get('control_flow', [])
-                    refs = res.get('line_references', [])
-                    
+                    # Older workers answer a single structure with flat lists
+                    per_structure = [(batch[0], res)]
+
+                for struct, struct_res in per_structure:
                     # Map Names back to IDs
-                    for f in flows:
-                        target_name = f.get('target_structure_name')
-                        line_num = f.get('line_number')
-                        source_line_id = f"{program_id}_{line_num}"
-                        
-                        target_id = structure_lookup.get(target_name)
-                        if target_id:
-                            all_control_flow.append({
-                                "flow_id": f"flow_{source_line_id}",
-                                "source_line_id": source_line_id,
-                                "target_structure_id": target_id,
-                                "type": f['type']
-                            })
-                            flow_counter += 1
-                    
-                    for r in refs:
-                        target_name = r.get('target_entity_name')
-                        line_num = r.get('line_number')
-                        source_line_id = f"{program_id}_{line_num}"
-                        
-                        target_id = entity_lookup.get(target_name)
-                        if target_id:
-                            all_line_references.append({
-                                "reference_id": f"ref_{source_line_id}_{target_name}",
-                                "source_line_id": source_line_id,
-                                "target_entity_id": target_id,
-                                "usage_type": r['usage_type']
-                            })
-                            ref_counter += 1
+                    struct_control_flow, struct_line_references, unmapped, struct_external = map_structure_results(
+                        program_id, struct_res, structure_lookup,
+                        lambda name, line_number: entity_lookup.get(name), flow_ids)
+                    external_calls.extend(struct_external)
+
+                    flow_counter += len(struct_control_flow)
+                    ref_counter += len(struct_line_references)
+                    yield progress(f"  [{'Cached' if res.get('cached') else 'Success'}] {struct['name']}: {len(struct_control_flow)} flows, {len(struct_line_references)} refs")
+                    # Each structure's edges go out as soon as they are mapped; nothing is accumulated here
+                    if struct_control_flow:
+                        yield partial_result("control_flow", struct['section_id'], struct_control_flow, structure=struct['name'])
+                    if struct_line_references:
+                        yield partial_result("line_references", struct['section_id'], struct_line_references, structure=struct['name'])
+
+                    # Store fresh results that parsed and passed validation; structures with failed output,
+                    # unclassified candidates or dropped items are retried next run
+                    sid = struct['section_id']
+                    worker_dropped = struct_res.get('dropped_references', []) + struct_res.get('dropped_control_flow', [])
+                    if sid in cache_keys and not res.get('cached') and res.get('cacheable') \
+                            and not struct_res.get('unclassified_candidates') and not worker_dropped:
+                        flow_cache.put(cache_keys[sid], to_relative(struct_res, first_lines[sid]))
+
+                    # Nothing is discarded silently: invalid or unmappable items are reported
+                    dropped = worker_dropped + unmapped
+                    if dropped:
+                        dropped_counter += len(dropped)
+                        yield progress(dropped_summary(dropped))
+
+                    # Recall net: pre-scan candidates the model did not classify
+                    unclassified = struct_res.get('unclassified_candidates', [])
+                    if unclassified:
+                        unclassified_counter += len(unclassified)
+                        shown = ', '.join(f"{u['line_number']}:{u['target_entity_name']}" for u in unclassified[:10])
+                        yield progress(f"    [Unclassified] {shown}" + (" ..." if len(unclassified) > 10 else ""))
             
-            yield f"Aggregation Complete. Flows: {flow_counter}, Refs: {ref_counter}\n"
+            yield progress(f"Aggregation Complete. Flows: {flow_counter}, Refs: {ref_counter}")
+            if tokens_saved:
+                yield progress(f"Context trimming saved ~{tokens_saved} prompt tokens.")
+            if unclassified_counter:
+                yield progress(f"Pre-scan candidates left unclassified: {unclassified_counter}")
+            if dropped_counter:
+                yield progress(f"Items dropped (invalid or unmapped): {dropped_counter}")
+            if external_calls:
+                yield progress(external_calls_summary(external_calls))
+            if routings:
+                yield progress(routing_summary(routings, policy))
+
+            calls, predicted_total, actual_total, mean_error = cost_model.error_summary()
+            if calls:
+                yield progress(f"Cost model: {calls} calls, predicted {predicted_total:.0f}s vs actual {actual_total:.0f}s (mean error {mean_error:.1f}s).")
+                cost_model.save()
             
         except Exception as e:
-            yield f"Fatal Error: {e}\n"
+            yield error(str(e), fatal=True)
             return
 
-        # Final Artifact
-        final_artifact = {
-            "control_flow": all_control_flow,
-            "line_references": all_line_references
+        yield summary(program_id=program_id, counts={
+            "control_flow": flow_counter,
+            "line_references": ref_counter,
+            "unclassified_candidates": unclassified_counter,
+            "dropped": dropped_counter,
+            "external_calls": len(external_calls)
+        })
+
+    if wants_ndjson(request, req_json):
+        return Response(render_ndjson(stream_events()), mimetype=NDJSON_MIMETYPE)
+    return Response(render_text(stream_events(), ["control_flow", "line_references"]), mimetype='text/plain')
+
+@functions_framework.http
+def fused_orchestrator(request: Request):
+    """
+    Fused Orchestrator (replaces running Agent 3 and Agent 4 back to back).
+    1. Reads inputs (Lines, Structure).
+    2. Dispatches one 'fused' worker call per batch: entities, control flow and references together.
+    3. Deterministic post-pass: merges entity candidates, assigns entity_ids from declarations.
+    4. Maps Names to IDs and returns both artifacts in one response:
+       program_id / entities / metadata (03_entities.json) and
+       control_flow / line_references (04_references_and_flow.json).
+    Streams text like the other orchestrators, or NDJSON events on request.
+    """
+    if request.method == 'OPTIONS':
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'POST',
+            'Access-Control-Allow-Headers': 'Content-Type, Accept',
         }
-        
-        yield "JSON_START\n"
-        yield json.dumps(final_artifact)
-        yield "\nJSON_END\n"
+        return ('', 204, headers)
 
-    return Response(stream_process(), mimetype='text/plain')
+    req_json = request.get_json(silent=True) or {}
+    structures = req_json.get('structures', []) # 02_structure.json list
+    source_lines = req_json.get('source_lines', []) # 01_source_lines_enriched.json list
+    program_id = req_json.get('program_id', 'UNKNOWN')
 
-async def call_worker(session, url, payload, tag):
-    try:
-        # Local testing mock: if URL is localhost and not running, self-call?
-        # No, we assume deployed or test harness.
-        async with session.post(url, json=payload) as resp:
-            if resp.status != 200:
-                txt = await resp.text()
-                return {'error': f"{tag}: {resp.status} - {txt}"}
-            return await resp.json()
-    except Exception as e:
-        return {'error': f"{tag}: {e}"}
+    # Only used in 'http' worker mode
+    worker_url = os.environ.get('WORKER_URL', 'http://localhost:8080')
+
+    paragraph_names = [s['name'] for s in structures if s['type'] in ('PARAGRAPH', 'SECTION')]
+    structure_lookup = {s['name']: s['section_id'] for s in structures}
+
+    fingerprint = program_fingerprint(source_lines)
+    index = get_program_index(program_id, source_lines, fingerprint)
+
+    def stream_events():
+        yield progress(f"--- Fused Orchestrator Started for {program_id} ---")
+        yield progress(f"Structures: {len(structures)}, Lines: {len(source_lines)}")
+        yield progress(f"Worker Mode: {WORKER_MODE}" + (f" ({worker_url})" if WORKER_MODE == 'http' else f" (pool {WORKER_POOL_SIZE})"))
+
+        active_structure_ids = set(index.structure_ids())
+        target_structures = [s for s in structures if s['section_id'] in active_structure_ids]
+
+        policy = get_policy(MODEL_NAME)
+        tiers = [route(fused_structure_features(index, s['section_id']), policy) for s in target_structures]
+        cost_model = CostModel('agent4_fused')
+        batches, batch_costs, packed_predictions = plan_batches(index, target_structures, cost_model, tiers)
+        yield progress(f"Dispatching {len(batches)} fused worker calls for {len(target_structures)} structures (budget {BATCH_TOKEN_BUDGET} tokens).")
+        if batches:
+            yield progress(schedule_summary(batch_costs, packed_predictions, cost_model))
+
+        def make_payload(batch):
+            return {
+                "mode": "fused",
+                "program_id": program_id,
+                "target_structure_ids": [s['section_id'] for s in batch],
+                "source_lines": source_lines,
+                "program_fingerprint": fingerprint,
+                "paragraphs": paragraph_names
+            }
+
+        try:
+            # Phase 1: extraction. Entity ids need every structure's candidates, so
+            # results are held (name-based) until the post-pass.
+            candidates = []
+            structure_results = []
+            tokens_saved = 0
+            routings = []
+            for batch, res in stream_async(dispatch_batches(worker_url, batches, batch_costs, make_payload, cost_model)):
+                if 'error' in res:
+                    yield error(res['error'], structures=[s['name'] for s in batch])
+                    continue
+                candidates.extend(res.get('entities', []))
+                if res.get('routing'):
+                    routings.append(res['routing'])
+                tokens_saved += (res.get('context_stats') or {}).get('tokens_saved', 0)
+                for struct in batch:
+                    struct_res = res.get('results', {}).get(struct['section_id'], {})
+                    structure_results.append((struct, struct_res))
+                    yield progress(f"  [Success] {struct['name']}: {len(struct_res.get('control_flow', []))} flows, "
+                                   f"{len(struct_res.get('line_references', []))} refs")
+            yield progress(f"Phase 1 Complete. Entity candidates: {len(candidates)}")
+
+            # Phase 2: deterministic post-pass
+            referenced_names = {r.get('target_entity_name') for _, struct_res in structure_results
+                                for r in struct_res.get('line_references', [])}
+            entities, entity_lookup = assemble_entities(program_id, candidates, referenced_names, index)
+            for entity in entities:
+                yield partial_result("entities", entity['entity_id'], [entity])
+            yield progress(f"Post-pass: {len(candidates)} candidates -> {len(entities)} entities.")
+
+            # Phase 3: map names to ids
+            flow_ids = set()
+            flow_counter = 0
+            ref_counter = 0
+            dropped_counter = 0
+            external_calls = []
+            for struct, struct_res in structure_results:
+                struct_control_flow, struct_line_references, unmapped, struct_external = map_structure_results(
+                    program_id, struct_res, structure_lookup,
+                    lambda name, line_number: resolve_reference(entity_lookup, name, line_number), flow_ids)
+                external_calls.extend(struct_external)
+                flow_counter += len(struct_control_flow)
+                ref_counter += len(struct_line_references)
+                dropped = struct_res.get('dropped_references', []) + unmapped
+                if dropped:
+                    dropped_counter += len(dropped)
+                    yield progress(dropped_summary(dropped, struct['name']))
+                if struct_control_flow:
+                    yield partial_result("control_flow", struct['section_id'], struct_control_flow, structure=struct['name'])
+                if struct_line_references:
+                    yield partial_result("line_references", struct['section_id'], struct_line_references, structure=struct['name'])
+
+            yield progress(f"Aggregation Complete. Entities: {len(entities)}, Flows: {flow_counter}, Refs: {ref_counter}")
+            if dropped_counter:
+                yield progress(f"Items dropped (invalid or unmapped): {dropped_counter}")
+            if external_calls:
+                yield progress(external_calls_summary(external_calls))
+            if tokens_saved:
+                yield progress(f"Context trimming saved ~{tokens_saved} prompt tokens.")
+            if routings:
+                yield progress(routing_summary(routings, policy))
+
+            calls, predicted_total, actual_total, mean_error = cost_model.error_summary()
+            if calls:
+                yield progress(f"Cost model: {calls} calls, predicted {predicted_total:.0f}s vs actual {actual_total:.0f}s (mean error {mean_error:.1f}s).")
+                cost_model.save()
+
+        except Exception as e:
+            yield error(str(e), fatal=True)
+            return
+
+        yield summary(
+            program_id=program_id,
+            metadata={
+                "total_entities": len(entities),
+                "generated_at": datetime.datetime.now().isoformat(),
+                "mode": "fused"
+            },
+            counts={
+                "entities": len(entities),
+                "control_flow": flow_counter,
+                "line_references": ref_counter,
+                "dropped": dropped_counter,
+                "external_calls": len(external_calls)
+            }
+        )
+
+    layout = ["program_id", "entities", "metadata", "control_flow", "line_references"]
+    if wants_ndjson(request, req_json):
+        return Response(render_ndjson(stream_events()), mimetype=NDJSON_MIMETYPE)
+    return Response(render_text(stream_events(), layout), mimetype='text/plain')
+
+def plan_batches(index, structures, cost_model, groups=None):
+    """
+    Packs structures into worker calls under the token budget and orders the calls
+    longest-predicted-first, so the most expensive ones start before the concurrency
+    limit fills. Returns (batches, batch_costs, packed_predictions): batch_costs[i] is
+    (lines, tokens, predicted seconds) of batches[i]; packed_predictions is the
+    prediction per call in packing order, for comparison.
+    groups (optional, index-aligned with structures): only structures of the same
+    group share a call, e.g. the routing tier.
+    """
+    costs = [estimate_tokens(index.structure_text(s['section_id'])) for s in structures]
+    groups = groups or [0] * len(structures)
+    index_batches = []
+    for group in sorted(set(groups)):
+        members = [i for i in range(len(structures)) if groups[i] == group]
+        index_batches.extend([members[k] for k in b] for b in pack_structures([costs[i] for i in members]))
+    batch_lines = [sum(index.line_count(structures[i]['section_id']) for i in b) for b in index_batches]
+    batch_tokens = [sum(costs[i] for i in b) for b in index_batches]
+    predicted = [cost_model.predict(l, t) for l, t in zip(batch_lines, batch_tokens)]
+    order = lpt_order(predicted)
+    batches = [[structures[i] for i in index_batches[j]] for j in order]
+    batch_costs = [(batch_lines[j], batch_tokens[j], predicted[j]) for j in order]
+    return batches, batch_costs, predicted
+
+def schedule_summary(batch_costs, packed_predictions, cost_model, concurrency=WORKER_CONCURRENCY):
+    return (f"Scheduling: longest first, predicted makespan ~{simulated_makespan([c[2] for c in batch_costs], concurrency):.0f}s "
+            f"(structure order ~{simulated_makespan(packed_predictions, concurrency):.0f}s, "
+            f"{'calibrated' if cost_model.calibrated else 'default'} cost model).")
+
+def dispatch_batches(worker_url, batches, batch_costs, make_payload, cost_model, concurrency=WORKER_CONCURRENCY):
+    """
+    Returns an async generator factory (for stream_async) that dispatches one worker
+    call per batch and yields (batch, result) as each completes. How long the
+    worker ran on each successful call is recorded on the cost model.
+    """
+    async def process_structures():
+        sem = asyncio.Semaphore(concurrency) # Concurrency limit
+
+        async def bound_call(session, batch, batch_cost):
+            payload = make_payload(batch)
+            tag = f"Structs [{', '.join(s['name'] for s in batch)}]"
+            async with sem:
+                res, seconds = await dispatch_worker_timed(session, worker_url, payload, tag)
+                if 'error' not in res:
+                    lines, tokens, predicted_seconds = batch_cost
+                    cost_model.record(lines, tokens, predicted_seconds, seconds)
+                return batch, res
+
+        if not batches:
+            return
+        async with aiohttp.ClientSession() as session:
+            # Tasks queue on the semaphore in creation order, i.e. longest first
+            tasks = [asyncio.create_task(bound_call(session, batch, cost))
+                     for batch, cost in zip(batches, batch_costs)]
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+
+    return process_structures
+
+def dropped_summary(items, structure_name=None, limit=10):
+    """One log line for dropped items: line:name (reason)."""
+    shown = '; '.join(f"{i.get('line_number')}:{i.get('target_entity_name') or i.get('target_structure_name')} ({i.get('reason')})"
+                      for i in items[:limit])
+    return "    [Dropped] " + (f"{structure_name}: " if structure_name else "") + shown + (" ..." if len(items) > limit else "")
+
+def external_calls_summary(external_calls, limit=10):
+    """One log line for the other programs called: names and call counts."""
+    counts = {}
+    for f in external_calls:
+        counts[f.get('target_structure_name')] = counts.get(f.get('target_structure_name'), 0) + 1
+    shown = ', '.join(f"{name} ({n})" for name, n in sorted(counts.items())[:limit])
+    return (f"External program calls (not structure flows): {len(external_calls)} - {shown}"
+            + (" ..." if len(counts) > limit else ""))
+
+def map_structure_results(program_id, struct_res, structure_lookup, resolve_entity, flow_ids):
+    """
+    Maps one structure's name-based worker output to artifact edges.
+    resolve_entity(name, line_number) returns the entity id or None; flow_ids is
+    shared across structures so flow ids stay unique.
+    Returns (control_flow, line_references, dropped, external_calls); dropped holds
+    the items whose target could not be mapped, with a reason. CALLs of other
+    programs have no structure to point at and go to external_calls instead.
+    """
+    control_flow = []
+    line_references = []
+    dropped = []
+    external_calls = []
+
+    for f in struct_res.get('control_flow', []):
+        target_name = f.get('target_structure_name')
+        line_num = f.get('line_number')
+        source_line_id = f"{program_id}_{line_num}"
+
+        target_id = structure_lookup.get(target_name)
+        if target_id:
+            # PERFORM ... THRU and GO TO ... DEPENDING ON give several edges per line
+            flow_id = f"flow_{source_line_id}"
+            if flow_id in flow_ids:
+                flow_id = f"flow_{source_line_id}_{target_name}"
+            flow_ids.add(flow_id)
+            control_flow.append({
+                "flow_id": flow_id,
+                "source_line_id": source_line_id,
+                "target_structure_id": target_id,
+                "type": f['type']
+            })
+        elif f.get('type') == 'CALL':
+            external_calls.append(f)
+        else:
+            dropped.append(dict(f, reason=f"no structure named '{target_name}'"))
+
+    for r in struct_res.get('line_references', []):
+        target_name = r.get('target_entity_name')
+        line_num = r.get('line_number')
+        source_line_id = f"{program_id}_{line_num}"
+
+        target_id = resolve_entity(target_name, line_num)
+        if target_id:
+            line_references.append({
+                "reference_id": f"ref_{source_line_id}_{target_name}",
+                "source_line_id": source_line_id,
+                "target_entity_id": target_id,
+                "usage_type": r['usage_type']
+            })
+        else:
+            dropped.append(dict(r, reason=f"no entity id for '{target_name}'"))
+
+    return control_flow, line_references, dropped, external_calls
+
+async def dispatch_worker(session, url, payload, tag):
+    """Calls this function's worker over HTTP or in-process (see worker_dispatch.py)."""
+    return await worker_dispatch.dispatch_worker(session, url, run_worker, payload, tag)
+
+async def dispatch_worker_timed(session, url, payload, tag):
+    """dispatch_worker, also returning how long the worker ran (see worker_dispatch.py)."""
+    return await worker_dispatch.dispatch_worker_timed(session, url, run_worker, payload, tag)
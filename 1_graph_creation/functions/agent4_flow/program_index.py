@@ -0,0 +1,77 @@
+"""
+Indexed program representation for the flow worker.
+
+Built once per program and cached across requests: lines sorted by number, a
+pre-rendered "N | content" text buffer with per-line offsets, and
+structure_id -> line index ranges. Target lines and text are slices of these,
+so a request no longer scans or re-renders the whole program.
+"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+PROGRAM_INDEX_CACHE_SIZE = int(os.environ.get("PROGRAM_INDEX_CACHE_SIZE", "8"))
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def program_fingerprint(source_lines):
+    """Content fingerprint of a program's lines (orchestrators send it so workers can skip hashing)."""
+    h = hashlib.sha1()
+    for line in source_lines:
+        h.update(f"{line.get('line_number')}|{line.get('structure_id')}|{line.get('content', '')}\n".encode())
+    return h.hexdigest()
+
+class ProgramIndex:
+    def __init__(self, source_lines):
+        self.lines = sorted(source_lines, key=lambda l: l.get('line_number') or 0)
+
+        rendered = [f"{l.get('line_number')} | {l.get('content', '')}\n" for l in self.lines]
+        self.text = "".join(rendered)
+        self.offsets = [0]
+        for chunk in rendered:
+            self.offsets.append(self.offsets[-1] + len(chunk))
+
+        # structure_id -> [(start, end)] contiguous runs of line indexes (end exclusive)
+        self.ranges = {}
+        run_start = 0
+        for i in range(1, len(self.lines) + 1):
+            if i == len(self.lines) or self.lines[i].get('structure_id') != self.lines[run_start].get('structure_id'):
+                sid = self.lines[run_start].get('structure_id')
+                if sid:
+                    self.ranges.setdefault(sid, []).append((run_start, i))
+                run_start = i
+
+    def structure_ids(self):
+        return list(self.ranges.keys())
+
+    def structure_lines(self, structure_id):
+        lines = []
+        for start, end in self.ranges.get(structure_id, ()):
+            lines.extend(self.lines[start:end])
+        return lines
+
+    def structure_text(self, structure_id):
+        """Rendered "N | content" text of a structure, sliced from the shared buffer."""
+        return "".join(self.text[self.offsets[start]:self.offsets[end]]
+                       for start, end in self.ranges.get(structure_id, ()))
+
+    def line_count(self, structure_id):
+        return sum(end - start for start, end in self.ranges.get(structure_id, ()))
+
+def get_program_index(program_id, source_lines, fingerprint=None):
+    """Returns the cached index for this program version, building it on a miss."""
+    key = (program_id, fingerprint or program_fingerprint(source_lines))
+    with _cache_lock:
+        index = _cache.get(key)
+        if index is not None:
+            _cache.move_to_end(key)
+            return index
+
+    index = ProgramIndex(source_lines)
+    with _cache_lock:
+        _cache[key] = index
+        while len(_cache) > PROGRAM_INDEX_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return index
@@ -0,0 +1,199 @@
+"""
+Deterministic validation of worker output.
+
+Line references from the model are checked before they are accepted:
+  - line range:  the line is one of the target structure's code lines
+  - membership:  the name is a known entity (case-insensitive; the known
+                 spelling is restored) and occurs on that line
+  - consistency: the usage_type fits the statement on the line, per the
+                 prompt's rules (OPENS needs OPEN, an OPEN statement's
+                 operands are OPENS not READS, DECLARATION only before the
+                 PROCEDURE DIVISION, ...). Statements are followed across
+                 lines, so a continuation line belongs to the verb above it.
+Invalid items come back with a reason, so the worker can re-ask about just
+those items and report whatever is still invalid instead of dropping it silently.
+"""
+from control_flow_extractor import tokenize
+from context_assembler import LEVEL_RE
+
+DECLARATION_WORDS = ('SELECT', 'FD', 'SD')
+# usage_type -> statement word the line must contain
+REQUIRED_WORD = {'OPENS': 'OPEN', 'CLOSES': 'CLOSE', 'WRITES': 'WRITE'}
+# statement verb -> the only usage_type its operands can have
+STATEMENT_USAGE = {'OPEN': 'OPENS', 'CLOSE': 'CLOSES'}
+# Words that start a statement; operands up to the next one (or a period / END-x) belong to it
+STATEMENT_VERBS = {
+    'ACCEPT', 'ADD', 'CALL', 'CANCEL', 'CLOSE', 'COMPUTE', 'CONTINUE', 'DELETE', 'DISPLAY', 'DIVIDE',
+    'ELSE', 'EVALUATE', 'EXEC', 'EXIT', 'GO', 'GOBACK', 'IF', 'INITIALIZE', 'INSPECT', 'MERGE', 'MOVE',
+    'MULTIPLY', 'OPEN', 'PERFORM', 'READ', 'RELEASE', 'RETURN', 'REWRITE', 'SEARCH', 'SET', 'SORT',
+    'START', 'STOP', 'STRING', 'SUBTRACT', 'UNSTRING', 'WHEN', 'WRITE',
+}
+
+def line_words(line):
+    """Upper-cased non-literal words of one line, in order."""
+    return [tok for tok, _, is_literal in tokenize([line]) if not is_literal]
+
+def is_declaration(words, level_allowed=True):
+    """
+    A data description or file entry. A leading number is a level only where
+    levels can occur (level_allowed); elsewhere it is a literal continuing a
+    statement, e.g. the 05 of a MOVE split over two lines.
+    """
+    if not words:
+        return False
+    return words[0] in DECLARATION_WORDS or (level_allowed and bool(LEVEL_RE.match(words[0])))
+
+def statement_context(lines):
+    """
+    Follows statements across lines. Returns {line_number: (continues, [(word, verb)])}
+    where continues says a sentence was still open when the line began and verb
+    is the statement each word belongs to (None outside any statement).
+    """
+    context = {}
+    verb, open_sentence = None, False
+    for line in sorted(lines, key=lambda l: l.get('line_number')):
+        continues = open_sentence
+        words = []
+        for word in line_words(line):
+            if word == '.':
+                verb, open_sentence = None, False
+                continue
+            open_sentence = True
+            if word in STATEMENT_VERBS:
+                verb = word
+            elif word.startswith('END-'):
+                verb = None
+            words.append((word, verb))
+        context[line.get('line_number')] = (continues, words)
+    return context
+
+def procedure_division_start(lines):
+    """Line number of the PROCEDURE DIVISION header, or None."""
+    for line in lines:
+        if line.get('type') in ('COMMENT', 'BLANK'):
+            continue
+        words = line_words(line)
+        if words[:2] == ['PROCEDURE', 'DIVISION']:
+            return line.get('line_number')
+    return None
+
+def get_procedure_start(index):
+    """procedure_division_start for a program index, cached on it."""
+    if not hasattr(index, '_procedure_start'):
+        index._procedure_start = procedure_division_start(index.lines)
+    return index._procedure_start
+
+class ReferenceValidator:
+    """Validates name-based line references against the target lines and the known entities."""
+
+    def __init__(self, target_lines, entity_names, usage_types, procedure_start=None):
+        self.lines = {l.get('line_number'): l for l in target_lines if l.get('type') not in ('COMMENT', 'BLANK')}
+        self.names = {}
+        for name in entity_names:
+            self.names.setdefault(name.strip().upper(), name)
+        self.usage_types = set(usage_types)
+        self.procedure_start = procedure_start
+        self._words = {}
+        self._context = None
+
+    def words(self, line_number):
+        if line_number not in self._words:
+            self._words[line_number] = line_words(self.lines[line_number])
+        return self._words[line_number]
+
+    def context(self, line_number):
+        if self._context is None:
+            self._context = statement_context(self.lines.values())
+        return self._context[line_number]
+
+    def verbs_of(self, line_number, word):
+        """Statements the word's occurrences on the line belong to."""
+        return {verb for w, verb in self.context(line_number)[1] if w == word}
+
+    def levels_allowed(self, line_number):
+        """Whether a leading number on the line can be a level number."""
+        if self.procedure_start is not None:
+            return line_number < self.procedure_start
+        return not self.context(line_number)[0]
+
+    def check(self, ref):
+        """Returns (ref with the known name spelling, None) if valid, else (ref, reason)."""
+        line_number = ref.get('line_number')
+        name = (ref.get('target_entity_name') or '').strip()
+        usage = ref.get('usage_type')
+
+        if line_number not in self.lines:
+            return ref, f"line {line_number} is not a code line of the target"
+        known = self.names.get(name.upper())
+        if known is None:
+            return ref, f"'{name}' is not a known entity"
+        ref = dict(ref, target_entity_name=known)
+        words = self.words(line_number)
+        # Disambiguated names (FD-CUST-DATA_L69) occur in the code without their suffix
+        word = known.upper().split('_')[0]
+        if word not in words:
+            return ref, f"'{known}' does not occur on line {line_number}"
+        if usage not in self.usage_types:
+            return ref, f"unknown usage_type {usage}"
+
+        if usage == 'DECLARATION' and not self.in_data_division(line_number, words):
+            return ref, "DECLARATION in the PROCEDURE DIVISION"
+        if is_declaration(words, self.levels_allowed(line_number)) and usage != 'DECLARATION':
+            return ref, f"{usage} on a declaration line"
+
+        # The statement(s) the name is an operand of, which may have started on an earlier line
+        verbs = self.verbs_of(line_number, word)
+        if usage in REQUIRED_WORD and REQUIRED_WORD[usage] not in verbs:
+            return ref, f"{usage} outside a {REQUIRED_WORD[usage]} statement"
+        if len(verbs) == 1:
+            verb = next(iter(verbs))
+            if verb in STATEMENT_USAGE and usage != STATEMENT_USAGE[verb]:
+                return ref, f"{usage} on a {verb} statement (should be {STATEMENT_USAGE[verb]})"
+        return ref, None
+
+    def in_data_division(self, line_number, words):
+        if self.procedure_start is None:
+            return is_declaration(words, self.levels_allowed(line_number)) or words[:1] == ['COPY']
+        return line_number < self.procedure_start
+
+    def validate(self, refs):
+        """Splits refs into (valid, invalid); invalid items carry a 'reason'. Duplicates are dropped."""
+        valid, invalid = [], []
+        seen = set()
+        for ref in refs:
+            ref, reason = self.check(ref)
+            if reason:
+                invalid.append(dict(ref, reason=reason))
+                continue
+            key = (ref['line_number'], ref['target_entity_name'].upper())
+            if key not in seen:
+                seen.add(key)
+                valid.append(ref)
+        return valid, invalid
+
+    def names_on_line(self, line_number):
+        """Known entity names occurring on a line (hints for the re-ask prompt)."""
+        if line_number not in self.lines:
+            return []
+        return [self.names[w] for w in dict.fromkeys(self.words(line_number)) if w in self.names]
+
+def validate_control_flow(flows, target_lines, paragraph_names):
+    """
+    Model-produced control flow: the line is in the target and the target is a
+    known paragraph. A CALL naming no paragraph calls another program and is kept
+    as it is (the orchestrator reports it as an external call).
+    """
+    lines = {l.get('line_number') for l in target_lines}
+    names = {n.upper(): n for n in paragraph_names}
+    valid, invalid = [], []
+    for f in flows:
+        target = (f.get('target_structure_name') or '').strip().upper()
+        if f.get('line_number') not in lines:
+            invalid.append(dict(f, reason=f"line {f.get('line_number')} is not in the target"))
+        elif target not in names and f.get('type') == 'CALL':
+            valid.append(f)
+        elif target not in names:
+            invalid.append(dict(f, reason=f"'{f.get('target_structure_name')}' is not a known paragraph"))
+        else:
+            valid.append(dict(f, target_structure_name=names[target]))
+    return valid, invalid
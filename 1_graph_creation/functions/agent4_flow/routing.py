@@ -0,0 +1,110 @@
+"""
+Complexity-based model routing for worker calls.
+
+Most structures are small (a CLOSE plus a status check), so sending every call
+to the top model at HIGH thinking wastes latency. Each call is routed by its
+complexity features:
+  - lines:      code lines in the target (comments/blank lines excluded)
+  - nesting:    deepest IF/EVALUATE nesting
+  - candidates: candidate entity references the model has to handle
+to the first tier of the policy whose limits it fits. Features are per structure;
+a batched call takes the maximum over its structures (its hardest member), and
+the orchestrator packs each tier's structures separately so small ones share
+cheap calls. The last tier has no limits and catches everything else.
+
+A call is re-asked one tier up when its output is empty or unparseable, leaves
+too many pre-scan candidates unclassified, or has too many references failing
+the reference validator. Invalid references left on the final tier go through
+the usual validator re-ask.
+
+The policy is a JSON list of tiers, from ROUTING_POLICY (inline JSON or a path
+to a JSON file). Unset means DEFAULT_POLICY; 'off' means a single tier, i.e.
+every call on the top model at HIGH as before.
+"""
+import hashlib
+import json
+import os
+
+from control_flow_extractor import tokenize
+
+DEFAULT_POLICY = [
+    {"name": "small", "max_lines": 15, "max_nesting": 1, "max_candidates": 12,
+     "model": "gemini-3-flash-preview", "thinking_level": "LOW"},
+    {"name": "medium", "max_lines": 80, "max_nesting": 3, "max_candidates": 60,
+     "model": "gemini-3-pro-preview", "thinking_level": "LOW"},
+    {"name": "large", "model": "gemini-3-pro-preview", "thinking_level": "HIGH"},
+]
+LIMITS = (("lines", "max_lines"), ("nesting", "max_nesting"), ("candidates", "max_candidates"))
+
+_policy = None
+
+def load_policy(spec=None, default_model=None):
+    """Parses a policy spec (JSON text, file path, 'off' or None) into a list of tiers."""
+    spec = os.environ.get("ROUTING_POLICY") if spec is None else spec
+    top = dict(DEFAULT_POLICY[-1], **({"model": default_model} if default_model else {}))
+    if not spec:
+        return DEFAULT_POLICY[:-1] + [top]
+    if spec == 'off':
+        return [top]
+    if not spec.lstrip().startswith('['):
+        with open(spec, 'r') as f:
+            spec = f.read()
+    policy = json.loads(spec)
+    if not policy or any('model' not in t or 'thinking_level' not in t for t in policy):
+        raise ValueError("ROUTING_POLICY: every tier needs 'model' and 'thinking_level'")
+    for i, tier in enumerate(policy):
+        tier.setdefault('name', f"tier{i}")
+    return policy
+
+def get_policy(default_model=None):
+    """Process-wide policy, loaded once from the environment."""
+    global _policy
+    if _policy is None:
+        _policy = load_policy(default_model=default_model)
+    return _policy
+
+def policy_key(policy):
+    """Short fingerprint of a policy, for cache keys."""
+    return hashlib.sha1(json.dumps(policy, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+def nesting_depth(lines):
+    """Deepest IF/EVALUATE nesting. A period ends the sentence and closes every open scope."""
+    depth = deepest = 0
+    for tok, _, is_literal in tokenize(lines):
+        if is_literal:
+            continue
+        if tok in ('IF', 'EVALUATE'):
+            depth += 1
+            deepest = max(deepest, depth)
+        elif tok in ('END-IF', 'END-EVALUATE'):
+            depth = max(depth - 1, 0)
+        elif tok == '.':
+            depth = 0
+    return deepest
+
+def complexity_features(lines, candidate_count):
+    code_lines = [l for l in lines if l.get('type') not in ('COMMENT', 'BLANK')]
+    return {"lines": len(code_lines), "nesting": nesting_depth(code_lines), "candidates": candidate_count}
+
+def combined_features(features_list):
+    """Features of a batched call: the per-feature maximum over its structures."""
+    return {feature: max((f[feature] for f in features_list), default=0) for feature, _ in LIMITS}
+
+def route(features, policy):
+    """Index of the first tier whose limits all hold (missing limits are unbounded)."""
+    for i, tier in enumerate(policy):
+        if all(tier.get(limit) is None or features[feature] <= tier[limit] for feature, limit in LIMITS):
+            return i
+    return len(policy) - 1
+
+def escalate(policy, tier_index):
+    """Next tier up, or None when already at the top."""
+    return tier_index + 1 if tier_index + 1 < len(policy) else None
+
+def routing_summary(routings, policy):
+    """One log line from the workers' 'routing' records: calls per tier, escalations."""
+    counts = {tier['name']: 0 for tier in policy}
+    for r in routings:
+        counts[r['tier']] = counts.get(r['tier'], 0) + 1
+    escalations = sum(r.get('escalations', 0) for r in routings)
+    return "Routing: " + ", ".join(f"{name} {n}" for name, n in counts.items()) + f" ({escalations} escalations)"
@@ -0,0 +1,158 @@
+"""
+Transitive call closure (the CallClosure table, REACHES edges in the graph).
+For every structure of a program, each structure reachable over PERFORM/GO TO
+flows, with the shortest number of hops (depth) and the line in the source
+structure where the first hop of that path is made. A trace like
+MAIN-PARA -[:CALLS]-> ... -[:CALLS]-> sub becomes one REACHES lookup.
+
+A flow reaches more than its target structure: PERFORM of a SECTION runs the
+paragraphs in it, and PERFORM A THRU B runs every procedure from A to B, so
+those are reached at the same depth (CodeStructure parents and line ranges).
+
+Rows are derived from ControlFlow, SourceCodeLines.structure_id and
+CodeStructure, so they are
+written with the graph tables (delta mode then only touches the closure rows
+that changed). refresh_closure recomputes a program already in the store, for
+writers that never hold the whole program (the NDJSON stream).
+"""
+import os
+import re
+from spanner_types import string_param_types
+from delta_writer import refresh_table
+from key_schemes import KEY_SCHEME
+
+# Compute CallClosure with every graph write
+CALL_CLOSURE = os.environ.get("CALL_CLOSURE", "true").lower() == "true"
+# Flow types followed; CALL leaves the program
+CLOSURE_FLOW_TYPES = tuple(os.environ.get("CLOSURE_FLOW_TYPES", "PERFORM,GO_TO").split(','))
+
+CALL_EDGES_SQL = """
+SELECT l.structure_id, l.line_id, l.line_number, f.target_structure_id, f.type, l.content
+FROM ControlFlow f JOIN SourceCodeLines l ON f.source_line_id = l.line_id
+WHERE l.program_id = @program_id
+"""
+
+STRUCTURES_SQL = """
+SELECT structure_id, parent_structure_id, type, start_line_number, end_line_number
+FROM CodeStructure WHERE program_id = @program_id
+"""
+
+THRU_RE = re.compile(r'\b(THRU|THROUGH)\b', re.IGNORECASE)
+
+def is_thru(content):
+    return bool(content and THRU_RE.search(content))
+
+def call_edges(tables):
+    """(source_structure_id, line_id, line_number, target_structure_id, type, thru) per flow in tables."""
+    lines = {l['line_id']: l for l in tables.get('SourceCodeLines', [])}
+    edges = []
+    for f in tables.get('ControlFlow', []):
+        line = lines.get(f['source_line_id'])
+        if line:
+            edges.append((line['structure_id'], line['line_id'], line['line_number'],
+                          f['target_structure_id'], f['type'], is_thru(line.get('content'))))
+    return edges
+
+def read_call_edges(database, program_id):
+    with database.snapshot() as snapshot:
+        rows = snapshot.execute_sql(CALL_EDGES_SQL, params={'program_id': program_id},
+                                    param_types=string_param_types('program_id'))
+        return [tuple(row[:5]) + (is_thru(row[5]),) for row in rows]
+
+def read_structures(database, program_id):
+    with database.snapshot() as snapshot:
+        rows = snapshot.execute_sql(STRUCTURES_SQL, params={'program_id': program_id},
+                                    param_types=string_param_types('program_id'))
+        columns = ('structure_id', 'parent_structure_id', 'type', 'start_line_number', 'end_line_number')
+        return [dict(zip(columns, row)) for row in rows]
+
+def procedure_spans(structures):
+    """structure_id -> (start_line, end_line, parent_structure_id) of the sections and paragraphs."""
+    return {s['structure_id']: (s['start_line_number'], s['end_line_number'], s.get('parent_structure_id'))
+            for s in structures
+            if s.get('type') != 'DIVISION' and s.get('start_line_number') is not None
+            and s.get('end_line_number') is not None}
+
+def within(spans, first, last):
+    """Procedures lying between the start of first and the end of last."""
+    start, end = spans[first][0], spans[last][1]
+    return {sid for sid, (s, e, _) in spans.items() if start <= s and e <= end}
+
+def expand_targets(targets, spans, thru):
+    """
+    Every structure a line's flows run: PERFORM A THRU B covers A to B (in either
+    order of the two edges), and a section brings the paragraphs inside it.
+    """
+    reached = set(targets)
+    known = [t for t in targets if t in spans]
+    if thru and len(known) == 2:
+        first, last = sorted(known, key=lambda t: spans[t][:2])
+        reached |= within(spans, first, last)
+    for target in list(reached):
+        if target in spans:
+            reached |= within(spans, target, target)
+            reached |= {sid for sid, (_, _, parent) in spans.items() if parent == target}
+    return reached
+
+def closure_rows(program_id, edges, structures=(), flow_types=CLOSURE_FLOW_TYPES):
+    """
+    CallClosure rows from the call edges, breadth first from every calling
+    structure. On ties at the same depth the lowest first-call line wins.
+    A structure reaching itself (recursion) gets a row too. structures
+    (CodeStructure rows) expand section and THRU targets; without them only
+    the flow targets themselves are reached.
+    """
+    spans = procedure_spans(structures)
+    line_targets = {} # (source, line_number, line_id) -> ([PERFORM targets], [other targets], thru)
+    for source, line_id, line_number, target, flow_type, thru in edges:
+        if source is None or flow_type not in flow_types:
+            continue
+        performs, others, _ = line_targets.setdefault((source, line_number, line_id), ([], [], thru))
+        (performs if flow_type == 'PERFORM' else others).append(target)
+
+    calls = {} # source -> {target: (line_number, line_id)} (lowest calling line)
+    for (source, line_number, line_id), (performs, others, thru) in line_targets.items():
+        reached = expand_targets(performs, spans, thru) | expand_targets(others, spans, False)
+        targets = calls.setdefault(source, {})
+        for target in reached:
+            targets[target] = min(targets.get(target, (line_number, line_id)), (line_number, line_id))
+
+    rows = []
+    for source in sorted(calls):
+        reached = {}
+        frontier = dict(calls[source]) # target -> first-call line
+        depth = 1
+        while frontier:
+            for target, first in frontier.items():
+                reached[target] = (depth, first)
+            following = {}
+            for target, first in frontier.items():
+                for nxt in calls.get(target, {}):
+                    if nxt not in reached:
+                        following[nxt] = min(following.get(nxt, first), first)
+            frontier = following
+            depth += 1
+
+        for target in sorted(reached):
+            depth, (line_number, line_id) = reached[target]
+            rows.append({
+                'closure_id': f"{source}->{target}",
+                'program_id': program_id,
+                'source_structure_id': source,
+                'target_structure_id': target,
+                'depth': depth,
+                'first_call_line_id': line_id,
+                'first_call_line_number': line_number,
+            })
+    return rows
+
+def refresh_closure(database, program_id, scheme=KEY_SCHEME):
+    """
+    Recomputes the program's closure from the stored flows and writes only the
+    rows that changed. Returns the insert/update/delete counts.
+    """
+    rows = closure_rows(program_id, read_call_edges(database, program_id), read_structures(database, program_id))
+    counts = refresh_table(database, program_id, 'CallClosure', rows, scheme)
+    print(f"[Closure] {program_id}: {len(rows)} rows ({counts['inserts']} inserts, "
+          f"{counts['updates']} updates, {counts['deletes']} deletes)")
+    return counts
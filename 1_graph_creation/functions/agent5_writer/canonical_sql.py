@@ -0,0 +1,338 @@
+"""
+The canonical graph queries, as GQL for Spanner and as plain SQL for the
+embedded store. Each SQL query returns the same columns, in the same order, as
+its GQL counterpart. Edges map to joins:
+  CONTAINS_LINE  SourceCodeLines.structure_id = CodeStructure.structure_id
+  CONTAINS_CHILD CodeStructure.parent_structure_id = CodeStructure.structure_id
+  CALLS          ControlFlow (source_line_id -> target_structure_id)
+  REFERENCES     LineReferences (source_line_id -> target_entity_id)
+  REACHES        CallClosure (source_structure_id -> target_structure_id)
+  USES           StructureEntityUsage (structure_id -> entity_id)
+ARRAY_AGG results come back as comma-separated strings from SQLite.
+"""
+
+# From canonical_queries.txt, verify_canonical.py and the test_scripts query scripts
+CANONICAL_GQL = {
+    # Step 0: SOURCE CODE CONTEXT
+    'source_code': """
+    GRAPH CobolLineGraph
+    MATCH (line:Line)
+    RETURN line.line_number AS Line_Number, line.content AS Source_Code
+    ORDER BY line.line_number
+    """,
+
+    # Step 1: DISCOVERY
+    'discovery': """
+    GRAPH CobolLineGraph
+    MATCH (div:Structure {type: 'DIVISION'})
+    OPTIONAL MATCH (div)-[:CONTAINS_CHILD]->(child:Structure)
+    RETURN div.name AS Division, child.name AS Content, child.type AS Type
+    ORDER BY div.start_line_number, child.start_line_number
+    """,
+
+    # Step 2: ASSET INVENTORY
+    'asset_inventory': """
+    GRAPH CobolLineGraph
+    MATCH (file:Entity {type: 'FILE'})
+    OPTIONAL MATCH (line:Line)-[ref:REFERENCES]->(file)
+    RETURN
+      file.name AS File_Name,
+      COUNTIF(ref.usage_type = 'READS') AS Read_Count,
+      COUNTIF(ref.usage_type = 'WRITES') AS Write_Count,
+      ARRAY_AGG(DISTINCT ref.usage_type) AS All_Operations
+    ORDER BY File_Name
+    """,
+
+    # Step 3: HIGH-LEVEL FLOW
+    'high_level_flow': """
+    GRAPH CobolLineGraph
+    MATCH (main:Structure {name: 'MAIN-PARA'})-[:CONTAINS_LINE]->(line:Line)-[:CALLS]->(sub:Structure)
+    RETURN DISTINCT sub.name AS Subroutine_Called
+    """,
+
+    # Step 4: DETAILED TRACE
+    'detailed_trace': """
+    GRAPH CobolLineGraph
+    MATCH (main:Structure {name: 'MAIN-PARA'})-[:CONTAINS_LINE]->(line:Line)
+    OPTIONAL MATCH (line)-[ref:REFERENCES]->(ref_entity:Entity)
+    OPTIONAL MATCH (line)-[:CALLS]->(sub:Structure)
+    OPTIONAL MATCH (sub)-[:CONTAINS_LINE]->(sub_line:Line)
+    OPTIONAL MATCH (sub_line)-[sub_ref:REFERENCES]->(sub_entity:Entity)
+    RETURN
+      line.line_number AS Main_Seq,
+      line.content AS Main_Code,
+      ref_entity.name AS Main_Ref_Entity,
+      ref_entity.type AS Main_Ref_EntType,
+      ref.usage_type AS Main_Ref_Op,
+      sub.name AS Called_Routine,
+      sub_line.content AS Sub_Code,
+      sub_entity.name AS Sub_Ref_Entity,
+      sub_entity.type AS Sub_Ref_EntType,
+      sub_ref.usage_type AS Sub_Ref_Op
+    ORDER BY Main_Seq, sub_line.line_number
+    """,
+
+    # Life of a Transaction (verify_canonical.py)
+    'policy_map': """
+    GRAPH CobolLineGraph
+    MATCH (main:Structure {name: 'MAIN-PARA'})-[:CONTAINS_LINE]->(call_line:Line)-[:CALLS]->(sub:Structure)
+    MATCH (sub)-[:CONTAINS_LINE]->(read_line:Line)-[:REFERENCES {usage_type: 'READS'}]->(entity:Entity)
+    MATCH (sub)-[:CONTAINS_LINE]->(update_line:Line)-[:REFERENCES {usage_type: 'UPDATES'}]->(status:Entity)
+    MATCH (main)-[:CONTAINS_LINE]->(decision_line:Line)-[:REFERENCES {usage_type: 'VALIDATES'}]->(status)
+    RETURN
+      call_line.line_number AS Sequence,
+      sub.name AS Routine,
+      entity.name AS Entity_Checked,
+      decision_line.content AS Logic_Gate
+    ORDER BY call_line.line_number
+    """,
+
+    # run_policy_map_query.py
+    'policy_map_detail': """
+    GRAPH CobolLineGraph
+    MATCH (main:Structure {name: 'MAIN-PARA'})-[:CONTAINS_LINE]->(call_line:Line)-[:CALLS]->(sub:Structure)
+    MATCH (main)-[:CONTAINS_LINE]->(decision_line:Line)-[:REFERENCES {usage_type: 'VALIDATES'}]->(status:Entity)
+    MATCH (sub)-[:CONTAINS_LINE]->(action_line:Line)-[ref:REFERENCES]->(entity:Entity)
+    RETURN
+      call_line.line_number AS Sequence,
+      sub.name AS Routine,
+      decision_line.content AS Logic_Gate,
+      action_line.content AS Source_Code,
+      ref.usage_type AS Operation,
+      entity.name AS Data_Object,
+      entity.type AS Entity_Type,
+      entity.description AS Description
+    ORDER BY Sequence, action_line.line_number
+    """,
+
+    # run_grand_logic_query.py
+    'grand_logic': """
+    GRAPH CobolLineGraph
+    MATCH (main:Structure {name: 'MAIN-PARA'})-[:CONTAINS_LINE]->(call_line:Line)-[:CALLS]->(sub:Structure)
+    MATCH (sub)-[:CONTAINS_LINE]->(action_line:Line)-[ref:REFERENCES]->(entity:Entity)
+    RETURN
+      call_line.line_number AS Sequence,
+      sub.name AS Routine,
+      action_line.content AS Source_Code,
+      ref.usage_type AS Operation,
+      entity.name AS Data_Object,
+      entity.type AS Object_Type,
+      entity.description AS Description
+    ORDER BY Sequence, action_line.line_number
+    """,
+
+    # Everything MAIN-PARA reaches, at any depth: one REACHES hop instead of a variable-length CALLS path
+    'call_closure': """
+    GRAPH CobolLineGraph
+    MATCH (main:Structure {name: 'MAIN-PARA'})-[r:REACHES]->(sub:Structure)
+    RETURN sub.name AS Routine, r.depth AS Depth, r.first_call_line_number AS First_Call_Line
+    ORDER BY Depth, Routine
+    """,
+
+    # Step 2 from the StructureEntityUsage rollup: one USES edge per structure and
+    # usage type instead of every REFERENCES edge
+    'asset_inventory_rollup': """
+    GRAPH CobolLineGraph
+    MATCH (file:Entity {type: 'FILE'})
+    OPTIONAL MATCH (:Structure)-[rollup:USES]->(file)
+    RETURN
+      file.name AS File_Name,
+      SUM(IF(rollup.usage_type = 'READS', rollup.reference_count, 0)) AS Read_Count,
+      SUM(IF(rollup.usage_type = 'WRITES', rollup.reference_count, 0)) AS Write_Count,
+      ARRAY_AGG(DISTINCT rollup.usage_type) AS All_Operations
+    ORDER BY File_Name
+    """,
+
+    # Files declared or opened but never read or written
+    'dead_files': """
+    GRAPH CobolLineGraph
+    MATCH (file:Entity {type: 'FILE'})
+    WHERE NOT EXISTS {
+      MATCH (:Structure)-[rollup:USES]->(file)
+      WHERE rollup.usage_type IN ('READS', 'WRITES')
+    }
+    RETURN file.name AS File_Name
+    ORDER BY File_Name
+    """,
+}
+
+CANONICAL_SQL = {
+    'source_code': """
+    SELECT line.line_number AS Line_Number, line.content AS Source_Code
+    FROM SourceCodeLines line
+    ORDER BY line.line_number
+    """,
+
+    'discovery': """
+    SELECT div.name AS Division, child.name AS Content, child.type AS Type
+    FROM CodeStructure div
+    LEFT JOIN CodeStructure child ON child.parent_structure_id = div.structure_id
+    WHERE div.type = 'DIVISION'
+    ORDER BY div.start_line_number, child.start_line_number
+    """,
+
+    'asset_inventory': """
+    SELECT
+      file.name AS File_Name,
+      COUNT(CASE WHEN ref.usage_type = 'READS' THEN 1 END) AS Read_Count,
+      COUNT(CASE WHEN ref.usage_type = 'WRITES' THEN 1 END) AS Write_Count,
+      GROUP_CONCAT(DISTINCT ref.usage_type) AS All_Operations
+    FROM DataEntities file
+    LEFT JOIN LineReferences ref ON ref.target_entity_id = file.entity_id
+    WHERE file.type = 'FILE'
+    GROUP BY file.entity_id, file.name
+    ORDER BY File_Name
+    """,
+
+    'high_level_flow': """
+    SELECT DISTINCT sub.name AS Subroutine_Called
+    FROM CodeStructure main
+    JOIN SourceCodeLines line ON line.structure_id = main.structure_id
+    JOIN ControlFlow calls ON calls.source_line_id = line.line_id
+    JOIN CodeStructure sub ON sub.structure_id = calls.target_structure_id
+    WHERE main.name = 'MAIN-PARA'
+    """,
+
+    'detailed_trace': """
+    SELECT
+      line.line_number AS Main_Seq,
+      line.content AS Main_Code,
+      ref_entity.name AS Main_Ref_Entity,
+      ref_entity.type AS Main_Ref_EntType,
+      ref.usage_type AS Main_Ref_Op,
+      sub.name AS Called_Routine,
+      sub_line.content AS Sub_Code,
+      sub_entity.name AS Sub_Ref_Entity,
+      sub_entity.type AS Sub_Ref_EntType,
+      sub_ref.usage_type AS Sub_Ref_Op
+    FROM CodeStructure main
+    JOIN SourceCodeLines line ON line.structure_id = main.structure_id
+    LEFT JOIN LineReferences ref ON ref.source_line_id = line.line_id
+    LEFT JOIN DataEntities ref_entity ON ref_entity.entity_id = ref.target_entity_id
+    LEFT JOIN ControlFlow calls ON calls.source_line_id = line.line_id
+    LEFT JOIN CodeStructure sub ON sub.structure_id = calls.target_structure_id
+    LEFT JOIN SourceCodeLines sub_line ON sub_line.structure_id = sub.structure_id
+    LEFT JOIN LineReferences sub_ref ON sub_ref.source_line_id = sub_line.line_id
+    LEFT JOIN DataEntities sub_entity ON sub_entity.entity_id = sub_ref.target_entity_id
+    WHERE main.name = 'MAIN-PARA'
+    ORDER BY Main_Seq, sub_line.line_number
+    """,
+
+    'policy_map': """
+    SELECT
+      call_line.line_number AS Sequence,
+      sub.name AS Routine,
+      entity.name AS Entity_Checked,
+      decision_line.content AS Logic_Gate
+    FROM CodeStructure main
+    JOIN SourceCodeLines call_line ON call_line.structure_id = main.structure_id
+    JOIN ControlFlow calls ON calls.source_line_id = call_line.line_id
+    JOIN CodeStructure sub ON sub.structure_id = calls.target_structure_id
+    JOIN SourceCodeLines read_line ON read_line.structure_id = sub.structure_id
+    JOIN LineReferences reads ON reads.source_line_id = read_line.line_id AND reads.usage_type = 'READS'
+    JOIN DataEntities entity ON entity.entity_id = reads.target_entity_id
+    JOIN SourceCodeLines update_line ON update_line.structure_id = sub.structure_id
+    JOIN LineReferences updates ON updates.source_line_id = update_line.line_id AND updates.usage_type = 'UPDATES'
+    JOIN SourceCodeLines decision_line ON decision_line.structure_id = main.structure_id
+    JOIN LineReferences validates ON validates.source_line_id = decision_line.line_id
+      AND validates.usage_type = 'VALIDATES' AND validates.target_entity_id = updates.target_entity_id
+    WHERE main.name = 'MAIN-PARA'
+    ORDER BY call_line.line_number
+    """,
+
+    'policy_map_detail': """
+    SELECT
+      call_line.line_number AS Sequence,
+      sub.name AS Routine,
+      decision_line.content AS Logic_Gate,
+      action_line.content AS Source_Code,
+      ref.usage_type AS Operation,
+      entity.name AS Data_Object,
+      entity.type AS Entity_Type,
+      entity.description AS Description
+    FROM CodeStructure main
+    JOIN SourceCodeLines call_line ON call_line.structure_id = main.structure_id
+    JOIN ControlFlow calls ON calls.source_line_id = call_line.line_id
+    JOIN CodeStructure sub ON sub.structure_id = calls.target_structure_id
+    JOIN SourceCodeLines decision_line ON decision_line.structure_id = main.structure_id
+    JOIN LineReferences validates ON validates.source_line_id = decision_line.line_id
+      AND validates.usage_type = 'VALIDATES'
+    JOIN SourceCodeLines action_line ON action_line.structure_id = sub.structure_id
+    JOIN LineReferences ref ON ref.source_line_id = action_line.line_id
+    JOIN DataEntities entity ON entity.entity_id = ref.target_entity_id
+    WHERE main.name = 'MAIN-PARA'
+    ORDER BY Sequence, action_line.line_number
+    """,
+
+    'grand_logic': """
+    SELECT
+      call_line.line_number AS Sequence,
+      sub.name AS Routine,
+      action_line.content AS Source_Code,
+      ref.usage_type AS Operation,
+      entity.name AS Data_Object,
+      entity.type AS Object_Type,
+      entity.description AS Description
+    FROM CodeStructure main
+    JOIN SourceCodeLines call_line ON call_line.structure_id = main.structure_id
+    JOIN ControlFlow calls ON calls.source_line_id = call_line.line_id
+    JOIN CodeStructure sub ON sub.structure_id = calls.target_structure_id
+    JOIN SourceCodeLines action_line ON action_line.structure_id = sub.structure_id
+    JOIN LineReferences ref ON ref.source_line_id = action_line.line_id
+    JOIN DataEntities entity ON entity.entity_id = ref.target_entity_id
+    WHERE main.name = 'MAIN-PARA'
+    ORDER BY Sequence, action_line.line_number
+    """,
+
+    # Variable-length CALLS from MAIN-PARA (GQL would need a quantified path);
+    # each routine once, at its shortest call depth. call_closure reads the
+    # same from the materialized CallClosure table (PERFORM/GO TO only).
+    'call_tree': """
+    WITH RECURSIVE reach(structure_id, depth, path) AS (
+      SELECT structure_id, 0, '/' || structure_id || '/'
+      FROM CodeStructure WHERE name = 'MAIN-PARA'
+      UNION ALL
+      SELECT calls.target_structure_id, reach.depth + 1, reach.path || calls.target_structure_id || '/'
+      FROM reach
+      JOIN SourceCodeLines line ON line.structure_id = reach.structure_id
+      JOIN ControlFlow calls ON calls.source_line_id = line.line_id
+      WHERE reach.depth < 20 AND instr(reach.path, '/' || calls.target_structure_id || '/') = 0
+    )
+    SELECT s.name AS Routine, MIN(reach.depth) AS Depth
+    FROM reach JOIN CodeStructure s ON s.structure_id = reach.structure_id
+    WHERE reach.depth > 0
+    GROUP BY s.structure_id, s.name
+    ORDER BY Depth, Routine
+    """,
+
+    'call_closure': """
+    SELECT sub.name AS Routine, r.depth AS Depth, r.first_call_line_number AS First_Call_Line
+    FROM CodeStructure main
+    JOIN CallClosure r ON r.source_structure_id = main.structure_id
+    JOIN CodeStructure sub ON sub.structure_id = r.target_structure_id
+    WHERE main.name = 'MAIN-PARA'
+    ORDER BY Depth, Routine
+    """,
+
+    'asset_inventory_rollup': """
+    SELECT
+      file.name AS File_Name,
+      COALESCE(SUM(CASE WHEN rollup.usage_type = 'READS' THEN rollup.reference_count END), 0) AS Read_Count,
+      COALESCE(SUM(CASE WHEN rollup.usage_type = 'WRITES' THEN rollup.reference_count END), 0) AS Write_Count,
+      GROUP_CONCAT(DISTINCT rollup.usage_type) AS All_Operations
+    FROM DataEntities file
+    LEFT JOIN StructureEntityUsage rollup ON rollup.entity_id = file.entity_id
+    WHERE file.type = 'FILE'
+    GROUP BY file.entity_id, file.name
+    ORDER BY File_Name
+    """,
+
+    'dead_files': """
+    SELECT file.name AS File_Name
+    FROM DataEntities file
+    WHERE file.type = 'FILE' AND NOT EXISTS (
+      SELECT 1 FROM StructureEntityUsage rollup
+      WHERE rollup.entity_id = file.entity_id AND rollup.usage_type IN ('READS', 'WRITES'))
+    ORDER BY File_Name
+    """,
+}
@@ -0,0 +1,215 @@
+"""
+Delta-aware graph writes for re-analyzed programs.
+The program's current rows are read in one multi-use snapshot (every query at
+the same timestamp) and hashed column by column. Only new and changed rows are
+upserted, and rows the new artifacts no longer contain are deleted, children
+first. Programs.artifact_hash records the artifacts last written, so an
+unchanged program is skipped without reading anything else.
+"""
+import json
+import time
+import hashlib
+import concurrent.futures
+from spanner_types import COMMIT_TIMESTAMP, string_param_types, key_set
+from mutation_writer import (write_tables, commit_batch, structure_depths, index_entries,
+                             MAX_MUTATIONS_PER_COMMIT, WRITE_WORKERS, COMMIT_TIMESTAMP_COLUMNS)
+from key_schemes import primary_key, apply_key_scheme, KEY_SCHEME
+
+# Compared columns per table (commit timestamps excluded), key column first
+TABLE_COLUMNS = {
+    'Programs': ['program_id', 'program_name', 'file_name', 'total_lines'],
+    'CodeStructure': ['structure_id', 'program_id', 'parent_structure_id', 'name', 'type',
+                      'start_line_number', 'end_line_number'],
+    'SourceCodeLines': ['line_id', 'program_id', 'structure_id', 'line_number', 'content', 'type'],
+    'DataEntities': ['entity_id', 'program_id', 'name', 'type', 'definition_line_id', 'description'],
+    'LineReferences': ['reference_id', 'source_line_id', 'target_entity_id', 'usage_type'],
+    'ControlFlow': ['flow_id', 'source_line_id', 'target_structure_id', 'type'],
+    'CallClosure': ['closure_id', 'program_id', 'source_structure_id', 'target_structure_id', 'depth',
+                    'first_call_line_id', 'first_call_line_number'],
+    'StructureEntityUsage': ['usage_id', 'program_id', 'structure_id', 'entity_id', 'usage_type',
+                             'reference_count', 'first_line_number', 'last_line_number'],
+}
+
+# Rows belonging to @program_id; edge tables are scoped through their source line
+# (under the interleaved key scheme they carry program_id themselves)
+PROGRAM_ROWS_SQL = {
+    'Programs': "SELECT {columns} FROM Programs t WHERE t.program_id = @program_id",
+    'CodeStructure': "SELECT {columns} FROM CodeStructure t WHERE t.program_id = @program_id",
+    'SourceCodeLines': "SELECT {columns} FROM SourceCodeLines t WHERE t.program_id = @program_id",
+    'DataEntities': "SELECT {columns} FROM DataEntities t WHERE t.program_id = @program_id",
+    'LineReferences': ("SELECT {columns} FROM LineReferences t "
+                       "JOIN SourceCodeLines l ON t.source_line_id = l.line_id WHERE l.program_id = @program_id"),
+    'ControlFlow': ("SELECT {columns} FROM ControlFlow t "
+                    "JOIN SourceCodeLines l ON t.source_line_id = l.line_id WHERE l.program_id = @program_id"),
+    'CallClosure': "SELECT {columns} FROM CallClosure t WHERE t.program_id = @program_id",
+    'StructureEntityUsage': "SELECT {columns} FROM StructureEntityUsage t WHERE t.program_id = @program_id",
+}
+INTERLEAVED_ROWS_SQL = "SELECT {columns} FROM {table} t WHERE t.program_id = @program_id"
+
+def row_hash(table_name, record):
+    """Hash of a row's compared columns."""
+    values = [record.get(col) for col in TABLE_COLUMNS[table_name]]
+    return hashlib.sha256(json.dumps(values, default=str).encode()).hexdigest()
+
+def artifact_hash(tables):
+    """Content hash of everything written for a program (commit timestamps excluded)."""
+    content = {
+        table_name: [{k: v for k, v in r.items() if k not in COMMIT_TIMESTAMP_COLUMNS} for r in records]
+        for table_name, records in sorted(tables.items())
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+def read_stored_hash(database, program_id):
+    """Programs.artifact_hash for the program, or None if it was never written."""
+    with database.snapshot() as snapshot:
+        rows = list(snapshot.execute_sql(
+            "SELECT artifact_hash FROM Programs WHERE program_id = @program_id",
+            params={'program_id': program_id},
+            param_types=string_param_types('program_id')))
+    return rows[0][0] if rows else None
+
+def read_current(database, program_id, scheme=KEY_SCHEME):
+    """The program's current rows, {table_name: {key: record}}, read at one timestamp."""
+    current = {}
+    with database.snapshot(multi_use=True) as snapshot:
+        for table_name, columns in TABLE_COLUMNS.items():
+            sql = PROGRAM_ROWS_SQL[table_name]
+            if scheme == 'interleaved':
+                # Every table has program_id as its key prefix: one range read, no join
+                sql = INTERLEAVED_ROWS_SQL.format(table=table_name, columns='{columns}')
+            sql = sql.format(columns=', '.join(f"t.{c}" for c in columns))
+            rows = snapshot.execute_sql(sql, params={'program_id': program_id},
+                                        param_types=string_param_types('program_id'))
+            current[table_name] = {row[0]: dict(zip(columns, row)) for row in rows}
+    return current
+
+def compute_delta(tables, current):
+    """
+    Splits the new rows into inserts and updates against the current ones.
+    Returns (upserts {table_name: records}, deletes {table_name: [keys]}, counts).
+    """
+    upserts, deletes = {}, {}
+    counts = {'inserts': 0, 'updates': 0, 'deletes': 0, 'unchanged': 0}
+    for table_name, columns in TABLE_COLUMNS.items():
+        key = columns[0]
+        existing = current.get(table_name, {})
+        changed = []
+        seen = set()
+        for record in tables.get(table_name, []):
+            seen.add(record[key])
+            old = existing.get(record[key])
+            if old is None:
+                counts['inserts'] += 1
+            elif row_hash(table_name, old) != row_hash(table_name, record):
+                counts['updates'] += 1
+            else:
+                counts['unchanged'] += 1
+                continue
+            changed.append(record)
+        upserts[table_name] = changed
+        # The Programs row itself is never deleted here
+        if table_name != 'Programs':
+            deletes[table_name] = [k for k in existing if k not in seen]
+            counts['deletes'] += len(deletes[table_name])
+    return upserts, deletes, counts
+
+def delete_data(transaction, table_name, keys):
+    """keys are full primary keys (lists), see key_schemes.primary_key."""
+    transaction.delete(table_name, key_set(keys))
+    print(f"Deleted {len(keys)} rows from {table_name}")
+
+def delete_levels(deletes, current):
+    """FK-ordered levels of (table_name, keys), children first."""
+    levels = [[('LineReferences', deletes.get('LineReferences', [])),
+               ('ControlFlow', deletes.get('ControlFlow', [])),
+               ('CallClosure', deletes.get('CallClosure', [])),
+               ('StructureEntityUsage', deletes.get('StructureEntityUsage', []))],
+              [('DataEntities', deletes.get('DataEntities', []))],
+              [('SourceCodeLines', deletes.get('SourceCodeLines', []))]]
+
+    structures = [current['CodeStructure'][k] for k in deletes.get('CodeStructure', [])]
+    depths = structure_depths(structures)
+    by_depth = {}
+    for s in structures:
+        by_depth.setdefault(depths[s['structure_id']], []).append(s['structure_id'])
+    levels += [[('CodeStructure', by_depth[d])] for d in sorted(by_depth, reverse=True)]
+
+    levels = [[(name, keys) for name, keys in level if keys] for level in levels]
+    return [level for level in levels if level]
+
+def delete_rows(database, deletes, current, max_mutations=MAX_MUTATIONS_PER_COMMIT, workers=WRITE_WORKERS,
+                scheme=KEY_SCHEME, program_id=None):
+    """Deletes the stale keys in bounded, parallel commits, children first. Returns rows deleted."""
+    deleted = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for level in delete_levels(deletes, current):
+            futures = []
+            for table_name, keys in level:
+                keys = [primary_key(table_name, k, scheme, program_id) for k in keys]
+                size = max(1, max_mutations // (1 + index_entries(table_name, scheme)))
+                for i in range(0, len(keys), size):
+                    futures.append(pool.submit(commit_batch, database, table_name, keys[i:i + size],
+                                               write=delete_data))
+                    deleted += len(keys[i:i + size])
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+    return deleted
+
+def refresh_table(database, program_id, table_name, rows, scheme=KEY_SCHEME):
+    """
+    Brings one table's rows for the program in line with rows, writing only
+    the differences (for derived tables recomputed after a write).
+    Returns the insert/update/delete counts.
+    """
+    columns = TABLE_COLUMNS[table_name]
+    with database.snapshot() as snapshot:
+        sql = PROGRAM_ROWS_SQL[table_name].format(columns=', '.join(f"t.{c}" for c in columns))
+        stored = snapshot.execute_sql(sql, params={'program_id': program_id},
+                                      param_types=string_param_types('program_id'))
+        current = {table_name: {row[0]: dict(zip(columns, row)) for row in stored}}
+
+    upserts, deletes, counts = compute_delta({table_name: rows}, current)
+    if upserts[table_name]:
+        write_tables(database, apply_key_scheme(upserts, scheme, program_id))
+    delete_rows(database, deletes, current, scheme=scheme, program_id=program_id)
+    return counts
+
+def mark_written(database, program_id, digest):
+    """Stores the artifact hash once every row of the delta has been applied."""
+    def update(transaction):
+        transaction.update(
+            table='Programs',
+            columns=['program_id', 'artifact_hash', 'last_analyzed', 'updated_at'],
+            values=[[program_id, digest, COMMIT_TIMESTAMP, COMMIT_TIMESTAMP]]
+        )
+    database.run_in_transaction(update)
+
+def delta_write(database, program_id, tables, max_mutations=MAX_MUTATIONS_PER_COMMIT, workers=WRITE_WORKERS,
+                scheme=KEY_SCHEME):
+    """
+    Writes only what changed since the program was last written.
+    Returns stats with the insert/update/delete counts, or skipped=True when
+    the artifacts match Programs.artifact_hash.
+    """
+    start = time.time()
+    digest = artifact_hash(tables)
+    if read_stored_hash(database, program_id) == digest:
+        print(f"[Delta] {program_id} unchanged (artifact hash {digest[:12]}), skipping")
+        return {'mode': 'delta', 'skipped': True, 'artifact_hash': digest,
+                'inserts': 0, 'updates': 0, 'deletes': 0, 'seconds': round(time.time() - start, 3)}
+
+    current = read_current(database, program_id, scheme)
+    upserts, deletes, counts = compute_delta(tables, current)
+    print(f"[Delta] {program_id}: {counts['inserts']} inserts, {counts['updates']} updates, "
+          f"{counts['deletes']} deletes, {counts['unchanged']} unchanged")
+
+    # Parents are upserted before children that point at them, and stale
+    # children are deleted before the parents they pointed at.
+    stats = write_tables(database, apply_key_scheme(upserts, scheme, program_id), max_mutations, workers)
+    delete_rows(database, deletes, current, max_mutations, workers, scheme, program_id)
+    mark_written(database, program_id, digest)
+
+    stats.update(counts)
+    stats.update({'mode': 'delta', 'skipped': False, 'artifact_hash': digest,
+                  'seconds': round(time.time() - start, 3)})
+    return stats
@@ -0,0 +1,86 @@
+"""
+Maps agent artifacts onto the spanner-schema.sql tables.
+One mapper per table so the batch writer and the streaming writer produce
+identical rows.
+"""
+from spanner_types import COMMIT_TIMESTAMP
+
+def program_row(program_id, meta=None, total_lines=None):
+    # Agent 1 'program' metadata when available, otherwise defaults from the id
+    meta = meta or {}
+    return {
+        'program_id': program_id,
+        'program_name': meta.get('program_name') or program_id,
+        'file_name': meta.get('file_name') or f"{program_id}.cbl",
+        'total_lines': meta.get('total_lines', total_lines),
+        'last_analyzed': COMMIT_TIMESTAMP,
+        'updated_at': COMMIT_TIMESTAMP
+    }
+
+def structure_row(program_id, s):
+    # Input has 'start_line' instead of 'start_line_number'
+    return {
+        'structure_id': s.get('section_id') or s.get('structure_id'),
+        'program_id': program_id,
+        'parent_structure_id': s.get('parent_structure_id'),
+        'name': s.get('name'),
+        'type': s.get('type'),
+        'start_line_number': s.get('start_line'),
+        'end_line_number': s.get('end_line')
+    }
+
+def line_row(program_id, l):
+    return {
+        'line_id': l.get('line_id'),
+        'program_id': program_id,
+        'structure_id': l.get('structure_id'),
+        'line_number': l.get('line_number'),
+        'content': l.get('content'),
+        'type': l.get('type') or l.get('line_type', 'CODE')
+    }
+
+def entity_row(program_id, e):
+    return {
+        'entity_id': e.get('entity_id'),
+        'program_id': program_id,
+        'name': e.get('entity_name'),
+        'type': e.get('entity_type'),
+        'definition_line_id': e.get('definition_line_id'),
+        'description': e.get('description')
+    }
+
+def reference_row(program_id, r):
+    return {
+        'reference_id': r.get('reference_id'),
+        'source_line_id': r.get('source_line_id'),
+        'target_entity_id': r.get('target_entity_id'),
+        'usage_type': r.get('usage_type')
+    }
+
+def flow_row(program_id, f):
+    return {
+        'flow_id': f.get('flow_id'),
+        'source_line_id': f.get('source_line_id'),
+        'target_structure_id': f.get('target_structure_id'),
+        'type': f.get('type')
+    }
+
+# Artifact record -> table row, by table name
+ROW_MAPPERS = {
+    'CodeStructure': structure_row,
+    'SourceCodeLines': line_row,
+    'DataEntities': entity_row,
+    'LineReferences': reference_row,
+    'ControlFlow': flow_row,
+}
+
+def build_tables(program_id, source_lines, structures, entities, control_flow, line_references, program=None):
+    """Maps the agent artifacts onto the spanner-schema.sql tables: {table_name: records}."""
+    return {
+        'Programs': [program_row(program_id, program, total_lines=len(source_lines))],
+        'CodeStructure': [structure_row(program_id, s) for s in structures],
+        'SourceCodeLines': [line_row(program_id, l) for l in source_lines],
+        'DataEntities': [entity_row(program_id, e) for e in entities],
+        'LineReferences': [reference_row(program_id, r) for r in line_references],
+        'ControlFlow': [flow_row(program_id, f) for f in control_flow],
+    }
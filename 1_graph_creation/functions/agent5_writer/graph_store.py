@@ -0,0 +1,276 @@
+"""
+Storage backends for the line graph.
+
+SpannerGraphStore wraps a Spanner database. SQLiteGraphStore keeps the same
+tables as spanner-schema.sql in an embedded SQLite file and answers the subset
+of the Spanner Database API the writers use (run_in_transaction with
+insert_or_update / update / delete, and snapshot().execute_sql), so
+write_tables, delta_write and StreamWriter run unchanged on either backend.
+Both stores add query(name) for the canonical queries in canonical_sql.py.
+
+Store spec (GRAPH_STORE): empty or 'spanner' for Spanner, 'sqlite:PATH' or a
+path ending in .db / .sqlite for SQLite.
+"""
+import re
+import sqlite3
+import datetime
+import threading
+from spanner_types import COMMIT_TIMESTAMP
+from canonical_sql import CANONICAL_GQL, CANONICAL_SQL
+
+# spanner-schema.sql in SQLite types. FKs are deferred to commit, as in Spanner.
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS Programs (
+  program_id TEXT NOT NULL PRIMARY KEY,
+  program_name TEXT NOT NULL,
+  file_name TEXT NOT NULL,
+  total_lines INTEGER,
+  last_analyzed TEXT NOT NULL,
+  created_at TEXT NOT NULL,
+  updated_at TEXT NOT NULL,
+  artifact_hash TEXT
+);
+CREATE TABLE IF NOT EXISTS CodeStructure (
+  structure_id TEXT NOT NULL PRIMARY KEY,
+  program_id TEXT NOT NULL REFERENCES Programs (program_id) DEFERRABLE INITIALLY DEFERRED,
+  parent_structure_id TEXT REFERENCES CodeStructure (structure_id) DEFERRABLE INITIALLY DEFERRED,
+  name TEXT NOT NULL,
+  type TEXT NOT NULL,
+  start_line_number INTEGER NOT NULL,
+  end_line_number INTEGER NOT NULL,
+  created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS SourceCodeLines (
+  line_id TEXT NOT NULL PRIMARY KEY,
+  program_id TEXT NOT NULL REFERENCES Programs (program_id) DEFERRABLE INITIALLY DEFERRED,
+  structure_id TEXT REFERENCES CodeStructure (structure_id) DEFERRABLE INITIALLY DEFERRED,
+  line_number INTEGER NOT NULL,
+  content TEXT NOT NULL,
+  type TEXT NOT NULL,
+  created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS DataEntities (
+  entity_id TEXT NOT NULL PRIMARY KEY,
+  program_id TEXT NOT NULL REFERENCES Programs (program_id) DEFERRABLE INITIALLY DEFERRED,
+  name TEXT NOT NULL,
+  type TEXT NOT NULL,
+  definition_line_id TEXT REFERENCES SourceCodeLines (line_id) DEFERRABLE INITIALLY DEFERRED,
+  description TEXT,
+  created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS LineReferences (
+  reference_id TEXT NOT NULL PRIMARY KEY,
+  source_line_id TEXT NOT NULL REFERENCES SourceCodeLines (line_id) DEFERRABLE INITIALLY DEFERRED,
+  target_entity_id TEXT NOT NULL REFERENCES DataEntities (entity_id) DEFERRABLE INITIALLY DEFERRED,
+  usage_type TEXT NOT NULL,
+  created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ControlFlow (
+  flow_id TEXT NOT NULL PRIMARY KEY,
+  source_line_id TEXT NOT NULL REFERENCES SourceCodeLines (line_id) DEFERRABLE INITIALLY DEFERRED,
+  target_structure_id TEXT NOT NULL REFERENCES CodeStructure (structure_id) DEFERRABLE INITIALLY DEFERRED,
+  type TEXT NOT NULL,
+  created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS CallClosure (
+  closure_id TEXT NOT NULL PRIMARY KEY,
+  program_id TEXT NOT NULL REFERENCES Programs (program_id) DEFERRABLE INITIALLY DEFERRED,
+  source_structure_id TEXT NOT NULL REFERENCES CodeStructure (structure_id) DEFERRABLE INITIALLY DEFERRED,
+  target_structure_id TEXT NOT NULL REFERENCES CodeStructure (structure_id) DEFERRABLE INITIALLY DEFERRED,
+  depth INTEGER NOT NULL,
+  first_call_line_id TEXT NOT NULL REFERENCES SourceCodeLines (line_id) DEFERRABLE INITIALLY DEFERRED,
+  first_call_line_number INTEGER NOT NULL,
+  created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS StructureEntityUsage (
+  usage_id TEXT NOT NULL PRIMARY KEY,
+  program_id TEXT NOT NULL REFERENCES Programs (program_id) DEFERRABLE INITIALLY DEFERRED,
+  structure_id TEXT NOT NULL REFERENCES CodeStructure (structure_id) DEFERRABLE INITIALLY DEFERRED,
+  entity_id TEXT NOT NULL REFERENCES DataEntities (entity_id) DEFERRABLE INITIALLY DEFERRED,
+  usage_type TEXT NOT NULL,
+  reference_count INTEGER NOT NULL,
+  first_line_number INTEGER NOT NULL,
+  last_line_number INTEGER NOT NULL,
+  created_at TEXT NOT NULL
+);
+-- Spanner backs every FK with an index; same here
+CREATE INDEX IF NOT EXISTS CodeStructure_program_id ON CodeStructure (program_id);
+CREATE INDEX IF NOT EXISTS CodeStructure_parent_structure_id ON CodeStructure (parent_structure_id);
+CREATE INDEX IF NOT EXISTS SourceCodeLines_program_id ON SourceCodeLines (program_id);
+CREATE INDEX IF NOT EXISTS SourceCodeLines_structure_id ON SourceCodeLines (structure_id);
+CREATE INDEX IF NOT EXISTS DataEntities_program_id ON DataEntities (program_id);
+CREATE INDEX IF NOT EXISTS DataEntities_definition_line_id ON DataEntities (definition_line_id);
+CREATE INDEX IF NOT EXISTS LineReferences_source_line_id ON LineReferences (source_line_id);
+CREATE INDEX IF NOT EXISTS LineReferences_target_entity_id ON LineReferences (target_entity_id);
+CREATE INDEX IF NOT EXISTS ControlFlow_source_line_id ON ControlFlow (source_line_id);
+CREATE INDEX IF NOT EXISTS ControlFlow_target_structure_id ON ControlFlow (target_structure_id);
+CREATE INDEX IF NOT EXISTS CallClosure_program_id ON CallClosure (program_id);
+CREATE INDEX IF NOT EXISTS CallClosure_source_structure_id ON CallClosure (source_structure_id);
+CREATE INDEX IF NOT EXISTS CallClosure_target_structure_id ON CallClosure (target_structure_id);
+CREATE INDEX IF NOT EXISTS CallClosure_first_call_line_id ON CallClosure (first_call_line_id);
+CREATE INDEX IF NOT EXISTS StructureEntityUsage_program_id ON StructureEntityUsage (program_id);
+CREATE INDEX IF NOT EXISTS StructureEntityUsage_structure_id ON StructureEntityUsage (structure_id);
+CREATE INDEX IF NOT EXISTS StructureEntityUsage_entity_id ON StructureEntityUsage (entity_id);
+"""
+
+# spanner-indexes.sql for SQLite: same names, STORING columns appended to the key (covering indexes)
+SQLITE_QUERY_INDEXES = """
+CREATE INDEX IF NOT EXISTS CodeStructureByProgramName
+  ON CodeStructure (program_id, name, type, parent_structure_id, start_line_number, end_line_number);
+CREATE INDEX IF NOT EXISTS CodeStructureByName
+  ON CodeStructure (name, program_id, type, start_line_number, end_line_number);
+CREATE INDEX IF NOT EXISTS SourceCodeLinesByProgramLine ON SourceCodeLines (program_id, line_number, structure_id, type);
+CREATE INDEX IF NOT EXISTS SourceCodeLinesByStructureLine ON SourceCodeLines (structure_id, line_number, type);
+CREATE INDEX IF NOT EXISTS DataEntitiesByType ON DataEntities (type, name, program_id, definition_line_id);
+CREATE INDEX IF NOT EXISTS LineReferencesByTargetUsage ON LineReferences (target_entity_id, usage_type, source_line_id);
+CREATE INDEX IF NOT EXISTS LineReferencesBySourceUsage ON LineReferences (source_line_id, usage_type, target_entity_id);
+CREATE INDEX IF NOT EXISTS ControlFlowByTarget ON ControlFlow (target_structure_id, source_line_id, type);
+CREATE INDEX IF NOT EXISTS ControlFlowBySource ON ControlFlow (source_line_id, target_structure_id, type);
+CREATE INDEX IF NOT EXISTS StructureEntityUsageByEntityUsage
+  ON StructureEntityUsage (entity_id, usage_type, reference_count);
+"""
+
+KEY_COLUMNS = {
+    'Programs': 'program_id',
+    'CodeStructure': 'structure_id',
+    'SourceCodeLines': 'line_id',
+    'DataEntities': 'entity_id',
+    'LineReferences': 'reference_id',
+    'ControlFlow': 'flow_id',
+    'CallClosure': 'closure_id',
+    'StructureEntityUsage': 'usage_id',
+}
+
+class SpannerGraphStore:
+    """A Spanner database plus canonical queries; everything else is delegated."""
+    backend = 'spanner'
+
+    def __init__(self, database):
+        self.database = database
+
+    def __getattr__(self, name):
+        return getattr(self.database, name)
+
+    def query(self, name):
+        """Runs a canonical GQL query. Returns (columns, rows)."""
+        with self.database.snapshot() as snapshot:
+            results = snapshot.execute_sql(CANONICAL_GQL[name])
+            rows = [tuple(row) for row in results]
+            return [field.name for field in results.fields], rows
+
+    def close(self):
+        pass
+
+class SQLiteTransaction:
+    """The mutation calls of a Spanner transaction, applied to a SQLite connection."""
+    def __init__(self, conn, commit_timestamp):
+        self.conn = conn
+        self.commit_timestamp = commit_timestamp
+
+    def _value(self, value):
+        return self.commit_timestamp if value == COMMIT_TIMESTAMP else value
+
+    def insert_or_update(self, table, columns, values):
+        key = KEY_COLUMNS[table]
+        updates = ', '.join(f"{c} = excluded.{c}" for c in columns if c != key)
+        sql = (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+               f"ON CONFLICT ({key}) DO UPDATE SET {updates}")
+        self.conn.executemany(sql, [[self._value(v) for v in row] for row in values])
+
+    def update(self, table, columns, values):
+        key = KEY_COLUMNS[table]
+        sets = ', '.join(f"{c} = ?" for c in columns if c != key)
+        sql = f"UPDATE {table} SET {sets} WHERE {key} = ?"
+        for row in values:
+            record = dict(zip(columns, row))
+            self.conn.execute(sql, [self._value(record[c]) for c in columns if c != key] + [record[key]])
+
+    def delete(self, table, keyset):
+        # The string id is the last key part under every key scheme
+        sql = f"DELETE FROM {table} WHERE {KEY_COLUMNS[table]} = ?"
+        self.conn.executemany(sql, [[key[-1]] for key in keyset.keys])
+
+class SQLiteSnapshot:
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute_sql(self, sql, params=None, param_types=None):
+        return self.store.execute_sql(sql, params)[1]
+
+class SQLiteGraphStore:
+    """
+    Embedded graph store with the spanner-schema.sql tables.
+    One connection shared by the writer threads; transactions are serialized.
+    """
+    backend = 'sqlite'
+
+    def __init__(self, path, query_indexes=True):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+        if query_indexes:
+            self.conn.executescript(SQLITE_QUERY_INDEXES)
+
+    def run_in_transaction(self, func, *args, **kwargs):
+        commit_timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        with self.lock:
+            try:
+                result = func(SQLiteTransaction(self.conn, commit_timestamp), *args, **kwargs)
+                self.conn.commit()
+                return result
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def snapshot(self, **kwargs):
+        return SQLiteSnapshot(self)
+
+    def mutation_groups(self):
+        raise NotImplementedError("batch_write is Spanner-only; use WRITE_MODE=transaction with SQLite")
+
+    def execute_sql(self, sql, params=None):
+        """Runs SQL (Spanner @name parameters accepted). Returns (columns, rows)."""
+        sql = re.sub(r"@(\w+)", r":\1", sql)
+        with self.lock:
+            cursor = self.conn.execute(sql, params or {})
+            rows = cursor.fetchall()
+        return [d[0] for d in cursor.description or []], rows
+
+    def query(self, name):
+        """Runs the SQL form of a canonical query. Returns (columns, rows)."""
+        return self.execute_sql(CANONICAL_SQL[name])
+
+    def close(self):
+        self.conn.close()
+
+# Write modes per backend; batch_write mutation groups are Spanner-only
+WRITE_MODES = {'spanner': ('transaction', 'bulk', 'delta'), 'sqlite': ('transaction', 'delta')}
+
+def check_write_mode(store, write_mode):
+    """Raises ValueError when the store cannot run write_mode, before anything is written."""
+    backend = getattr(store, 'backend', 'spanner')
+    if write_mode not in WRITE_MODES[backend]:
+        raise ValueError(f"WRITE_MODE={write_mode} is not supported by the {backend} graph store "
+                         f"(use {' or '.join(WRITE_MODES[backend])})")
+
+def open_store(spec, project_id=None, instance_id=None, database_id=None):
+    """Opens the store named by spec (see module docstring)."""
+    if spec.startswith('sqlite:'):
+        return SQLiteGraphStore(spec[len('sqlite:'):])
+    if spec.endswith(('.db', '.sqlite')):
+        return SQLiteGraphStore(spec)
+    if spec not in ('', 'spanner'):
+        raise ValueError(f"Unknown graph store: {spec}")
+    # Only the Spanner store needs the client library
+    from google.cloud import spanner
+    client = spanner.Client(project=project_id)
+    return SpannerGraphStore(client.instance(instance_id).database(database_id))
@@ -0,0 +1,75 @@
+"""
+Primary key schemes for the graph tables.
+
+'plain' keys every table by its string id, as spanner-schema.sql does. Those
+ids are monotonic within a program ({program_id}_{line_number}, flow_..., ref_...),
+so a bulk load concentrates on one key range.
+
+'sharded' (spanner-schema-sharded.sql) prefixes the key of the high-volume
+tables with shard_id = hash(id) mod SHARD_COUNT, spreading a program's rows over
+SHARD_COUNT key ranges. The string id stays a column with a unique index, so
+foreign keys and lookups by id are unchanged. The shard is computed here, not
+in the database, so deletes and reads by key can rebuild the full key.
+
+'interleaved' (spanner-schema-interleaved.sql) interleaves every per-program
+table in Programs under (program_id, <string id>), so a program's rows share
+its key range and a per-program read or write touches one split. The edge
+tables gain a program_id column for this.
+"""
+import os
+import hashlib
+
+# 'plain', 'sharded' or 'interleaved'; must match the schema the database was created with
+KEY_SCHEME = os.environ.get("KEY_SCHEME", "plain")
+# Must match the schema too: changing it re-keys every row
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", "64"))
+
+# Tables with a shard prefix, and the string id it is computed from
+SHARDED_TABLES = {
+    'SourceCodeLines': 'line_id',
+    'LineReferences': 'reference_id',
+    'ControlFlow': 'flow_id',
+}
+
+def shard_id(key, shard_count=SHARD_COUNT):
+    """Stable shard of a string id (same value on every client and run)."""
+    return int(hashlib.sha256(key.encode()).hexdigest()[:8], 16) % shard_count
+
+# Tables interleaved in Programs; the edge tables have no program_id of their own
+INTERLEAVED_TABLES = ('CodeStructure', 'SourceCodeLines', 'DataEntities', 'LineReferences', 'ControlFlow',
+                      'CallClosure', 'StructureEntityUsage')
+
+KEY_SCHEMES = ('plain', 'sharded', 'interleaved')
+
+def keyed_row(table_name, row, scheme=KEY_SCHEME, program_id=None):
+    """The row with its key-scheme columns added."""
+    if scheme == 'sharded' and table_name in SHARDED_TABLES:
+        return {'shard_id': shard_id(row[SHARDED_TABLES[table_name]]), **row}
+    if scheme == 'interleaved' and table_name in INTERLEAVED_TABLES and 'program_id' not in row:
+        if not program_id:
+            raise ValueError(f"{table_name} rows need a program_id under the interleaved key scheme")
+        return {'program_id': program_id, **row}
+    return row
+
+def apply_key_scheme(tables, scheme=KEY_SCHEME, program_id=None):
+    """{table_name: records} of one program with key-scheme columns added."""
+    if scheme not in KEY_SCHEMES:
+        raise ValueError(f"Unknown key scheme: {scheme}")
+    if scheme == 'plain':
+        return tables
+    return {table_name: [keyed_row(table_name, r, scheme, program_id) for r in records]
+            for table_name, records in tables.items()}
+
+def primary_key(table_name, key, scheme=KEY_SCHEME, program_id=None):
+    """Full primary key for a row's string id, for deletes and point reads."""
+    if scheme == 'sharded' and table_name in SHARDED_TABLES:
+        return [shard_id(key), key]
+    if scheme == 'interleaved' and table_name in INTERLEAVED_TABLES:
+        if not program_id:
+            raise ValueError(f"{table_name} keys need a program_id under the interleaved key scheme")
+        return [program_id, key]
+    return [key]
+
+def extra_index_entries(table_name, scheme=KEY_SCHEME):
+    """Index entries the scheme adds per row (the unique index on the string id)."""
+    return 1 if scheme == 'sharded' and table_name in SHARDED_TABLES else 0
@@ -2,55 +2,33 @@ import functions_framework
 from flask import Request, Response, jsonify
 import os
 import json
-from google.cloud import spanner
+from mutation_writer import write_tables, bulk_write, WRITE_MODE
+from delta_writer import delta_write
+from graph_rows import build_tables
+from stream_writer import StreamWriter
+from graph_store import open_store, check_write_mode
+from key_schemes import apply_key_scheme, KEY_SCHEME
+from call_closure import closure_rows, call_edges, refresh_closure, CALL_CLOSURE
+from usage_rollup import usage_rows, usage_edges, refresh_usage, USAGE_ROLLUP
 
 # Configuration
 PROJECT_ID = os.environ.get("GOOGLE_CLOUD_PROJECT", "wz-cobol-graph")
 INSTANCE_ID = os.environ.get("SPANNER_INSTANCE", "cobol-graph-v2")
 DATABASE_ID = os.environ.get("SPANNER_DATABASE", "cobol-graph-db-agent-outputs")
+# Storage backend: empty for Spanner, or sqlite:PATH for a local graph store (see graph_store.py)
+GRAPH_STORE = os.environ.get("GRAPH_STORE", "")
 
-# Initialize Spanner
+# Initialize the graph store
 try:
-    spanner_client = spanner.Client(project=PROJECT_ID)
-    instance = spanner_client.instance(INSTANCE_ID)
-    database = instance.database(DATABASE_ID)
+    database = open_store(GRAPH_STORE, PROJECT_ID, INSTANCE_ID, DATABASE_ID)
+    check_write_mode(database, WRITE_MODE)
 except Exception as e:
-    print(f"Error initializing Spanner: {e}")
+    print(f"Error initializing graph store: {e}")
     database = None
 
-def insert_data(transaction, table_name, records):
-    if not records:
-        return
-    
-    # Get columns from first record
-    # Ensure we only use columns that exist in schema
-    # For safety, we might need to whitelist or filter, but assuming artifacts match schema.
-    # We append created_at.
-    
-    columns = list(records[0].keys())
-    if 'created_at' not in columns:
-        columns.append('created_at')
-        
-    values = []
-    for record in records:
-        row = []
-        for col in columns:
-            if col == 'created_at':
-                row.append(spanner.COMMIT_TIMESTAMP)
-            elif col == 'last_analyzed': # For Programs
-                row.append(spanner.COMMIT_TIMESTAMP)
-            elif col == 'updated_at': # For Programs
-                row.append(spanner.COMMIT_TIMESTAMP)
-            else:
-                row.append(record.get(col))
-        values.append(row)
-
-    transaction.insert_or_update(
-        table=table_name,
-        columns=columns,
-        values=values
-    )
-    print(f"Inserted/Updated {len(values)} rows into {table_name}")
+def store_key_scheme():
+    """KEY_SCHEME applies to Spanner; the local store has no hot splits and keeps plain keys."""
+    return KEY_SCHEME if getattr(database, 'backend', 'spanner') == 'spanner' else 'plain'
 
 @functions_framework.http
 def graph_writer(request: Request):
@@ -63,7 +41,7 @@ def graph_writer(request: Request):
         return ('', 204, headers)
 
     if not database:
-        return jsonify({'error': 'Spanner not initialized'}), 500
+        return jsonify({'error': 'Graph store not initialized'}), 500
 
     try:
         req_json = request.get_json(silent=True) or {}
@@ -81,94 +59,43 @@ def graph_writer(request: Request):
         if not program_id:
             return jsonify({'error': 'Missing program_id'}), 400
 
-        def write_transaction(transaction):
-            # 1. Programs
-            # We construct program record. 
-            # Assuming source_lines[0] has program info or we just make basic record
-            program_record = {
-                'program_id': program_id,
-                'program_name': program_id, # Default
-                'file_name': f"{program_id}.cbl", # Default
-                'total_lines': len(source_lines),
-                'last_analyzed': spanner.COMMIT_TIMESTAMP,
-                'updated_at': spanner.COMMIT_TIMESTAMP
-            }
-            # If artifacts provided metadata, override
-            
-            # Insert Programs
-            insert_data(transaction, 'Programs', [program_record])
-
-            # 2. CodeStructure
-            # Ensure fields match schema: structure_id, program_id, parent_structure_id, name, type, start_line_number, end_line_number
-            # Input might have 'start_line' instead of 'start_line_number'
-            clean_structures = []
-            for s in structures:
-                clean_structures.append({
-                    'structure_id': s.get('section_id'),
-                    'program_id': program_id,
-                    'parent_structure_id': s.get('parent_structure_id'),
-                    'name': s.get('name'),
-                    'type': s.get('type'),
-                    'start_line_number': s.get('start_line'),
-                    'end_line_number': s.get('end_line')
-                })
-            insert_data(transaction, 'CodeStructure', clean_structures)
-
-            # 3. SourceCodeLines
-            # Schema: line_id, program_id, structure_id, line_number, content, type
-            clean_lines = []
-            for l in source_lines:
-                clean_lines.append({
-                    'line_id': l.get('line_id'),
-                    'program_id': program_id,
-                    'structure_id': l.get('structure_id'),
-                    'line_number': l.get('line_number'),
-                    'content': l.get('content'),
-                    'type': l.get('type') or l.get('line_type', 'CODE')
-                })
-            insert_data(transaction, 'SourceCodeLines', clean_lines)
-
-            # 4. DataEntities
-            # Schema: entity_id, program_id, name, type, definition_line_id, description
-            clean_entities = []
-            for e in entities:
-                clean_entities.append({
-                    'entity_id': e.get('entity_id'),
-                    'program_id': program_id,
-                    'name': e.get('entity_name'),
-                    'type': e.get('entity_type'),
-                    'definition_line_id': e.get('definition_line_id'),
-                    'description': e.get('description')
+        tables = build_tables(program_id, source_lines, structures, entities, control_flow, line_references,
+                              program=req_json.get('program'))
+        if CALL_CLOSURE:
+            # Derived from the flows; written with them, so delta mode only touches closure rows that changed
+            tables['CallClosure'] = closure_rows(program_id, call_edges(tables), tables['CodeStructure'])
+        if USAGE_ROLLUP:
+            tables['StructureEntityUsage'] = usage_rows(program_id, usage_edges(tables))
+
+        write_mode = req_json.get('write_mode', WRITE_MODE)
+        try:
+            check_write_mode(database, write_mode)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        key_scheme = store_key_scheme()
+        if write_mode == 'delta':
+            # Only new/changed rows are written and stale ones deleted; unchanged programs are skipped
+            write_stats = delta_write(database, program_id, tables, scheme=key_scheme)
+            if write_stats['skipped']:
+                return jsonify({
+                    'status': 'unchanged',
+                    'message': f'Graph for {program_id} is already up to date',
+                    'stats': {'write': write_stats}
                 })
-            insert_data(transaction, 'DataEntities', clean_entities)
-
-            # 5. LineReferences
-            # Schema: reference_id, source_line_id, target_entity_id, usage_type
-            clean_refs = []
-            for r in line_references:
-                clean_refs.append({
-                    'reference_id': r.get('reference_id'),
-                    'source_line_id': r.get('source_line_id'),
-                    'target_entity_id': r.get('target_entity_id'),
-                    'usage_type': r.get('usage_type')
-                })
-            insert_data(transaction, 'LineReferences', clean_refs)
-
-            # 6. ControlFlow
-            # Schema: flow_id, source_line_id, target_structure_id, type
-            clean_flows = []
-            for f in control_flow:
-                clean_flows.append({
-                    'flow_id': f.get('flow_id'),
-                    'source_line_id': f.get('source_line_id'),
-                    'target_structure_id': f.get('target_structure_id'),
-                    'type': f.get('type')
-                })
-            insert_data(transaction, 'ControlFlow', clean_flows)
+        elif write_mode == 'bulk':
+            # Non-atomic mutation groups; failed groups are retried and reported, not raised
+            write_stats = bulk_write(database, {program_id: apply_key_scheme(tables, key_scheme, program_id)})
+            if write_stats['failed_groups']:
+                return jsonify({
+                    'status': 'partial',
+                    'error': f"{write_stats['failed_groups']} mutation groups failed for {program_id} "
+                             f"({write_stats['skipped_groups']} dependent groups skipped)",
+                    'stats': {'write': write_stats}
+                }), 500
+        else:
+            # Bounded batches, parent tables first; one huge commit would hit the mutation limit
+            write_stats = write_tables(database, apply_key_scheme(tables, key_scheme, program_id))
 
-        # Execute Transaction
-        database.run_in_transaction(write_transaction)
-        
         return jsonify({
             'status': 'success',
             'message': f'Successfully wrote graph for {program_id}',
@@ -177,7 +104,10 @@ def graph_writer(request: Request):
                 'structures': len(structures),
                 'entities': len(entities),
                 'flows': len(control_flow),
-                'references': len(line_references)
+                'references': len(line_references),
+                'closure': len(tables.get('CallClosure', [])),
+                'usage': len(tables.get('StructureEntityUsage', [])),
+                'write': write_stats
             }
         })
 
@@ -185,3 +115,54 @@ def graph_writer(request: Request):
         import traceback
         print(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
+
+@functions_framework.http
+def graph_stream_writer(request: Request):
+    """
+    Streaming ingestion endpoint.
+    Body is NDJSON, one {"table", "program_id", "record"} per line, in any
+    table order. Rows are written in bounded, FK-ordered flushes while the
+    body is still being read.
+    """
+    if request.method == 'OPTIONS':
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'POST',
+            'Access-Control-Allow-Headers': 'Content-Type',
+        }
+        return ('', 204, headers)
+
+    if not database:
+        return jsonify({'error': 'Graph store not initialized'}), 500
+
+    key_scheme = store_key_scheme()
+    writer = StreamWriter(database, scheme=key_scheme)
+    program_ids = set()
+    line_number = 0
+    try:
+        for line_number, line in enumerate(request.stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            writer.add(record)
+            program_ids.add(record.get('program_id'))
+        stats = writer.close()
+
+        if CALL_CLOSURE:
+            # Post-write stage: the stream never holds a whole program, so derived tables are read back
+            stats['closure'] = {pid: refresh_closure(database, pid, key_scheme) for pid in sorted(program_ids) if pid}
+        if USAGE_ROLLUP:
+            stats['usage'] = {pid: refresh_usage(database, pid, key_scheme) for pid in sorted(program_ids) if pid}
+
+        return jsonify({
+            'status': 'success',
+            'message': f"Streamed {stats['written']} rows",
+            'stats': stats
+        })
+
+    except Exception as e:
+        import traceback
+        print(traceback.format_exc())
+        writer.stop()
+        return jsonify({'error': f"line {line_number}: {e}", 'stats': writer.stats}), 500
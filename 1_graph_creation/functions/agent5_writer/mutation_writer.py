@@ -0,0 +1,330 @@
+"""
+Chunked, parallel mutation writer for the graph tables.
+Spanner caps the mutations in one commit (every column of every row, plus one
+per index entry), so each table is split into bounded batches. Tables are
+committed in FK levels, parent before child; batches within a level commit in
+parallel. Writes are idempotent upserts, so a failed load can simply be re-run.
+Bulk mode uses non-atomic batch_write mutation groups instead of transactions
+for corpus loads.
+"""
+import os
+import time
+import concurrent.futures
+from spanner_types import COMMIT_TIMESTAMP
+from key_schemes import extra_index_entries, KEY_SCHEME
+
+# Mutations per commit. Spanner rejects commits over 80,000; smaller commits also finish faster.
+MAX_MUTATIONS_PER_COMMIT = int(os.environ.get("MAX_MUTATIONS_PER_COMMIT", "20000"))
+# Concurrent commits within one FK level
+WRITE_WORKERS = int(os.environ.get("WRITE_WORKERS", "8"))
+# Attempts per batch (run_in_transaction already retries aborts; this covers the rest)
+WRITE_RETRIES = int(os.environ.get("WRITE_RETRIES", "3"))
+# 'transaction' (FK-ordered bounded commits), 'bulk' (batch_write mutation groups)
+# or 'delta' (only changed rows, see delta_writer.py)
+WRITE_MODE = os.environ.get("WRITE_MODE", "transaction")
+
+# Columns always set to the commit timestamp
+COMMIT_TIMESTAMP_COLUMNS = ('created_at', 'last_analyzed', 'updated_at')
+
+# Index entries per row: the FK backing indexes on non-key columns in spanner-schema.sql
+TABLE_INDEXES = {
+    'Programs': 0,
+    'CodeStructure': 2,     # program_id, parent_structure_id
+    'SourceCodeLines': 2,   # program_id, structure_id
+    'DataEntities': 2,      # program_id, definition_line_id
+    'LineReferences': 2,    # source_line_id, target_entity_id
+    'ControlFlow': 2,       # source_line_id, target_structure_id
+    'CallClosure': 4,       # program_id, source/target_structure_id, first_call_line_id
+    'StructureEntityUsage': 3,  # program_id, structure_id, entity_id
+}
+
+# Whether the database has the query indexes of spanner-indexes.sql
+QUERY_INDEXES = os.environ.get("QUERY_INDEXES", "false").lower() == "true"
+
+# Index entries per row added by spanner-indexes.sql
+QUERY_INDEX_ENTRIES = {
+    'CodeStructure': 2,     # ByProgramName, ByName
+    'SourceCodeLines': 2,   # ByProgramLine, ByStructureLine
+    'DataEntities': 1,      # ByType
+    'LineReferences': 2,    # ByTargetUsage, BySourceUsage
+    'ControlFlow': 2,       # ByTarget, BySource
+    'StructureEntityUsage': 1,  # ByEntityUsage
+}
+
+def row_columns(records):
+    """Columns written for a batch: the record keys plus created_at."""
+    columns = list(records[0].keys())
+    if 'created_at' not in columns:
+        columns.append('created_at')
+    return columns
+
+def insert_data(transaction, table_name, records):
+    if not records:
+        return
+
+    columns = row_columns(records)
+    values = []
+    for record in records:
+        row = []
+        for col in columns:
+            if col in COMMIT_TIMESTAMP_COLUMNS:
+                row.append(COMMIT_TIMESTAMP)
+            else:
+                row.append(record.get(col))
+        values.append(row)
+
+    transaction.insert_or_update(
+        table=table_name,
+        columns=columns,
+        values=values
+    )
+    print(f"Inserted/Updated {len(values)} rows into {table_name}")
+
+def index_entries(table_name, scheme=KEY_SCHEME):
+    """Index entries written (or removed) with each row of the table."""
+    entries = TABLE_INDEXES.get(table_name, 0) + extra_index_entries(table_name, scheme)
+    if QUERY_INDEXES:
+        entries += QUERY_INDEX_ENTRIES.get(table_name, 0)
+    return entries
+
+def mutations_per_row(table_name, columns):
+    """Estimated mutations for one upserted row: its columns plus its index entries."""
+    return len(columns) + index_entries(table_name)
+
+def chunk_rows(table_name, records, max_mutations=MAX_MUTATIONS_PER_COMMIT):
+    """Splits records into batches that each stay under max_mutations."""
+    if not records:
+        return []
+    size = max(1, max_mutations // mutations_per_row(table_name, row_columns(records)))
+    return [records[i:i + size] for i in range(0, len(records), size)]
+
+def structure_depths(structures):
+    """
+    Depth of each CodeStructure row under its parents in the same write.
+    Roots, and rows whose parent is outside the write (or in a cycle), are 0.
+    """
+    parents = {s['structure_id']: s.get('parent_structure_id') for s in structures}
+    depths = {}
+    for sid in parents:
+        chain = []
+        node = sid
+        while node in parents and node not in depths and node not in chain:
+            chain.append(node)
+            node = parents[node]
+        base = depths.get(node, -1) if node not in chain else -1
+        for offset, member in enumerate(reversed(chain)):
+            depths[member] = base + 1 + offset
+    return depths
+
+def write_levels(tables):
+    """
+    FK-ordered levels of (table_name, records), parents first:
+    Programs, CodeStructure (one level per depth), SourceCodeLines,
+    DataEntities, then the edge and derived tables together.
+    Tables in one level do not reference each other.
+    """
+    levels = [[('Programs', tables.get('Programs', []))]]
+
+    structures = tables.get('CodeStructure', [])
+    depths = structure_depths(structures)
+    by_depth = {}
+    for s in structures:
+        by_depth.setdefault(depths[s['structure_id']], []).append(s)
+    levels += [[('CodeStructure', by_depth[d])] for d in sorted(by_depth)]
+
+    levels.append([('SourceCodeLines', tables.get('SourceCodeLines', []))])
+    levels.append([('DataEntities', tables.get('DataEntities', []))])
+    levels.append([('LineReferences', tables.get('LineReferences', [])),
+                   ('ControlFlow', tables.get('ControlFlow', [])),
+                   ('CallClosure', tables.get('CallClosure', [])),
+                   ('StructureEntityUsage', tables.get('StructureEntityUsage', []))])
+
+    levels = [[(name, records) for name, records in level if records] for level in levels]
+    return [level for level in levels if level]
+
+def commit_batch(database, table_name, records, retries=WRITE_RETRIES, write=insert_data):
+    """Commits one batch in its own transaction. Returns (retries used, seconds)."""
+    start = time.time()
+    delay = 1
+    for attempt in range(retries):
+        try:
+            database.run_in_transaction(write, table_name, records)
+            return attempt, time.time() - start
+        except Exception as e:
+            if attempt == retries - 1: raise
+            print(f"[Write] {table_name} batch of {len(records)} failed ({e}), retrying in {delay}s")
+            time.sleep(delay)
+            delay *= 2
+
+def write_tables(database, tables, max_mutations=MAX_MUTATIONS_PER_COMMIT, workers=WRITE_WORKERS):
+    """
+    Writes {table_name: records} in FK order with bounded, parallel commits.
+    Returns throughput stats per table and overall. A batch that still fails
+    after its retries raises; later levels are not started.
+    """
+    stats = {'tables': {}, 'rows': 0, 'mutations': 0, 'batches': 0, 'retries': 0}
+    start = time.time()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for level in write_levels(tables):
+            futures = {}
+            for table_name, records in level:
+                per_row = mutations_per_row(table_name, row_columns(records))
+                for batch in chunk_rows(table_name, records, max_mutations):
+                    future = pool.submit(commit_batch, database, table_name, batch)
+                    futures[future] = (table_name, len(batch), len(batch) * per_row)
+
+            for future in concurrent.futures.as_completed(futures):
+                table_name, rows, mutations = futures[future]
+                retries, seconds = future.result()
+                table = stats['tables'].setdefault(table_name, {
+                    'rows': 0, 'mutations': 0, 'batches': 0, 'retries': 0, 'seconds': 0.0})
+                table['rows'] += rows
+                table['mutations'] += mutations
+                table['batches'] += 1
+                table['retries'] += retries
+                table['seconds'] += seconds
+                stats['rows'] += rows
+                stats['mutations'] += mutations
+                stats['batches'] += 1
+                stats['retries'] += retries
+
+    stats['seconds'] = round(time.time() - start, 3)
+    stats['rows_per_second'] = round(stats['rows'] / stats['seconds'], 1) if stats['seconds'] else None
+    for table_name, table in stats['tables'].items():
+        table['seconds'] = round(table['seconds'], 3)
+        print(f"[Write] {table_name}: {table['rows']} rows, {table['mutations']} mutations, "
+              f"{table['batches']} batches, {table['retries']} retries, {table['seconds']}s commit time")
+    print(f"[Write] Total: {stats['rows']} rows in {stats['batches']} batches, "
+          f"{stats['seconds']}s ({stats['rows_per_second']} rows/s)")
+    return stats
+
+# --- BULK MODE (batch_write) ---
+
+def mutation_groups(programs, max_mutations=MAX_MUTATIONS_PER_COMMIT):
+    """
+    Mutation groups for {program_id: tables}, one per program, table and batch.
+    Returned as FK levels: level i holds level i of every program. Programs do
+    not reference each other, so mixing them in a level is safe.
+    """
+    levels = []
+    for program_id, tables in programs.items():
+        for i, level in enumerate(write_levels(tables)):
+            if i == len(levels):
+                levels.append([])
+            for table_name, records in level:
+                for batch in chunk_rows(table_name, records, max_mutations):
+                    levels[i].append({'program_id': program_id, 'table': table_name, 'records': batch})
+    return levels
+
+def submit_groups(database, groups):
+    """
+    One batch_write request. Groups apply atomically each, in any order.
+    Returns {group index: error} for the groups that were not applied.
+    """
+    failed = {i: "no response" for i in range(len(groups))}
+    try:
+        with database.mutation_groups() as request:
+            for group in groups:
+                insert_data(request.group(), group['table'], group['records'])
+            for response in request.batch_write():
+                for i in response.indexes:
+                    if response.status.code == 0:
+                        failed.pop(i, None)
+                    else:
+                        failed[i] = response.status.message
+    except Exception as e:
+        failed = {i: str(e) for i in failed}
+    return failed
+
+def retry_group(database, group, error, retries=WRITE_RETRIES):
+    """Resubmits a failed group on its own with backoff. Returns (attempts, last error or None)."""
+    delay = 1
+    for attempt in range(1, retries):
+        print(f"[Bulk] {group['program_id']} {group['table']} group failed ({error}), retrying in {delay}s")
+        time.sleep(delay)
+        delay *= 2
+        error = submit_groups(database, [group]).get(0)
+        if error is None:
+            return attempt, None
+    return retries - 1, error
+
+def bulk_write(database, programs, max_mutations=MAX_MUTATIONS_PER_COMMIT, workers=WRITE_WORKERS):
+    """
+    Upserts {program_id: tables} with concurrent batch_write requests, one FK
+    level at a time. Failed groups are retried individually; a group that still
+    fails stops its program, whose later levels (rows referencing it) are
+    skipped. Returns stats with a status entry per group; failures are
+    reported, not raised.
+    """
+    stats = {'mode': 'bulk', 'tables': {}, 'rows': 0, 'mutations': 0, 'groups': 0,
+             'requests': 0, 'retries': 0, 'failed_groups': 0, 'skipped_groups': 0, 'group_status': []}
+    start = time.time()
+    workers = max(1, workers)
+    failed_programs = {} # program_id -> table of its first failed group
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        for level in mutation_groups(programs, max_mutations):
+            for group in level:
+                if group['program_id'] in failed_programs:
+                    stats['group_status'].append({'program_id': group['program_id'], 'table': group['table'],
+                                                  'rows': len(group['records']), 'retries': 0, 'status': 'skipped',
+                                                  'error': f"{failed_programs[group['program_id']]} group failed"})
+                    stats['skipped_groups'] += 1
+            level = [group for group in level if group['program_id'] not in failed_programs]
+            if not level:
+                continue
+
+            # Spread the level over up to `workers` concurrent requests
+            size = -(-len(level) // workers)
+            requests = [level[i:i + size] for i in range(0, len(level), size)]
+            results = list(pool.map(lambda groups: submit_groups(database, groups), requests))
+            stats['requests'] += len(requests)
+
+            outcomes = {} # id(group) -> (attempts, error)
+            retries = {}
+            for groups, failed in zip(requests, results):
+                for i, group in enumerate(groups):
+                    if i in failed:
+                        retries[pool.submit(retry_group, database, group, failed[i])] = group
+                    else:
+                        outcomes[id(group)] = (0, None)
+            for future in concurrent.futures.as_completed(retries):
+                outcomes[id(retries[future])] = future.result()
+            stats['requests'] += sum(attempts for attempts, _ in outcomes.values())
+
+            for group in level:
+                attempts, error = outcomes[id(group)]
+                rows = len(group['records'])
+                mutations = rows * mutations_per_row(group['table'], row_columns(group['records']))
+                stats['group_status'].append({'program_id': group['program_id'], 'table': group['table'],
+                                              'rows': rows, 'retries': attempts,
+                                              'status': 'failed' if error else 'ok', 'error': error})
+                stats['groups'] += 1
+                stats['retries'] += attempts
+                if error:
+                    stats['failed_groups'] += 1
+                    failed_programs.setdefault(group['program_id'], group['table'])
+                    continue
+                table = stats['tables'].setdefault(group['table'], {'rows': 0, 'mutations': 0, 'groups': 0})
+                table['rows'] += rows
+                table['mutations'] += mutations
+                table['groups'] += 1
+                stats['rows'] += rows
+                stats['mutations'] += mutations
+
+    stats['seconds'] = round(time.time() - start, 3)
+    stats['rows_per_second'] = round(stats['rows'] / stats['seconds'], 1) if stats['seconds'] else None
+    for table_name, table in stats['tables'].items():
+        print(f"[Bulk] {table_name}: {table['rows']} rows, {table['mutations']} mutations, {table['groups']} groups")
+    for status in stats['group_status']:
+        if status['status'] == 'failed':
+            print(f"[Bulk] FAILED {status['program_id']} {status['table']} ({status['rows']} rows): {status['error']}")
+    for program_id, table in failed_programs.items():
+        skipped = sum(1 for s in stats['group_status'] if s['program_id'] == program_id and s['status'] == 'skipped')
+        if skipped:
+            print(f"[Bulk] SKIPPED {skipped} dependent groups of {program_id} after its {table} group failed")
+    print(f"[Bulk] Total: {stats['rows']} rows in {stats['groups']} groups over {stats['requests']} requests, "
+          f"{stats['failed_groups']} failed, {stats['skipped_groups']} skipped, "
+          f"{stats['seconds']}s ({stats['rows_per_second']} rows/s)")
+    return stats
@@ -1,3 +1,5 @@
+import argparse
+import io
 import json
 import os
 import sys
@@ -7,11 +9,12 @@ from flask import Flask
 # Add function dir to path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from main import graph_writer
+from main import graph_writer, graph_stream_writer
 
 class MockRequest:
-    def __init__(self, json_data):
+    def __init__(self, json_data=None, stream=None):
         self._json = json_data
+        self.stream = stream
         self.method = 'POST'
     
     def get_json(self, silent=True):
@@ -21,7 +24,23 @@ def load_json(filepath):
     with open(filepath, 'r') as f:
         return json.load(f)
 
+def stream_records(data_01, data_02, data_03, data_04):
+    """NDJSON lines in agent order (lines arrive before the structures they point at)."""
+    program_id = data_01['program']['program_id']
+    yield {'table': 'Programs', 'program_id': program_id, 'record': data_01['program']}
+    for table, records in [('SourceCodeLines', data_01['source_code_lines']),
+                           ('CodeStructure', data_02['structure']),
+                           ('DataEntities', data_03['entities']),
+                           ('LineReferences', data_04['line_references']),
+                           ('ControlFlow', data_04['control_flow'])]:
+        for record in records:
+            yield {'table': table, 'program_id': program_id, 'record': record}
+
 def main():
+    parser = argparse.ArgumentParser(description='Run Agent 5 locally on the agent artifacts')
+    parser.add_argument('--stream', action='store_true', help='Send the artifacts as NDJSON to graph_stream_writer')
+    args = parser.parse_args()
+
     # Paths
     base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..'))
     agent2_dir = os.path.join(base_dir, '1_graph_creation/functions/agent2_structure')
@@ -45,8 +64,19 @@ def main():
     path_04 = os.path.join(agent4_dir, '04_references_and_flow.json')
     data_04 = load_json(path_04)
 
-    # Construct Payload
     program_id = data_01['program']['program_id']
+    app = Flask(__name__)
+
+    if args.stream:
+        print(f"Streaming graph for {program_id}...")
+        body = ''.join(json.dumps(r) + '\n' for r in stream_records(data_01, data_02, data_03, data_04))
+        req = MockRequest(stream=io.BytesIO(body.encode()))
+        with app.app_context():
+            response = graph_stream_writer(req)
+        print("Response:", response.get_json() if hasattr(response, 'get_json') else response)
+        return
+
+    # Construct Payload
     payload = {
         "program_id": program_id,
         "source_lines": data_01['source_code_lines'],
@@ -62,7 +92,6 @@ def main():
     req = MockRequest(payload)
     
     # Call Function with App Context
-    app = Flask(__name__)
     with app.app_context():
         response = graph_writer(req)
     
@@ -0,0 +1,31 @@
+"""
+The Spanner client values the writers put into mutations and queries.
+
+The commit timestamp sentinel is defined here, and parameter types and key
+sets import the client on first use, so the SQLite graph store runs without
+google-cloud-spanner installed.
+"""
+
+# Same value as spanner.COMMIT_TIMESTAMP: Spanner replaces it with the commit time
+COMMIT_TIMESTAMP = "spanner.commit_timestamp()"
+
+class KeySet:
+    """Stand-in for spanner.KeySet when the client is not installed (SQLite deletes read .keys)."""
+    def __init__(self, keys):
+        self.keys = keys
+
+def string_param_types(*names):
+    """param_types marking the named query parameters as STRING; None without the client (SQLite ignores them)."""
+    try:
+        from google.cloud import spanner
+    except ImportError:
+        return None
+    return {name: spanner.param_types.STRING for name in names}
+
+def key_set(keys):
+    """A KeySet for transaction.delete over the given key tuples."""
+    try:
+        from google.cloud import spanner
+    except ImportError:
+        return KeySet(keys)
+    return spanner.KeySet(keys=keys)
@@ -0,0 +1,196 @@
+"""
+Streaming graph writes from NDJSON.
+Each line is one artifact record tagged with its table, e.g.
+  {"table": "SourceCodeLines", "program_id": "CBTRN01C", "record": {...}}
+Rows are buffered per table and flushed through write_tables once a buffer
+reaches STREAM_BATCH_ROWS or STREAM_FLUSH_SECONDS have passed; a background
+timer checks the deadline too, so a stalled producer does not leave rows
+buffered. A row whose FK parent has not been seen yet waits in a holding
+queue until the parent arrives, so every flush is parent-complete.
+
+Buffered and held rows are bounded. The keys of rows that can be FK parents
+(programs, structures, lines, entities) are remembered for the whole stream,
+so that part grows with the program size; references and flows are not.
+"""
+import os
+import time
+import threading
+from mutation_writer import write_tables
+from graph_rows import program_row, ROW_MAPPERS
+from key_schemes import keyed_row, KEY_SCHEME
+
+# Rows per table buffer before a flush
+STREAM_BATCH_ROWS = int(os.environ.get("STREAM_BATCH_ROWS", "2000"))
+# Maximum age of buffered rows before a flush
+STREAM_FLUSH_SECONDS = float(os.environ.get("STREAM_FLUSH_SECONDS", "5"))
+# Rows allowed to wait for a missing parent before the stream is rejected
+MAX_HELD_ROWS = int(os.environ.get("MAX_HELD_ROWS", "10000"))
+
+KEY_COLUMNS = {
+    'Programs': 'program_id',
+    'CodeStructure': 'structure_id',
+    'SourceCodeLines': 'line_id',
+    'DataEntities': 'entity_id',
+    'LineReferences': 'reference_id',
+    'ControlFlow': 'flow_id',
+}
+
+# (column, parent table) per child table, from spanner-schema.sql
+FOREIGN_KEYS = {
+    'CodeStructure': [('program_id', 'Programs'), ('parent_structure_id', 'CodeStructure')],
+    'SourceCodeLines': [('program_id', 'Programs'), ('structure_id', 'CodeStructure')],
+    'DataEntities': [('program_id', 'Programs'), ('definition_line_id', 'SourceCodeLines')],
+    'LineReferences': [('source_line_id', 'SourceCodeLines'), ('target_entity_id', 'DataEntities')],
+    'ControlFlow': [('source_line_id', 'SourceCodeLines'), ('target_structure_id', 'CodeStructure')],
+}
+
+# Tables whose keys other rows point at: the only keys remembered
+PARENT_TABLES = sorted({parent for fks in FOREIGN_KEYS.values() for _, parent in fks})
+
+class StreamWriter:
+    def __init__(self, database, batch_rows=STREAM_BATCH_ROWS, flush_seconds=STREAM_FLUSH_SECONDS,
+                 max_held=MAX_HELD_ROWS, scheme=KEY_SCHEME):
+        self.database = database
+        self.scheme = scheme
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_seconds
+        self.max_held = max_held
+        self.buffers = {table: [] for table in KEY_COLUMNS}
+        self.seen = {table: set() for table in PARENT_TABLES}
+        self.held = {} # (parent table, parent key) -> [(table, row)]
+        self.held_rows = 0
+        self.last_flush = time.time()
+        self.stats = {'accepted': 0, 'written': 0, 'flushes': 0, 'timed_flushes': 0, 'max_held': 0,
+                      'released_unresolved': 0, 'tables': {}}
+        # add() and the deadline timer both flush
+        self.lock = threading.RLock()
+        self.timer_error = None
+        self.stopped = threading.Event()
+        self.timer = threading.Thread(target=self.flush_on_deadline, daemon=True)
+        self.timer.start()
+
+    def flush_on_deadline(self):
+        """Flushes buffers older than flush_seconds while no record arrives."""
+        while True:
+            with self.lock:
+                wait = self.flush_seconds
+                if any(self.buffers.values()):
+                    wait = max(self.last_flush + self.flush_seconds - time.time(), 0)
+            if self.stopped.wait(wait):
+                return
+            with self.lock:
+                if self.stopped.is_set() or not self.due():
+                    continue
+                try:
+                    self.flush()
+                    self.stats['timed_flushes'] += 1
+                except Exception as e:
+                    # Raised to the producer on its next add() or close()
+                    self.timer_error = e
+                    return
+
+    def stop(self):
+        """Stops the deadline timer (close() does this; call it when abandoning the stream)."""
+        self.stopped.set()
+
+    def check_timer(self):
+        if self.timer_error is not None:
+            raise self.timer_error
+
+    def add(self, record):
+        """Accepts one NDJSON record; may trigger a flush."""
+        with self.lock:
+            self.check_timer()
+            self.add_record(record)
+
+    def add_record(self, record):
+        table = record.get('table')
+        program_id = record.get('program_id')
+        if table == 'Programs':
+            row = program_row(program_id, record.get('record'))
+        elif table in ROW_MAPPERS:
+            row = ROW_MAPPERS[table](program_id, record.get('record') or {})
+        else:
+            raise ValueError(f"Unknown table: {table}")
+        if not row[KEY_COLUMNS[table]]:
+            raise ValueError(f"{table} record has no {KEY_COLUMNS[table]}")
+
+        self.stats['accepted'] += 1
+        self.place(table, keyed_row(table, row, self.scheme, program_id))
+        if self.due():
+            self.flush()
+
+    def missing_parent(self, table, row):
+        for column, parent in FOREIGN_KEYS.get(table, []):
+            key = row.get(column)
+            if key is not None and key not in self.seen[parent]:
+                return parent, key
+        return None
+
+    def place(self, table, row):
+        """Buffers the row if its parents are known, else holds it; releases rows waiting on it."""
+        pending = [(table, row)]
+        while pending:
+            table, row = pending.pop()
+            missing = self.missing_parent(table, row)
+            if missing:
+                if self.held_rows >= self.max_held:
+                    raise OverflowError(f"{self.held_rows} rows are waiting on missing parents "
+                                        f"(latest: {missing[0]} {missing[1]})")
+                self.held.setdefault(missing, []).append((table, row))
+                self.held_rows += 1
+                self.stats['max_held'] = max(self.stats['max_held'], self.held_rows)
+                continue
+
+            key = row[KEY_COLUMNS[table]]
+            if table in self.seen:
+                self.seen[table].add(key)
+            self.buffers[table].append(row)
+            released = self.held.pop((table, key), [])
+            self.held_rows -= len(released)
+            pending.extend(released)
+
+    def due(self):
+        if any(len(rows) >= self.batch_rows for rows in self.buffers.values()):
+            return True
+        waited = time.time() - self.last_flush >= self.flush_seconds
+        return waited and any(self.buffers.values())
+
+    def flush(self):
+        """Writes every buffer in FK order (parents of buffered rows are buffered or already written)."""
+        tables = {table: rows for table, rows in self.buffers.items() if rows}
+        self.last_flush = time.time()
+        if not tables:
+            return
+        write_stats = write_tables(self.database, tables)
+        self.stats['flushes'] += 1
+        self.stats['written'] += write_stats['rows']
+        for table, rows in tables.items():
+            self.stats['tables'][table] = self.stats['tables'].get(table, 0) + len(rows)
+        self.buffers = {table: [] for table in KEY_COLUMNS}
+
+    def close(self):
+        """
+        Flushes what is left. Rows still waiting on a parent that never came in
+        the stream are written last; the parent may already be in the database
+        from an earlier run, otherwise the FK error is raised.
+        """
+        self.stop()
+        with self.lock:
+            self.check_timer()
+            return self.close_buffers()
+
+    def close_buffers(self):
+        self.flush()
+        if self.held:
+            unresolved = [item for items in self.held.values() for item in items]
+            print(f"[Stream] {len(unresolved)} rows never saw their parent in the stream, writing them last")
+            self.held = {}
+            self.held_rows = 0
+            for table, row in unresolved:
+                self.buffers[table].append(row)
+            self.stats['released_unresolved'] = len(unresolved)
+            self.flush()
+        print(f"[Stream] {self.stats['accepted']} records, {self.stats['written']} rows written "
+              f"in {self.stats['flushes']} flushes (max held {self.stats['max_held']})")
+        return self.stats
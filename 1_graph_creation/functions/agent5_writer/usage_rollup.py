@@ -0,0 +1,82 @@
+"""
+Per-structure entity usage rollup (the StructureEntityUsage table, USES edges
+in the graph). One row per (structure, entity, usage_type) of a program with
+the number of REFERENCES edges behind it and the first and last line making
+them, so inventory queries read one row per entity and usage instead of
+aggregating every reference.
+
+Like CallClosure, rows are derived from the written tables and written with
+them; refresh_usage recomputes a program already in the store (NDJSON stream).
+"""
+import os
+from spanner_types import string_param_types
+from delta_writer import refresh_table
+from key_schemes import KEY_SCHEME
+
+# Maintain StructureEntityUsage with every graph write
+USAGE_ROLLUP = os.environ.get("USAGE_ROLLUP", "true").lower() == "true"
+
+USAGE_EDGES_SQL = """
+SELECT l.structure_id, l.line_number, r.target_entity_id, r.usage_type
+FROM LineReferences r JOIN SourceCodeLines l ON r.source_line_id = l.line_id
+WHERE l.program_id = @program_id
+"""
+
+def usage_edges(tables):
+    """(structure_id, line_number, entity_id, usage_type) per reference in tables."""
+    lines = {l['line_id']: l for l in tables.get('SourceCodeLines', [])}
+    edges = []
+    for r in tables.get('LineReferences', []):
+        line = lines.get(r['source_line_id'])
+        if line:
+            edges.append((line['structure_id'], line['line_number'], r['target_entity_id'], r['usage_type']))
+    return edges
+
+def read_usage_edges(database, program_id):
+    with database.snapshot() as snapshot:
+        rows = snapshot.execute_sql(USAGE_EDGES_SQL, params={'program_id': program_id},
+                                    param_types=string_param_types('program_id'))
+        return [tuple(row) for row in rows]
+
+def usage_rows(program_id, edges):
+    """
+    StructureEntityUsage rows from the reference edges. References from lines
+    outside any structure are left out: structure_id is the USES edge's source key.
+    """
+    usage = {} # (structure_id, entity_id, usage_type) -> [count, first_line, last_line]
+    for structure_id, line_number, entity_id, usage_type in edges:
+        if structure_id is None:
+            continue
+        key = (structure_id, entity_id, usage_type)
+        if key in usage:
+            entry = usage[key]
+            entry[0] += 1
+            entry[1] = min(entry[1], line_number)
+            entry[2] = max(entry[2], line_number)
+        else:
+            usage[key] = [1, line_number, line_number]
+
+    rows = []
+    for (structure_id, entity_id, usage_type), (count, first_line, last_line) in sorted(usage.items()):
+        rows.append({
+            'usage_id': f"{structure_id}|{entity_id}|{usage_type}",
+            'program_id': program_id,
+            'structure_id': structure_id,
+            'entity_id': entity_id,
+            'usage_type': usage_type,
+            'reference_count': count,
+            'first_line_number': first_line,
+            'last_line_number': last_line,
+        })
+    return rows
+
+def refresh_usage(database, program_id, scheme=KEY_SCHEME):
+    """
+    Recomputes the program's rollup from the stored references and writes only
+    the rows that changed. Returns the insert/update/delete counts.
+    """
+    rows = usage_rows(program_id, read_usage_edges(database, program_id))
+    counts = refresh_table(database, program_id, 'StructureEntityUsage', rows, scheme)
+    print(f"[Usage] {program_id}: {len(rows)} rows ({counts['inserts']} inserts, "
+          f"{counts['updates']} updates, {counts['deletes']} deletes)")
+    return counts
@@ -0,0 +1,68 @@
+"""
+Typed orchestrator event stream.
+
+Orchestrators produce a sequence of events:
+  {"event": "progress", "message": ...}
+  {"event": "partial_result", "kind": <artifact list>, "key": ..., "items": [...]}
+  {"event": "error", "message": ..., "fatal": bool}
+  {"event": "summary", ...non-list artifact fields and counts...}
+
+A partial_result supersedes any earlier one with the same (kind, key), so a
+result can be re-emitted when it is revised. Events are rendered either as
+NDJSON (one JSON object per line, opt-in) or as the original text log with the
+whole artifact between JSON_START / JSON_END.
+"""
+import json
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+def wants_ndjson(request, req_json):
+    """NDJSON is opt-in: {"format": "ndjson"} in the body or an Accept: application/x-ndjson header."""
+    if req_json.get('format') == 'ndjson':
+        return True
+    headers = getattr(request, 'headers', None)
+    return bool(headers) and NDJSON_MIMETYPE in (headers.get('Accept') or '')
+
+def progress(message):
+    return {"event": "progress", "message": message}
+
+def partial_result(kind, key, items, **fields):
+    return {"event": "partial_result", "kind": kind, "key": key, "items": items, **fields}
+
+def error(message, fatal=False, **fields):
+    return {"event": "error", "message": message, "fatal": fatal, **fields}
+
+def summary(**fields):
+    return {"event": "summary", **fields}
+
+def render_ndjson(events):
+    for ev in events:
+        yield json.dumps(ev) + "\n"
+
+def render_text(events, layout):
+    """
+    Legacy framing: progress/error lines as text, then the artifact between JSON_START / JSON_END.
+    layout lists the artifact keys in order; each comes from the summary if present there,
+    otherwise from the collected partial results of that kind.
+    """
+    collected = {} # kind -> {key: items}, latest emission last
+    for ev in events:
+        kind = ev.get('event')
+        if kind == 'progress':
+            yield ev['message'] + "\n"
+        elif kind == 'error':
+            yield (f"Fatal Error: {ev['message']}" if ev.get('fatal') else f"  [Error] {ev['message']}") + "\n"
+        elif kind == 'partial_result':
+            parts = collected.setdefault(ev['kind'], {})
+            parts.pop(ev['key'], None)
+            parts[ev['key']] = ev['items']
+        elif kind == 'summary':
+            artifact = {}
+            for field in layout:
+                if field in ev:
+                    artifact[field] = ev[field]
+                else:
+                    artifact[field] = [item for items in collected.get(field, {}).values() for item in items]
+            yield "JSON_START\n"
+            yield json.dumps(artifact)
+            yield "\nJSON_END\n"
@@ -0,0 +1,175 @@
+"""
+Structure scheduling for the orchestrator.
+Packs small structures into shared worker calls under a token budget, and orders
+the calls longest-predicted-first (LPT) so large structures do not start last.
+Predicted vs actual call times are kept in a calibration store so the cost model
+improves across runs.
+"""
+import os
+import json
+import heapq
+import threading
+
+# Target-code token budget per worker call. 0 disables packing (1 call per structure).
+BATCH_TOKEN_BUDGET = int(os.environ.get("BATCH_TOKEN_BUDGET", "1500"))
+# Upper bound on structures per call, keeps the response size sane
+MAX_STRUCTURES_PER_BATCH = int(os.environ.get("MAX_STRUCTURES_PER_BATCH", "20"))
+
+# Local JSON file or gs://bucket/path.json for call-time observations. Empty keeps the defaults.
+COST_CALIBRATION_PATH = os.environ.get("COST_CALIBRATION_PATH", "")
+# Observations kept per cost model, and the minimum before the fit replaces the defaults
+CALIBRATION_WINDOW = 500
+CALIBRATION_MIN_SAMPLES = 10
+# Uncalibrated seconds per call: fixed overhead + per target line + per target token
+DEFAULT_COEFFICIENTS = [5.0, 0.05, 0.01]
+# Ridge penalty of the fit, relative to each feature's sum of squares
+FIT_RIDGE = 1e-3
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+def pack_structures(costs, token_budget=BATCH_TOKEN_BUDGET, max_items=MAX_STRUCTURES_PER_BATCH):
+    """
+    First-fit-decreasing bin packing.
+    costs: estimated tokens per structure, index-aligned with the structure list.
+    Returns a list of batches (lists of structure indices). Structures at or
+    over the budget always go alone.
+    """
+    if token_budget <= 0 or max_items <= 1:
+        return [[i] for i in range(len(costs))]
+
+    batches = [] # [remaining_budget, [indices]]
+    for i in sorted(range(len(costs)), key=lambda i: costs[i], reverse=True):
+        cost = costs[i]
+        if cost >= token_budget:
+            batches.append([0, [i]])
+            continue
+        for batch in batches:
+            if batch[0] >= cost and len(batch[1]) < max_items:
+                batch[0] -= cost
+                batch[1].append(i)
+                break
+        else:
+            batches.append([token_budget - cost, [i]])
+
+    return [sorted(indices) for _, indices in batches]
+
+def lpt_order(predicted):
+    """Task indices, most expensive first (ties keep the original order)."""
+    return sorted(range(len(predicted)), key=lambda i: -predicted[i])
+
+def simulated_makespan(predicted, slots):
+    """Makespan of dispatching tasks in the given order onto `slots` concurrent workers."""
+    if not predicted:
+        return 0.0
+    finish = [0.0] * max(1, min(slots, len(predicted)))
+    for cost in predicted:
+        heapq.heappush(finish, heapq.heappop(finish) + cost)
+    return max(finish)
+
+class CostModel:
+    """
+    Linear call-time model: seconds = a + b * lines + c * tokens.
+    Fitted by least squares on the stored observations of this model name once
+    there are enough of them; otherwise DEFAULT_COEFFICIENTS.
+    """
+    def __init__(self, name, path=COST_CALIBRATION_PATH):
+        self.name = name
+        self.path = path
+        self.observations = [] # [lines, tokens, predicted, actual]
+        self.new_observations = []
+        self._lock = threading.Lock()
+        self._blob = None
+        if path.startswith('gs://'):
+            from google.cloud import storage
+            bucket_name, _, blob_name = path[len('gs://'):].partition('/')
+            self._blob = storage.Client().bucket(bucket_name).blob(blob_name)
+        self.observations = self._load().get(name, [])
+        self.coefficients = self._fit()
+
+    @property
+    def calibrated(self):
+        return len(self.observations) >= CALIBRATION_MIN_SAMPLES
+
+    def predict(self, lines, tokens):
+        a, b, c = self.coefficients
+        return a + b * lines + c * tokens
+
+    def record(self, lines, tokens, predicted, actual):
+        with self._lock:
+            self.new_observations.append([lines, tokens, round(predicted, 3), round(actual, 3)])
+
+    def _fit(self):
+        if not self.calibrated:
+            return list(DEFAULT_COEFFICIENTS)
+        # Normal equations (X'X + ridge) w = X'y. Lines and tokens are nearly collinear, so
+        # the ridge scales with each feature's diagonal entry (the intercept is not penalized)
+        rows = [(1.0, float(o[0]), float(o[1])) for o in self.observations]
+        ys = [float(o[3]) for o in self.observations]
+        xtx = [[sum(r[i] * r[j] for r in rows) for j in range(3)] for i in range(3)]
+        for i in (1, 2):
+            xtx[i][i] *= 1.0 + FIT_RIDGE
+        xty = [sum(r[i] * y for r, y in zip(rows, ys)) for i in range(3)]
+        try:
+            w = _solve3(xtx, xty)
+        except ZeroDivisionError:
+            return list(DEFAULT_COEFFICIENTS)
+        # Negative per-line/per-token costs make no sense for scheduling
+        return [max(w[0], 0.0), max(w[1], 0.0), max(w[2], 0.0)]
+
+    def error_summary(self):
+        """(calls, predicted seconds, actual seconds, mean absolute error) for this run."""
+        obs = self.new_observations
+        if not obs:
+            return 0, 0.0, 0.0, 0.0
+        predicted = sum(o[2] for o in obs)
+        actual = sum(o[3] for o in obs)
+        return len(obs), predicted, actual, sum(abs(o[2] - o[3]) for o in obs) / len(obs)
+
+    def _load(self):
+        if not self.path:
+            return {}
+        try:
+            if self._blob is not None:
+                return json.loads(self._blob.download_as_text()) if self._blob.exists() else {}
+            if not os.path.exists(self.path):
+                return {}
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Cost calibration read failed: {e}")
+            return {}
+
+    def save(self):
+        """Appends this run's observations to the store (keeping the last CALIBRATION_WINDOW)."""
+        if not self.path or not self.new_observations:
+            return
+        data = self._load()
+        data[self.name] = (data.get(self.name, []) + self.new_observations)[-CALIBRATION_WINDOW:]
+        try:
+            if self._blob is not None:
+                self._blob.upload_from_string(json.dumps(data), content_type='application/json')
+            else:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(self.path, 'w') as f:
+                    json.dump(data, f)
+        except Exception as e:
+            print(f"Cost calibration write failed: {e}")
+
+def _solve3(a, b):
+    """Gaussian elimination with partial pivoting for a 3x3 system."""
+    m = [row[:] + [b[i]] for i, row in enumerate(a)]
+    for col in range(3):
+        pivot = max(range(col, 3), key=lambda r: abs(m[r][col]))
+        if abs(m[pivot][col]) < 1e-12:
+            raise ZeroDivisionError("singular system")
+        m[col], m[pivot] = m[pivot], m[col]
+        for r in range(col + 1, 3):
+            factor = m[r][col] / m[col][col]
+            for c in range(col, 4):
+                m[r][c] -= factor * m[col][c]
+    x = [0.0] * 3
+    for r in range(2, -1, -1):
+        x[r] = (m[r][3] - sum(m[r][c] * x[c] for c in range(r + 1, 3))) / m[r][r]
+    return x
@@ -0,0 +1,113 @@
+"""
+Orchestrator-to-worker plumbing shared by the Agent 3 and Agent 4 functions.
+
+Each orchestrator scatters payloads to its own worker (run_worker in its main.py)
+and streams events back from an async pipeline. Only the worker body differs, so
+it is passed in. deploy.sh copies this directory into each function before
+deploying; locally main.py puts it on sys.path.
+"""
+import os
+import time
+import asyncio
+import queue
+import threading
+import concurrent.futures
+import multiprocessing
+
+# How the orchestrator reaches the worker:
+#   'http'    - POST to WORKER_URL (scaled deployments, default when WORKER_URL is set)
+#   'thread'  - call the worker body directly in a thread pool (default otherwise)
+#   'process' - call the worker body directly in a process pool
+WORKER_MODE = os.environ.get("WORKER_MODE") or ("http" if os.environ.get("WORKER_URL") else "thread")
+WORKER_POOL_SIZE = int(os.environ.get("WORKER_POOL_SIZE", "16"))
+_worker_pool = None
+
+def stream_async(agen_factory):
+    """
+    Async-to-sync bridge.
+    Runs the async generator on an event loop in a background thread and hands each
+    item over through a queue, so the sync streaming response can yield it immediately.
+    """
+    q = queue.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for item in agen_factory():
+                q.put(item)
+        except Exception as e:
+            q.put(e)
+        finally:
+            q.put(done)
+
+    thread = threading.Thread(target=lambda: asyncio.run(pump()), daemon=True)
+    thread.start()
+    while True:
+        item = q.get()
+        if item is done:
+            break
+        if isinstance(item, Exception):
+            raise item
+        yield item
+    thread.join()
+
+def get_worker_pool():
+    """Lazily creates the shared executor for the in-process worker modes."""
+    global _worker_pool
+    if _worker_pool is None:
+        if WORKER_MODE == 'process':
+            # spawn: forked children would share the parent's Gemini client connections
+            _worker_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=WORKER_POOL_SIZE, mp_context=multiprocessing.get_context('spawn'))
+        else:
+            _worker_pool = concurrent.futures.ThreadPoolExecutor(max_workers=WORKER_POOL_SIZE)
+    return _worker_pool
+
+def run_timed(run_worker, payload):
+    """Runs the worker body in the executor and returns (body, seconds it ran)."""
+    started = time.monotonic()
+    body = run_worker(payload)
+    return body, time.monotonic() - started
+
+async def call_worker_inprocess(run_worker, payload, tag):
+    body, _ = await call_worker_inprocess_timed(run_worker, payload, tag)
+    return body
+
+async def call_worker_inprocess_timed(run_worker, payload, tag):
+    # Timed inside the executor: calls queued behind a full pool do not count their wait
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_worker_pool(), run_timed, run_worker, payload)
+    except Exception as e:
+        return {'error': f"{tag}: {e}"}, None
+
+async def call_worker(session, url, payload, tag):
+    try:
+        async with session.post(url, json=payload) as resp:
+            if resp.status != 200:
+                txt = await resp.text()
+                return {'error': f"{tag}: Status {resp.status} - {txt}"}
+            return await resp.json()
+    except Exception as e:
+        return {'error': f"{tag}: {e}"}
+
+async def dispatch_worker(session, url, run_worker, payload, tag):
+    """
+    Calls the worker over HTTP or in-process, depending on WORKER_MODE.
+    run_worker is the function's in-process entry point (module level, so the
+    process pool can pickle it).
+    """
+    if WORKER_MODE == 'http':
+        return await call_worker(session, url, payload, tag)
+    return await call_worker_inprocess(run_worker, payload, tag)
+
+async def dispatch_worker_timed(session, url, run_worker, payload, tag):
+    """
+    dispatch_worker, also returning the call's duration in seconds for the cost model.
+    In-process calls are timed from when the pool starts them, not from dispatch.
+    """
+    if WORKER_MODE == 'http':
+        started = time.monotonic()
+        body = await call_worker(session, url, payload, tag)
+        return body, time.monotonic() - started
+    return await call_worker_inprocess_timed(run_worker, payload, tag)
@@ -0,0 +1,83 @@
+import argparse
+import json
+import os
+import sys
+import time
+import tempfile
+import statistics
+
+# Add Agent 5 to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../1_graph_creation/functions/agent5_writer')))
+
+from graph_store import SQLiteGraphStore, open_store
+from graph_rows import build_tables
+from mutation_writer import write_tables
+from canonical_sql import CANONICAL_SQL
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../1_graph_creation/functions'))
+
+def load_json(filepath):
+    with open(filepath, 'r') as f:
+        return json.load(f)
+
+def load_artifacts():
+    """The committed Agent 2/3/4 artifacts as one JSON string (for cheap copying)."""
+    return json.dumps({
+        '01': load_json(os.path.join(BASE_DIR, 'agent2_structure/01_source_lines_enriched.json')),
+        '02': load_json(os.path.join(BASE_DIR, 'agent2_structure/02_structure.json')),
+        '03': load_json(os.path.join(BASE_DIR, 'agent3_entities/03_entities.json')),
+        '04': load_json(os.path.join(BASE_DIR, 'agent4_flow/04_references_and_flow.json')),
+    })
+
+def program_copy(artifacts, index):
+    """A copy of the artifacts under a new program_id (every id embeds it)."""
+    program_id = json.loads(artifacts)['01']['program']['program_id']
+    data = json.loads(artifacts.replace(program_id, f"{program_id}{index:03d}"))
+    new_id = data['01']['program']['program_id']
+    return new_id, build_tables(new_id, data['01']['source_code_lines'], data['02']['structure'],
+                                data['03']['entities'], data['04']['control_flow'], data['04']['line_references'],
+                                program=data['01']['program'])
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark graph store writes and canonical queries')
+    parser.add_argument('--programs', type=int, default=10, help='Copies of the sample program to load')
+    parser.add_argument('--store', default='', help="sqlite:PATH or 'spanner' (default: temporary SQLite file)")
+    parser.add_argument('--project_id', default="wz-cobol-graph")
+    parser.add_argument('--instance_id', default="cobol-graph-v2")
+    parser.add_argument('--database_id', default="cobol-graph-db-agent-outputs")
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per query')
+    args = parser.parse_args()
+
+    if args.store:
+        store = open_store(args.store, args.project_id, args.instance_id, args.database_id)
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'graph.db')
+        store = SQLiteGraphStore(path)
+        print(f"Using {path}")
+
+    artifacts = load_artifacts()
+    programs = [program_copy(artifacts, i) for i in range(args.programs)]
+
+    print(f"Writing {len(programs)} programs to {store.backend}...")
+    start = time.time()
+    rows = 0
+    for program_id, tables in programs:
+        rows += write_tables(store, tables)['rows']
+    seconds = time.time() - start
+    print(f"\n=== WRITE: {rows} rows in {seconds:.2f}s ({rows / seconds:.0f} rows/s) ===")
+
+    print(f"\n=== QUERIES (median of {args.repeat}) ===")
+    for name in CANONICAL_SQL:
+        if store.backend == 'spanner' and name == 'call_tree':
+            continue
+        timings = []
+        for _ in range(args.repeat):
+            start = time.time()
+            _, result = store.query(name)
+            timings.append(time.time() - start)
+        print(f"{name:20} {len(result):7} rows  {statistics.median(timings) * 1000:8.1f} ms")
+
+    store.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Streaming client for the orchestrators' NDJSON event protocol.
+
+Requests {"format": "ndjson"} and consumes progress / partial_result / error /
+summary events as they arrive, so neither side holds the whole response as text.
+
+Usage:
+    python ndjson_client.py <orchestrator_url> <payload.json> [output.json]
+
+As a library:
+    for event in stream_events(url, payload):
+        ...
+    artifact = collect_artifact(stream_events(url, payload), ["control_flow", "line_references"])
+"""
+import json
+import sys
+
+import requests
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+# Artifact layouts per orchestrator (keys in output order)
+AGENT3_LAYOUT = ["program_id", "entities", "metadata"]
+AGENT4_LAYOUT = ["control_flow", "line_references"]
+
+class OrchestratorError(Exception):
+    pass
+
+def iter_events(chunks):
+    """Parses NDJSON events from an iterable of str/bytes chunks (lines may span chunks)."""
+    buffer = ""
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = chunk.decode('utf-8')
+        buffer += chunk
+        while "\n" in buffer:
+            line, buffer = buffer.split("\n", 1)
+            if line.strip():
+                yield json.loads(line)
+    if buffer.strip():
+        yield json.loads(buffer)
+
+def stream_events(url, payload, timeout=3600):
+    """POSTs the payload and yields events as the orchestrator streams them."""
+    response = requests.post(url, json={**payload, "format": "ndjson"},
+                             headers={"Accept": NDJSON_MIMETYPE}, stream=True, timeout=timeout)
+    response.raise_for_status()
+    yield from iter_events(response.iter_content(chunk_size=8192))
+
+def collect_artifact(events, layout, on_event=None):
+    """
+    Rebuilds the artifact from partial results. A partial_result replaces any earlier
+    one with the same (kind, key). Raises OrchestratorError on a fatal error or when
+    the stream ends without a summary.
+    """
+    collected = {}
+    for ev in events:
+        if on_event:
+            on_event(ev)
+        kind = ev.get('event')
+        if kind == 'partial_result':
+            parts = collected.setdefault(ev['kind'], {})
+            parts.pop(ev['key'], None)
+            parts[ev['key']] = ev['items']
+        elif kind == 'error' and ev.get('fatal'):
+            raise OrchestratorError(ev.get('message'))
+        elif kind == 'summary':
+            return {field: ev[field] if field in ev
+                    else [item for items in collected.get(field, {}).values() for item in items]
+                    for field in layout}
+    raise OrchestratorError("Stream ended without a summary")
+
+def print_event(ev):
+    kind = ev.get('event')
+    if kind == 'progress':
+        print(ev['message'], flush=True)
+    elif kind == 'error':
+        print(f"{'Fatal Error' if ev.get('fatal') else '  [Error]'}: {ev['message']}", flush=True)
+    elif kind == 'summary':
+        print(f"Summary: {json.dumps(ev.get('counts', {}))}", flush=True)
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+
+    url, payload_path = sys.argv[1], sys.argv[2]
+    with open(payload_path, 'r') as f:
+        payload = json.load(f)
+
+    # Entity payloads (agent 3) carry no 'entities'; flow payloads (agent 4) do
+    layout = AGENT4_LAYOUT if 'entities' in payload else AGENT3_LAYOUT
+    artifact = collect_artifact(stream_events(url, payload), layout, on_event=print_event)
+
+    if len(sys.argv) > 3:
+        with open(sys.argv[3], 'w') as f:
+            json.dump(artifact, f, indent=2)
+        print(f"Saved artifact to {sys.argv[3]}")
+
+if __name__ == '__main__':
+    main()
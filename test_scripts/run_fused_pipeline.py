@@ -0,0 +1,70 @@
+"""
+Runs the fused entity + reference extraction (Agent 3 and Agent 4 in one pass)
+and writes the two artifacts the downstream loaders expect.
+
+Usage:
+    python run_fused_pipeline.py <01_source_lines_enriched.json> <02_structure.json> [fused_orchestrator_url] [output_dir]
+
+Without a URL the orchestrator runs in-process (WORKER_MODE thread/process).
+Writes 03_entities.json and 04_references_and_flow.json to output_dir (default: current dir).
+"""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../1_graph_creation/functions/agent4_flow'))
+
+from ndjson_client import stream_events, collect_artifact, print_event, iter_events
+
+FUSED_LAYOUT = ["program_id", "entities", "metadata", "control_flow", "line_references"]
+
+class LocalRequest:
+    method = 'POST'
+    headers = {}
+    def __init__(self, payload):
+        self.payload = payload
+    def get_json(self, silent=False):
+        return self.payload
+
+def run_local(payload):
+    from flask import Flask
+    import main
+    with Flask(__name__).app_context():
+        response = main.fused_orchestrator(LocalRequest({**payload, "format": "ndjson"}))
+        yield from iter_events(response.response)
+
+def split_artifact(artifact):
+    entities = {k: artifact[k] for k in ("program_id", "entities", "metadata")}
+    flow = {k: artifact[k] for k in ("control_flow", "line_references")}
+    return entities, flow
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+
+    with open(sys.argv[1], 'r') as f:
+        source_lines = json.load(f)['source_code_lines']
+    with open(sys.argv[2], 'r') as f:
+        structures = json.load(f)['structure']
+    url = sys.argv[3] if len(sys.argv) > 3 and sys.argv[3].startswith('http') else None
+    output_dir = sys.argv[-1] if len(sys.argv) > (4 if url else 3) else '.'
+
+    payload = {
+        "program_id": source_lines[0].get('program_id', 'UNKNOWN') if source_lines else 'UNKNOWN',
+        "structures": structures,
+        "source_lines": source_lines
+    }
+    events = stream_events(url, payload) if url else run_local(payload)
+    artifact = collect_artifact(events, FUSED_LAYOUT, on_event=print_event)
+
+    entities, flow = split_artifact(artifact)
+    os.makedirs(output_dir, exist_ok=True)
+    for name, data in (("03_entities.json", entities), ("04_references_and_flow.json", flow)):
+        path = os.path.join(output_dir, name)
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+        print(f"Saved {path}")
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,10 @@
+import argparse
+import os
+import sys
 from google.cloud import spanner
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../1_graph_creation/functions/agent5_writer')))
+
 def run_query(database, query):
     print(f"\n--- Running Grand Unified Logic Query ---")
     print(query)
@@ -13,6 +18,16 @@ def run_query(database, query):
             print(row)
 
 def main():
+    parser = argparse.ArgumentParser(description='Run the Grand Unified Logic Query')
+    parser.add_argument('--sqlite', help='Query a local SQLite graph store at this path instead of Spanner')
+    args = parser.parse_args()
+
+    if args.sqlite:
+        from graph_store import SQLiteGraphStore
+        from canonical_sql import CANONICAL_SQL
+        run_query(SQLiteGraphStore(args.sqlite), CANONICAL_SQL['grand_logic'])
+        return
+
     PROJECT_ID = "wz-cobol-graph"
     INSTANCE_ID = "cobol-graph-v2"
     DATABASE_ID = "cobol-graph-db-agent-outputs"
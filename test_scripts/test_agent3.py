@@ -15,6 +15,7 @@ sys.path.append(os.path.abspath(function_dir))
 
 # Import the functions
 import main
+import worker_dispatch
 from main import entity_orchestrator, entity_worker
 
 # Setup Mock Request
@@ -49,8 +50,9 @@ async def mock_call_worker(session, url, payload, context_tag):
         except Exception as e:
             return {'error': f"Mock Call Failed: {str(e)}"}
 
-# Apply Patch
-main.call_worker = mock_call_worker
+# Apply Patch (HTTP mode goes through the shared dispatch module)
+worker_dispatch.call_worker = mock_call_worker
+worker_dispatch.WORKER_MODE = 'http'
 
 def test_agent3_orchestrator():
     # 1. Load Input Data
@@ -0,0 +1,128 @@
+import unittest
+import sys
+import os
+
+# Add the function directory to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/agent5_writer')))
+
+from call_closure import closure_rows, call_edges, refresh_closure
+from graph_store import SQLiteGraphStore
+from mutation_writer import write_tables
+from delta_writer import delta_write
+
+def program(flows):
+    """Structures A..E, line n of structure X is X_n; flows are (source line, target, type)."""
+    names = 'ABCDE'
+    return {
+        'Programs': [{'program_id': 'P', 'program_name': 'P', 'file_name': 'P.cbl', 'total_lines': 50,
+                      'last_analyzed': 'ts', 'updated_at': 'ts'}],
+        'CodeStructure': [{'structure_id': n, 'program_id': 'P', 'parent_structure_id': None, 'name': n,
+                           'type': 'PARAGRAPH', 'start_line_number': 10 * i, 'end_line_number': 10 * i + 9}
+                          for i, n in enumerate(names)],
+        'SourceCodeLines': [{'line_id': f"{n}_{k}", 'program_id': 'P', 'structure_id': n,
+                             'line_number': 10 * i + k, 'content': '', 'type': 'CODE'}
+                            for i, n in enumerate(names) for k in range(10)],
+        'ControlFlow': [{'flow_id': f"flow_{line}_{target}", 'source_line_id': line,
+                         'target_structure_id': target, 'type': flow_type}
+                        for line, target, flow_type in flows],
+    }
+
+def closure(tables):
+    return {(r['source_structure_id'], r['target_structure_id']): (r['depth'], r['first_call_line_id'])
+            for r in closure_rows('P', call_edges(tables), tables['CodeStructure'])}
+
+def with_section(tables, name, first, last):
+    """Adds a SECTION holding the paragraphs first..last (it owns no lines of its own)."""
+    structures = {s['structure_id']: s for s in tables['CodeStructure']}
+    for s in tables['CodeStructure']:
+        if first <= s['name'] <= last:
+            s['parent_structure_id'] = name
+    tables['CodeStructure'].append({'structure_id': name, 'program_id': 'P', 'parent_structure_id': None,
+                                    'name': name, 'type': 'SECTION',
+                                    'start_line_number': structures[first]['start_line_number'],
+                                    'end_line_number': structures[last]['end_line_number']})
+    return tables
+
+def set_content(tables, line_id, content):
+    for l in tables['SourceCodeLines']:
+        if l['line_id'] == line_id:
+            l['content'] = content
+    return tables
+
+class TestCallClosure(unittest.TestCase):
+
+    def test_transitive_depth_and_first_line(self):
+        tables = program([('A_1', 'B', 'PERFORM'), ('B_2', 'C', 'PERFORM'), ('C_3', 'D', 'GO_TO'),
+                          ('A_5', 'C', 'PERFORM')])
+        rows = closure(tables)
+        self.assertEqual(rows[('A', 'B')], (1, 'A_1'))
+        # Shortest path wins: A reaches C directly (line 5), not through B
+        self.assertEqual(rows[('A', 'C')], (1, 'A_5'))
+        self.assertEqual(rows[('A', 'D')], (2, 'A_5'))
+        self.assertEqual(rows[('B', 'D')], (2, 'B_2'))
+        self.assertNotIn(('D', 'A'), rows)
+
+    def test_ties_cycles_and_flow_types(self):
+        tables = program([('A_4', 'B', 'PERFORM'), ('A_2', 'C', 'PERFORM'), ('B_1', 'D', 'PERFORM'),
+                          ('C_1', 'D', 'PERFORM'), ('D_1', 'A', 'GO_TO'), ('E_1', 'A', 'CALL')])
+        rows = closure(tables)
+        # D is two hops away over B and C; the lower first-call line (via C) is kept
+        self.assertEqual(rows[('A', 'D')], (2, 'A_2'))
+        # Recursion: A reaches itself
+        self.assertEqual(rows[('A', 'A')], (3, 'A_2'))
+        # CALL leaves the program and is not followed
+        self.assertFalse([key for key in rows if key[0] == 'E'])
+
+    def test_perform_section_reaches_its_paragraphs(self):
+        tables = with_section(program([('A_1', 'S', 'PERFORM'), ('C_1', 'D', 'PERFORM')]), 'S', 'B', 'C')
+        rows = closure(tables)
+        # The section's lines all belong to B and C, which run with it
+        self.assertEqual(rows[('A', 'S')], (1, 'A_1'))
+        self.assertEqual(rows[('A', 'B')], (1, 'A_1'))
+        self.assertEqual(rows[('A', 'C')], (1, 'A_1'))
+        self.assertEqual(rows[('A', 'D')], (2, 'A_1'))
+        self.assertNotIn(('A', 'E'), rows)
+
+        # Same result when recomputed from the store
+        store = SQLiteGraphStore(':memory:')
+        delta_write(store, 'P', tables)
+        refresh_closure(store, 'P')
+        self.assertEqual(store.execute_sql("SELECT COUNT(*) FROM CallClosure WHERE source_structure_id = 'A'")[1][0][0], 4)
+
+    def test_perform_thru_reaches_the_range(self):
+        flows = [('A_2', 'D', 'PERFORM'), ('A_2', 'B', 'PERFORM')]
+        rows = closure(set_content(program(flows), 'A_2', "PERFORM B THRU D."))
+        self.assertEqual({key[1]: value for key, value in rows.items() if key[0] == 'A'},
+                         {'B': (1, 'A_2'), 'C': (1, 'A_2'), 'D': (1, 'A_2')})
+        # Two plain PERFORMs on one line are not a range
+        rows = closure(set_content(program(flows), 'A_2', "PERFORM B. PERFORM D."))
+        self.assertNotIn(('A', 'C'), rows)
+        # A THRU range takes in the sections inside it, and their paragraphs
+        tables = with_section(set_content(program([('A_2', 'B', 'PERFORM'), ('A_2', 'E', 'PERFORM')]),
+                                          'A_2', "PERFORM B THROUGH E."), 'S', 'C', 'D')
+        self.assertEqual(sorted(key[1] for key in closure(tables) if key[0] == 'A'), ['B', 'C', 'D', 'E', 'S'])
+
+    def test_written_and_refreshed_incrementally(self):
+        store = SQLiteGraphStore(':memory:')
+        tables = program([('A_1', 'B', 'PERFORM'), ('B_1', 'C', 'PERFORM')])
+        tables['CallClosure'] = closure_rows('P', call_edges(tables), tables['CodeStructure'])
+        delta_write(store, 'P', tables)
+        self.assertEqual(store.execute_sql("SELECT COUNT(*) FROM CallClosure")[1][0][0], 3)
+        self.assertEqual(refresh_closure(store, 'P')['unchanged'], 3)
+
+        # Dropping B -> C removes the two closure rows through it; the rest is untouched
+        tables['ControlFlow'] = tables['ControlFlow'][:1]
+        tables['CallClosure'] = closure_rows('P', call_edges(tables), tables['CodeStructure'])
+        stats = delta_write(store, 'P', tables)
+        self.assertEqual((stats['inserts'], stats['updates'], stats['deletes']), (0, 0, 3))
+        self.assertEqual(store.execute_sql("SELECT closure_id FROM CallClosure")[1], [('A->B',)])
+
+        # Flows written without the closure (e.g. streamed) are picked up by a refresh
+        write_tables(store, {'ControlFlow': [{'flow_id': 'f_AD', 'source_line_id': 'A_9',
+                                              'target_structure_id': 'D', 'type': 'PERFORM'}]})
+        self.assertEqual(refresh_closure(store, 'P')['inserts'], 1)
+        self.assertEqual(store.execute_sql("SELECT depth, first_call_line_number FROM CallClosure "
+                                           "WHERE closure_id = 'A->D'")[1], [(1, 9)])
+
+if __name__ == '__main__':
+    unittest.main()
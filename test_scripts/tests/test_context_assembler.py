@@ -0,0 +1,74 @@
+import unittest
+import sys
+import os
+
+# Add the function directory (and the modules it shares with Agent 3) to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/agent4_flow')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/shared')))
+
+from program_index import ProgramIndex
+from context_assembler import assemble_context, get_declarations
+from scheduling import estimate_tokens
+
+SOURCE = [
+    (None, "DATA DIVISION."),
+    (None, "FD  ACCT-FILE."),
+    (None, "01  ACCT-REC."),
+    (None, "    05 ACCT-ID          PIC 9(11)."),
+    (None, "01  WS-STATUS           PIC XX."),
+    (None, "    88 WS-OK            VALUE '00'."),
+    (None, "01  WS-UNUSED           PIC X."),
+    (None, "PROCEDURE DIVISION."),
+    ('S1', "MAIN-PARA."),
+    ('S1', "    READ ACCT-FILE"),
+    ('S1', "    IF WS-OK PERFORM SHOW-PARA END-IF"),
+    ('S1', "    MOVE ACCT-ID TO WS-STATUS."),
+    ('S2', "SHOW-PARA."),
+    ('S2', "    DISPLAY WS-UNUSED."),
+]
+
+LINES = [{'line_number': i + 1, 'line_id': f"P_{i + 1}", 'structure_id': sid, 'content': '       ' + c, 'type': 'CODE'}
+         for i, (sid, c) in enumerate(SOURCE)]
+
+ENTITIES = ['ACCT-FILE', 'ACCT-ID', 'WS-STATUS', 'WS-UNUSED']
+PARAGRAPHS = ['MAIN-PARA', 'SHOW-PARA']
+
+class TestContextAssembler(unittest.TestCase):
+
+    def setUp(self):
+        self.index = ProgramIndex(LINES)
+        self.target = self.index.structure_lines('S1')
+
+    def line_text(self, line_number):
+        return self.index.text[self.index.offsets[line_number - 1]:self.index.offsets[line_number]]
+
+    def test_declarations(self):
+        declarations = get_declarations(self.index)
+        self.assertEqual(declarations['ACCT-FILE'], [1])
+        # 88-level conditions come with the item they sit under
+        self.assertEqual(declarations['WS-STATUS'], [4, 5])
+        self.assertEqual(declarations['WS-OK'], [5])
+        self.assertNotIn('MAIN-PARA', declarations)
+
+    def test_only_used_declarations(self):
+        text, entities, paragraphs, stats = assemble_context(self.index, self.target, ENTITIES, PARAGRAPHS)
+        self.assertEqual(text, "".join(self.line_text(n) for n in (2, 4, 5, 6)))
+        self.assertEqual(entities, ['ACCT-FILE', 'ACCT-ID', 'WS-STATUS'])
+        self.assertEqual(paragraphs, ['SHOW-PARA'])
+        self.assertEqual(stats['declarations'], 4)
+        self.assertEqual(stats['declarations_dropped_for_budget'], 0)
+        self.assertLess(stats['trimmed_context_tokens'], stats['full_context_tokens'])
+
+    def test_budget_keeps_first_used(self):
+        # Room for ACCT-FILE (first used) and WS-OK only; ACCT-ID and WS-STATUS do not fit
+        budget = estimate_tokens(self.line_text(2)) + estimate_tokens(self.line_text(6))
+        text, _, _, stats = assemble_context(self.index, self.target, ENTITIES, PARAGRAPHS, token_budget=budget)
+        self.assertEqual(text, self.line_text(2) + self.line_text(6))
+        self.assertEqual(stats['declarations_dropped_for_budget'], 2)
+
+        text, _, _, stats = assemble_context(self.index, self.target, ENTITIES, PARAGRAPHS, token_budget=0)
+        self.assertEqual(text, "")
+        self.assertEqual(stats['declarations'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
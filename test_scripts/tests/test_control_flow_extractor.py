@@ -0,0 +1,73 @@
+import unittest
+import sys
+import os
+
+# Add the function directory to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/agent4_flow')))
+
+from control_flow_extractor import extract_control_flow
+
+def make_lines(*contents, start=100):
+    return [
+        {'line_number': start + i, 'content': '       ' + c, 'type': 'CODE'}
+        for i, c in enumerate(contents)
+    ]
+
+PARAGRAPHS = ['1000-INIT', '2000-PROCESS', '2999-EXIT', '3000-A', '3000-B', '9999-ABEND']
+
+class TestControlFlowExtractor(unittest.TestCase):
+
+    def test_simple_perform(self):
+        flows = extract_control_flow(make_lines("PERFORM 1000-INIT."), PARAGRAPHS)
+        self.assertEqual(flows, [{'line_number': 100, 'target_structure_name': '1000-INIT', 'type': 'PERFORM'}])
+
+    def test_perform_thru_emits_both_ends(self):
+        flows = extract_control_flow(make_lines("PERFORM 2000-PROCESS THRU 2999-EXIT"), PARAGRAPHS)
+        self.assertEqual([f['target_structure_name'] for f in flows], ['2000-PROCESS', '2999-EXIT'])
+
+    def test_perform_until_and_varying_with_target(self):
+        flows = extract_control_flow(make_lines(
+            "PERFORM 2000-PROCESS UNTIL END-OF-FILE = 'Y'",
+            "PERFORM 1000-INIT VARYING WS-I FROM 1 BY 1 UNTIL WS-I > 10"), PARAGRAPHS)
+        self.assertEqual([(f['line_number'], f['target_structure_name']) for f in flows],
+                         [(100, '2000-PROCESS'), (101, '1000-INIT')])
+
+    def test_inline_perform_has_no_edge(self):
+        flows = extract_control_flow(make_lines(
+            "PERFORM UNTIL WS-EOF = 'Y'",
+            "    PERFORM 3000-A",
+            "END-PERFORM",
+            "PERFORM VARYING WS-I FROM 1 BY 1 UNTIL WS-I > 5",
+            "    DISPLAY WS-I",
+            "END-PERFORM",
+            "PERFORM WS-COUNT TIMES",
+            "    ADD 1 TO WS-X",
+            "END-PERFORM"), PARAGRAPHS)
+        self.assertEqual(flows, [{'line_number': 101, 'target_structure_name': '3000-A', 'type': 'PERFORM'}])
+
+    def test_go_to_depending_on(self):
+        flows = extract_control_flow(make_lines(
+            "GO TO 3000-A 3000-B",
+            "      DEPENDING ON WS-CHOICE.",
+            "GO 9999-ABEND."), PARAGRAPHS)
+        self.assertEqual([(f['line_number'], f['target_structure_name'], f['type']) for f in flows],
+                         [(100, '3000-A', 'GO_TO'), (100, '3000-B', 'GO_TO'), (102, '9999-ABEND', 'GO_TO')])
+
+    def test_call_literal_and_identifier(self):
+        flows = extract_control_flow(make_lines(
+            "CALL 'CEE3ABD' USING ABCODE, TIMING.",
+            "CALL WS-PGM-NAME USING WS-AREA."), PARAGRAPHS)
+        self.assertEqual([(f['target_structure_name'], f['type']) for f in flows],
+                         [('CEE3ABD', 'CALL'), ('WS-PGM-NAME', 'CALL')])
+
+    def test_statement_split_across_lines_and_case(self):
+        flows = extract_control_flow(make_lines("perform", "    1000-init"), PARAGRAPHS)
+        self.assertEqual(flows, [{'line_number': 100, 'target_structure_name': '1000-INIT', 'type': 'PERFORM'}])
+
+    def test_comments_and_literals_ignored(self):
+        lines = make_lines("DISPLAY 'PERFORM 1000-INIT'")
+        lines.append({'line_number': 200, 'content': '      *    PERFORM 2000-PROCESS', 'type': 'COMMENT'})
+        self.assertEqual(extract_control_flow(lines, PARAGRAPHS), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+import sys
+import os
+import tempfile
+
+# Add the function directory to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/agent3_entities')))
+
+import copybook_registry
+from copybook_registry import CopybookRegistry, find_copy_statements, copybook_hash, materialize
+
+def make_lines(*contents, start=10):
+    return [
+        {'line_number': start + i, 'line_id': f"P_{start + i}", 'content': '       ' + c, 'type': 'CODE'}
+        for i, c in enumerate(contents)
+    ]
+
+TEMPLATES = [
+    {'entity_name': 'CVACT01Y', 'entity_type': 'COPYBOOK', 'description': 'Account record layout'},
+    {'entity_name': 'ACCT-ID', 'entity_type': 'VARIABLE', 'description': 'Account id'},
+]
+
+class TestCopybookRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.copybook_dir = os.path.join(self.tmp.name, 'cpy')
+        os.makedirs(self.copybook_dir)
+        self.write_copybook('CVACT01Y', "01 ACCOUNT-RECORD.\n   05 ACCT-ID PIC 9(11).\n")
+        self.saved_dir = copybook_registry.COPYBOOK_DIR
+        copybook_registry.COPYBOOK_DIR = self.copybook_dir
+        self.registry = CopybookRegistry(os.path.join(self.tmp.name, 'registry'))
+
+    def tearDown(self):
+        copybook_registry.COPYBOOK_DIR = self.saved_dir
+        self.tmp.cleanup()
+
+    def write_copybook(self, name, text):
+        with open(os.path.join(self.copybook_dir, name + '.cpy'), 'w') as f:
+            f.write(text)
+
+    def statement(self):
+        statements = find_copy_statements(make_lines("COPY CVACT01Y."))
+        self.assertEqual(len(statements), 1)
+        return statements[0]
+
+    def test_hit_after_put(self):
+        stmt = self.statement()
+        self.assertIsNone(self.registry.get('CVACT01Y', stmt['content_hash']))
+        self.registry.put('CVACT01Y', stmt['content_hash'], TEMPLATES, 'PROG1')
+
+        templates = self.registry.get('CVACT01Y', self.statement()['content_hash'])
+        self.assertEqual([t['entity_name'] for t in templates], ['CVACT01Y', 'ACCT-ID'])
+        entities = materialize('PROG2', stmt, templates)
+        self.assertEqual(entities[0]['definition_line_id'], 'P_10')
+        self.assertIsNone(entities[1]['definition_line_id'])
+        self.assertTrue(all(e['program_id'] == 'PROG2' for e in entities))
+
+    def test_edited_copybook_misses(self):
+        stmt = self.statement()
+        self.registry.put('CVACT01Y', stmt['content_hash'], TEMPLATES, 'PROG1')
+
+        self.write_copybook('CVACT01Y', "01 ACCOUNT-RECORD.\n   05 ACCT-ID PIC 9(11).\n   05 ACCT-NAME PIC X(30).\n")
+        edited = self.statement()
+        self.assertNotEqual(edited['content_hash'], stmt['content_hash'])
+        self.assertIsNone(self.registry.get('CVACT01Y', edited['content_hash']))
+
+    def test_replacing_clause_changes_the_key(self):
+        plain = self.statement()
+        replaced = find_copy_statements(make_lines("COPY CVACT01Y REPLACING ==ACCT== BY ==CARD==."))[0]
+        self.assertNotEqual(plain['content_hash'], replaced['content_hash'])
+
+    def test_unreadable_copybook_bypasses_registry(self):
+        self.assertIsNone(copybook_hash('CVCUS01Y'))
+        self.assertEqual(find_copy_statements(make_lines("COPY CVCUS01Y.", "COPY CVACT01Y.")),
+                         [self.statement() | {'line_id': 'P_11', 'line_number': 11}])
+
+        copybook_registry.COPYBOOK_DIR = ''
+        self.assertEqual(find_copy_statements(make_lines("COPY CVACT01Y.")), [])
+
+if __name__ == '__main__':
+    unittest.main()
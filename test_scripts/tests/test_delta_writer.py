@@ -0,0 +1,123 @@
+import unittest
+import sys
+import os
+import re
+import threading
+
+# Add the function directory to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/agent5_writer')))
+
+from delta_writer import delta_write, compute_delta, delete_levels, artifact_hash, TABLE_COLUMNS
+
+class FakeStore:
+    """In-memory tables keyed by their first column; enough Spanner for the delta path."""
+    def __init__(self):
+        self.tables = {name: {} for name in TABLE_COLUMNS}
+        self.lock = threading.Lock()
+        self.log = []
+
+    # Transactions
+    def insert_or_update(self, table, columns, values):
+        for row in values:
+            record = self.tables[table].setdefault(row[0], {})
+            record.update(zip(columns, row))
+            self.log.append(('upsert', table, row[0]))
+
+    def update(self, table, columns, values):
+        for row in values:
+            self.tables[table][row[0]].update(zip(columns, row))
+
+    def delete(self, table, keyset):
+        for key in keyset.keys:
+            del self.tables[table][key[0]]
+            self.log.append(('delete', table, key[0]))
+
+    def run_in_transaction(self, func, *args):
+        with self.lock:
+            func(self, *args)
+
+    # Reads
+    def snapshot(self, multi_use=False):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute_sql(self, sql, params, param_types):
+        program_id = params['program_id']
+        if sql.startswith("SELECT artifact_hash"):
+            row = self.tables['Programs'].get(program_id)
+            return [[row.get('artifact_hash')]] if row else []
+        table = re.search(r"FROM (\w+) t", sql).group(1)
+        columns = TABLE_COLUMNS[table]
+        lines = self.tables['SourceCodeLines']
+        rows = []
+        for record in self.tables[table].values():
+            owner = record.get('program_id') or lines.get(record.get('source_line_id'), {}).get('program_id')
+            if owner == program_id:
+                rows.append([record.get(c) for c in columns])
+        return rows
+
+def program(lines=3, refs=('A',), title='X'):
+    return {
+        'Programs': [{'program_id': 'P', 'program_name': 'P', 'file_name': 'P.cbl', 'total_lines': lines,
+                      'last_analyzed': 'ts', 'updated_at': 'ts'}],
+        'CodeStructure': [{'structure_id': 'P_DIV', 'program_id': 'P', 'parent_structure_id': None, 'name': 'DIV',
+                           'type': 'DIVISION', 'start_line_number': 1, 'end_line_number': lines}],
+        'SourceCodeLines': [{'line_id': f"P_{i}", 'program_id': 'P', 'structure_id': 'P_DIV', 'line_number': i,
+                             'content': title if i == 1 else '', 'type': 'CODE'} for i in range(1, lines + 1)],
+        'DataEntities': [{'entity_id': f"P_{n}", 'program_id': 'P', 'name': n, 'type': 'VARIABLE',
+                          'definition_line_id': 'P_1', 'description': None} for n in refs],
+        'LineReferences': [{'reference_id': f"ref_{n}", 'source_line_id': 'P_2', 'target_entity_id': f"P_{n}",
+                            'usage_type': 'READS'} for n in refs],
+        'ControlFlow': [],
+    }
+
+class TestDeltaWriter(unittest.TestCase):
+
+    def test_artifact_hash_ignores_timestamps(self):
+        a, b = program(), program()
+        b['Programs'][0]['last_analyzed'] = 'later'
+        self.assertEqual(artifact_hash(a), artifact_hash(b))
+        self.assertNotEqual(artifact_hash(a), artifact_hash(program(title='Y')))
+
+    def test_compute_delta(self):
+        store = FakeStore()
+        delta_write(store, 'P', program())
+        current = {t: {r[TABLE_COLUMNS[t][0]]: r for r in rows.values()} for t, rows in store.tables.items()}
+        upserts, deletes, counts = compute_delta(program(lines=2, refs=('B',), title='Y'), current)
+        self.assertEqual([r['line_id'] for r in upserts['SourceCodeLines']], ['P_1'])
+        self.assertEqual(deletes['SourceCodeLines'], ['P_3'])
+        self.assertEqual(deletes['LineReferences'], ['ref_A'])
+        # Programs (total_lines), CodeStructure (end line) and P_1 changed
+        self.assertEqual(counts, {'inserts': 2, 'updates': 3, 'deletes': 3, 'unchanged': 1})
+
+    def test_delete_levels_children_first(self):
+        current = {'CodeStructure': {'S': {'structure_id': 'S', 'parent_structure_id': 'D'},
+                                     'D': {'structure_id': 'D', 'parent_structure_id': None}}}
+        levels = delete_levels({'CodeStructure': ['D', 'S'], 'LineReferences': ['r'], 'SourceCodeLines': ['l']},
+                               current)
+        self.assertEqual(levels, [[('LineReferences', ['r'])], [('SourceCodeLines', ['l'])],
+                                  [('CodeStructure', ['S'])], [('CodeStructure', ['D'])]])
+
+    def test_rewrite_and_skip(self):
+        store = FakeStore()
+        first = delta_write(store, 'P', program())
+        self.assertEqual((first['inserts'], first['skipped']), (7, False))
+        self.assertIsNotNone(store.tables['Programs']['P']['artifact_hash'])
+
+        store.log = []
+        self.assertTrue(delta_write(store, 'P', program())['skipped'])
+        self.assertEqual(store.log, [])
+
+        stats = delta_write(store, 'P', program(refs=('B',)))
+        self.assertEqual((stats['inserts'], stats['updates'], stats['deletes']), (2, 0, 2))
+        self.assertEqual(sorted(store.tables['DataEntities']), ['P_B'])
+        # The new entity lands before the stale reference and entity are removed
+        self.assertEqual([op for op, _, _ in store.log], ['upsert', 'upsert', 'delete', 'delete'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import sys
+import os
+
+# Add the function directory to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/agent4_flow')))
+
+from entity_matcher import EntityMatcher, get_matcher
+
+def make_lines(*contents, start=100):
+    return [
+        {'line_number': start + i, 'content': '       ' + c, 'type': 'CODE'}
+        for i, c in enumerate(contents)
+    ]
+
+ENTITIES = ['WS-A', 'WS-A-B', 'ACCT-FILE', 'ACCT-FILE-STATUS', 'END-OF-FILE']
+
+class TestEntityMatcher(unittest.TestCase):
+
+    def test_identifier_boundaries(self):
+        matcher = EntityMatcher(ENTITIES)
+        self.assertEqual(matcher.scan(make_lines("MOVE WS-A-B TO WS-A.")),
+                         [(100, 'WS-A-B'), (100, 'WS-A')])
+        self.assertEqual(matcher.scan(make_lines("MOVE WS-AB TO XWS-A")), [])
+
+    def test_overlapping_names(self):
+        matcher = EntityMatcher(ENTITIES)
+        candidates = matcher.scan(make_lines("IF ACCT-FILE-STATUS = '00'", "OPEN INPUT ACCT-FILE"))
+        self.assertEqual(candidates, [(100, 'ACCT-FILE-STATUS'), (101, 'ACCT-FILE')])
+
+    def test_case_insensitive_keeps_entity_spelling(self):
+        matcher = EntityMatcher(ENTITIES)
+        self.assertEqual(matcher.scan(make_lines("perform until end-of-file = 'Y'")),
+                         [(100, 'END-OF-FILE')])
+
+    def test_unique_per_line(self):
+        matcher = EntityMatcher(ENTITIES)
+        self.assertEqual(matcher.scan(make_lines("ADD WS-A TO WS-A")), [(100, 'WS-A')])
+
+    def test_comments_literals_and_sequence_area_ignored(self):
+        matcher = EntityMatcher(ENTITIES)
+        lines = make_lines("DISPLAY 'WS-A IS ' WS-A-B")
+        lines.append({'line_number': 101, 'content': '      * MOVE WS-A TO WS-A-B', 'type': 'CODE'})
+        lines.append({'line_number': 102, 'content': 'WS-A   ' + 'CONTINUE'.ljust(65) + 'WS-A', 'type': 'CODE'})
+        self.assertEqual(matcher.scan(lines), [(100, 'WS-A-B')])
+
+    def test_matcher_cached_per_name_set(self):
+        self.assertIs(get_matcher(ENTITIES), get_matcher(list(reversed(ENTITIES))))
+        self.assertIsNot(get_matcher(ENTITIES), get_matcher(ENTITIES[:2]))
+
+if __name__ == '__main__':
+    unittest.main()
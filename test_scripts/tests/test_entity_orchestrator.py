@@ -0,0 +1,155 @@
+import unittest
+import sys
+import os
+import json
+import time
+import importlib.util
+import flask
+
+# Add the function directory to the path
+FUNCTION_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/agent3_entities'))
+sys.path.append(FUNCTION_DIR)
+
+# Every function has a main.py; load this one under its own name
+spec = importlib.util.spec_from_file_location('agent3_main', os.path.join(FUNCTION_DIR, 'main.py'))
+agent3_main = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(agent3_main)
+import worker_dispatch
+
+SOURCE_LINES = [
+    {'line_number': 1, 'line_id': 'P_1', 'content': '       01 WS-A PIC X.', 'type': 'CODE'},
+    {'line_number': 2, 'line_id': 'P_2', 'content': '       01 WS-B PIC X.', 'type': 'CODE'},
+    {'line_number': 3, 'line_id': 'P_3', 'content': '       01 WS-C PIC 9.', 'type': 'CODE'},
+    {'line_number': 4, 'line_id': 'P_4', 'content': '       MOVE WS-A TO WS-B', 'type': 'CODE'},
+    {'line_number': 5, 'line_id': 'P_5', 'content': '       DISPLAY WS-C', 'type': 'CODE'},
+    {'line_number': 6, 'line_id': 'P_6', 'content': '       ADD 1 TO WS-C', 'type': 'CODE'},
+]
+
+STRUCTURES = [
+    {'name': 'MAIN-PARA', 'start_line': 4, 'end_line': 4},
+    {'name': 'SHOW-PARA', 'start_line': 5, 'end_line': 5},
+    {'name': 'COUNT-PARA', 'start_line': 6, 'end_line': 6},
+]
+
+def candidate(name, definition, structure, description=''):
+    return {'entity_name': name, 'entity_type': 'VARIABLE', 'definition_line_id': definition,
+            'description': description, 'found_in_structure': structure}
+
+# Extract results per structure. COUNT-PARA returns last and also reports WS-A
+# and WS-B, which its text does not mention: both arrive after finalization.
+EXTRACTED = {
+    'MAIN-PARA': [candidate('WS-A', 'P_1', 'MAIN-PARA', 'input'),
+                  candidate('WS-B', 'P_2', 'MAIN-PARA'), candidate('WS-B', 'P_9', 'MAIN-PARA')],
+    'SHOW-PARA': [candidate('WS-C', 'P_3', 'SHOW-PARA', 'counter')],
+    'COUNT-PARA': [candidate('WS-C', None, 'COUNT-PARA', 'count'),
+                   candidate('WS-A', 'P_1', 'COUNT-PARA', 'input field'),
+                   candidate('WS-B', 'P_2', 'COUNT-PARA')],
+}
+
+def fake_extract(req_json, program_id):
+    names = [s['name'] for s in req_json['structures']]
+    if 'COUNT-PARA' in names:
+        time.sleep(0.3)
+    return {'results_by_structure': {n: [dict(c) for c in EXTRACTED[n]] for n in names}}, 200
+
+def fake_resolve(req_json, program_id):
+    """One record per definition, described by the structures that reported it."""
+    entities = [{'entity_name': req_json['entity_name'], 'entity_type': c['entity_type'],
+                 'definition_line_id': c['definition_line_id'],
+                 'description': ','.join(sorted(c['found_in_structures'])), 'program_id': program_id}
+                for c in req_json['candidates']]
+    return {'entities': entities}, 200
+
+def comparable(entities):
+    return sorted((e['entity_name'], e.get('definition_line_id') or '', e.get('description') or '') for e in entities)
+
+class TestPremerge(unittest.TestCase):
+
+    def test_same_definition_collapses(self):
+        group = [candidate('WS-A ', 'P_1', 'MAIN-PARA'), candidate('WS-A', None, 'SHOW-PARA', 'input field'),
+                 dict(candidate('WS-A', 'P_1', 'COUNT-PARA'), source_copybook='CVACT01Y')]
+        merged = agent3_main.premerge_group('PROG', group)
+        self.assertEqual(merged, {
+            'entity_name': 'WS-A', 'entity_type': 'VARIABLE', 'definition_line_id': 'P_1',
+            'description': 'input field', 'program_id': 'PROG', 'entity_id': 'PROG_WS-A',
+            'source_copybook': 'CVACT01Y'})
+
+    def test_defining_description_wins(self):
+        group = [candidate('WS-A', None, 'SHOW-PARA', 'a much longer description'),
+                 candidate('WS-A', 'P_1', 'MAIN-PARA', 'input')]
+        self.assertEqual(agent3_main.premerge_group('PROG', group)['description'], 'input')
+
+    def test_distinct_fields_need_resolution(self):
+        two_definitions = [candidate('WS-B', 'P_2', 'MAIN-PARA'), candidate('WS-B', 'P_9', 'SHOW-PARA')]
+        two_types = [candidate('WS-B', 'P_2', 'MAIN-PARA'), dict(candidate('WS-B', 'P_2', 'SHOW-PARA'), entity_type='FILE')]
+        self.assertIsNone(agent3_main.premerge_group('PROG', two_definitions))
+        self.assertIsNone(agent3_main.premerge_group('PROG', two_types))
+
+    def test_compaction_keeps_distinct_candidates(self):
+        group = [candidate('WS-B', 'P_2', 'MAIN-PARA'), candidate('WS-B', 'P_2', 'SHOW-PARA', 'output'),
+                 candidate('WS-B', 'P_2', 'MAIN-PARA', 'ignored'), candidate('WS-B', 'P_9', 'COUNT-PARA', 'x' * 1000),
+                 dict(candidate('WS-B', 'P_9', 'COUNT-PARA'), entity_type='FILE')]
+        compacted = agent3_main.compact_candidates(group)
+        self.assertEqual([(c['entity_type'], c['definition_line_id'], c['found_in_structures']) for c in compacted], [
+            ('VARIABLE', 'P_2', ['MAIN-PARA', 'SHOW-PARA']),
+            ('VARIABLE', 'P_9', ['COUNT-PARA']),
+            ('FILE', 'P_9', ['COUNT-PARA'])])
+        # The first non-empty description is kept, clipped for the prompt
+        self.assertEqual(compacted[0]['description'], 'output')
+        self.assertEqual(len(compacted[1]['description']), agent3_main.RESOLVE_DESCRIPTION_CHARS)
+        self.assertNotIn('found_in_structure', compacted[0])
+
+class TestEntityOrchestrator(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = {k: getattr(agent3_main, k) for k in ('handle_extract', 'handle_resolve', 'pack_structures')}
+        self.saved_mode = worker_dispatch.WORKER_MODE
+        agent3_main.handle_extract = fake_extract
+        agent3_main.handle_resolve = fake_resolve
+        # One worker call per structure, so COUNT-PARA completes on its own
+        agent3_main.pack_structures = lambda tokens: [[i] for i in range(len(tokens))]
+        worker_dispatch.WORKER_MODE = 'thread'
+
+    def tearDown(self):
+        for k, v in self.saved.items():
+            setattr(agent3_main, k, v)
+        worker_dispatch.WORKER_MODE = self.saved_mode
+
+    def run_orchestrator(self):
+        payload = {'program_id': 'PROG', 'structures': STRUCTURES, 'source_lines': SOURCE_LINES, 'format': 'ndjson'}
+        with flask.Flask('test').test_request_context(method='POST', json=payload):
+            response = agent3_main.entity_orchestrator(flask.request)
+            events = [json.loads(l) for l in response.get_data(as_text=True).splitlines()]
+        final = {}
+        for ev in events:
+            if ev['event'] == 'partial_result' and ev['kind'] == 'entities':
+                final[ev['key']] = ev['items']
+        return events, final
+
+    def batch_result(self):
+        """All candidates grouped at once, then pre-merged or resolved."""
+        groups = {}
+        for ents in EXTRACTED.values():
+            for e in ents:
+                groups.setdefault(e['entity_name'], []).append(e)
+        final = {}
+        for name, group in groups.items():
+            merged = agent3_main.premerge_group('PROG', group)
+            if merged:
+                final[name] = [merged]
+            else:
+                final[name] = fake_resolve({'entity_name': name, 'candidates': agent3_main.compact_candidates(group)}, 'PROG')[0]['entities']
+        return final
+
+    def test_late_recheck_matches_batch(self):
+        events, final = self.run_orchestrator()
+        self.assertEqual(events[-1]['counts']['late'], 2)
+        expected = self.batch_result()
+        self.assertEqual(sorted(final), sorted(expected))
+        for name in expected:
+            self.assertEqual(comparable(final[name]), comparable(expected[name]), name)
+        # The resolve for WS-B saw both structures' raw candidates
+        self.assertIn(('WS-B', 'P_2', 'COUNT-PARA,MAIN-PARA'), comparable(final['WS-B']))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+import sys
+import os
+
+# Add the function directory to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/agent3_entities')))
+
+from entity_validator import EntityValidator, structure_words
+
+def make_lines(*contents, start=10):
+    return [
+        {'line_number': start + i, 'line_id': f"P_{start + i}", 'content': '       ' + c, 'type': 'CODE'}
+        for i, c in enumerate(contents)
+    ]
+
+PROGRAM = make_lines(
+    "SELECT ACCT-FILE ASSIGN TO ACCTFILE.",
+    "FD  ACCT-FILE.",
+    "01  WS-STATUS          PIC XX.",
+    "    COPY CVACT01Y.",
+    "    OPEN INPUT ACCT-FILE",
+    "    DISPLAY 'WS-TOTAL' WS-STATUS",
+)
+
+def entity(name, entity_type='VARIABLE', line_id=None, **fields):
+    return {'entity_name': name, 'entity_type': entity_type, 'definition_line_id': line_id, **fields}
+
+class TestEntityValidator(unittest.TestCase):
+
+    def setUp(self):
+        self.validator = EntityValidator('P', PROGRAM)
+        self.words = structure_words(PROGRAM[4:])
+
+    def test_valid(self):
+        valid, invalid = self.validator.validate(
+            [entity('ACCT-FILE', 'FILE', 'P_10'), entity('ws-status', line_id='P_12')], structure_words(PROGRAM))
+        self.assertEqual(invalid, [])
+        self.assertEqual(len(valid), 2)
+
+    def test_line_id_normalized(self):
+        e, reason = self.validator.check(entity('WS-STATUS', line_id='Line 12'), self.words)
+        self.assertIsNone(reason)
+        self.assertEqual(e['definition_line_id'], 'P_12')
+
+    def test_membership(self):
+        # Literal text and names from other structures do not count
+        _, reason = self.validator.check(entity('WS-TOTAL'), self.words)
+        self.assertEqual(reason, "'WS-TOTAL' does not occur in the structure")
+        _, reason = self.validator.check(entity('CVACT-FIELD', source_copybook='CVACT01Y'), self.words)
+        self.assertIsNone(reason)
+
+    def test_definition_line(self):
+        _, reason = self.validator.check(entity('WS-STATUS', line_id='P_11'), self.words)
+        self.assertEqual(reason, "'WS-STATUS' does not occur on definition line P_11")
+        _, reason = self.validator.check(entity('WS-STATUS', line_id='P_999'), self.words)
+        self.assertEqual(reason, "definition line P_999 is not a line of P")
+        self.assertEqual(self.validator.declared_on['WS-STATUS'], ['P_12'])
+
+    def test_type_consistency(self):
+        _, reason = self.validator.check(entity('WS-STATUS', 'FILE'), self.words)
+        self.assertEqual(reason, "FILE 'WS-STATUS' has no SELECT/FD")
+        _, reason = self.validator.check(entity('CVACT01Y', 'COPYBOOK'), structure_words(PROGRAM))
+        self.assertIsNone(reason)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+import sys
+import os
+import json
+
+# Add the function directory and the client to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/shared')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from event_stream import progress, partial_result, error, summary, render_text, render_ndjson, wants_ndjson
+from ndjson_client import iter_events, collect_artifact, OrchestratorError
+
+LAYOUT = ["program_id", "entities"]
+
+def sample_events():
+    return [
+        progress("Started"),
+        partial_result("entities", "WS-A", [{"entity_name": "WS-A"}]),
+        partial_result("entities", "WS-B", [{"entity_name": "WS-B"}]),
+        error("worker failed"),
+        # Revised result for WS-A supersedes the first one
+        partial_result("entities", "WS-A", [{"entity_name": "WS-A", "revised": True}]),
+        summary(program_id="P")
+    ]
+
+class TestEventStream(unittest.TestCase):
+
+    def test_text_rendering_keeps_legacy_framing(self):
+        text = "".join(render_text(sample_events(), LAYOUT))
+        log, rest = text.split("JSON_START\n")
+        self.assertEqual(log, "Started\n  [Error] worker failed\n")
+        artifact = json.loads(rest.split("\nJSON_END")[0])
+        self.assertEqual(artifact, {"program_id": "P", "entities": [
+            {"entity_name": "WS-B"}, {"entity_name": "WS-A", "revised": True}]})
+
+    def test_client_rebuilds_same_artifact_from_split_chunks(self):
+        text = "".join(render_text(sample_events(), LAYOUT))
+        expected = json.loads(text.split("JSON_START\n")[1].split("\nJSON_END")[0])
+        body = "".join(render_ndjson(sample_events()))
+        chunks = [body[i:i + 7].encode() for i in range(0, len(body), 7)]
+        self.assertEqual(collect_artifact(iter_events(chunks), LAYOUT), expected)
+
+    def test_fatal_error_and_missing_summary_raise(self):
+        with self.assertRaises(OrchestratorError):
+            collect_artifact([progress("x"), error("boom", fatal=True)], LAYOUT)
+        with self.assertRaises(OrchestratorError):
+            collect_artifact([progress("x")], LAYOUT)
+
+    def test_ndjson_is_opt_in(self):
+        class Req:
+            def __init__(self, headers):
+                self.headers = headers
+        self.assertTrue(wants_ndjson(Req({}), {"format": "ndjson"}))
+        self.assertTrue(wants_ndjson(Req({"Accept": "application/x-ndjson"}), {}))
+        self.assertFalse(wants_ndjson(Req({}), {}))
+        self.assertFalse(wants_ndjson(object(), {}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import sys
+import os
+import tempfile
+
+# Add the function directory (and the modules it shares with Agent 3) to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/agent4_flow')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/shared')))
+
+from flow_cache import FlowCache, structure_cache_key, to_relative, rebase
+
+def make_lines(*contents, start=100):
+    return [
+        {'line_number': start + i, 'content': '       ' + c, 'type': 'CODE'}
+        for i, c in enumerate(contents)
+    ]
+
+CODE = ("1000-INIT.", "    PERFORM 2000-READ", "    MOVE WS-A TO WS-B.")
+ENTITIES = ['WS-A', 'WS-B', 'WS-UNUSED']
+PARAGRAPHS = ['1000-INIT', '2000-READ', '3000-UNUSED']
+
+class TestFlowCache(unittest.TestCase):
+
+    def key(self, lines, entities=ENTITIES, paragraphs=PARAGRAPHS, version='1'):
+        return structure_cache_key(lines, entities, paragraphs, version)
+
+    def test_key_survives_line_shift(self):
+        self.assertEqual(self.key(make_lines(*CODE)), self.key(make_lines(*CODE, start=250)))
+
+    def test_key_changes_with_content_and_prompt_version(self):
+        base = self.key(make_lines(*CODE))
+        self.assertNotEqual(base, self.key(make_lines(*CODE[:2], "    MOVE WS-B TO WS-A.")))
+        self.assertNotEqual(base, self.key(make_lines(*CODE), version='2'))
+
+    def test_key_ignores_unreferenced_names(self):
+        base = self.key(make_lines(*CODE))
+        self.assertEqual(base, self.key(make_lines(*CODE), ENTITIES + ['WS-NEW'], PARAGRAPHS + ['4000-NEW']))
+        self.assertNotEqual(base, self.key(make_lines(*CODE), ['WS-A']))
+
+    def test_store_and_rebase(self):
+        result = {'control_flow': [{'line_number': 101, 'target_structure_name': '2000-READ', 'type': 'PERFORM'}],
+                  'line_references': [{'line_number': 102, 'target_entity_name': 'WS-A', 'usage_type': 'READS'}]}
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = FlowCache(tmp)
+            cache.put('k1', to_relative(result, 100))
+            self.assertIsNone(cache.get('k2'))
+            restored = rebase(cache.get_many(['k1', 'k2'])['k1'], 300)
+        self.assertEqual(restored['control_flow'][0]['line_number'], 301)
+        self.assertEqual(restored['line_references'][0]['line_number'], 302)
+
+    def test_disabled_without_path(self):
+        cache = FlowCache('')
+        cache.put('k', {'control_flow': [], 'line_references': []})
+        self.assertIsNone(cache.get('k'))
+
+if __name__ == '__main__':
+    unittest.main()
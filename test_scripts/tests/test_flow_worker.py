@@ -0,0 +1,112 @@
+import unittest
+import sys
+import os
+import json
+import importlib.util
+
+# Add the function directory to the path
+FUNCTION_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/agent4_flow'))
+sys.path.append(FUNCTION_DIR)
+
+# Every function has a main.py; load this one under its own name
+spec = importlib.util.spec_from_file_location('agent4_flow_main', os.path.join(FUNCTION_DIR, 'main.py'))
+agent4_main = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(agent4_main)
+
+SOURCE = [
+    (None, "DATA DIVISION."),
+    (None, "01  WS-A PIC X."),
+    (None, "01  WS-B PIC X."),
+    (None, "PROCEDURE DIVISION."),
+    ('S1', "MAIN-PARA."),
+    ('S1', "    MOVE WS-A TO WS-B."),
+]
+LINES = [{'line_number': i + 1, 'line_id': f"P_{i + 1}", 'structure_id': sid, 'content': '       ' + c, 'type': 'CODE'}
+         for i, (sid, c) in enumerate(SOURCE)]
+
+PAYLOAD = {'program_id': 'PROG', 'target_structure_ids': ['S1'], 'source_lines': LINES,
+           'entities': ['WS-A', 'WS-B'], 'paragraphs': ['MAIN-PARA']}
+
+VALID = json.dumps({'line_references': [
+    {'line_number': 6, 'target_entity_name': 'WS-A', 'usage_type': 'READS'},
+    {'line_number': 6, 'target_entity_name': 'WS-B', 'usage_type': 'UPDATES'}]})
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class TestFlowWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = {k: getattr(agent4_main, k) for k in ('generate_with_retries', 'REFERENCE_CANDIDATES', 'REFERENCE_VALIDATION')}
+        agent4_main.REFERENCE_CANDIDATES = 'llm'
+        self.calls = []
+
+    def tearDown(self):
+        for k, v in self.saved.items():
+            setattr(agent4_main, k, v)
+
+    def answer(self, *texts):
+        """Fake model: returns the texts in turn, the last one for every further call."""
+        def generate(model, contents, config):
+            self.calls.append(model)
+            return FakeResponse(texts[min(len(self.calls), len(texts)) - 1])
+        agent4_main.generate_with_retries = generate
+
+    def test_valid_output_is_cacheable(self):
+        self.answer(VALID)
+        body, status = agent4_main.analyze_structures(dict(PAYLOAD))
+        self.assertEqual(status, 200)
+        self.assertTrue(body['cacheable'])
+        self.assertEqual(len(body['results']['S1']['line_references']), 2)
+
+    def test_failed_output_is_not_cacheable(self):
+        for text in ('', '{"line_references": [', '{}'):
+            self.calls = []
+            self.answer(text)
+            body, status = agent4_main.analyze_structures(dict(PAYLOAD))
+            self.assertEqual(status, 200)
+            if text == '{}':
+                # Parsed, just no references: nothing failed
+                self.assertTrue(body['cacheable'])
+            else:
+                self.assertFalse(body['cacheable'], text)
+                self.assertEqual(body['routing']['escalations'], len(self.calls) - 1)
+
+    def test_escalated_success_is_cacheable(self):
+        self.answer('', VALID)
+        body, _ = agent4_main.analyze_structures(dict(PAYLOAD))
+        self.assertEqual(body['routing']['escalations'], 1)
+        self.assertTrue(body['cacheable'])
+
+    def test_invalid_references_escalate(self):
+        wrong_line = json.dumps({'line_references': [
+            {'line_number': 2, 'target_entity_name': 'WS-A', 'usage_type': 'READS'}]})
+        agent4_main.REFERENCE_VALIDATION = 'drop'
+        self.answer(wrong_line, VALID)
+        body, _ = agent4_main.analyze_structures(dict(PAYLOAD))
+        self.assertEqual(body['routing']['escalations'], 1)
+        self.assertEqual(len(body['results']['S1']['line_references']), 2)
+
+    def test_unvalidated_output_is_not_cacheable(self):
+        agent4_main.REFERENCE_VALIDATION = 'off'
+        self.answer(VALID)
+        body, _ = agent4_main.analyze_structures(dict(PAYLOAD))
+        self.assertFalse(body['cacheable'])
+
+class TestMapStructureResults(unittest.TestCase):
+
+    def test_external_calls_are_not_dropped(self):
+        struct_res = {'control_flow': [
+            {'line_number': 6, 'target_structure_name': 'MAIN-PARA', 'type': 'PERFORM'},
+            {'line_number': 6, 'target_structure_name': 'SUBPROG', 'type': 'CALL'},
+            {'line_number': 6, 'target_structure_name': 'NO-PARA', 'type': 'GO_TO'}]}
+        control_flow, _, dropped, external_calls = agent4_main.map_structure_results(
+            'PROG', struct_res, {'MAIN-PARA': 'S1'}, lambda name, line_number: None, set())
+        self.assertEqual([f['target_structure_id'] for f in control_flow], ['S1'])
+        self.assertEqual([f['target_structure_name'] for f in external_calls], ['SUBPROG'])
+        self.assertEqual([f['target_structure_name'] for f in dropped], ['NO-PARA'])
+        self.assertIn("SUBPROG (1)", agent4_main.external_calls_summary(external_calls))
+
+if __name__ == '__main__':
+    unittest.main()
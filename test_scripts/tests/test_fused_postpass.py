@@ -0,0 +1,74 @@
+import unittest
+import sys
+import os
+
+# Add the function directory (and the modules it shares with Agent 3) to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/agent4_flow')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/shared')))
+
+from program_index import ProgramIndex
+from fused_postpass import declaration_lines, assemble_entities, resolve_reference
+
+def make_lines(*contents, start=10):
+    return [
+        {'line_number': start + i, 'content': '       ' + c, 'type': 'CODE', 'structure_id': 'S1'}
+        for i, c in enumerate(contents)
+    ]
+
+PROGRAM = make_lines(
+    "SELECT ACCT-FILE ASSIGN TO ACCTFILE.",
+    "FD  ACCT-FILE.",
+    "01  ACCT-REC.",
+    "    05  ACCT-DATA      PIC X(10).",
+    "01  CUST-REC.",
+    "    05  ACCT-DATA      PIC X(10).",
+    "01  WS-EOF             PIC X.",
+    "    88  END-OF-FILE    VALUE 'Y'.",
+    "MOVE ACCT-DATA OF CUST-REC TO WS-EOF.",
+)
+
+class TestFusedPostpass(unittest.TestCase):
+
+    def setUp(self):
+        self.index = ProgramIndex(PROGRAM)
+
+    def test_declaration_lines(self):
+        declared = declaration_lines(self.index)
+        self.assertEqual(declared['ACCT-FILE'], [10])   # SELECT and FD are one entity
+        self.assertEqual(declared['ACCT-DATA'], [13, 15])
+        self.assertEqual(declared['WS-EOF'], [16])
+
+    def test_merge_candidates(self):
+        candidates = [
+            {'entity_name': 'acct-file', 'entity_type': 'VARIABLE', 'definition_line_number': 11, 'description': 'f'},
+            {'entity_name': 'ACCT-FILE', 'entity_type': 'FILE', 'definition_line_number': None, 'description': 'Account file'},
+            {'entity_name': 'ACCT-FILE', 'entity_type': 'FILE', 'description': ''},
+        ]
+        entities, lookup = assemble_entities('P', candidates, set(), self.index)
+        self.assertEqual(len(entities), 1)
+        self.assertEqual(entities[0]['entity_type'], 'FILE')
+        self.assertEqual(entities[0]['description'], 'Account file')
+        self.assertEqual(entities[0]['definition_line_id'], 'P_10')
+        self.assertEqual(entities[0]['entity_id'], 'P_ACCT-FILE')
+
+    def test_duplicate_declarations_split(self):
+        candidates = [{'entity_name': 'ACCT-DATA', 'entity_type': 'VARIABLE', 'description': 'd'}]
+        entities, lookup = assemble_entities('P', candidates, set(), self.index)
+        self.assertEqual([e['entity_id'] for e in entities], ['P_ACCT-DATA_L13', 'P_ACCT-DATA_L15'])
+        self.assertEqual(resolve_reference(lookup, 'ACCT-DATA', 15), 'P_ACCT-DATA_L15')
+        # Unqualified use elsewhere resolves to the first declaration
+        self.assertEqual(resolve_reference(lookup, 'acct-data', 18), 'P_ACCT-DATA_L13')
+
+    def test_referenced_names_added(self):
+        entities, lookup = assemble_entities('P', [], {'WS-EOF', 'NOT-DECLARED'}, self.index)
+        self.assertEqual([e['entity_id'] for e in entities], ['P_WS-EOF'])
+        self.assertEqual(entities[0]['definition_line_id'], 'P_16')
+        self.assertIsNone(resolve_reference(lookup, 'NOT-DECLARED', 18))
+
+    def test_model_definition_line_fallback(self):
+        candidates = [{'entity_name': 'CPY-REC', 'entity_type': 'COPYBOOK', 'definition_line_number': 5}]
+        entities, _ = assemble_entities('P', candidates, set(), self.index)
+        self.assertEqual(entities[0]['definition_line_id'], 'P_5')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+import sys
+import os
+import re
+import json
+import sqlite3
+import subprocess
+
+# Add the function directory to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/agent5_writer')))
+
+from graph_store import SQLiteGraphStore, open_store, check_write_mode
+from graph_rows import build_tables
+from mutation_writer import write_tables
+from delta_writer import delta_write
+from canonical_sql import CANONICAL_GQL, CANONICAL_SQL
+from call_closure import closure_rows, call_edges
+from usage_rollup import usage_rows, usage_edges
+
+FUNCTIONS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions'))
+
+def load_json(path):
+    with open(os.path.join(FUNCTIONS_DIR, path), 'r') as f:
+        return json.load(f)
+
+def sample_tables():
+    data_01 = load_json('agent2_structure/01_source_lines_enriched.json')
+    data_04 = load_json('agent4_flow/04_references_and_flow.json')
+    return build_tables(data_01['program']['program_id'], data_01['source_code_lines'],
+                        load_json('agent2_structure/02_structure.json')['structure'],
+                        load_json('agent3_entities/03_entities.json')['entities'],
+                        data_04['control_flow'], data_04['line_references'], program=data_01['program'])
+
+def count(store, table):
+    return store.execute_sql(f"SELECT COUNT(*) FROM {table}")[1][0][0]
+
+class TestSQLiteGraphStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = SQLiteGraphStore(':memory:')
+        self.tables = sample_tables()
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_write_is_idempotent(self):
+        write_tables(self.store, self.tables, workers=4)
+        write_tables(self.store, self.tables, workers=4)
+        for table, records in self.tables.items():
+            self.assertEqual(count(self.store, table), len(records), table)
+
+    def test_foreign_keys_checked_at_commit(self):
+        def children_first(transaction):
+            transaction.insert_or_update('CodeStructure', ['structure_id', 'program_id', 'name', 'type',
+                                         'start_line_number', 'end_line_number', 'created_at'],
+                                         [['S', 'P', 'S', 'PARAGRAPH', 1, 1, 'now']])
+            transaction.insert_or_update('Programs', ['program_id', 'program_name', 'file_name', 'last_analyzed',
+                                         'created_at', 'updated_at'], [['P', 'P', 'P.cbl', 'now', 'now', 'now']])
+        self.store.run_in_transaction(children_first)
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.store.run_in_transaction(lambda t: t.insert_or_update(
+                'ControlFlow', ['flow_id', 'source_line_id', 'target_structure_id', 'type', 'created_at'],
+                [['f', 'missing', 'S', 'PERFORM', 'now']]))
+        self.assertEqual(count(self.store, 'ControlFlow'), 0)
+
+    def test_delta_write(self):
+        self.assertFalse(delta_write(self.store, 'CBTRN01C', self.tables)['skipped'])
+        self.assertTrue(delta_write(self.store, 'CBTRN01C', self.tables)['skipped'])
+        self.tables['LineReferences'] = self.tables['LineReferences'][:-5]
+        stats = delta_write(self.store, 'CBTRN01C', self.tables)
+        self.assertEqual((stats['inserts'], stats['updates'], stats['deletes']), (0, 0, 5))
+
+    def test_canonical_queries(self):
+        self.tables['CallClosure'] = closure_rows('CBTRN01C', call_edges(self.tables))
+        self.tables['StructureEntityUsage'] = usage_rows('CBTRN01C', usage_edges(self.tables))
+        write_tables(self.store, self.tables)
+        for name in CANONICAL_SQL:
+            columns, rows = self.store.query(name)
+            if name in CANONICAL_GQL:
+                # Same column names as the GQL RETURN clause
+                gql_columns = re.findall(r"AS (\w+)", CANONICAL_GQL[name].split('RETURN')[1])
+                self.assertEqual(columns, gql_columns, name)
+        self.assertEqual(len(self.store.query('source_code')[1]), 494)
+        self.assertIn('2000-LOOKUP-XREF', {r[1] for r in self.store.query('grand_logic')[1]})
+        self.assertIn(('Z-ABEND-PROGRAM', 2), self.store.query('call_tree')[1])
+        # One REACHES hop gives the same routines and depths as the recursive walk
+        self.assertEqual([r[:2] for r in self.store.query('call_closure')[1]], self.store.query('call_tree')[1])
+        # The rollup answers the inventory exactly like the per-reference aggregation
+        self.assertEqual(self.store.query('asset_inventory_rollup'), self.store.query('asset_inventory'))
+        self.assertEqual(self.store.query('dead_files')[1], [('CARD-FILE',), ('CUSTOMER-FILE',), ('TRANSACT-FILE',)])
+
+    def test_query_indexes_used(self):
+        write_tables(self.store, self.tables)
+        indexes = {r[0] for r in self.store.execute_sql("SELECT name FROM sqlite_master WHERE type = 'index'")[1]}
+        self.assertIn('CodeStructureByName', indexes)
+        plan = self.store.execute_sql("EXPLAIN QUERY PLAN " + CANONICAL_SQL['high_level_flow'])[1]
+        # MAIN-PARA is found by name instead of scanning an edge table
+        self.assertFalse([row[3] for row in plan if row[3].startswith('SCAN')])
+        self.assertFalse(SQLiteGraphStore(':memory:', query_indexes=False).execute_sql(
+            "SELECT name FROM sqlite_master WHERE name = 'CodeStructureByName'")[1])
+
+    def test_open_store(self):
+        self.assertEqual(open_store('sqlite::memory:').backend, 'sqlite')
+        with self.assertRaises(ValueError):
+            open_store('duckdb:x')
+
+    def test_bulk_rejected_for_sqlite(self):
+        check_write_mode(self.store, 'delta')
+        with self.assertRaises(ValueError):
+            check_write_mode(self.store, 'bulk')
+
+    def test_runs_without_spanner_client(self):
+        # A None entry in sys.modules makes the import fail, as if the package were not installed
+        script = (
+            "import sys; sys.modules['google.cloud.spanner'] = None; sys.path.insert(0, sys.argv[1]); "
+            "from test_graph_store import sample_tables, SQLiteGraphStore, delta_write; "
+            "from call_closure import refresh_closure; from usage_rollup import refresh_usage; "
+            "store = SQLiteGraphStore(':memory:'); tables = sample_tables(); "
+            "delta_write(store, 'CBTRN01C', tables); tables['LineReferences'] = tables['LineReferences'][:-5]; "
+            "print(delta_write(store, 'CBTRN01C', tables)['deletes'], "
+            "refresh_closure(store, 'CBTRN01C')['inserts'] > 0, refresh_usage(store, 'CBTRN01C')['inserts'] > 0)")
+        result = subprocess.run([sys.executable, '-c', script, os.path.dirname(os.path.abspath(__file__))],
+                                capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip().splitlines()[-1], "5 True True")
+
+if __name__ == '__main__':
+    unittest.main()
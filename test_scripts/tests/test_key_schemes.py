@@ -0,0 +1,123 @@
+import unittest
+import sys
+import os
+import threading
+
+# Add the function directory to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/agent5_writer')))
+
+from key_schemes import shard_id, keyed_row, apply_key_scheme, primary_key, extra_index_entries, SHARD_COUNT
+from delta_writer import delete_rows, read_current
+
+class RecordingDatabase:
+    """Records the keys of every delete."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.deletes = []
+
+    def delete(self, table, keyset):
+        self.deletes.append((table, list(keyset.keys)))
+
+    def run_in_transaction(self, func, *args):
+        with self.lock:
+            func(self, *args)
+
+class SQLRecorder:
+    """Snapshot that records its SQL and returns no rows."""
+    def __init__(self):
+        self.sql = []
+
+    def snapshot(self, multi_use=False):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute_sql(self, sql, params, param_types):
+        self.sql.append(sql)
+        return []
+
+class TestKeySchemes(unittest.TestCase):
+    def test_shard_id_is_stable_and_in_range(self):
+        self.assertEqual(shard_id('CBTRN01C_100'), shard_id('CBTRN01C_100'))
+        shards = {shard_id(f"CBTRN01C_{i}") for i in range(1000)}
+        self.assertTrue(all(0 <= s < SHARD_COUNT for s in shards))
+        # Consecutive line ids spread over (nearly) every shard
+        self.assertGreater(len(shards), SHARD_COUNT * 0.9)
+
+    def test_keyed_row(self):
+        row = {'line_id': 'P_1', 'program_id': 'P'}
+        self.assertEqual(keyed_row('SourceCodeLines', row, 'plain'), row)
+        self.assertEqual(keyed_row('CodeStructure', {'structure_id': 'S'}, 'sharded'), {'structure_id': 'S'})
+        keyed = keyed_row('SourceCodeLines', row, 'sharded')
+        self.assertEqual(list(keyed)[0], 'shard_id')
+        self.assertEqual(keyed['shard_id'], shard_id('P_1'))
+        self.assertNotIn('shard_id', row)
+
+    def test_apply_key_scheme(self):
+        tables = {'Programs': [{'program_id': 'P'}], 'ControlFlow': [{'flow_id': 'flow_1'}]}
+        self.assertIs(apply_key_scheme(tables, 'plain'), tables)
+        sharded = apply_key_scheme(tables, 'sharded')
+        self.assertNotIn('shard_id', sharded['Programs'][0])
+        self.assertEqual(sharded['ControlFlow'][0]['shard_id'], shard_id('flow_1'))
+        with self.assertRaises(ValueError):
+            apply_key_scheme(tables, 'hashed')
+
+    def test_primary_key_and_index_entries(self):
+        self.assertEqual(primary_key('LineReferences', 'ref_1', 'plain'), ['ref_1'])
+        self.assertEqual(primary_key('LineReferences', 'ref_1', 'sharded'), [shard_id('ref_1'), 'ref_1'])
+        self.assertEqual(primary_key('DataEntities', 'P_X', 'sharded'), ['P_X'])
+        self.assertEqual(extra_index_entries('LineReferences', 'sharded'), 1)
+        self.assertEqual(extra_index_entries('LineReferences', 'plain'), 0)
+        self.assertEqual(extra_index_entries('Programs', 'sharded'), 0)
+
+    def test_delete_rows_uses_full_keys(self):
+        db = RecordingDatabase()
+        deletes = {'SourceCodeLines': ['P_9'], 'LineReferences': ['ref_X'], 'DataEntities': ['P_X']}
+        current = {'CodeStructure': {}}
+        self.assertEqual(delete_rows(db, deletes, current, scheme='sharded'), 3)
+        keys = dict(db.deletes)
+        self.assertEqual(keys['LineReferences'], [[shard_id('ref_X'), 'ref_X']])
+        self.assertEqual(keys['SourceCodeLines'], [[shard_id('P_9'), 'P_9']])
+        self.assertEqual(keys['DataEntities'], [['P_X']])
+        # Children are still deleted before their parents
+        order = [table for table, _ in db.deletes]
+        self.assertLess(order.index('LineReferences'), order.index('DataEntities'))
+        self.assertLess(order.index('DataEntities'), order.index('SourceCodeLines'))
+
+    def test_interleaved_rows_and_keys(self):
+        tables = {'Programs': [{'program_id': 'P'}],
+                  'SourceCodeLines': [{'line_id': 'P_1', 'program_id': 'P'}],
+                  'ControlFlow': [{'flow_id': 'flow_1', 'source_line_id': 'P_1'}]}
+        keyed = apply_key_scheme(tables, 'interleaved', 'P')
+        self.assertEqual(keyed['SourceCodeLines'][0], {'line_id': 'P_1', 'program_id': 'P'})
+        self.assertEqual(list(keyed['ControlFlow'][0])[0], 'program_id')
+        self.assertEqual(keyed['ControlFlow'][0]['program_id'], 'P')
+        with self.assertRaises(ValueError):
+            apply_key_scheme(tables, 'interleaved')
+
+        self.assertEqual(primary_key('ControlFlow', 'flow_1', 'interleaved', 'P'), ['P', 'flow_1'])
+        self.assertEqual(primary_key('Programs', 'P', 'interleaved', 'P'), ['P'])
+        self.assertEqual(extra_index_entries('ControlFlow', 'interleaved'), 0)
+
+    def test_interleaved_delete_and_read(self):
+        db = RecordingDatabase()
+        delete_rows(db, {'LineReferences': ['ref_X'], 'SourceCodeLines': ['P_9']}, {'CodeStructure': {}},
+                    scheme='interleaved', program_id='P')
+        keys = dict(db.deletes)
+        self.assertEqual(keys['LineReferences'], [['P', 'ref_X']])
+        self.assertEqual(keys['SourceCodeLines'], [['P', 'P_9']])
+
+        # Edge tables are read by their own program_id, without the join through lines
+        recorder = SQLRecorder()
+        read_current(recorder, 'P', 'interleaved')
+        self.assertTrue(all('JOIN' not in sql and 't.program_id = @program_id' in sql for sql in recorder.sql))
+        recorder = SQLRecorder()
+        read_current(recorder, 'P', 'plain')
+        self.assertEqual(sum('JOIN' in sql for sql in recorder.sql), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+import unittest
+import sys
+import os
+import threading
+
+# Add the function directory to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/agent5_writer')))
+
+import mutation_writer
+from mutation_writer import (chunk_rows, structure_depths, write_levels, write_tables, mutations_per_row,
+                             mutation_groups, bulk_write)
+
+class FakeTransaction:
+    def __init__(self):
+        self.mutations = []
+
+    def insert_or_update(self, table, columns, values):
+        self.mutations.append((table, columns, values))
+
+class FakeDatabase:
+    """Records each commit; the first `failures` commits raise."""
+    def __init__(self, failures=0):
+        self.commits = []
+        self.failures = failures
+        self.lock = threading.Lock()
+
+    def run_in_transaction(self, func, *args):
+        with self.lock:
+            if self.failures:
+                self.failures -= 1
+                raise RuntimeError("deadline exceeded")
+        transaction = FakeTransaction()
+        func(transaction, *args)
+        with self.lock:
+            self.commits.extend(transaction.mutations)
+
+class FakeStatus:
+    def __init__(self, code, message=''):
+        self.code = code
+        self.message = message
+
+class FakeResponse:
+    def __init__(self, indexes, status):
+        self.indexes = indexes
+        self.status = status
+
+class FakeMutationGroups:
+    def __init__(self, database):
+        self.database = database
+        self.groups = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def group(self):
+        group = FakeTransaction()
+        self.groups.append(group)
+        return group
+
+    def batch_write(self):
+        self.database.requests.append(len(self.groups))
+        for i, group in enumerate(self.groups):
+            table, columns, values = group.mutations[0]
+            program_id = values[0][columns.index('program_id')] if 'program_id' in columns else None
+            with self.database.lock:
+                if program_id in self.database.failing_programs:
+                    yield FakeResponse([i], FakeStatus(10, "aborted"))
+                    continue
+                if self.database.failing.get(table):
+                    self.database.failing[table] -= 1
+                    yield FakeResponse([i], FakeStatus(10, "aborted"))
+                    continue
+                self.database.commits.extend(group.mutations)
+            yield FakeResponse([i], FakeStatus(0))
+
+class FakeBulkDatabase(FakeDatabase):
+    """batch_write fake; the first failing[table] groups for a table fail, and every group of failing_programs."""
+    def __init__(self, failing, failing_programs=()):
+        super().__init__()
+        self.failing = dict(failing)
+        self.failing_programs = set(failing_programs)
+        self.requests = []
+
+    def mutation_groups(self):
+        return FakeMutationGroups(self)
+
+def lines(n):
+    return [{'line_id': f"P_{i}", 'program_id': 'P', 'structure_id': None, 'line_number': i,
+             'content': '', 'type': 'CODE'} for i in range(1, n + 1)]
+
+def structure(sid, parent=None):
+    return {'structure_id': sid, 'program_id': 'P', 'parent_structure_id': parent}
+
+class TestMutationWriter(unittest.TestCase):
+
+    def test_chunks_stay_under_limit(self):
+        records = lines(100)
+        # 6 columns + created_at + 2 index entries
+        per_row = mutations_per_row('SourceCodeLines', list(records[0]) + ['created_at'])
+        self.assertEqual(per_row, 9)
+        batches = chunk_rows('SourceCodeLines', records, max_mutations=90)
+        self.assertEqual([len(b) for b in batches], [10] * 10)
+        # A row over the limit still goes alone
+        self.assertEqual(len(chunk_rows('SourceCodeLines', records[:2], max_mutations=1)), 2)
+
+    def test_query_indexes_counted(self):
+        columns = list(lines(1)[0]) + ['created_at']
+        mutation_writer.QUERY_INDEXES = True
+        try:
+            # spanner-indexes.sql adds two index entries per line
+            self.assertEqual(mutations_per_row('SourceCodeLines', columns), 11)
+            self.assertEqual(mutations_per_row('Programs', ['program_id']), 1)
+        finally:
+            mutation_writer.QUERY_INDEXES = False
+
+    def test_structure_depths(self):
+        depths = structure_depths([structure('PARA', 'SEC'), structure('SEC', 'DIV'), structure('DIV'),
+                                   structure('ORPHAN', 'ELSEWHERE'), structure('A', 'B'), structure('B', 'A')])
+        self.assertEqual((depths['DIV'], depths['SEC'], depths['PARA'], depths['ORPHAN']), (0, 1, 2, 0))
+        self.assertEqual(sorted(depths[s] for s in ('A', 'B')), [0, 1])
+
+    def test_levels_parent_first(self):
+        tables = {'Programs': [{'program_id': 'P'}],
+                  'CodeStructure': [structure('SEC', 'DIV'), structure('DIV')],
+                  'SourceCodeLines': lines(1), 'DataEntities': [],
+                  'LineReferences': [{'reference_id': 'r'}], 'ControlFlow': [{'flow_id': 'f'}]}
+        levels = [[name for name, _ in level] for level in write_levels(tables)]
+        self.assertEqual(levels, [['Programs'], ['CodeStructure'], ['CodeStructure'], ['SourceCodeLines'],
+                                  ['LineReferences', 'ControlFlow']])
+        self.assertEqual(write_levels(tables)[1][0][1][0]['structure_id'], 'DIV')
+
+    def test_write_tables(self):
+        database = FakeDatabase(failures=1)
+        delay = mutation_writer.time.sleep
+        mutation_writer.time.sleep = lambda s: None
+        try:
+            stats = write_tables(database, {'Programs': [{'program_id': 'P'}], 'SourceCodeLines': lines(25)},
+                                 max_mutations=90, workers=4)
+        finally:
+            mutation_writer.time.sleep = delay
+        self.assertEqual(database.commits[0][0], 'Programs')
+        self.assertEqual(sum(len(v) for t, _, v in database.commits if t == 'SourceCodeLines'), 25)
+        self.assertEqual(stats['tables']['SourceCodeLines']['batches'], 3)
+        self.assertEqual((stats['rows'], stats['batches'], stats['retries']), (26, 4, 1))
+
+class TestBulkWrite(unittest.TestCase):
+
+    def setUp(self):
+        self.sleep = mutation_writer.time.sleep
+        mutation_writer.time.sleep = lambda s: None
+
+    def tearDown(self):
+        mutation_writer.time.sleep = self.sleep
+
+    def programs(self):
+        return {p: {'Programs': [{'program_id': p}], 'SourceCodeLines': lines(25)} for p in ('A', 'B')}
+
+    def test_groups_by_program_and_level(self):
+        levels = mutation_groups(self.programs(), max_mutations=90)
+        self.assertEqual([[(g['program_id'], g['table']) for g in level] for level in levels][0],
+                         [('A', 'Programs'), ('B', 'Programs')])
+        self.assertEqual(len(levels[1]), 6)
+
+    def test_failed_groups_retried_individually(self):
+        database = FakeBulkDatabase({'SourceCodeLines': 2})
+        stats = bulk_write(database, self.programs(), max_mutations=90, workers=2)
+        self.assertEqual((stats['groups'], stats['failed_groups'], stats['retries']), (8, 0, 2))
+        self.assertEqual(stats['rows'], 52)
+        # 2 requests per level, then one single-group request per retry
+        self.assertEqual(database.requests, [1, 1, 3, 3, 1, 1])
+
+    def test_persistent_failure_reported(self):
+        database = FakeBulkDatabase({'Programs': 99})
+        stats = bulk_write(database, {'A': {'Programs': [{'program_id': 'A'}]}}, workers=1)
+        self.assertEqual(stats['failed_groups'], 1)
+        self.assertEqual(stats['group_status'][0]['status'], 'failed')
+        self.assertEqual(stats['group_status'][0]['error'], 'aborted')
+
+    def test_failed_parent_skips_dependents(self):
+        programs = {p: {'Programs': [{'program_id': p}],
+                        'SourceCodeLines': [dict(l, program_id=p) for l in lines(25)]} for p in ('A', 'B')}
+        database = FakeBulkDatabase({}, failing_programs={'A'})
+        stats = bulk_write(database, programs, max_mutations=90, workers=2)
+        self.assertEqual((stats['failed_groups'], stats['skipped_groups']), (1, 3))
+        self.assertEqual([(s['table'], s['status']) for s in stats['group_status'] if s['program_id'] == 'A'],
+                         [('Programs', 'failed')] + [('SourceCodeLines', 'skipped')] * 3)
+        self.assertEqual(stats['group_status'][2]['error'], 'Programs group failed')
+        # Nothing of A reached the database; B was written in full
+        written = {(t, v[0][c.index('program_id')]) for t, c, v in database.commits}
+        self.assertEqual(written, {('Programs', 'B'), ('SourceCodeLines', 'B')})
+        self.assertEqual(stats['rows'], 26)
+
+if __name__ == '__main__':
+    unittest.main()
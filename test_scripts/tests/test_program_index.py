@@ -0,0 +1,70 @@
+import unittest
+import sys
+import os
+
+# Add the function directory to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/agent4_flow')))
+
+import program_index
+from program_index import ProgramIndex, get_program_index, program_fingerprint
+
+def make_lines(*specs):
+    """specs: (line_number, structure_id, content)"""
+    return [{'line_number': n, 'line_id': f"P_{n}", 'structure_id': sid, 'content': c} for n, sid, c in specs]
+
+LINES = make_lines(
+    (3, 'S2', 'DISPLAY WS-A.'),
+    (1, 'S1', 'MAIN-PARA.'),
+    (2, 'S1', 'PERFORM S2.'),
+    (4, None, '*> comment'),
+    (5, 'S1', 'STOP RUN.'),
+)
+
+class TestProgramIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.saved_size = program_index.PROGRAM_INDEX_CACHE_SIZE
+        program_index._cache.clear()
+
+    def tearDown(self):
+        program_index.PROGRAM_INDEX_CACHE_SIZE = self.saved_size
+        program_index._cache.clear()
+
+    def test_structure_slices(self):
+        index = ProgramIndex(LINES)
+        self.assertEqual([l['line_number'] for l in index.lines], [1, 2, 3, 4, 5])
+        # S1 is split by S2 and an unowned line: two runs
+        self.assertEqual(index.ranges['S1'], [(0, 2), (4, 5)])
+        self.assertEqual([l['line_number'] for l in index.structure_lines('S1')], [1, 2, 5])
+        self.assertEqual(index.structure_text('S1'), "1 | MAIN-PARA.\n2 | PERFORM S2.\n5 | STOP RUN.\n")
+        self.assertEqual(index.structure_text('S2'), "3 | DISPLAY WS-A.\n")
+        self.assertEqual(index.line_count('S1'), 3)
+        self.assertEqual(index.structure_text('MISSING'), "")
+
+    def test_hit_reuses_index(self):
+        first = get_program_index('PROG', LINES)
+        self.assertIs(get_program_index('PROG', [dict(l) for l in LINES]), first)
+        self.assertIs(get_program_index('PROG', [], fingerprint=program_fingerprint(LINES)), first)
+
+    def test_changed_program_gets_new_index(self):
+        first = get_program_index('PROG', LINES)
+        edited = [dict(l, content='DISPLAY WS-B.') if l['line_number'] == 3 else l for l in LINES]
+        second = get_program_index('PROG', edited)
+        self.assertIsNot(second, first)
+        self.assertEqual(second.structure_text('S2'), "3 | DISPLAY WS-B.\n")
+        # Re-assigning a line to another structure changes the fingerprint too
+        moved = [dict(l, structure_id='S2') if l['line_number'] == 5 else l for l in LINES]
+        self.assertNotEqual(program_fingerprint(moved), program_fingerprint(LINES))
+
+    def test_lru_eviction(self):
+        program_index.PROGRAM_INDEX_CACHE_SIZE = 2
+        a = get_program_index('A', LINES)
+        b = get_program_index('B', LINES)
+        self.assertIs(get_program_index('A', LINES), a) # A is now most recent
+        get_program_index('C', LINES)                   # evicts B
+        self.assertEqual(len(program_index._cache), 2)
+        self.assertIs(get_program_index('A', LINES), a)
+        self.assertIsNot(get_program_index('B', LINES), b)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+import sys
+import os
+
+# Add the function directory (and the modules it shares with Agent 3) to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/agent4_flow')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/shared')))
+
+from reference_validator import ReferenceValidator, validate_control_flow, procedure_division_start
+
+USAGE_TYPES = ["READS", "WRITES", "UPDATES", "VALIDATES", "OPENS", "CLOSES", "DECLARATION"]
+
+def make_lines(*contents, start=10):
+    return [
+        {'line_number': start + i, 'content': '       ' + c, 'type': 'CODE'}
+        for i, c in enumerate(contents)
+    ]
+
+PROGRAM = make_lines(
+    "FD  ACCT-FILE.",
+    "01  ACCT-REC           PIC X(10).",
+    "    COPY CVACT01Y.",
+    "PROCEDURE DIVISION.",
+    "    OPEN INPUT ACCT-FILE",
+    "    READ ACCT-FILE INTO WS-REC",
+    "    MOVE 'ACCT-REC' TO WS-REC",
+    "    CLOSE ACCT-FILE.",
+)
+ENTITIES = ['ACCT-FILE', 'ACCT-REC', 'WS-REC', 'CVACT01Y']
+
+def ref(line_number, name, usage):
+    return {'line_number': line_number, 'target_entity_name': name, 'usage_type': usage}
+
+class TestReferenceValidator(unittest.TestCase):
+
+    def setUp(self):
+        self.validator = ReferenceValidator(PROGRAM, ENTITIES, USAGE_TYPES, procedure_division_start(PROGRAM))
+
+    def test_procedure_division_start(self):
+        self.assertEqual(procedure_division_start(PROGRAM), 13)
+
+    def test_valid_references(self):
+        refs = [ref(10, 'ACCT-FILE', 'DECLARATION'), ref(12, 'CVACT01Y', 'DECLARATION'),
+                ref(14, 'acct-file', 'OPENS'), ref(15, 'ACCT-FILE', 'READS'), ref(15, 'WS-REC', 'UPDATES'),
+                ref(17, 'ACCT-FILE', 'CLOSES')]
+        valid, invalid = self.validator.validate(refs)
+        self.assertEqual(invalid, [])
+        # Known spelling is restored
+        self.assertEqual(valid[2]['target_entity_name'], 'ACCT-FILE')
+
+    def test_line_and_membership(self):
+        _, invalid = self.validator.validate([ref(99, 'ACCT-FILE', 'READS'), ref(15, 'NOT-AN-ENTITY', 'READS'),
+                                              ref(16, 'ACCT-REC', 'READS')])
+        reasons = [i['reason'] for i in invalid]
+        self.assertIn("line 99 is not a code line of the target", reasons)
+        self.assertIn("'NOT-AN-ENTITY' is not a known entity", reasons)
+        # Inside a literal is not an occurrence
+        self.assertIn("'ACCT-REC' does not occur on line 16", reasons)
+
+    def test_usage_consistency(self):
+        _, invalid = self.validator.validate([ref(14, 'ACCT-FILE', 'READS'), ref(17, 'ACCT-FILE', 'UPDATES'),
+                                              ref(15, 'ACCT-FILE', 'DECLARATION'), ref(11, 'ACCT-REC', 'READS'),
+                                              ref(15, 'WS-REC', 'WRITES')])
+        self.assertEqual([i['reason'] for i in invalid], [
+            "READS on a OPEN statement (should be OPENS)",
+            "UPDATES on a CLOSE statement (should be CLOSES)",
+            "DECLARATION in the PROCEDURE DIVISION",
+            "READS on a declaration line",
+            "WRITES outside a WRITE statement",
+        ])
+
+    def test_statements_spanning_lines(self):
+        program = make_lines(
+            "PROCEDURE DIVISION.",
+            "    OPEN INPUT ACCT-FILE",
+            "               CARD-FILE",
+            "    CLOSE ACCT-FILE",
+            "          CARD-FILE.",
+            "    WRITE ACCT-REC",
+            "        FROM WS-REC",
+            "    MOVE WS-REC TO ACCT-REC",
+            "    CARD-FILE",
+        )
+        validator = ReferenceValidator(program, ENTITIES + ['CARD-FILE'], USAGE_TYPES, 10)
+        valid, invalid = validator.validate([ref(12, 'CARD-FILE', 'OPENS'), ref(14, 'CARD-FILE', 'CLOSES'),
+                                             ref(15, 'ACCT-REC', 'WRITES')])
+        self.assertEqual((len(valid), invalid), (3, []))
+        # The continuation still belongs to its statement, and a new statement ends it
+        _, invalid = validator.validate([ref(12, 'CARD-FILE', 'READS'), ref(18, 'CARD-FILE', 'OPENS')])
+        self.assertEqual([i['reason'] for i in invalid], ["READS on a OPEN statement (should be OPENS)",
+                                                          "OPENS outside a OPEN statement"])
+
+    def test_numeric_continuation_is_not_a_level(self):
+        program = make_lines(
+            "01  WS-REC             PIC 9(2).",
+            "PROCEDURE DIVISION.",
+            "    MOVE",
+            "    05 TO WS-REC",
+            "    COMPUTE WS-REC = WS-REC +",
+            "    1 * WS-REC",
+        )
+        for procedure_start in (11, None):
+            validator = ReferenceValidator(program, ENTITIES, USAGE_TYPES, procedure_start)
+            valid, invalid = validator.validate([ref(13, 'WS-REC', 'UPDATES'), ref(15, 'WS-REC', 'READS'),
+                                                 ref(10, 'WS-REC', 'DECLARATION')])
+            self.assertEqual((len(valid), invalid), (3, []), procedure_start)
+
+    def test_disambiguated_names(self):
+        validator = ReferenceValidator(PROGRAM, ['ACCT-REC_L11'], USAGE_TYPES, 13)
+        valid, invalid = validator.validate([ref(11, 'ACCT-REC_L11', 'DECLARATION')])
+        self.assertEqual((len(valid), invalid), (1, []))
+
+    def test_duplicates_dropped(self):
+        valid, _ = self.validator.validate([ref(15, 'WS-REC', 'UPDATES'), ref(15, 'ws-rec', 'UPDATES')])
+        self.assertEqual(len(valid), 1)
+
+    def test_control_flow(self):
+        flows = [{'line_number': 14, 'target_structure_name': 'main-para', 'type': 'PERFORM'},
+                 {'line_number': 14, 'target_structure_name': 'NOPE', 'type': 'PERFORM'},
+                 {'line_number': 99, 'target_structure_name': 'MAIN-PARA', 'type': 'GO_TO'},
+                 {'line_number': 14, 'target_structure_name': 'SUBPROG', 'type': 'CALL'}]
+        valid, invalid = validate_control_flow(flows, PROGRAM, ['MAIN-PARA'])
+        # A CALL of another program names no paragraph and is kept
+        self.assertEqual([f['target_structure_name'] for f in valid], ['MAIN-PARA', 'SUBPROG'])
+        self.assertEqual(len(invalid), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import sys
+import os
+import json
+
+# Add the function directory to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/agent4_flow')))
+
+from routing import (load_policy, nesting_depth, complexity_features, combined_features,
+                     route, escalate, routing_summary, DEFAULT_POLICY)
+
+def make_lines(*contents, start=100):
+    return [
+        {'line_number': start + i, 'content': '       ' + c, 'type': 'CODE'}
+        for i, c in enumerate(contents)
+    ]
+
+class TestRouting(unittest.TestCase):
+
+    def test_nesting_depth(self):
+        lines = make_lines(
+            "IF A = 1",
+            "    EVALUATE B",
+            "        WHEN 1",
+            "            IF C = 'Y' MOVE 1 TO D END-IF",
+            "    END-EVALUATE",
+            "END-IF.",
+            "IF X = 'IF' DISPLAY 'END-IF'.",
+        )
+        self.assertEqual(nesting_depth(lines), 3)
+        # A period closes every open scope
+        self.assertEqual(nesting_depth(make_lines("IF A = 1 MOVE 1 TO B.", "IF C = 1 MOVE 1 TO D.")), 1)
+
+    def test_features_skip_comments(self):
+        lines = make_lines("CLOSE ACCT-FILE", "IF ACCT-STATUS = '00'", "    CONTINUE", "END-IF")
+        lines.append({'line_number': 200, 'content': '      * IF IF IF', 'type': 'COMMENT'})
+        self.assertEqual(complexity_features(lines, 2), {'lines': 4, 'nesting': 1, 'candidates': 2})
+
+    def test_route_first_fitting_tier(self):
+        policy = load_policy('', default_model='top-model')
+        self.assertEqual(route({'lines': 4, 'nesting': 1, 'candidates': 2}, policy), 0)
+        self.assertEqual(route({'lines': 4, 'nesting': 2, 'candidates': 2}, policy), 1)
+        self.assertEqual(route({'lines': 500, 'nesting': 0, 'candidates': 0}, policy), 2)
+        self.assertEqual(policy[-1]['model'], 'top-model')
+        self.assertEqual(len(DEFAULT_POLICY), 3)
+
+    def test_batch_takes_hardest_member(self):
+        features = combined_features([{'lines': 4, 'nesting': 3, 'candidates': 1},
+                                      {'lines': 40, 'nesting': 0, 'candidates': 9}])
+        self.assertEqual(features, {'lines': 40, 'nesting': 3, 'candidates': 9})
+
+    def test_escalate(self):
+        policy = load_policy('')
+        self.assertEqual(escalate(policy, 0), 1)
+        self.assertIsNone(escalate(policy, len(policy) - 1))
+
+    def test_configured_policy(self):
+        spec = json.dumps([{"max_lines": 10, "model": "m1", "thinking_level": "LOW"},
+                           {"model": "m2", "thinking_level": "HIGH"}])
+        policy = load_policy(spec)
+        self.assertEqual([t['name'] for t in policy], ['tier0', 'tier1'])
+        self.assertEqual(route({'lines': 11, 'nesting': 9, 'candidates': 99}, policy), 1)
+        self.assertEqual(len(load_policy('off')), 1)
+        with self.assertRaises(ValueError):
+            load_policy(json.dumps([{"model": "m1"}]))
+
+    def test_routing_summary(self):
+        policy = load_policy('')
+        line = routing_summary([{'tier': 'small', 'escalations': 0}, {'tier': 'large', 'escalations': 1}], policy)
+        self.assertEqual(line, "Routing: small 1, medium 0, large 1 (1 escalations)")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import sys
+import os
+import tempfile
+
+# Add the function directory to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/shared')))
+
+from scheduling import pack_structures, lpt_order, simulated_makespan, CostModel, CALIBRATION_MIN_SAMPLES
+
+class TestScheduling(unittest.TestCase):
+
+    def test_pack_structures_respects_budget(self):
+        batches = pack_structures([900, 400, 300, 2000, 100], token_budget=1000, max_items=20)
+        self.assertIn([3], batches)
+        self.assertEqual(sorted(i for b in batches for i in b), [0, 1, 2, 3, 4])
+        costs = [900, 400, 300, 2000, 100]
+        for b in batches:
+            if len(b) > 1:
+                self.assertLessEqual(sum(costs[i] for i in b), 1000)
+
+    def test_lpt_beats_structure_order_on_skewed_work(self):
+        predicted = [1, 1, 1, 1, 1, 1, 10]
+        order = lpt_order(predicted)
+        self.assertEqual(order[0], 6)
+        self.assertEqual(simulated_makespan(predicted, 2), 13)
+        self.assertEqual(simulated_makespan([predicted[i] for i in order], 2), 10)
+
+    def test_cost_model_defaults_then_calibrates(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'calibration.json')
+            model = CostModel('test', path)
+            self.assertFalse(model.calibrated)
+            default_prediction = model.predict(100, 1000)
+
+            # Calls actually take 1s + 0.1s per line
+            for lines in range(10, 10 + CALIBRATION_MIN_SAMPLES * 10, 10):
+                model.record(lines, lines * 10, default_prediction, 1 + 0.1 * lines)
+            model.save()
+
+            calibrated = CostModel('test', path)
+            self.assertTrue(calibrated.calibrated)
+            self.assertAlmostEqual(calibrated.predict(100, 1000), 11.0, delta=0.5)
+            self.assertFalse(CostModel('other', path).calibrated)
+
+    def test_cost_model_fit_with_correlated_features(self):
+        # Tokens track lines closely; the noise must not push either coefficient negative
+        model = CostModel('test', '')
+        noise = [-2, 3, -1, 3, 2, -2, -3, 0, 3, 2]
+        timing = [0.04, 0.16, -0.23, -0.03, -0.07, -0.24, 0.24, -0.04, 0.16, -0.03]
+        model.observations = [[lines, lines * 10 + n, 0, 1 + 0.1 * lines + t]
+                              for lines, n, t in zip(range(10, 110, 10), noise, timing)]
+        model.coefficients = model._fit()
+        self.assertTrue(all(c > 0 for c in model.coefficients), model.coefficients)
+        self.assertAlmostEqual(model.predict(100, 1000), 11.0, delta=0.2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import sys
+import os
+import time
+
+# Add the function directory to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/agent5_writer')))
+
+import stream_writer
+from stream_writer import StreamWriter
+from test_mutation_writer import FakeDatabase
+
+def record(table, **fields):
+    return {'table': table, 'program_id': 'P', 'record': fields}
+
+PROGRAM = record('Programs', program_name='P', file_name='P.cbl', total_lines=2)
+DIVISION = record('CodeStructure', section_id='P_DIV', name='DIV', type='DIVISION', start_line=1, end_line=2)
+
+def line(n, structure_id='P_DIV'):
+    return record('SourceCodeLines', line_id=f"P_{n}", line_number=n, content='', type='CODE',
+                  structure_id=structure_id)
+
+class TestStreamWriter(unittest.TestCase):
+
+    def written(self, database):
+        return [(table, row[0]) for table, _, values in database.commits for row in values]
+
+    def test_children_wait_for_parents(self):
+        database = FakeDatabase()
+        writer = StreamWriter(database, batch_rows=100, flush_seconds=60)
+        for r in [line(1), line(2), PROGRAM, DIVISION]:
+            writer.add(r)
+        self.assertEqual(writer.stats['max_held'], 2)
+        self.assertEqual(writer.held_rows, 0)
+        stats = writer.close()
+        self.assertEqual(self.written(database), [('Programs', 'P'), ('CodeStructure', 'P_DIV'),
+                                                  ('SourceCodeLines', 'P_1'), ('SourceCodeLines', 'P_2')])
+        self.assertEqual((stats['written'], stats['flushes']), (4, 1))
+
+    def test_flush_by_size_keeps_fk_order(self):
+        database = FakeDatabase()
+        writer = StreamWriter(database, batch_rows=2, flush_seconds=60)
+        for r in [PROGRAM, DIVISION, line(1), line(2),
+                  record('ControlFlow', flow_id='f', source_line_id='P_2', target_structure_id='P_DIV')]:
+            writer.add(r)
+        stats = writer.close()
+        self.assertEqual(stats['flushes'], 2)
+        written = self.written(database)
+        self.assertLess(written.index(('SourceCodeLines', 'P_2')), written.index(('ControlFlow', 'f')))
+
+    def test_unresolved_rows_written_last(self):
+        database = FakeDatabase()
+        writer = StreamWriter(database, batch_rows=100, flush_seconds=60)
+        writer.add(PROGRAM)
+        writer.add(line(1, structure_id='P_ELSEWHERE'))
+        stats = writer.close()
+        self.assertEqual(stats['released_unresolved'], 1)
+        self.assertEqual(self.written(database)[-1], ('SourceCodeLines', 'P_1'))
+
+    def test_bounded_holding_queue(self):
+        writer = StreamWriter(FakeDatabase(), max_held=1)
+        writer.add(line(1))
+        with self.assertRaises(OverflowError):
+            writer.add(line(2))
+        with self.assertRaises(ValueError):
+            writer.add(record('Nope'))
+
+    def test_deadline_flushes_without_new_records(self):
+        database = FakeDatabase()
+        writer = StreamWriter(database, batch_rows=100, flush_seconds=0.05)
+        writer.add(PROGRAM)
+        writer.add(record('ControlFlow', flow_id='f', source_line_id='P_9', target_structure_id='P_DIV'))
+        # The producer stalls: the timer writes the program row on its own
+        for _ in range(40):
+            if writer.stats['timed_flushes']:
+                break
+            time.sleep(0.05)
+        self.assertEqual(self.written(database), [('Programs', 'P')])
+        self.assertEqual(writer.stats['timed_flushes'], 1)
+        # Only keys that other rows point at are remembered
+        self.assertNotIn('ControlFlow', writer.seen)
+        writer.close()
+        self.assertFalse(writer.timer.is_alive())
+
+    def test_timer_error_reaches_the_producer(self):
+        def failing_write(database, tables):
+            raise RuntimeError("store unavailable")
+        saved = stream_writer.write_tables
+        stream_writer.write_tables = failing_write
+        try:
+            writer = StreamWriter(FakeDatabase(), batch_rows=100, flush_seconds=0.05)
+            writer.add(PROGRAM)
+            writer.timer.join(2)
+            with self.assertRaises(RuntimeError):
+                writer.add(DIVISION)
+        finally:
+            stream_writer.write_tables = saved
+
+if __name__ == '__main__':
+    unittest.main()
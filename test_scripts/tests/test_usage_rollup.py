@@ -0,0 +1,78 @@
+import unittest
+import sys
+import os
+
+# Add the function directory to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions/agent5_writer')))
+
+from usage_rollup import usage_rows, usage_edges, refresh_usage
+from graph_store import SQLiteGraphStore
+from mutation_writer import write_tables
+from delta_writer import delta_write
+
+def program(refs):
+    """Structures A and B (lines A_1..A_9, B_1..B_9), entities X and Y; refs are (line, entity, usage)."""
+    return {
+        'Programs': [{'program_id': 'P', 'program_name': 'P', 'file_name': 'P.cbl', 'total_lines': 20,
+                      'last_analyzed': 'ts', 'updated_at': 'ts'}],
+        'CodeStructure': [{'structure_id': n, 'program_id': 'P', 'parent_structure_id': None, 'name': n,
+                           'type': 'PARAGRAPH', 'start_line_number': 10 * i, 'end_line_number': 10 * i + 9}
+                          for i, n in enumerate('AB')],
+        'SourceCodeLines': [{'line_id': f"{n}_{k}", 'program_id': 'P', 'structure_id': n,
+                             'line_number': 10 * i + k, 'content': '', 'type': 'CODE'}
+                            for i, n in enumerate('AB') for k in range(1, 10)],
+        'DataEntities': [{'entity_id': e, 'program_id': 'P', 'name': e, 'type': 'FILE',
+                          'definition_line_id': None, 'description': None} for e in 'XY'],
+        'LineReferences': [{'reference_id': f"ref_{line}_{entity}_{usage}", 'source_line_id': line,
+                            'target_entity_id': entity, 'usage_type': usage} for line, entity, usage in refs],
+    }
+
+def rollup(tables):
+    return {r['usage_id']: (r['reference_count'], r['first_line_number'], r['last_line_number'])
+            for r in usage_rows('P', usage_edges(tables))}
+
+class TestUsageRollup(unittest.TestCase):
+
+    def test_rollup_counts_and_line_range(self):
+        tables = program([('A_3', 'X', 'READS'), ('A_7', 'X', 'READS'), ('A_5', 'X', 'WRITES'),
+                          ('B_1', 'X', 'READS'), ('B_2', 'Y', 'OPENS')])
+        self.assertEqual(rollup(tables), {
+            'A|X|READS': (2, 3, 7),
+            'A|X|WRITES': (1, 5, 5),
+            'B|X|READS': (1, 11, 11),
+            'B|Y|OPENS': (1, 12, 12),
+        })
+
+    def test_lines_outside_structures(self):
+        tables = program([('A_1', 'X', 'READS'), ('A_2', 'X', 'READS')])
+        tables['SourceCodeLines'][0]['structure_id'] = None
+        # structure_id is the USES edge's source key, so unassigned lines are not rolled up
+        rows = usage_rows('P', usage_edges(tables))
+        self.assertEqual([(r['usage_id'], r['reference_count']) for r in rows], [('A|X|READS', 1)])
+
+    def test_maintained_on_write(self):
+        store = SQLiteGraphStore(':memory:')
+        tables = program([('A_3', 'X', 'READS'), ('A_7', 'X', 'READS'), ('B_2', 'Y', 'OPENS')])
+        tables['StructureEntityUsage'] = usage_rows('P', usage_edges(tables))
+        delta_write(store, 'P', tables)
+        self.assertEqual(refresh_usage(store, 'P')['unchanged'], 2)
+
+        # One reference removed: only the A|X|READS rollup row changes
+        tables['LineReferences'] = tables['LineReferences'][1:]
+        tables['StructureEntityUsage'] = usage_rows('P', usage_edges(tables))
+        stats = delta_write(store, 'P', tables)
+        self.assertEqual((stats['inserts'], stats['updates'], stats['deletes']), (0, 1, 1))
+        self.assertEqual(store.execute_sql("SELECT reference_count, first_line_number FROM StructureEntityUsage "
+                                           "WHERE usage_id = 'A|X|READS'")[1], [(1, 7)])
+
+        # Y is only opened so far
+        self.assertEqual(store.query('dead_files')[1], [('Y',)])
+
+        # References written without the rollup (e.g. streamed) are picked up by a refresh
+        write_tables(store, {'LineReferences': [{'reference_id': 'ref_new', 'source_line_id': 'B_9',
+                                                 'target_entity_id': 'Y', 'usage_type': 'WRITES'}]})
+        self.assertEqual(refresh_usage(store, 'P')['inserts'], 1)
+        self.assertEqual(store.query('dead_files')[1], [])
+
+if __name__ == '__main__':
+    unittest.main()
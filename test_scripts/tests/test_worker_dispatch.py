@@ -0,0 +1,150 @@
+import unittest
+import sys
+import os
+import json
+import time
+import asyncio
+import importlib.util
+import flask
+
+FUNCTIONS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../1_graph_creation/functions'))
+sys.path.append(os.path.join(FUNCTIONS_DIR, 'shared'))
+
+import worker_dispatch
+
+def load_main(function, name):
+    """Every function has a main.py; load one under its own name."""
+    sys.path.append(os.path.join(FUNCTIONS_DIR, function))
+    spec = importlib.util.spec_from_file_location(name, os.path.join(FUNCTIONS_DIR, function, 'main.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+agent3_main = load_main('agent3_entities', 'agent3_worker_main')
+agent4_main = load_main('agent4_flow', 'agent4_worker_main')
+
+class FakeResponse:
+    def __init__(self, response):
+        self.status = response.status_code
+        self.body = response.get_data(as_text=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def text(self):
+        return self.body
+
+    async def json(self):
+        return json.loads(self.body)
+
+class FakeSession:
+    """aiohttp-like session that serves posts with an HTTP worker function."""
+    def __init__(self, worker):
+        self.worker = worker
+
+    def post(self, url, json=None):
+        with flask.Flask('test').test_request_context(method='POST', json=json):
+            return FakeResponse(flask.make_response(self.worker(flask.request)))
+
+def fake_extract(req_json, program_id):
+    if req_json.get('fail'):
+        raise RuntimeError("model unavailable")
+    return {'results_by_structure': {s['name']: [{'entity_name': 'WS-A', 'program_id': program_id}]
+                                     for s in req_json['structures']}}, 200
+
+def fake_analyze(req_json):
+    if req_json.get('fail'):
+        return {'error': "model unavailable", '_debug': ['[EXCEPTION] model unavailable']}, 500
+    return {'line_references': [], 'results': {sid: {'control_flow': []} for sid in req_json['target_structure_ids']}}, 200
+
+def slow_analyze(req_json):
+    time.sleep(0.05)
+    return fake_analyze(req_json)
+
+class RecordingCostModel:
+    def __init__(self):
+        self.actuals = []
+
+    def record(self, lines, tokens, predicted, actual):
+        self.actuals.append(actual)
+
+class TestWorkerDispatch(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (worker_dispatch.WORKER_MODE, agent3_main.handle_extract, agent4_main.analyze_structures)
+        agent3_main.handle_extract = fake_extract
+        agent4_main.analyze_structures = fake_analyze
+
+    def tearDown(self):
+        worker_dispatch.WORKER_MODE, agent3_main.handle_extract, agent4_main.analyze_structures = self.saved
+        if worker_dispatch._worker_pool is not None:
+            worker_dispatch._worker_pool.shutdown()
+            worker_dispatch._worker_pool = None
+
+    def dispatch(self, main, worker, mode, payload):
+        worker_dispatch.WORKER_MODE = mode
+        return asyncio.run(worker_dispatch.dispatch_worker(
+            FakeSession(worker), 'http://worker', main.run_worker, payload, 'tag'))
+
+    def assert_same_payload(self, main, worker, payload):
+        over_http = self.dispatch(main, worker, 'http', payload)
+        in_process = self.dispatch(main, worker, 'thread', payload)
+        self.assertEqual(in_process, over_http)
+        return in_process
+
+    def test_agent3_extract(self):
+        payload = {'mode': 'extract', 'program_id': 'PROG', 'structures': [{'name': 'MAIN-PARA'}]}
+        body = self.assert_same_payload(agent3_main, agent3_main.entity_worker, payload)
+        self.assertEqual(body['results_by_structure']['MAIN-PARA'][0]['entity_name'], 'WS-A')
+
+    def test_agent4_analyze(self):
+        payload = {'program_id': 'PROG', 'target_structure_ids': ['S1', 'S2']}
+        body = self.assert_same_payload(agent4_main, agent4_main.flow_worker, payload)
+        self.assertEqual(sorted(body['results']), ['S1', 'S2'])
+
+    def test_failures_are_errors_both_ways(self):
+        cases = [
+            (agent3_main, agent3_main.entity_worker, {'mode': 'extract', 'structures': [], 'fail': True}),
+            (agent3_main, agent3_main.entity_worker, {'mode': 'unknown'}),
+            (agent4_main, agent4_main.flow_worker, {'target_structure_ids': ['S1'], 'fail': True}),
+        ]
+        for main, worker, payload in cases:
+            over_http = self.dispatch(main, worker, 'http', payload)
+            in_process = self.dispatch(main, worker, 'thread', payload)
+            # HTTP errors carry the status and body; the in-process error is the handler's message
+            self.assertIn('error', over_http)
+            self.assertIn('error', in_process)
+            self.assertIn(in_process['error'], over_http['error'])
+
+    def test_recorded_times_exclude_pool_wait(self):
+        # Six calls allowed at once, but a pool of one runs them back to back
+        saved_size = worker_dispatch.WORKER_POOL_SIZE
+        worker_dispatch.WORKER_POOL_SIZE = 1
+        worker_dispatch.WORKER_MODE = 'thread'
+        agent4_main.analyze_structures = slow_analyze
+        try:
+            batches = [[{'name': f"P{i}", 'section_id': f"S{i}"}] for i in range(6)]
+            cost_model = RecordingCostModel()
+            process = agent4_main.dispatch_batches(
+                'http://worker', batches, [(1, 10, 1.0)] * 6,
+                lambda batch: {'target_structure_ids': [s['section_id'] for s in batch]}, cost_model, concurrency=6)
+
+            async def run():
+                return [item async for item in process()]
+
+            started = time.monotonic()
+            self.assertEqual(len(asyncio.run(run())), 6)
+            self.assertGreaterEqual(time.monotonic() - started, 0.3)
+        finally:
+            worker_dispatch.WORKER_POOL_SIZE = saved_size
+        # Each call is timed from when the pool started it, not from dispatch
+        self.assertEqual(len(cost_model.actuals), 6)
+        for actual in cost_model.actuals:
+            self.assertGreaterEqual(actual, 0.05)
+            self.assertLess(actual, 0.15)
+
+if __name__ == '__main__':
+    unittest.main()